@@ -0,0 +1,150 @@
+"""
+Management command to benchmark the busiest API endpoints under concurrent job load
+
+Seeds a throwaway test database on the configured engine (SQLite or the
+PostgreSQL profile), starts writer threads that update running jobs the way
+the job runner threads and Celery workers do, and measures p50/p95/p99
+latency of read endpoints hit concurrently by reader threads.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection, connections
+from rest_framework.test import APIClient
+
+from api.management.commands.check_query_budgets import seed_api_data
+
+BUSY_ENDPOINTS = [
+    '/api/dashboard/stats/',
+    '/api/dashboard/recent_backups/',
+    '/api/backup-jobs/',
+    '/api/vm-backups/',
+    '/api/vm-replications/',
+    '/api/health/overall/',
+    '/api/metrics',
+]
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = 'Measure p50/p95/p99 latency of the busiest endpoints while jobs write progress concurrently'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200, help='Rows seeded per resource')
+        parser.add_argument('--running-jobs', type=int, default=20, help='Jobs updated by the writer threads')
+        parser.add_argument('--writers', type=int, default=4, help='Threads writing job progress')
+        parser.add_argument('--readers', type=int, default=8, help='Threads calling the endpoints')
+        parser.add_argument('--duration', type=float, default=15, help='Benchmark duration in seconds')
+        parser.add_argument('--endpoint', action='append', help='Endpoint to benchmark (repeatable)')
+
+    def handle(self, *args, **options):
+        settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ['testserver']
+        endpoints = options['endpoint'] or BUSY_ENDPOINTS
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+        try:
+            user, job_ids = self.seed(options['rows'], options['running_jobs'])
+            connections.close_all()
+            self.stdout.write(
+                f"{connection.vendor}: {options['writers']} writer(s), {options['readers']} reader(s), "
+                f"{options['duration']:.0f}s, {options['rows']} rows per resource"
+            )
+            latencies, errors, writes, write_errors = self.run(user, job_ids, endpoints, options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f"{'endpoint':<34} {'requests':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6}")
+        for url in endpoints:
+            values = latencies[url]
+            self.stdout.write(
+                f"{url:<34} {len(values):>8} {_percentile(values, 50):>8.1f} "
+                f"{_percentile(values, 95):>8.1f} {_percentile(values, 99):>8.1f} {errors[url]:>6}"
+            )
+        self.stdout.write(
+            f"progress writes: {writes} ({writes / options['duration']:.0f}/s), {write_errors} error(s)"
+        )
+
+    @staticmethod
+    def seed(rows, running_jobs):
+        from backups.models import BackupJob, VMBackupJob
+        from esxi.models import VirtualMachine
+
+        user = seed_api_data(rows)
+        vms = list(VirtualMachine.objects.all()[:running_jobs])
+        backup_jobs = BackupJob.objects.bulk_create([BackupJob(virtual_machine=vm, status='running') for vm in vms])
+        vm_backups = VMBackupJob.objects.bulk_create([
+            VMBackupJob(virtual_machine=vm, status='running', backup_location='/backups') for vm in vms
+        ])
+        return user, [(BackupJob, job.id) for job in backup_jobs] + [(VMBackupJob, job.id) for job in vm_backups]
+
+    @staticmethod
+    def run(user, job_ids, endpoints, options):
+        stop = threading.Event()
+        lock = threading.Lock()
+        latencies = {url: [] for url in endpoints}
+        errors = {url: 0 for url in endpoints}
+        counters = {'writes': 0, 'write_errors': 0}
+
+        def writer():
+            # Même schéma que les threads d'exécution: une mise à jour de progression par appel
+            rng = random.Random()
+            try:
+                while not stop.is_set():
+                    model, job_id = rng.choice(job_ids)
+                    try:
+                        model.objects.filter(id=job_id).update(progress_percentage=rng.randint(0, 99))
+                        key = 'writes'
+                    except Exception:
+                        key = 'write_errors'
+                    with lock:
+                        counters[key] += 1
+                    time.sleep(0.01)
+            finally:
+                close_old_connections()
+                connection.close()
+
+        def reader():
+            client = APIClient()
+            client.force_authenticate(user=user)
+            rng = random.Random()
+            try:
+                while not stop.is_set():
+                    url = rng.choice(endpoints)
+                    started = time.perf_counter()
+                    try:
+                        ok = client.get(url).status_code == 200
+                    except Exception:
+                        ok = False
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    with lock:
+                        latencies[url].append(elapsed_ms)
+                        if not ok:
+                            errors[url] += 1
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = (
+            [threading.Thread(target=writer, daemon=True) for _ in range(options['writers'])]
+            + [threading.Thread(target=reader, daemon=True) for _ in range(options['readers'])]
+        )
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        return latencies, errors, counters['writes'], counters['write_errors']
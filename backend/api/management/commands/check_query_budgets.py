@@ -0,0 +1,134 @@
+"""
+Management command to check the SQL query budget of the API list endpoints
+
+Seeds a throwaway test database with N rows per resource (1 then --rows),
+calls every list endpoint and fails if the number of queries exceeds its
+budget or grows with the number of rows (N+1 regression).
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+# Endpoint -> nombre maximal de requêtes SQL pour une liste complète
+QUERY_BUDGETS = {
+    '/api/esxi-servers/': 2,
+    '/api/virtual-machines/': 2,
+    '/api/backup-jobs/': 2,
+    '/api/backup-schedules/': 2,
+    '/api/notifications/': 4,
+    '/api/notification-logs/': 2,
+    '/api/vm-replications/': 2,
+    '/api/failover-events/': 2,
+    '/api/ovf-exports/': 2,
+    '/api/vm-backups/': 2,
+}
+
+
+def seed_api_data(rows):
+    """Crée `rows` lignes reliées pour chaque ressource listée"""
+    from backups.models import (
+        BackupJob, BackupSchedule, FailoverEvent, NotificationConfig, NotificationLog,
+        OVFExportJob, RemoteStorageConfig, VMBackupJob, VMReplication
+    )
+    from esxi.models import ESXiServer, VirtualMachine
+
+    user = User.objects.create_user('query-budget', password='query-budget')
+    storage = RemoteStorageConfig.objects.create(name='query-budget', protocol='local', host='localhost')
+    servers = ESXiServer.objects.bulk_create([
+        ESXiServer(hostname=f'esxi-{i}', username='root', password='x', created_by=user)
+        for i in range(rows)
+    ])
+    vms = VirtualMachine.objects.bulk_create([
+        VirtualMachine(
+            server=servers[i], vm_id=f'vm-{i}', name=f'vm-{i}', power_state='poweredOn',
+            num_cpu=1, memory_mb=1024, disk_gb=10, guest_os='linux', guest_os_full='Linux'
+        )
+        for i in range(rows)
+    ])
+    fulls = BackupJob.objects.bulk_create([BackupJob(virtual_machine=vm, status='completed') for vm in vms])
+    BackupJob.objects.bulk_create([
+        BackupJob(virtual_machine=vm, job_type='incremental', base_backup=base, status='completed')
+        for vm, base in zip(vms, fulls)
+    ])
+    BackupSchedule.objects.bulk_create([BackupSchedule(virtual_machine=vm, remote_storage=storage) for vm in vms])
+    OVFExportJob.objects.bulk_create([
+        OVFExportJob(virtual_machine=vm, remote_storage=storage, export_location='/exports') for vm in vms
+    ])
+    VMBackupJob.objects.bulk_create([
+        VMBackupJob(virtual_machine=vm, remote_storage=storage, backup_location='/backups') for vm in vms
+    ])
+
+    configs = NotificationConfig.objects.bulk_create([
+        NotificationConfig(name=f'config-{i}', notification_type='email', created_by=user)
+        for i in range(rows)
+    ])
+    for config, vm in zip(configs, vms):
+        config.filter_vms.add(vm)
+    NotificationLog.objects.bulk_create([
+        NotificationLog(config=config, virtual_machine=vm, event_type='backup_success', subject='query-budget')
+        for config, vm in zip(configs, vms)
+    ])
+
+    replications = VMReplication.objects.bulk_create([
+        VMReplication(
+            name=f'replication-{i}', virtual_machine=vms[i], source_server=servers[i],
+            destination_server=servers[(i + 1) % rows], destination_datastore='datastore1'
+        )
+        for i in range(rows)
+    ])
+    FailoverEvent.objects.bulk_create([
+        FailoverEvent(replication=replication, failover_type='test', triggered_by=user)
+        for replication in replications
+    ])
+    return user
+
+
+class Command(BaseCommand):
+    help = 'Fail if an API list endpoint exceeds its SQL query budget or issues one query per row'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500, help='Rows seeded per resource for the large run')
+
+    def handle(self, *args, **options):
+        settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ['testserver']
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            small = self.measure(1)
+            large = self.measure(options['rows'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        failures = []
+        for url, budget in QUERY_BUDGETS.items():
+            line = f'{url}: {small[url]} quer(ies) at N=1, {large[url]} at N={options["rows"]} (budget {budget})'
+            if large[url] > budget or large[url] != small[url]:
+                failures.append(line)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+
+        if failures:
+            raise CommandError(f'{len(failures)} endpoint(s) over query budget')
+        self.stdout.write(self.style.SUCCESS('All list endpoints within query budget'))
+
+    def measure(self, rows):
+        """Recrée le jeu de données avec `rows` lignes par ressource et compte les requêtes par endpoint"""
+        call_command('flush', interactive=False, verbosity=0)
+        user = seed_api_data(rows)
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        counts = {}
+        for url in QUERY_BUDGETS:
+            # Les requêtes d'authentification/session ne dépendent pas du volume
+            with CaptureQueriesContext(connection) as context:
+                response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{url} returned HTTP {response.status_code}')
+            counts[url] = len(context.captured_queries)
+        return counts
@@ -0,0 +1,108 @@
+"""
+Pagination par curseur (keyset) des historiques
+
+La page suivante est obtenue par un WHERE (date, id) < (dernière ligne) sur un
+index composite au lieu d'un OFFSET: le coût d'une page reste proportionnel à
+sa taille, quelle que soit la profondeur dans l'historique.
+
+La pagination est optionnelle: sans paramètre `cursor` ni `page_size`, les
+endpoints renvoient la liste complète comme avant (compatibilité frontend).
+"""
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+
+
+class HistoryCursorPagination(CursorPagination):
+    """
+    Curseur sur (date décroissante, id décroissant)
+
+    Les sous-classes indiquent le champ de date dans `ordering`; l'id sert de
+    départage pour les lignes créées dans la même microseconde.
+    """
+
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class BackupJobCursorPagination(HistoryCursorPagination):
+    ordering = ('-created_at', '-id')
+
+
+class BackupLogCursorPagination(HistoryCursorPagination):
+    ordering = ('-timestamp', '-id')
+
+
+class NotificationLogCursorPagination(HistoryCursorPagination):
+    ordering = ('-sent_at', '-id')
+
+
+class StartedAtCursorPagination(HistoryCursorPagination):
+    """FailoverEvent et ReplicationLog"""
+    ordering = ('-started_at', '-id')
+
+
+def _parse_bound(value, param):
+    """Date ou date-heure ISO 8601 -> datetime aware (minuit pour une date seule)"""
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value)
+            parsed = datetime.combine(day, time.min) if day else None
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({param: 'Date invalide (ISO 8601 attendu)'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def history_bounds(params):
+    """Bornes (since, until) des query params, en datetime aware (None si absentes)"""
+    since = params.get('since')
+    until = params.get('until')
+    return (
+        _parse_bound(since, 'since') if since else None,
+        _parse_bound(until, 'until') if until else None,
+    )
+
+
+def filter_history(queryset, params, time_field, vm_field=None, status_field='status'):
+    """
+    Filtres communs des historiques: VM, statut et intervalle de temps
+
+    Chaque filtre garde le préfixe (vm | statut) de l'index composite, donc la
+    pagination reste un parcours d'index borné.
+
+    Query params:
+        vm_id: ID de la VM (si `vm_field` est fourni)
+        status: Statut
+        since / until: Bornes ISO 8601 (date ou date-heure) sur `time_field`, until exclue
+    """
+    vm_id = params.get('vm_id')
+    if vm_field and vm_id:
+        queryset = queryset.filter(**{vm_field: vm_id})
+
+    status_filter = params.get('status')
+    if status_filter and status_field:
+        queryset = queryset.filter(**{status_field: status_filter})
+
+    since, until = history_bounds(params)
+    if since:
+        queryset = queryset.filter(**{f'{time_field}__gte': since})
+    if until:
+        queryset = queryset.filter(**{f'{time_field}__lt': until})
+
+    return queryset
@@ -1,10 +1,11 @@
 from rest_framework import serializers
 from esxi.models import ESXiServer, VirtualMachine, DatastoreInfo, EmailSettings
 from backups.models import (
-    BackupConfiguration, BackupJob, BackupSchedule,
+    BackupConfiguration, BackupJob, BackupLog, BackupSchedule,
     SnapshotSchedule, Snapshot, RemoteStorageConfig,
     OVFExportJob, VMBackupJob, StoragePath,
     VMReplication, FailoverEvent, ReplicationLog,
+    RecoveryPlan, RecoveryPlanItem, RecoveryPlanExecution,
     BackupVerification, BackupVerificationSchedule
 )
 
@@ -45,6 +46,12 @@ class BackupJobSerializer(serializers.ModelSerializer):
                   'completed_at', 'duration_seconds', 'base_backup_id', 'change_id', 'is_cbt_enabled']
 
 
+class BackupLogSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BackupLog
+        fields = ['id', 'job', 'level', 'message', 'timestamp']
+
+
 class BackupJobCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = BackupJob
@@ -132,7 +139,7 @@ class RemoteStorageConfigSerializer(serializers.ModelSerializer):
         model = RemoteStorageConfig
         fields = [
             'id', 'name', 'protocol', 'host', 'port', 'share_name', 'base_path',
-            'username', 'domain', 'is_active', 'is_default',
+            'username', 'domain', 'region', 'use_ssl', 'is_active', 'is_default',
             'last_test_at', 'last_test_success', 'last_test_message',
             'connection_string', 'full_path', 'created_at', 'updated_at'
         ]
@@ -156,7 +163,7 @@ class RemoteStorageConfigCreateSerializer(serializers.ModelSerializer):
         model = RemoteStorageConfig
         fields = [
             'id', 'name', 'protocol', 'host', 'port', 'share_name', 'base_path',
-            'username', 'password', 'domain', 'is_active', 'is_default'
+            'username', 'password', 'domain', 'region', 'use_ssl', 'is_active', 'is_default'
         ]
         read_only_fields = ['id']
 
@@ -191,7 +198,7 @@ class RemoteStorageTestSerializer(serializers.Serializer):
     # Mêmes champs que création mais tout optionnel pour test avant sauvegarde
     name = serializers.CharField(required=False)
     protocol = serializers.ChoiceField(
-        choices=['smb', 'nfs', 'local'],
+        choices=['smb', 'nfs', 's3', 'local'],
         required=True
     )
     host = serializers.CharField(required=True)
@@ -201,6 +208,8 @@ class RemoteStorageTestSerializer(serializers.Serializer):
     username = serializers.CharField(required=False, allow_blank=True)
     password = serializers.CharField(required=False, allow_blank=True, style={'input_type': 'password'})
     domain = serializers.CharField(required=False, allow_blank=True, default='WORKGROUP')
+    region = serializers.CharField(required=False, allow_blank=True, default='')
+    use_ssl = serializers.BooleanField(required=False, default=True)
 
 
 # ============================================================================
@@ -360,14 +369,16 @@ class VMBackupJobSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'virtual_machine', 'vm_name', 'backup_type', 'remote_storage', 'remote_storage_name',
             'backup_location', 'backup_full_path', 'backup_size_mb',
-            'snapshot_name', 'snapshot_id', 'base_backup', 'base_backup_id',
+            'snapshot_name', 'snapshot_id', 'snapshot_open_seconds', 'snapshot_delta_bytes',
+            'consolidation_seconds', 'base_backup', 'base_backup_id',
             'vm_config_file', 'vmdk_files', 'scheduled_by',
             'status', 'progress_percentage', 'error_message',
             'downloaded_bytes', 'total_bytes', 'download_speed_mbps',
             'created_by', 'created_at', 'started_at', 'completed_at', 'duration_seconds'
         ]
         read_only_fields = ['id', 'status', 'progress_percentage', 'backup_full_path',
-                            'backup_size_mb', 'snapshot_name', 'snapshot_id', 'vm_config_file',
+                            'backup_size_mb', 'snapshot_name', 'snapshot_id', 'snapshot_open_seconds',
+                            'snapshot_delta_bytes', 'consolidation_seconds', 'vm_config_file',
                             'vmdk_files', 'downloaded_bytes', 'total_bytes', 'download_speed_mbps',
                             'created_at', 'started_at', 'completed_at', 'duration_seconds']
 
@@ -395,6 +406,11 @@ class VMBackupJobCreateSerializer(serializers.ModelSerializer):
                 "Un backup full ne peut pas avoir de backup de base"
             )
 
+        # Stockage objet: les VMDKs sont envoyés directement dans le bucket
+        remote_storage = data.get('remote_storage')
+        if remote_storage and remote_storage.protocol == 's3':
+            data['backup_location'] = remote_storage.get_full_path()
+
         if not data.get('backup_location'):
             raise serializers.ValidationError("Le chemin de backup est requis")
 
@@ -412,7 +428,7 @@ class StoragePathSerializer(serializers.ModelSerializer):
     class Meta:
         model = StoragePath
         fields = [
-            'id', 'name', 'path', 'storage_type', 'storage_type_display',
+            'id', 'name', 'path', 'storage_type', 'storage_type_display', 'tier',
             'description', 'is_active', 'is_default',
             'created_at', 'updated_at'
         ]
@@ -439,8 +455,8 @@ class VMReplicationSerializer(serializers.ModelSerializer):
     """Serializer pour la réplication de VMs"""
 
     vm_name = serializers.CharField(source='virtual_machine.name', read_only=True)
-    source_server_name = serializers.CharField(source='source_server.name', read_only=True)
-    destination_server_name = serializers.CharField(source='destination_server.name', read_only=True)
+    source_server_name = serializers.CharField(source='get_source_server.hostname', read_only=True)
+    destination_server_name = serializers.CharField(source='destination_server.hostname', read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
     failover_mode_display = serializers.CharField(source='get_failover_mode_display', read_only=True)
 
@@ -499,11 +515,73 @@ class FailoverEventSerializer(serializers.ModelSerializer):
             'id', 'replication', 'vm_name', 'failover_type', 'failover_type_display',
             'status', 'status_display', 'triggered_by', 'triggered_by_username',
             'reason', 'source_vm_powered_off', 'destination_vm_powered_on',
-            'error_message', 'started_at', 'completed_at'
+            'error_message', 'recovery_execution', 'started_at', 'completed_at'
         ]
         read_only_fields = ['started_at', 'completed_at']
 
 
+class RecoveryPlanItemSerializer(serializers.ModelSerializer):
+    """Serializer pour les éléments (VM + palier) d'un plan de reprise"""
+
+    vm_name = serializers.CharField(source='replication.virtual_machine.name', read_only=True)
+
+    class Meta:
+        model = RecoveryPlanItem
+        fields = ['id', 'plan', 'replication', 'vm_name', 'tier', 'depends_on']
+
+    def validate(self, data):
+        """
+        Valider que les dépendances appartiennent au même plan et à un palier inférieur
+        """
+        plan = data.get('plan', self.instance.plan if self.instance else None)
+        tier = data.get('tier', self.instance.tier if self.instance else 1)
+
+        for dependency in data.get('depends_on', []):
+            if dependency.plan_id != plan.id:
+                raise serializers.ValidationError({
+                    'depends_on': f'L\'élément {dependency.id} n\'appartient pas à ce plan'
+                })
+            if dependency.tier >= tier:
+                raise serializers.ValidationError({
+                    'depends_on': f'L\'élément {dependency.id} (palier {dependency.tier}) doit être dans un palier inférieur à {tier}'
+                })
+
+        return data
+
+
+class RecoveryPlanSerializer(serializers.ModelSerializer):
+    """Serializer pour les plans de reprise"""
+
+    items = RecoveryPlanItemSerializer(many=True, read_only=True)
+    created_by_username = serializers.CharField(source='created_by.username', read_only=True)
+
+    class Meta:
+        model = RecoveryPlan
+        fields = [
+            'id', 'name', 'description', 'target_rto_minutes', 'max_parallel_per_tier',
+            'items', 'created_by', 'created_by_username', 'created_at', 'updated_at'
+        ]
+        read_only_fields = ['created_by', 'created_at', 'updated_at']
+
+
+class RecoveryPlanExecutionSerializer(serializers.ModelSerializer):
+    """Serializer pour les exécutions de plans de reprise"""
+
+    plan_name = serializers.CharField(source='plan.name', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    triggered_by_username = serializers.CharField(source='triggered_by.username', read_only=True)
+
+    class Meta:
+        model = RecoveryPlanExecution
+        fields = [
+            'id', 'plan', 'plan_name', 'status', 'status_display', 'test_mode',
+            'triggered_by', 'triggered_by_username', 'target_rto_minutes',
+            'rto_seconds', 'rto_met', 'total_vms', 'succeeded_vms', 'failed_vms',
+            'skipped_vms', 'tier_report', 'error_message', 'started_at', 'completed_at'
+        ]
+        read_only_fields = fields
+
+
 class ReplicationLogSerializer(serializers.ModelSerializer):
     """Serializer pour l'historique des réplications"""
 
@@ -531,7 +609,7 @@ class BackupVerificationSerializer(serializers.ModelSerializer):
     backup_name = serializers.SerializerMethodField()
     test_type_display = serializers.CharField(source='get_test_type_display', read_only=True)
     status_display = serializers.CharField(source='get_status_display', read_only=True)
-    server_name = serializers.CharField(source='esxi_server.name', read_only=True)
+    server_name = serializers.CharField(source='esxi_server.hostname', read_only=True)
     
     class Meta:
         model = BackupVerification
@@ -550,7 +628,7 @@ class BackupVerificationSerializer(serializers.ModelSerializer):
     def get_backup_name(self, obj):
         """Nom du backup vérifié"""
         if obj.ovf_export:
-            return obj.ovf_export.vm_name
+            return obj.ovf_export.virtual_machine.name
         elif obj.vm_backup:
             return obj.vm_backup.virtual_machine.name
         return "Unknown"
@@ -560,7 +638,7 @@ class BackupVerificationScheduleSerializer(serializers.ModelSerializer):
     """Serializer pour les planifications de vérifications"""
 
     vm_name = serializers.CharField(source='virtual_machine.name', read_only=True, allow_null=True)
-    server_name = serializers.CharField(source='esxi_server.name', read_only=True)
+    server_name = serializers.CharField(source='esxi_server.hostname', read_only=True)
     frequency_display = serializers.CharField(source='get_frequency_display', read_only=True)
     test_type_display = serializers.CharField(source='get_test_type_display', read_only=True)
 
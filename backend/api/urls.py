@@ -8,8 +8,10 @@ from .views import (
     NotificationConfigViewSet, NotificationLogViewSet, HealthMonitoringViewSet,
     OVFExportJobViewSet, VMBackupJobViewSet, StoragePathViewSet,
     VMReplicationViewSet, FailoverEventViewSet,
+    RecoveryPlanViewSet, RecoveryPlanItemViewSet, RecoveryPlanExecutionViewSet,
     EmailSettingsViewSet,
-    login_view, logout_view, current_user_view, prometheus_metrics
+    login_view, logout_view, current_user_view, prometheus_metrics, progress_stream,
+    progress_stream_ticket
 )
 
 router = routers.DefaultRouter()
@@ -33,6 +35,9 @@ router.register(r'vm-backups', VMBackupJobViewSet, basename='vm-backups')
 router.register(r'storage-paths', StoragePathViewSet, basename='storage-paths')
 router.register(r'vm-replications', VMReplicationViewSet, basename='vm-replications')
 router.register(r'failover-events', FailoverEventViewSet, basename='failover-events')
+router.register(r'recovery-plans', RecoveryPlanViewSet, basename='recovery-plans')
+router.register(r'recovery-plan-items', RecoveryPlanItemViewSet, basename='recovery-plan-items')
+router.register(r'recovery-plan-executions', RecoveryPlanExecutionViewSet, basename='recovery-plan-executions')
 # REMOVED: SureBackup routes (module supprimé)
 # router.register(r'backup-verifications', BackupVerificationViewSet, basename='backup-verifications')
 # router.register(r'verification-schedules', BackupVerificationScheduleViewSet, basename='verification-schedules')
@@ -47,6 +52,10 @@ urlpatterns = [
     # Prometheus metrics for Grafana
     path('metrics', prometheus_metrics, name='prometheus-metrics'),
 
+    # Server-Sent Events: progression des opérations en temps réel
+    path('progress/ticket/', progress_stream_ticket, name='progress-stream-ticket'),
+    path('progress/stream/', progress_stream, name='progress-stream'),
+
     # Router URLs (all other endpoints)
     path('', include(router.urls)),
 ]
@@ -3,20 +3,28 @@ API Views for ESXi Backup Manager
 """
 import logging
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from django.core.cache import cache
 from rest_framework import viewsets, status, permissions
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import APIException, PermissionDenied
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate
-from django.db.models import Sum, Count
+from django.db.models import Sum, Count, Prefetch
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 
 logger = logging.getLogger(__name__)
 
+
+class InsufficientStorage(APIException):
+    """Job refusé avant transfert: aucune cible de sauvegarde n'a la place (voir backups.storage_capacity)"""
+    status_code = status.HTTP_507_INSUFFICIENT_STORAGE
+    default_detail = "Espace de stockage insuffisant"
+    default_code = 'insufficient_storage'
+
 from esxi.models import ESXiServer, VirtualMachine, DatastoreInfo, EmailSettings
 from esxi.email_service import EmailNotificationService
 from backups.models import (
@@ -24,6 +32,7 @@ from backups.models import (
     BackupSchedule, SnapshotSchedule, Snapshot,
     RemoteStorageConfig, NotificationConfig, NotificationLog,
     StoragePath, VMReplication, FailoverEvent,
+    RecoveryPlan, RecoveryPlanItem, RecoveryPlanExecution,
     BackupVerification, BackupVerificationSchedule, OVFExportJob
 )
 from esxi.vmware_service import VMwareService
@@ -31,7 +40,7 @@ from backups.backup_service import BackupService
 from api.serializers import (
     ESXiServerSerializer, VirtualMachineSerializer,
     DatastoreInfoSerializer, BackupConfigurationSerializer,
-    BackupJobSerializer, BackupJobCreateSerializer,
+    BackupJobSerializer, BackupJobCreateSerializer, BackupLogSerializer,
     BackupScheduleSerializer, DashboardStatsSerializer,
     SnapshotScheduleSerializer, SnapshotScheduleCreateSerializer,
     SnapshotSerializer, RemoteStorageConfigSerializer,
@@ -41,9 +50,21 @@ from api.serializers import (
     NotificationConfigSerializer, NotificationLogSerializer, TestNotificationSerializer,
     StoragePathSerializer, VMReplicationSerializer, FailoverEventSerializer,
     ReplicationLogSerializer, BackupVerificationSerializer, BackupVerificationScheduleSerializer,
+    RecoveryPlanSerializer, RecoveryPlanItemSerializer, RecoveryPlanExecutionSerializer,
     EmailSettingsSerializer
 )
+from api.pagination import (
+    BackupJobCursorPagination, BackupLogCursorPagination,
+    NotificationLogCursorPagination, StartedAtCursorPagination, filter_history, history_bounds
+)
+from backups.log_archive_service import log_archive_service
+from backups.job_dispatcher import job_dispatcher
+from backups.tenant_scheduler import TenantQuotaExceeded, tenant_scheduler
+from backups.storage_capacity import StorageCapacityExceeded, storage_capacity
+from backups import storage_backends
 from backups.tasks import execute_backup_job  # Celery tasks
+from backups.progress_stream import set_progress
+from backups.rollup_service import rollup_service
 
 
 # ==========================================================
@@ -114,6 +135,33 @@ def current_user_view(request):
 # ==========================================================
 # 🔹 ESXi SERVERS
 # ==========================================================
+def _bulk_sync(model, server, key_field, rows, fields):
+    """
+    Crée ou met à jour les objets d'un serveur en trois requêtes (lecture, bulk_update, bulk_create)
+
+    Args:
+        model: VirtualMachine ou DatastoreInfo
+        key_field: Champ identifiant un objet sur le serveur ('vm_id', 'name')
+        rows: {clé: {champ: valeur}}
+        fields: Champs mis à jour
+    """
+    existing = {getattr(obj, key_field): obj for obj in model.objects.filter(server=server)}
+    to_update, to_create = [], []
+    for key, values in rows.items():
+        obj = existing.get(key)
+        if obj is None:
+            to_create.append(model(server=server, **{key_field: key}, **values))
+            continue
+        for field, value in values.items():
+            setattr(obj, field, value)
+        to_update.append(obj)
+
+    if to_update:
+        model.objects.bulk_update(to_update, fields, batch_size=500)
+    if to_create:
+        model.objects.bulk_create(to_create, batch_size=500)
+
+
 class ESXiServerViewSet(viewsets.ModelViewSet):
     """ViewSet for ESXi Server management"""
     queryset = ESXiServer.objects.all()
@@ -168,43 +216,33 @@ class ESXiServerViewSet(viewsets.ModelViewSet):
                              'message': 'Échec de la connexion à ESXi'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        # Sync VMs
+        # Sync VMs (une lecture + écritures groupées au lieu d'un update_or_create par VM)
         vms_data = vmware.get_virtual_machines()
-        synced_count = 0
-        for vm_data in vms_data:
-            VirtualMachine.objects.update_or_create(
-                server=server,
-                vm_id=vm_data['vm_id'],
-                defaults={
-                    'name': vm_data['name'],
-                    'power_state': vm_data['power_state'],
-                    'num_cpu': vm_data['num_cpu'],
-                    'memory_mb': vm_data['memory_mb'],
-                    'disk_gb': vm_data['disk_gb'],
-                    'guest_os': vm_data['guest_os'],
-                    'guest_os_full': vm_data['guest_os_full'],
-                    'tools_status': vm_data['tools_status'],
-                    'ip_address': vm_data['ip_address'],
-                }
-            )
-            synced_count += 1
+        vm_fields = ['name', 'power_state', 'num_cpu', 'memory_mb', 'disk_gb',
+                     'guest_os', 'guest_os_full', 'tools_status', 'ip_address']
+        _bulk_sync(
+            VirtualMachine, server, 'vm_id',
+            {vm_data['vm_id']: {field: vm_data[field] for field in vm_fields} for vm_data in vms_data},
+            vm_fields
+        )
+        synced_count = len(vms_data)
 
         # Sync datastores
         datastores_data = vmware.get_datastores()
-        for ds_data in datastores_data:
-            DatastoreInfo.objects.update_or_create(
-                server=server,
-                name=ds_data['name'],
-                defaults={
-                    'type': ds_data['type'],
-                    'capacity_gb': ds_data['capacity_gb'],
-                    'free_space_gb': ds_data['free_space_gb'],
-                    'accessible': ds_data['accessible'],
-                }
-            )
+        ds_fields = ['type', 'capacity_gb', 'free_space_gb', 'accessible']
+        _bulk_sync(
+            DatastoreInfo, server, 'name',
+            {ds_data['name']: {field: ds_data[field] for field in ds_fields} for ds_data in datastores_data},
+            ds_fields
+        )
 
         vmware.disconnect()
 
+        # Nombre de VMs de l'organisation (UsageMetrics)
+        from backups.progress_stream import tenant_for_user
+        from tenants.services.usage_service import usage_service
+        usage_service.refresh_inventory(tenant_for_user(server.created_by_id))
+
         return Response({
             'status': 'success',
             'message': f'{synced_count} machines virtuelles synchronisées',
@@ -327,15 +365,14 @@ class ESXiServerViewSet(viewsets.ModelViewSet):
 
             # Générer un ID unique pour suivre la progression
             import uuid
-            import threading
             restore_id = str(uuid.uuid4())
 
             # Initialiser la progression dans le cache
-            cache.set(f'restore_progress_{restore_id}', {
+            set_progress('restore', restore_id, {
                 'progress': 0,
                 'status': 'starting',
                 'message': 'Initialisation de la restauration...'
-            }, timeout=3600)  # 1 heure
+            }, timeout=3600, user=request.user)  # 1 heure
 
             # Callback pour mettre à jour la progression
             def progress_callback(progress_percent):
@@ -362,7 +399,7 @@ class ESXiServerViewSet(viewsets.ModelViewSet):
                         'status': status_val,
                         'message': message
                     }
-                    cache.set(f'restore_progress_{restore_id}', progress_data, timeout=3600)
+                    set_progress('restore', restore_id, progress_data, timeout=3600, user=request.user)
                     logger.info(f"[RESTORE] Progression mise à jour: {int(progress_percent)}% (ID: {restore_id})")
                 except Exception as e:
                     logger.error(f"[RESTORE] Erreur mise à jour progression: {e}")
@@ -383,25 +420,25 @@ class ESXiServerViewSet(viewsets.ModelViewSet):
 
                     if success:
                         logger.info(f"[RESTORE] Restauration réussie: {vm_name}")
-                        cache.set(f'restore_progress_{restore_id}', {
+                        set_progress('restore', restore_id, {
                             'progress': 100,
                             'status': 'completed',
                             'message': 'Restauration terminée avec succès'
-                        }, timeout=3600)
+                        }, timeout=3600, user=request.user)
                     else:
                         logger.error(f"[RESTORE] Échec du déploiement OVF")
-                        cache.set(f'restore_progress_{restore_id}', {
+                        set_progress('restore', restore_id, {
                             'progress': 0,
                             'status': 'error',
                             'message': 'Échec du déploiement OVF'
-                        }, timeout=3600)
+                        }, timeout=3600, user=request.user)
                 except Exception as e:
                     logger.exception(f"[RESTORE] Erreur dans le thread: {e}")
-                    cache.set(f'restore_progress_{restore_id}', {
+                    set_progress('restore', restore_id, {
                         'progress': 0,
                         'status': 'error',
                         'message': f'Erreur: {str(e)}'
-                    }, timeout=3600)
+                    }, timeout=3600, user=request.user)
                 finally:
                     vmware.disconnect()
                     # Nettoyer le répertoire temporaire
@@ -412,9 +449,9 @@ class ESXiServerViewSet(viewsets.ModelViewSet):
                         except Exception as e:
                             logger.warning(f"[RESTORE] Impossible de nettoyer {temp_dir}: {e}")
 
-            # Lancer le déploiement dans un thread séparé
-            thread = threading.Thread(target=deploy_in_background, daemon=True)
-            thread.start()
+            # Lancer le déploiement dans la file locale des restaurations
+            # (la connexion vSphere ouverte ici ne peut pas être transmise à Celery)
+            job_dispatcher.submit('restore', deploy_in_background, description=f'restore-ovf {restore_id}')
 
             # Retourner immédiatement avec le restore_id
             return Response({
@@ -428,11 +465,11 @@ class ESXiServerViewSet(viewsets.ModelViewSet):
 
             # Si on a un restore_id, mettre à jour la progression avec l'erreur
             if 'restore_id' in locals():
-                cache.set(f'restore_progress_{restore_id}', {
+                set_progress('restore', restore_id, {
                     'progress': 0,
                     'status': 'error',
                     'message': f'Erreur: {str(e)}'
-                }, timeout=3600)
+                }, timeout=3600, user=request.user)
 
             return Response(
                 {'status': 'error', 'message': str(e), 'restore_id': locals().get('restore_id')},
@@ -476,11 +513,11 @@ class ESXiServerViewSet(viewsets.ModelViewSet):
             # Marquer comme annulée dans le cache
             logger.info(f"[RESTORE] Annulation demandée pour: {restore_id}")
             cache.set(f'restore_cancel_{restore_id}', True, timeout=3600)
-            cache.set(f'restore_progress_{restore_id}', {
+            set_progress('restore', restore_id, {
                 'progress': progress_data.get('progress', 0),
                 'status': 'cancelled',
                 'message': 'Restauration annulée par l\'utilisateur'
-            }, timeout=3600)
+            }, timeout=3600, user=request.user)
 
             return Response({
                 'status': 'success',
@@ -500,7 +537,7 @@ class ESXiServerViewSet(viewsets.ModelViewSet):
 # ==========================================================
 class VirtualMachineViewSet(viewsets.ReadOnlyModelViewSet):
     """Read-only view for Virtual Machines"""
-    queryset = VirtualMachine.objects.all()
+    queryset = VirtualMachine.objects.all().select_related('server')
     serializer_class = VirtualMachineSerializer
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['server', 'power_state']
@@ -773,11 +810,26 @@ class BackupConfigurationViewSet(viewsets.ModelViewSet):
 # ==========================================================
 class BackupJobViewSet(viewsets.ModelViewSet):
     """Manage Backup Jobs"""
-    queryset = BackupJob.objects.all()
+    queryset = BackupJob.objects.all().select_related('virtual_machine', 'base_backup').order_by('-created_at', '-id')
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = BackupJobCursorPagination
     filterset_fields = ['status', 'job_type', 'virtual_machine']
     ordering_fields = ['created_at', 'started_at', 'completed_at']
 
+    def get_queryset(self):
+        """Filtrage optionnel par VM (vm_id), status, job_type et période (since/until sur created_at)"""
+        queryset = super().get_queryset()
+        if self.action != 'list':
+            return queryset
+
+        queryset = filter_history(queryset, self.request.query_params, 'created_at', vm_field='virtual_machine_id')
+
+        job_type = self.request.query_params.get('job_type')
+        if job_type:
+            queryset = queryset.filter(job_type=job_type)
+
+        return queryset
+
     def get_serializer_class(self):
         return BackupJobCreateSerializer if self.action == 'create' else BackupJobSerializer
 
@@ -787,7 +839,6 @@ class BackupJobViewSet(viewsets.ModelViewSet):
     def perform_destroy(self, instance):
         """Supprime le job de backup ET le dossier physique associé"""
         import os
-        import shutil
         from backups.backup_service import normalize_windows_path
 
         # Récupérer le chemin du dossier de sauvegarde
@@ -807,10 +858,12 @@ class BackupJobViewSet(viewsets.ModelViewSet):
         if backup_folder:
             backup_folder = normalize_windows_path(backup_folder)
             try:
-                if os.path.exists(backup_folder):
+                storage = storage_backends.backend_for_path(backup_folder)
+                if storage.exists(backup_folder):
                     logger.info(f"[DELETE] Suppression du dossier de sauvegarde: {backup_folder}")
-                    shutil.rmtree(backup_folder)
+                    storage.delete(backup_folder)
                     logger.info(f"[DELETE] Dossier supprimé avec succès: {backup_folder}")
+                    _record_storage_freed(instance, instance.backup_size_mb)
                 else:
                     logger.warning(f"[DELETE] Le dossier n'existe pas: {backup_folder}")
             except PermissionError as e:
@@ -831,49 +884,28 @@ class BackupJobViewSet(viewsets.ModelViewSet):
                 'current_status': job.status
             }, status=400)
 
+        owner_id = job.created_by_id or request.user.id
+        try:
+            tenant_scheduler.check_storage_quota(owner_id, job.virtual_machine, 'backup_job', job=job)
+        except TenantQuotaExceeded as e:
+            return Response({'status': 'error', 'message': str(e)}, status=403)
+        try:
+            storage_capacity.admit_job('backup_job', job)
+        except StorageCapacityExceeded as e:
+            return Response({'status': 'error', 'message': str(e)}, status=507)
+
         try:
             job.status = 'running'
             job.started_at = timezone.now()
             job.progress_percentage = 0
             job.save()
 
-            # Try to use Celery if available, otherwise run in a thread
-            # Vérifier si Celery est disponible en testant la connexion au broker
-            use_celery = False
-            try:
-                from celery import current_app
-                # Essayer de pinger le broker Celery avec un timeout court
-                inspect = current_app.control.inspect(timeout=1.0)
-                active = inspect.active()
-                if active is not None:
-                    use_celery = True
-                    logger.info(f"[BACKUP] Celery disponible, utilisation de Celery")
-                else:
-                    logger.warning(f"[BACKUP] Celery broker non accessible, utilisation du fallback sur threads")
-            except Exception as e:
-                logger.warning(f"[BACKUP] Celery non disponible ({e}), utilisation du fallback sur threads")
-
-            if use_celery:
-                # Lancer avec Celery
-                execute_backup_job.delay(job.id)
-                message = 'Sauvegarde lancée en tâche de fond (Celery)'
-            else:
-                # Fallback : exécuter dans un thread séparé
-                from backups.backup_service import BackupService
-                import threading
-
-                def run_backup(job_id):
-                    try:
-                        # Reload job from database to ensure fresh data
-                        backup_job = BackupJob.objects.get(id=job_id)
-                        BackupService(backup_job).execute_backup()
-                    except Exception as e:
-                        logger.error(f"Erreur lors du backup: {str(e)}")
-
-                # Start backup in background thread
-                backup_thread = threading.Thread(target=run_backup, args=(job.id,), daemon=True)
-                backup_thread.start()
-                message = 'Sauvegarde lancée en tâche de fond (Thread)'
+            # Queue Celery 'backup' si un worker la consomme, sinon file locale bornée
+            mode = job_dispatcher.dispatch(
+                'backup', execute_backup_job, args=(job.id,), description=f'backup-job {job.id}',
+                expected_size_gb=job.virtual_machine.disk_gb, tenant=tenant_scheduler.profile(owner_id)
+            )
+            message = f"Sauvegarde lancée en tâche de fond ({'Celery' if mode == 'celery' else 'Thread'})"
 
             # Try to create log, but don't fail if it doesn't work
             try:
@@ -904,6 +936,35 @@ class BackupJobViewSet(viewsets.ModelViewSet):
         BackupLog.objects.create(job=job, level='warning', message='Sauvegarde annulée par utilisateur')
         return Response({'status': 'success', 'message': 'Sauvegarde annulée'})
 
+    @action(detail=True, methods=['get'])
+    def logs(self, request, pk=None):
+        """
+        GET /api/backup-jobs/{id}/logs/
+        Journal du job (plus récent d'abord), paginé par curseur si `cursor` ou `page_size` est fourni
+        """
+        job = self.get_object()
+        queryset = BackupLog.objects.filter(job=job).order_by('-timestamp', '-id')
+
+        level = request.query_params.get('level')
+        if level:
+            queryset = queryset.filter(level=level)
+        queryset = filter_history(queryset, request.query_params, 'timestamp', status_field=None)
+
+        # Période remontant avant la rétention: base + archives
+        since, until = history_bounds(request.query_params)
+        if log_archive_service.needs_archive('backup_log', since):
+            return Response(log_archive_service.merge_with_archive(
+                'backup_log', BackupLogSerializer(queryset[:log_archive_service.query_limit()], many=True).data,
+                since, until,
+                filters={'job': job.id, 'level': level}
+            ))
+
+        paginator = BackupLogCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        if page is not None:
+            return paginator.get_paginated_response(BackupLogSerializer(page, many=True).data)
+        return Response(BackupLogSerializer(queryset, many=True).data)
+
     @action(detail=False, methods=['get'])
     def statistics(self, request):
         """Backup job statistics"""
@@ -980,9 +1041,6 @@ class BackupJobViewSet(viewsets.ModelViewSet):
             # Créer un nouveau job de restauration (optionnel, pour tracking)
             # Pour l'instant, on fait la restauration directement
 
-            # Démarrer la restauration dans un thread
-            import threading
-
             def run_restore():
                 try:
                     vmware = VMwareService(
@@ -1015,9 +1073,8 @@ class BackupJobViewSet(viewsets.ModelViewSet):
                 except Exception as e:
                     logger.exception(f"[RESTORE] Erreur lors de la restauration: {str(e)}")
 
-            # Lancer la restauration en arrière-plan
-            restore_thread = threading.Thread(target=run_restore, daemon=True)
-            restore_thread.start()
+            # Lancer la restauration dans la file locale des restaurations
+            job_dispatcher.submit('restore', run_restore, description=f'restore {vm_name}')
 
             return Response({
                 'status': 'success',
@@ -1042,7 +1099,7 @@ class BackupJobViewSet(viewsets.ModelViewSet):
 # ==========================================================
 class BackupScheduleViewSet(viewsets.ModelViewSet):
     """Manage scheduled backups"""
-    queryset = BackupSchedule.objects.all()
+    queryset = BackupSchedule.objects.all().select_related('virtual_machine', 'remote_storage')
     serializer_class = BackupScheduleSerializer
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['is_active', 'frequency', 'virtual_machine']
@@ -1089,70 +1146,17 @@ class SnapshotScheduleViewSet(viewsets.ModelViewSet):
         schedule = self.get_object()
         vm = schedule.virtual_machine
 
-        # Créer un snapshot
-        import threading
         from datetime import datetime
+        from backups.tasks import execute_snapshot
 
         snapshot_name = f"snapshot-{vm.name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
 
-        def create_snapshot_task(vm_id, snap_name, include_memory, schedule_id):
-            from backups.models import Snapshot
-            from esxi.vmware_service import VMwareService
-
-            snapshot = Snapshot.objects.create(
-                virtual_machine_id=vm_id,
-                schedule_id=schedule_id,
-                snapshot_name=snap_name,
-                include_memory=include_memory,
-                status='creating'
-            )
-
-            try:
-                vm_obj = VirtualMachine.objects.get(id=vm_id)
-                server = vm_obj.server
-
-                vmware = VMwareService(
-                    host=server.hostname,
-                    user=server.username,
-                    password=server.password,
-                    port=server.port
-                )
-
-                if vmware.connect():
-                    success = vmware.create_snapshot(
-                        vm_obj.vm_id,
-                        snap_name,
-                        description=f"Snapshot automatique - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                        memory=include_memory
-                    )
-
-                    if success:
-                        snapshot.status = 'completed'
-                        snapshot.save()
-                        logger.info(f"[SNAPSHOT] Snapshot créé: {snap_name}")
-                    else:
-                        snapshot.status = 'failed'
-                        snapshot.save()
-                        logger.error(f"[SNAPSHOT] Échec de création: {snap_name}")
-
-                    vmware.disconnect()
-                else:
-                    snapshot.status = 'failed'
-                    snapshot.save()
-                    logger.error(f"[SNAPSHOT] Connexion ESXi échouée")
-
-            except Exception as e:
-                snapshot.status = 'failed'
-                snapshot.save()
-                logger.exception(f"[SNAPSHOT] Erreur: {str(e)}")
-
-        # Lancer en background
-        thread = threading.Thread(
-            target=create_snapshot_task,
-            args=(vm.id, snapshot_name, schedule.include_memory, schedule.id),
-            daemon=True
+        # Même tâche que les snapshots planifiés (rétention, notifications), file 'snapshot'
+        job_dispatcher.dispatch(
+            'snapshot', execute_snapshot,
+            args=(schedule.id, vm.id, schedule.include_memory, snapshot_name),
+            description=f'snapshot {snapshot_name}'
         )
-        thread.start()
 
         # Mettre à jour last_run
         schedule.last_run = timezone.now()
@@ -1258,6 +1262,29 @@ class SnapshotViewSet(viewsets.ModelViewSet):
             )
 
 
+def _record_storage_freed(job, size_mb):
+    """Décompte le stockage d'un job terminé dont le dossier vient d'être supprimé (UsageMetrics)"""
+    from backups.progress_stream import tenant_for_user
+    from tenants.services.usage_service import usage_service
+
+    if job.status == 'completed' and size_mb:
+        usage_service.record_storage_freed(tenant_for_user(job.created_by_id), size_mb * 1024 * 1024)
+
+
+def _request_tenant_id(request):
+    """
+    Organisation du demandeur (clé des caches par tenant)
+
+    request.tenant (ID de l'organisation) n'est renseigné par TenantMiddleware que
+    pour les sessions; pour l'authentification par token, le tenant est résolu
+    depuis l'utilisateur (contexte tenant en cache).
+    """
+    from backups.progress_stream import tenant_for_user
+
+    tenant = getattr(request, 'tenant', None)
+    return tenant if tenant else tenant_for_user(request.user)
+
+
 # ==========================================================
 # 🔹 DASHBOARD
 # ==========================================================
@@ -1267,32 +1294,45 @@ class DashboardViewSet(viewsets.ViewSet):
 
     @action(detail=False, methods=['get'])
     def stats(self, request):
-        total_backups = BackupJob.objects.count()
-        completed = BackupJob.objects.filter(status='completed').count()
-        failed = BackupJob.objects.filter(status='failed').count()
-        running = BackupJob.objects.filter(status='running').count()
-        total_size = BackupJob.objects.filter(status='completed').aggregate(Sum('backup_size_mb'))['backup_size_mb__sum'] or 0
-
-        stats = {
-            'total_servers': ESXiServer.objects.filter(is_active=True).count(),
-            'total_vms': VirtualMachine.objects.count(),
-            'total_backups': total_backups,
-            'successful_backups': completed,
-            'failed_backups': failed,
-            'running_backups': running,
-            'total_backup_size_gb': round(total_size / 1024, 2),
-            'active_schedules': BackupSchedule.objects.filter(is_active=True).count(),
-        }
+        from backups.dashboard_service import dashboard_summary
 
+        stats = dashboard_summary.get_stats(tenant_id=_request_tenant_id(request))
         serializer = DashboardStatsSerializer(stats)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'])
+    def throughput(self, request):
+        """
+        GET /api/dashboard/throughput/?granularity=day&days=30&operation=backup_job
+        Série temporelle (agrégats BackupRollup): volume, MB/s, durées p50/p95, échecs, taux de changement
+        """
+        granularity = request.query_params.get('granularity', 'day')
+        if granularity not in ('hour', 'day'):
+            return Response({'error': "granularity doit valoir 'hour' ou 'day'"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            days = max(1, min(int(request.query_params.get('days', 30)), 366))
+        except ValueError:
+            return Response({'error': 'days doit être un entier'}, status=status.HTTP_400_BAD_REQUEST)
+
+        operation = request.query_params.get('operation')
+        since = timezone.now() - timedelta(days=days)
+        # Agrégats de l'organisation du demandeur (global sans organisation)
+        tenant_id = _request_tenant_id(request)
+        series = rollup_service.series(
+            operations=[operation] if operation else None,
+            dimension='tenant' if tenant_id else 'global',
+            dimension_id=tenant_id or 0,
+            granularity=granularity,
+            since=rollup_service.bucket_start(since, granularity)
+        )
+        return Response({'granularity': granularity, 'days': days, 'series': series})
+
     @action(detail=False, methods=['get'])
     def recent_backups(self, request):
         """Return latest 10 backup jobs"""
-        recent = BackupJob.objects.order_by('-created_at')[:10]
-        serializer = BackupJobSerializer(recent, many=True)
-        return Response(serializer.data)
+        from backups.dashboard_service import dashboard_summary
+
+        return Response(dashboard_summary.get_recent_backups(tenant_id=_request_tenant_id(request)))
 
 
 # ==========================================================
@@ -1366,7 +1406,9 @@ class RemoteStorageConfigViewSet(viewsets.ModelViewSet):
             share_name=serializer.validated_data.get('share_name', ''),
             base_path=serializer.validated_data.get('base_path', ''),
             username=serializer.validated_data.get('username', ''),
-            domain=serializer.validated_data.get('domain', 'WORKGROUP')
+            domain=serializer.validated_data.get('domain', 'WORKGROUP'),
+            region=serializer.validated_data.get('region', ''),
+            use_ssl=serializer.validated_data.get('use_ssl', True)
         )
 
         # Chiffrer le mot de passe si fourni
@@ -1546,6 +1588,31 @@ class RemoteStorageConfigViewSet(viewsets.ModelViewSet):
 
             return Response(result, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=True, methods=['get'])
+    def capacity(self, request, pk=None):
+        """
+        Espace libre, réservations des jobs en cours et prévision de saturation
+
+        GET /api/remote-storage/{id}/capacity/
+        """
+        target = storage_capacity.target_for_remote_storage(self.get_object())
+        return Response(storage_capacity.forecast(target))
+
+    @action(detail=True, methods=['get', 'post'])
+    def mount(self, request, pk=None):
+        """
+        État du montage partagé (références des jobs, latence, débit)
+
+        GET /api/remote-storage/{id}/mount/
+        POST /api/remote-storage/{id}/mount/ : remonte et vérifie la cible
+        """
+        from backups.remote_storage import mount_manager
+
+        storage_config = self.get_object()
+        if request.method == 'POST':
+            mount_manager.verify(storage_config, force=True)
+        return Response(mount_manager.status(storage_config))
+
     @action(detail=False, methods=['get'])
     def active(self, request):
         """
@@ -2185,27 +2252,23 @@ class RestoreViewSet(viewsets.ViewSet):
 
             # Parcourir chaque chemin
             for base_path in paths_to_scan:
-                if not os.path.exists(base_path):
+                storage = storage_backends.backend_for_path(base_path)
+                if not storage.exists(base_path):
                     logger.warning(f"[RESTORE-API] Chemin inexistant: {base_path}")
                     continue
 
                 # Parcourir récursivement pour trouver les fichiers .ova et .ovf
-                for root, dirs, files in os.walk(base_path):
-                    for filename in files:
-                        if filename.endswith(('.ova', '.ovf')):
-                            file_path = os.path.join(root, filename)
-                            try:
-                                stat_info = os.stat(file_path)
-                                backup_files.append({
-                                    'name': filename,
-                                    'path': file_path,
-                                    'size_mb': round(stat_info.st_size / (1024 * 1024), 2),
-                                    'type': 'ova' if filename.endswith('.ova') else 'ovf',
-                                    'modified': datetime.fromtimestamp(stat_info.st_mtime).isoformat(),
-                                    'storage_path': base_path
-                                })
-                            except Exception as e:
-                                logger.error(f"[RESTORE-API] Erreur lecture fichier {file_path}: {e}")
+                for relative, info in storage.list_files(base_path).items():
+                    filename = relative.rsplit('/', 1)[-1]
+                    if filename.endswith(('.ova', '.ovf')):
+                        backup_files.append({
+                            'name': filename,
+                            'path': storage.join(base_path, *relative.split('/')),
+                            'size_mb': round(info['size'] / (1024 * 1024), 2),
+                            'type': 'ova' if filename.endswith('.ova') else 'ovf',
+                            'modified': datetime.fromtimestamp(info['modified']).isoformat(),
+                            'storage_path': base_path
+                        })
 
             # Trier par date de modification (plus récent en premier)
             backup_files.sort(key=lambda x: x['modified'], reverse=True)
@@ -2362,7 +2425,10 @@ class NotificationConfigViewSet(viewsets.ModelViewSet):
     - POST /api/notifications/{id}/test/ - Tester une configuration
     - POST /api/notifications/{id}/toggle/ - Activer/désactiver
     """
-    queryset = NotificationConfig.objects.all().order_by('-created_at')
+    queryset = NotificationConfig.objects.all().prefetch_related(
+        Prefetch('filter_vms', queryset=VirtualMachine.objects.only('id', 'name')),
+        Prefetch('filter_schedules', queryset=BackupSchedule.objects.only('id'))
+    ).order_by('-created_at')
     serializer_class = NotificationConfigSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -2434,12 +2500,15 @@ class NotificationLogViewSet(viewsets.ReadOnlyModelViewSet):
     - GET /api/notification-logs/{id}/ - Détails d'un log
     - GET /api/notification-logs/stats/ - Statistiques
     """
-    queryset = NotificationLog.objects.all().order_by('-sent_at')
+    queryset = NotificationLog.objects.all().select_related(
+        'config', 'virtual_machine', 'backup_job'
+    ).order_by('-sent_at', '-id')
     serializer_class = NotificationLogSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = NotificationLogCursorPagination
 
     def get_queryset(self):
-        """Filtrage optionnel par config, VM, status, event_type"""
+        """Filtrage optionnel par config, VM, status, event_type et période (since/until)"""
         queryset = super().get_queryset()
 
         # Filtrer par configuration
@@ -2447,15 +2516,8 @@ class NotificationLogViewSet(viewsets.ReadOnlyModelViewSet):
         if config_id:
             queryset = queryset.filter(config_id=config_id)
 
-        # Filtrer par VM
-        vm_id = self.request.query_params.get('vm_id')
-        if vm_id:
-            queryset = queryset.filter(virtual_machine_id=vm_id)
-
-        # Filtrer par statut
-        status_filter = self.request.query_params.get('status')
-        if status_filter:
-            queryset = queryset.filter(status=status_filter)
+        # Filtrer par VM, statut et période
+        queryset = filter_history(queryset, self.request.query_params, 'sent_at', vm_field='virtual_machine_id')
 
         # Filtrer par type d'événement
         event_type = self.request.query_params.get('event_type')
@@ -2464,6 +2526,24 @@ class NotificationLogViewSet(viewsets.ReadOnlyModelViewSet):
 
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """Liste des logs, complétée par les archives si `since` remonte avant la rétention"""
+        since, until = history_bounds(request.query_params)
+        if not log_archive_service.needs_archive('notification_log', since):
+            return super().list(request, *args, **kwargs)
+
+        params = request.query_params
+        live = self.get_serializer(self.get_queryset()[:log_archive_service.query_limit()], many=True).data
+        return Response(log_archive_service.merge_with_archive(
+            'notification_log', live, since, until,
+            filters={
+                'config': params.get('config_id'),
+                'virtual_machine': params.get('vm_id'),
+                'status': params.get('status'),
+                'event_type': params.get('event_type'),
+            }
+        ))
+
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """
@@ -2507,7 +2587,9 @@ class NotificationLogViewSet(viewsets.ReadOnlyModelViewSet):
             },
             'last_7days': {
                 'count': last_7days_count
-            }
+            },
+            # Logs déplacés dans les archives (hors des compteurs ci-dessus)
+            'archived_count': log_archive_service.archived_count('notification_log')
         }, status=status.HTTP_200_OK)
 
 
@@ -2521,16 +2603,21 @@ class HealthMonitoringViewSet(viewsets.ViewSet):
     """
     permission_classes = [IsAuthenticated]
 
+    @staticmethod
+    def _get_overall_health(request):
+        """Santé globale partagée (cache par tenant) entre overall, issues et metrics"""
+        from backups.health_monitoring_service import health_monitor
+
+        return health_monitor.get_overall_health(tenant_id=_request_tenant_id(request))
+
     @action(detail=False, methods=['get'])
     def overall(self, request):
         """
         GET /api/health/overall/
         Retourne l'état de santé global du système de backup
         """
-        from backups.health_monitoring_service import health_monitor
-
         try:
-            health_data = health_monitor.get_overall_health()
+            health_data = self._get_overall_health(request)
             return Response(health_data, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f"[HEALTH] Erreur lors de la récupération de la santé globale: {e}")
@@ -2548,7 +2635,7 @@ class HealthMonitoringViewSet(viewsets.ViewSet):
         from backups.health_monitoring_service import health_monitor
 
         try:
-            health_data = health_monitor.get_vm_health(vm_id)
+            health_data = health_monitor.get_vm_health(vm_id, tenant_id=_request_tenant_id(request))
 
             if 'error' in health_data:
                 return Response(health_data, status=status.HTTP_404_NOT_FOUND)
@@ -2567,10 +2654,8 @@ class HealthMonitoringViewSet(viewsets.ViewSet):
         GET /api/health/issues/
         Retourne uniquement les problèmes détectés (sans les métriques)
         """
-        from backups.health_monitoring_service import health_monitor
-
         try:
-            health_data = health_monitor.get_overall_health()
+            health_data = self._get_overall_health(request)
 
             return Response({
                 'status': health_data['status'],
@@ -2592,10 +2677,8 @@ class HealthMonitoringViewSet(viewsets.ViewSet):
         GET /api/health/metrics/
         Retourne uniquement les métriques (sans les problèmes)
         """
-        from backups.health_monitoring_service import health_monitor
-
         try:
-            health_data = health_monitor.get_overall_health()
+            health_data = self._get_overall_health(request)
 
             return Response({
                 'metrics': health_data['metrics'],
@@ -2633,7 +2716,19 @@ class OVFExportJobViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         """Crée un export OVF et le démarre"""
+        try:
+            tenant_scheduler.check_storage_quota(
+                self.request.user.id, serializer.validated_data['virtual_machine'], 'ovf_export'
+            )
+        except TenantQuotaExceeded as e:
+            raise PermissionDenied(str(e))
+
         export_job = serializer.save(created_by=self.request.user, status='pending')
+        try:
+            storage_capacity.admit_job('ovf_export', export_job)
+        except StorageCapacityExceeded as e:
+            export_job.delete()
+            raise InsufficientStorage(str(e))
 
         # Générer le chemin complet avec format: VM-NAME_DD-MM-YYYY_HH-MM
         timestamp = timezone.now().strftime('%d-%m-%Y_%H-%M')
@@ -2644,68 +2739,14 @@ class OVFExportJobViewSet(viewsets.ModelViewSet):
         )
         export_job.save()
 
-        # Lancer l'export en arrière-plan (Celery ou Thread)
-        # Vérifier si Celery est disponible en testant la connexion au broker
-        use_celery = False
-        try:
-            from backups.tasks import execute_ovf_export
-            from celery import current_app
-            # Essayer de pinger le broker Celery avec un timeout court
-            inspect = current_app.control.inspect(timeout=1.0)
-            active = inspect.active()
-            if active is not None:
-                use_celery = True
-                logger.info(f"[OVF-EXPORT] Celery disponible, utilisation de Celery")
-            else:
-                logger.warning(f"[OVF-EXPORT] Celery broker non accessible, utilisation du fallback sur threads")
-        except Exception as e:
-            logger.warning(f"[OVF-EXPORT] Celery non disponible ({e}), utilisation du fallback sur threads")
-
-        if use_celery:
-            # Lancer avec Celery
-            execute_ovf_export.delay(export_job.id)
-            logger.info(f"[OVF-EXPORT] Export créé et tâche Celery lancée: {export_job.id}")
-        else:
-            # Fallback : exécuter dans un thread séparé
-            import threading
-
-            def run_export_in_thread():
-                """Exécute l'export dans un thread séparé pour ne pas bloquer la requête HTTP"""
-                from backups.ovf_export_lease import OVFExportLeaseService
-                from esxi.vmware_service import VMwareService
-
-                vm = export_job.virtual_machine
-                vmware_service = VMwareService(vm.server.hostname, vm.server.username, vm.server.password)
+        # Lancer l'export en arrière-plan: queue Celery 'export' ou file locale bornée
+        from backups.tasks import execute_ovf_export
 
-                try:
-                    # Marquer comme en cours
-                    export_job.status = 'running'
-                    export_job.started_at = timezone.now()
-                    export_job.save()
-
-                    vmware_service.connect()
-                    vm_obj = vmware_service._find_vm_by_name(vm.name)
-
-                    # Create OVF export service using HttpNfcLease API (handles thin-provisioned disks)
-                    ovf_service = OVFExportLeaseService(vm_obj, export_job)
-                    success = ovf_service.export_ovf()
-
-                    if not success:
-                        logger.error(f"[OVF-EXPORT] Export failed for job {export_job.id}")
-
-                except Exception as export_error:
-                    export_job.status = 'failed'
-                    export_job.error_message = str(export_error)
-                    export_job.completed_at = timezone.now()
-                    export_job.save()
-                    logger.error(f"[OVF-EXPORT] Erreur export: {export_error}", exc_info=True)
-                finally:
-                    vmware_service.disconnect()
-
-            # Lancer le thread en arrière-plan
-            thread = threading.Thread(target=run_export_in_thread, daemon=True)
-            thread.start()
-            logger.info(f"[OVF-EXPORT] Export créé et thread lancé: {export_job.id}")
+        mode = job_dispatcher.dispatch(
+            'export', execute_ovf_export, args=(export_job.id,), description=f'ovf-export {export_job.id}',
+            expected_size_gb=export_job.virtual_machine.disk_gb, tenant=tenant_scheduler.profile(self.request.user.id)
+        )
+        logger.info(f"[OVF-EXPORT] Export créé et lancé ({mode}): {export_job.id}")
 
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -2726,13 +2767,13 @@ class OVFExportJobViewSet(viewsets.ModelViewSet):
 
     def perform_destroy(self, instance):
         """Supprime l'export et son dossier physique"""
-        import shutil
-
-        # Supprimer le dossier physique si il existe
-        if instance.export_full_path and os.path.exists(instance.export_full_path):
+        # Supprimer le dossier (ou l'OVA) physique s'il existe
+        storage = storage_backends.backend_for_path(instance.export_full_path) if instance.export_full_path else None
+        if storage and storage.exists(instance.export_full_path):
             try:
-                shutil.rmtree(instance.export_full_path)
+                storage.delete(instance.export_full_path)
                 logger.info(f"[OVF-EXPORT] Dossier supprimé: {instance.export_full_path}")
+                _record_storage_freed(instance, instance.export_size_mb)
             except Exception as e:
                 logger.error(f"[OVF-EXPORT] Erreur suppression dossier: {e}")
                 # Continue quand même pour supprimer l'entrée en base de données
@@ -2762,74 +2803,39 @@ class VMBackupJobViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         """Crée un backup et le démarre"""
+        try:
+            tenant_scheduler.check_storage_quota(
+                self.request.user.id, serializer.validated_data['virtual_machine'], 'vm_backup'
+            )
+        except TenantQuotaExceeded as e:
+            raise PermissionDenied(str(e))
+
         backup_job = serializer.save(created_by=self.request.user, status='pending')
+        try:
+            storage_capacity.admit_job('vm_backup', backup_job)
+        except StorageCapacityExceeded as e:
+            backup_job.delete()
+            raise InsufficientStorage(str(e))
 
         # Générer le chemin complet
         timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
         vm_name = backup_job.virtual_machine.name
         backup_type = backup_job.backup_type
-        backup_job.backup_full_path = os.path.join(
+        backup_job.backup_full_path = storage_backends.join(
             backup_job.backup_location,
             f"{backup_type}_{vm_name}_{timestamp}"
         )
         backup_job.started_at = timezone.now()
         backup_job.save()
 
-        # Lancer le backup en arrière-plan (Celery ou Thread)
-        # Vérifier si Celery est disponible en testant la connexion au broker
-        use_celery = False
-        try:
-            from backups.tasks import execute_vm_backup
-            from celery import current_app
-            # Essayer de pinger le broker Celery avec un timeout court
-            inspect = current_app.control.inspect(timeout=1.0)
-            active = inspect.active()
-            if active is not None:
-                use_celery = True
-                logger.info(f"[VM-BACKUP] Celery disponible, utilisation de Celery")
-            else:
-                logger.warning(f"[VM-BACKUP] Celery broker non accessible, utilisation du fallback sur threads")
-        except Exception as e:
-            logger.warning(f"[VM-BACKUP] Celery non disponible ({e}), utilisation du fallback sur threads")
-
-        if use_celery:
-            # Lancer avec Celery
-            execute_vm_backup.delay(backup_job.id)
-            logger.info(f"[VM-BACKUP] Backup créé et tâche Celery lancée: {backup_job.id} - {backup_type} - {vm_name}")
-        else:
-            # Fallback : exécuter dans un thread séparé
-            import threading
-
-            def run_backup_in_thread():
-                """Exécute le backup dans un thread séparé pour ne pas bloquer la requête HTTP"""
-                from backups.vm_backup_service import execute_vm_backup as run_backup
-                from esxi.vmware_service import VMwareService
-
-                vm = backup_job.virtual_machine
-                vmware_service = VMwareService(vm.server.hostname, vm.server.username, vm.server.password)
-
-                try:
-                    # Marquer comme en cours
-                    backup_job.status = 'running'
-                    backup_job.save()
-
-                    vmware_service.connect()
-                    vm_obj = vmware_service._find_vm_by_name(vm.name)
-                    run_backup(vm_obj, backup_job)
-
-                except Exception as backup_error:
-                    backup_job.status = 'failed'
-                    backup_job.error_message = str(backup_error)
-                    backup_job.completed_at = timezone.now()
-                    backup_job.save()
-                    logger.error(f"[VM-BACKUP] Erreur backup: {backup_error}", exc_info=True)
-                finally:
-                    vmware_service.disconnect()
+        # Lancer le backup en arrière-plan: queue Celery 'backup' ou file locale bornée
+        from backups.tasks import execute_vm_backup
 
-            # Lancer le thread en arrière-plan
-            thread = threading.Thread(target=run_backup_in_thread, daemon=True)
-            thread.start()
-            logger.info(f"[VM-BACKUP] Backup créé et thread lancé: {backup_job.id} - {backup_type} - {vm_name}")
+        mode = job_dispatcher.dispatch(
+            'backup', execute_vm_backup, args=(backup_job.id,), description=f'vm-backup {backup_job.id}',
+            expected_size_gb=backup_job.virtual_machine.disk_gb, tenant=tenant_scheduler.profile(self.request.user.id)
+        )
+        logger.info(f"[VM-BACKUP] Backup créé et lancé ({mode}): {backup_job.id} - {backup_type} - {vm_name}")
 
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -2905,13 +2911,26 @@ class StoragePathViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(active_paths, many=True)
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def capacity(self, request, pk=None):
+        """Espace libre, réservations des jobs en cours, prévision de saturation et dernière sonde"""
+        from backups.storage_placement import storage_placement
+
+        target = storage_capacity.target_for_storage_path(self.get_object())
+        forecast = storage_capacity.forecast(target)
+        forecast['tier'] = target['tier']
+        forecast['probe'] = storage_placement.last_probe(target)
+        return Response(forecast)
+
 
 # ==========================================================
 # 🔹 VM REPLICATION - Réplication de VMs
 # ==========================================================
 class VMReplicationViewSet(viewsets.ModelViewSet):
     """Gestion de la réplication de VMs entre serveurs ESXi"""
-    queryset = VMReplication.objects.all()
+    queryset = VMReplication.objects.all().select_related(
+        'virtual_machine__server', 'source_server', 'destination_server'
+    )
     serializer_class = VMReplicationSerializer
     permission_classes = [permissions.IsAuthenticated]
     filterset_fields = ['virtual_machine', 'source_server', 'destination_server', 'status', 'is_active']
@@ -2946,7 +2965,6 @@ class VMReplicationViewSet(viewsets.ModelViewSet):
         from django.utils import timezone
         from django.core.cache import cache
         import uuid
-        import threading
         import logging
         import sys
         logger = logging.getLogger(__name__)
@@ -2973,6 +2991,7 @@ class VMReplicationViewSet(viewsets.ModelViewSet):
 
         # Marquer la réplication comme en cours de synchronisation
         replication.status = 'syncing'
+        replication.sync_started_at = timezone.now()
         replication.save()
         print(f"[DEBUG] Statut mis à jour: syncing", file=sys.stderr)
 
@@ -2997,7 +3016,7 @@ class VMReplicationViewSet(viewsets.ModelViewSet):
                 'vm_name': replication.virtual_machine.name,
                 'started_at': timezone.now().isoformat()
             }
-            cache.set(f'replication_progress_{replication_id}', initial_progress, timeout=3600)
+            set_progress('replication', replication_id, initial_progress, timeout=3600, user=request.user)
             print(f"[DEBUG] Cache initialisé à 0%", file=sys.stderr)
 
             # Vérifier que le cache a bien été écrit
@@ -3017,7 +3036,7 @@ class VMReplicationViewSet(viewsets.ModelViewSet):
                     'started_at': initial_progress.get('started_at'),  # Garder le timestamp de départ
                     'updated_at': timezone.now().isoformat()
                 }
-                cache.set(f'replication_progress_{replication_id}', progress_data, timeout=3600)
+                set_progress('replication', replication_id, progress_data, timeout=3600, user=request.user)
                 logger.info(f"[API] Progression mise à jour: {progress_data}")
 
             # Fonction pour exécuter la réplication dans un thread
@@ -3042,13 +3061,13 @@ class VMReplicationViewSet(viewsets.ModelViewSet):
                     # Mettre à jour le cache avec l'erreur
                     progress_callback(-1, 'error', str(e))
 
-            # Démarrer la réplication dans un thread séparé
-            print(f"[DEBUG] Création thread...", file=sys.stderr)
-            thread = threading.Thread(target=run_replication, daemon=True)
-            print(f"[DEBUG] Démarrage thread...", file=sys.stderr)
-            thread.start()
-            print(f"[DEBUG] Thread démarré! Actif: {thread.is_alive()}", file=sys.stderr)
-            logger.info(f"[API] Thread lancé pour replication_id={replication_id}")
+            # Démarrer la réplication dans la file locale des réplications
+            # (l'annulation et la progression par utilisateur dépendent de ce processus)
+            job_dispatcher.submit(
+                'replication', run_replication, description=f'replication {replication_id}',
+                tenant=tenant_scheduler.profile(request.user.id), cost=replication.virtual_machine.disk_gb
+            )
+            logger.info(f"[API] Réplication mise en file pour replication_id={replication_id}")
 
             # Retourner l'ID immédiatement
             return Response({
@@ -3111,7 +3130,7 @@ class VMReplicationViewSet(viewsets.ModelViewSet):
             # Marquer comme annulée dans le cache
             progress_data['status'] = 'cancelled'
             progress_data['message'] = 'Réplication annulée par l\'utilisateur'
-            cache.set(f'replication_progress_{replication_id}', progress_data, timeout=3600)
+            set_progress('replication', replication_id, progress_data, timeout=3600, user=request.user)
 
             # Note: Le thread continuera mais l'UI sera informée de l'annulation
             logger.info(f"[API] Réplication {replication_id} marquée comme annulée")
@@ -3199,8 +3218,7 @@ class VMReplicationViewSet(viewsets.ModelViewSet):
             existing_replica = service._get_vm_by_name(dest_si, replica_vm_name)
 
             # Déconnexion
-            from pyVim.connect import Disconnect
-            Disconnect(dest_si)
+            service._disconnect(dest_si)
 
             if existing_replica:
                 logger.info(f"[CHECK-REPLICA] Replica trouvée: {replica_vm_name}")
@@ -3228,11 +3246,27 @@ class VMReplicationViewSet(viewsets.ModelViewSet):
         """Obtenir l'historique des réplications pour une VMReplication donnée"""
         replication = self.get_object()
 
-        # Limiter à 20 dernières réplications par défaut
+        logs = replication.replication_logs.select_related('replication__virtual_machine').order_by('-started_at', '-id')
+        logs = filter_history(logs, request.query_params, 'started_at')
+
+        # Période remontant avant la rétention: base + archives
+        since, until = history_bounds(request.query_params)
+        if log_archive_service.needs_archive('replication_log', since):
+            return Response(log_archive_service.merge_with_archive(
+                'replication_log', ReplicationLogSerializer(logs[:log_archive_service.query_limit()], many=True).data,
+                since, until,
+                filters={'replication': replication.id, 'status': request.query_params.get('status')}
+            ))
+
+        # Pagination par curseur si demandée (cursor / page_size)
+        paginator = StartedAtCursorPagination()
+        page = paginator.paginate_queryset(logs, request, view=self)
+        if page is not None:
+            return paginator.get_paginated_response(ReplicationLogSerializer(page, many=True).data)
+
+        # Sinon: 20 dernières réplications par défaut
         limit = int(request.query_params.get('limit', 20))
-
-        logs = replication.replication_logs.all()[:limit]
-        serializer = ReplicationLogSerializer(logs, many=True)
+        serializer = ReplicationLogSerializer(logs[:limit], many=True)
 
         return Response(serializer.data)
 
@@ -3290,9 +3324,8 @@ class VMReplicationViewSet(viewsets.ModelViewSet):
                 time_to_next_sync = int(delta.total_seconds() / 60)  # en minutes
 
             # Déconnexion
-            from pyVim.connect import Disconnect
-            Disconnect(source_si)
-            Disconnect(dest_si)
+            service._disconnect(source_si)
+            service._disconnect(dest_si)
 
             return Response({
                 'source_vm': {
@@ -3435,13 +3468,124 @@ class VMReplicationViewSet(viewsets.ModelViewSet):
 
 class FailoverEventViewSet(viewsets.ReadOnlyModelViewSet):
     """Historique des événements de failover"""
-    queryset = FailoverEvent.objects.all()
+    queryset = FailoverEvent.objects.all().select_related(
+        'replication__virtual_machine', 'triggered_by'
+    ).order_by('-started_at', '-id')
     serializer_class = FailoverEventSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = StartedAtCursorPagination
     filterset_fields = ['replication', 'failover_type', 'status']
     ordering_fields = ['started_at', 'completed_at']
     ordering = ['-started_at']
 
+    def get_queryset(self):
+        """Filtrage optionnel par réplication, VM (vm_id), status, failover_type et période (since/until)"""
+        queryset = super().get_queryset()
+        params = self.request.query_params
+
+        replication_id = params.get('replication')
+        if replication_id:
+            queryset = queryset.filter(replication_id=replication_id)
+
+        failover_type = params.get('failover_type')
+        if failover_type:
+            queryset = queryset.filter(failover_type=failover_type)
+
+        return filter_history(queryset, params, 'started_at', vm_field='replication__virtual_machine_id')
+
+
+# ==========================================================
+# 🔹 RECOVERY PLANS - Plans de reprise (failover de site)
+# ==========================================================
+class RecoveryPlanViewSet(viewsets.ModelViewSet):
+    """Gestion des plans de reprise (paliers de démarrage + dépendances)"""
+    queryset = RecoveryPlan.objects.select_related('created_by').prefetch_related('items__depends_on', 'items__replication__virtual_machine')
+    serializer_class = RecoveryPlanSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    ordering = ['name']
+
+    def perform_create(self, serializer):
+        serializer.save(created_by=self.request.user)
+
+    @action(detail=True, methods=['get'])
+    def validate(self, request, pk=None):
+        """Vérifier la cohérence des paliers et dépendances du plan"""
+        from backups.recovery_plan_service import RecoveryPlanExecutor
+
+        errors = RecoveryPlanExecutor.validate_plan(self.get_object())
+        return Response({'valid': not errors, 'errors': errors})
+
+    @action(detail=True, methods=['post'])
+    def execute(self, request, pk=None):
+        """Lancer le plan de reprise (toutes les VMs d'un palier démarrent en parallèle)"""
+        from backups.recovery_plan_service import RecoveryPlanExecutor, start_recovery_plan
+        import threading
+
+        plan = self.get_object()
+        test_mode = bool(request.data.get('test_mode', False))
+
+        errors = RecoveryPlanExecutor.validate_plan(plan)
+        if errors:
+            return Response({'error': 'Plan de reprise invalide', 'errors': errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if plan.executions.filter(status__in=['pending', 'running']).exists():
+            return Response({'error': 'Une exécution de ce plan est déjà en cours'},
+                            status=status.HTTP_409_CONFLICT)
+
+        execution = start_recovery_plan(plan, triggered_by=request.user, test_mode=test_mode)
+
+        def run_plan(execution_id):
+            try:
+                execution = RecoveryPlanExecution.objects.select_related('plan', 'triggered_by').get(id=execution_id)
+                RecoveryPlanExecutor().execute(execution)
+            except Exception as e:
+                logger.error(f"[RECOVERY-PLAN] Erreur exécution {execution_id}: {e}", exc_info=True)
+
+        # Thread local plutôt que Celery: le plan doit pouvoir être lancé même si le broker est indisponible
+        threading.Thread(target=run_plan, args=(execution.id,), daemon=True).start()
+        logger.info(f"[API] Plan de reprise '{plan.name}' lancé (exécution {execution.id})")
+
+        return Response({
+            'message': f"Plan de reprise '{plan.name}' démarré",
+            'execution': RecoveryPlanExecutionSerializer(execution).data
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class RecoveryPlanItemViewSet(viewsets.ModelViewSet):
+    """Gestion des VMs (et de leur palier) dans les plans de reprise"""
+    queryset = RecoveryPlanItem.objects.select_related('replication__virtual_machine').prefetch_related('depends_on')
+    serializer_class = RecoveryPlanItemSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filterset_fields = ['plan', 'tier', 'replication']
+
+
+class RecoveryPlanExecutionViewSet(viewsets.ReadOnlyModelViewSet):
+    """Historique des exécutions de plans de reprise (RTO mesuré + rapport par palier)"""
+    queryset = RecoveryPlanExecution.objects.select_related('plan', 'triggered_by')
+    serializer_class = RecoveryPlanExecutionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    filterset_fields = ['plan', 'status', 'test_mode']
+    ordering_fields = ['started_at', 'completed_at', 'rto_seconds']
+    ordering = ['-started_at']
+
+    @action(detail=True, methods=['get'])
+    def progress(self, request, pk=None):
+        """Progression agrégée de l'exécution (paliers, VMs démarrées, temps écoulé)"""
+        from backups.recovery_plan_service import RecoveryPlanExecutor
+
+        execution = self.get_object()
+        progress_data = RecoveryPlanExecutor.get_progress(execution.id)
+        if progress_data is None:
+            serializer = self.get_serializer(execution)
+            return Response({
+                'execution_id': execution.id,
+                'status': execution.status,
+                'progress': 100 if execution.completed_at else 0,
+                'report': serializer.data
+            })
+        return Response(progress_data)
+
 
 # ==========================================================
 # 🔹 SUREBACKUP - Vérification de sauvegardes
@@ -3453,6 +3597,141 @@ class FailoverEventViewSet(viewsets.ReadOnlyModelViewSet):
 # ont été retirés car le module SureBackup a été supprimé du système.
 
 
+# ==========================================================
+# 🔹 PROGRESS STREAM - Server-Sent Events (remplace le polling)
+# ==========================================================
+def _authenticate_stream_request(request):
+    """
+    Authentifie une requête SSE et résout son tenant
+
+    EventSource ne peut pas envoyer d'en-têtes: le navigateur passe un ticket à
+    usage unique obtenu via POST /api/progress/ticket/ (?ticket=), jamais son token.
+    Les autres clients peuvent utiliser l'en-tête Authorization: Token ...
+
+    Returns:
+        tuple: (user, tenant_id, all_tenants, (message d'erreur, code HTTP) ou None)
+    """
+    from django.contrib.auth.models import User
+    from backups.progress_stream import consume_stream_ticket
+    from tenants.middleware import resolve_organization
+
+    org_id = request.GET.get('organization') or request.META.get('HTTP_X_ORGANIZATION_ID')
+    ticket = request.GET.get('ticket')
+    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+
+    if ticket:
+        payload = consume_stream_ticket(ticket)
+        user = User.objects.filter(id=payload['user_id']).first() if payload else None
+        if user is None:
+            return None, None, False, ('Ticket invalide ou expiré', 401)
+        # L'organisation suivie est celle demandée à l'émission du ticket
+        org_id = payload['organization_id']
+    elif auth_header.startswith('Token '):
+        try:
+            user = Token.objects.select_related('user').get(key=auth_header[len('Token '):]).user
+        except Token.DoesNotExist:
+            return None, None, False, ('Token invalide', 401)
+    else:
+        return None, None, False, ('Authentification requise', 401)
+
+    if not user.is_active:
+        return None, None, False, ('Utilisateur désactivé', 401)
+
+    organization, error = resolve_organization(user, org_id)
+    if error:
+        return None, None, False, (error, 403)
+
+    if organization and not user.is_superuser and not organization.is_active():
+        return None, None, False, ('Votre abonnement n\'est pas actif', 403)
+
+    all_tenants = user.is_superuser and organization is None
+    return user, (organization.id if organization else None), all_tenants, None
+
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def progress_stream_ticket(request):
+    """
+    POST /api/progress/ticket/
+    Ticket d'ouverture du flux SSE (usage unique, valable PROGRESS_STREAM_TICKET_SECONDS)
+
+    Paramètres:
+        organization: Organisation à suivre (optionnel, sinon en-tête X-Organization-ID)
+    """
+    from django.conf import settings
+    from backups.progress_stream import issue_stream_ticket
+    from tenants.middleware import resolve_organization
+
+    org_id = request.data.get('organization') or request.META.get('HTTP_X_ORGANIZATION_ID')
+    _organization, error = resolve_organization(request.user, org_id)
+    if error:
+        return Response({'error': error}, status=status.HTTP_403_FORBIDDEN)
+
+    # Organisation demandée: le flux la résout à nouveau à l'ouverture
+    ticket = issue_stream_ticket(request.user, org_id)
+    return Response({
+        'ticket': ticket,
+        'expires_in': getattr(settings, 'PROGRESS_STREAM_TICKET_SECONDS', 30)
+    })
+
+
+async def progress_stream(request):
+    """
+    Flux SSE des événements de progression (backups, exports, restaurations, réplications)
+
+    Chaque événement est envoyé sous la forme:
+        event: progress
+        data: {"kind": "...", "id": "...", "data": {...}, "timestamp": "..."}
+
+    Paramètres:
+        ticket: Ticket à usage unique (POST /api/progress/ticket/), ou en-tête Authorization: Token ...
+        organization: Organisation à suivre avec l'en-tête Authorization (optionnel)
+        kinds: Types d'événements séparés par des virgules (optionnel)
+
+    Les endpoints de polling restent disponibles en repli. Nécessite un serveur
+    ASGI (sauvegarde/asgi.py): sous WSGI (runserver, gunicorn wsgi) Django
+    consommerait le flux en entier avant de répondre et bloquerait un worker
+    par client; la vue répond alors 503 et le client reste en polling.
+    """
+    import json
+    from asgiref.sync import sync_to_async
+    from django.conf import settings
+    from django.core.handlers.asgi import ASGIRequest
+    from django.http import JsonResponse, StreamingHttpResponse
+    from backups.progress_stream import progress_broker
+
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'error': "Flux de progression disponible uniquement sous ASGI (uvicorn sauvegarde.asgi:application)"},
+            status=503
+        )
+
+    user, tenant_id, all_tenants, error = await sync_to_async(_authenticate_stream_request)(request)
+    if error:
+        message, status_code = error
+        return JsonResponse({'error': message}, status=status_code)
+
+    kinds = {k for k in request.GET.get('kinds', '').split(',') if k}
+    heartbeat = getattr(settings, 'PROGRESS_STREAM_HEARTBEAT_SECONDS', 15)
+
+    async def event_source():
+        yield 'retry: 3000\n\n'
+        async for event in progress_broker.subscribe(tenant_id, all_tenants, heartbeat_seconds=heartbeat):
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            if kinds and event['kind'] not in kinds:
+                continue
+            yield f"event: progress\ndata: {json.dumps(event, default=str)}\n\n"
+
+    logger.info(f"[PROGRESS-STREAM] Abonnement de {user.username} (tenant={tenant_id}, kinds={sorted(kinds) or 'tous'})")
+
+    response = StreamingHttpResponse(event_source(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Désactive le buffering nginx
+    return response
+
+
 # ==========================================================
 # 🔹 PROMETHEUS METRICS - Pour Grafana
 # ==========================================================
@@ -3461,147 +3740,15 @@ class FailoverEventViewSet(viewsets.ReadOnlyModelViewSet):
 def prometheus_metrics(request):
     """
     Endpoint Prometheus pour Grafana
-    Format: métrique{label="value"} valeur timestamp
+    Format: métrique{label="value"} valeur
+
+    Les métriques sont calculées par requêtes groupées et mises en cache
+    (voir backups.metrics_aggregator).
     """
-    from django.db.models import Count, Sum, Avg, Q
-    from django.utils import timezone
-    from datetime import timedelta
-    
-    metrics = []
-    now = timezone.now()
-    last_24h = now - timedelta(hours=24)
-    last_7d = now - timedelta(days=7)
-    
-    # ===== MÉTRIQUES BACKUPS =====
-    total_backups = BackupJob.objects.count()
-    metrics.append(f'esxi_backups_total {total_backups}')
-    
-    backups_completed = BackupJob.objects.filter(status='completed').count()
-    metrics.append(f'esxi_backups_completed_total {backups_completed}')
-    
-    backups_failed = BackupJob.objects.filter(status='failed').count()
-    metrics.append(f'esxi_backups_failed_total {backups_failed}')
-    
-    backups_running = BackupJob.objects.filter(status='running').count()
-    metrics.append(f'esxi_backups_running {backups_running}')
-    
-    # Backups des dernières 24h
-    backups_24h = BackupJob.objects.filter(created_at__gte=last_24h).count()
-    metrics.append(f'esxi_backups_last_24h {backups_24h}')
-    
-    # Taux de succès
-    success_rate = (backups_completed / total_backups * 100) if total_backups > 0 else 0
-    metrics.append(f'esxi_backups_success_rate {success_rate:.2f}')
-    
-    # ===== MÉTRIQUES EXPORTS OVF =====
-    ovf_exports = OVFExportJob.objects.count()
-    metrics.append(f'esxi_ovf_exports_total {ovf_exports}')
-    
-    ovf_completed = OVFExportJob.objects.filter(status='completed').count()
-    metrics.append(f'esxi_ovf_exports_completed_total {ovf_completed}')
-    
-    ovf_failed = OVFExportJob.objects.filter(status='failed').count()
-    metrics.append(f'esxi_ovf_exports_failed_total {ovf_failed}')
-    
-    ovf_running = OVFExportJob.objects.filter(status='running').count()
-    metrics.append(f'esxi_ovf_exports_running {ovf_running}')
-    
-    # Taille totale exportée (en GB)
-    total_exported_mb = OVFExportJob.objects.filter(
-        status='completed'
-    ).aggregate(total=Sum('export_size_mb'))['total'] or 0
-    total_exported_gb = total_exported_mb / 1024
-    metrics.append(f'esxi_ovf_total_exported_gb {total_exported_gb:.2f}')
-    
-    # ===== MÉTRIQUES SERVEURS ESXi =====
-    esxi_servers = ESXiServer.objects.count()
-    metrics.append(f'esxi_servers_total {esxi_servers}')
-    
-    # ===== MÉTRIQUES VMS =====
-    vms_total = VirtualMachine.objects.count()
-    metrics.append(f'esxi_vms_total {vms_total}')
-    
-    vms_powered_on = VirtualMachine.objects.filter(power_state='poweredOn').count()
-    metrics.append(f'esxi_vms_powered_on {vms_powered_on}')
-    
-    vms_powered_off = VirtualMachine.objects.filter(power_state='poweredOff').count()
-    metrics.append(f'esxi_vms_powered_off {vms_powered_off}')
-    
-    # ===== MÉTRIQUES RÉPLICATION =====
-    replications_total = VMReplication.objects.count()
-    metrics.append(f'esxi_replications_total {replications_total}')
-    
-    replications_active = VMReplication.objects.filter(status='active', is_active=True).count()
-    metrics.append(f'esxi_replications_active {replications_active}')
-    
-    replications_paused = VMReplication.objects.filter(status='paused').count()
-    metrics.append(f'esxi_replications_paused {replications_paused}')
-    
-    replications_error = VMReplication.objects.filter(status='error').count()
-    metrics.append(f'esxi_replications_error {replications_error}')
-    
-    # Failovers
-    failovers_total = FailoverEvent.objects.count()
-    metrics.append(f'esxi_failovers_total {failovers_total}')
-    
-    failovers_completed = FailoverEvent.objects.filter(status='completed').count()
-    metrics.append(f'esxi_failovers_completed {failovers_completed}')
-    
-    failovers_failed = FailoverEvent.objects.filter(status='failed').count()
-    metrics.append(f'esxi_failovers_failed {failovers_failed}')
-    
-    # ===== MÉTRIQUES SUREBACKUP =====
-    verifications_total = BackupVerification.objects.count()
-    metrics.append(f'esxi_verifications_total {verifications_total}')
-    
-    verifications_passed = BackupVerification.objects.filter(status='passed').count()
-    metrics.append(f'esxi_verifications_passed {verifications_passed}')
-    
-    verifications_failed = BackupVerification.objects.filter(status='failed').count()
-    metrics.append(f'esxi_verifications_failed {verifications_failed}')
-    
-    verifications_running = BackupVerification.objects.filter(status='running').count()
-    metrics.append(f'esxi_verifications_running {verifications_running}')
-    
-    # Taux de succès des vérifications
-    verification_success_rate = (verifications_passed / verifications_total * 100) if verifications_total > 0 else 0
-    metrics.append(f'esxi_verifications_success_rate {verification_success_rate:.2f}')
-    
-    # ===== MÉTRIQUES DATASTORES =====
-    datastores = DatastoreInfo.objects.all()
-    for ds in datastores:
-        if ds.capacity and ds.free_space:
-            used_percent = ((ds.capacity - ds.free_space) / ds.capacity) * 100
-            # Utilisez des labels pour identifier chaque datastore
-            safe_name = ds.name.replace(' ', '_').replace('-', '_')
-            metrics.append(f'esxi_datastore_used_percent{{datastore="{ds.name}"}} {used_percent:.2f}')
-            metrics.append(f'esxi_datastore_capacity_gb{{datastore="{ds.name}"}} {ds.capacity / (1024**3):.2f}')
-            metrics.append(f'esxi_datastore_free_gb{{datastore="{ds.name}"}} {ds.free_space / (1024**3):.2f}')
-    
-    # ===== MÉTRIQUES SNAPSHOTS =====
-    snapshots_total = Snapshot.objects.count()
-    metrics.append(f'esxi_snapshots_total {snapshots_total}')
-    
-    # ===== MÉTRIQUES PERFORMANCES =====
-    # Temps moyen de backup (en secondes)
-    avg_backup_duration = BackupJob.objects.filter(
-        status='completed',
-        backup_duration_seconds__isnull=False
-    ).aggregate(avg=Avg('backup_duration_seconds'))['avg'] or 0
-    metrics.append(f'esxi_backup_avg_duration_seconds {avg_backup_duration:.2f}')
-    
-    # Temps moyen d'export OVF (en secondes)
-    avg_export_duration = OVFExportJob.objects.filter(
-        status='completed',
-        export_duration_seconds__isnull=False
-    ).aggregate(avg=Avg('export_duration_seconds'))['avg'] or 0
-    metrics.append(f'esxi_ovf_export_avg_duration_seconds {avg_export_duration:.2f}')
-    
-    # Construire la réponse au format Prometheus
-    response_text = '\n'.join(metrics) + '\n'
-    
     from django.http import HttpResponse
-    return HttpResponse(response_text, content_type='text/plain; version=0.0.4')
+    from backups.metrics_aggregator import metrics_aggregator
+
+    return HttpResponse(metrics_aggregator.get_metrics(), content_type='text/plain; version=0.0.4')
 
 
 
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class BackupsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'backups'
+
+    def ready(self):
+        from backups import checks, signals  # noqa: F401
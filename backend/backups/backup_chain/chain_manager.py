@@ -3,13 +3,14 @@ Backup Chain Manager - Gestion professionnelle des chaînes de sauvegarde
 Maintient un fichier chain.json par VM sur le stockage distant
 """
 
-import os
 import json
 import logging
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 from pathlib import Path
 
+from backups.storage_backends import backend_for_config, backend_for_path
+
 logger = logging.getLogger(__name__)
 
 
@@ -17,6 +18,9 @@ class BackupChainManager:
     """
     Gestionnaire de chaînes de sauvegarde pour une VM
 
+    chain.json est lu et écrit par le backend du stockage (système de
+    fichiers ou S3, voir backups.storage_backends).
+
     Structure:
     \\\\NAS\\backups\\
         ├── VM_WebServer\\
@@ -40,11 +44,12 @@ class BackupChainManager:
         """
         self.storage = remote_storage_config
         self.vm_name = vm_name
-        self.vm_folder = os.path.join(self.storage.get_full_path(), vm_name)
-        self.chain_file = os.path.join(self.vm_folder, 'chain.json')
+        self.backend = backend_for_config(self.storage)
+        self.vm_folder = self.backend.join(self.storage.get_full_path(), vm_name)
+        self.chain_file = self.backend.join(self.vm_folder, 'chain.json')
 
         # Créer le dossier VM si nécessaire
-        os.makedirs(self.vm_folder, exist_ok=True)
+        self.backend.makedirs(self.vm_folder)
 
         logger.info(f"[CHAIN] Gestionnaire initialisé pour {vm_name}")
         logger.info(f"[CHAIN] Dossier VM: {self.vm_folder}")
@@ -57,13 +62,12 @@ class BackupChainManager:
         Returns:
             Dict contenant la chaîne de sauvegarde
         """
-        if not os.path.exists(self.chain_file):
+        if not self.backend.exists(self.chain_file):
             logger.info(f"[CHAIN] Pas de chaîne existante pour {self.vm_name}, création d'une nouvelle")
             return self._create_empty_chain()
 
         try:
-            with open(self.chain_file, 'r', encoding='utf-8') as f:
-                chain = json.load(f)
+            chain = json.loads(self.backend.read_bytes(self.chain_file).decode('utf-8'))
 
             logger.info(f"[CHAIN] Chaîne chargée: {len(chain.get('backups', []))} sauvegardes")
             return chain
@@ -82,15 +86,17 @@ class BackupChainManager:
         """
         try:
             # Backup de l'ancienne chaîne
-            if os.path.exists(self.chain_file):
+            if self.backend.exists(self.chain_file):
                 backup_file = f"{self.chain_file}.backup"
-                with open(self.chain_file, 'r', encoding='utf-8') as f_src:
-                    with open(backup_file, 'w', encoding='utf-8') as f_dst:
-                        f_dst.write(f_src.read())
+                self.backend.write_bytes(backup_file, self.backend.read_bytes(self.chain_file))
 
-            # Sauvegarder la nouvelle chaîne
-            with open(self.chain_file, 'w', encoding='utf-8') as f:
-                json.dump(chain, f, indent=2, ensure_ascii=False)
+            # Sauvegarder la nouvelle chaîne (fichier temporaire puis remplacement:
+            # jamais de chain.json partiel en cas d'interruption)
+            temp_file = f"{self.chain_file}.tmp"
+            self.backend.write_bytes(
+                temp_file, json.dumps(chain, indent=2, ensure_ascii=False).encode('utf-8')
+            )
+            self.backend.rename_atomic(temp_file, self.chain_file)
 
             logger.info(f"[CHAIN] Chaîne sauvegardée: {self.chain_file}")
 
@@ -114,7 +120,8 @@ class BackupChainManager:
                 'files': ['VM.ovf', 'VM.vmdk'],
                 'base_backup_id': 'full_20250118_140000',  # Pour incremental
                 'vm_uuid': '564d6d90-459c-...',
-                'vm_config': {...}  # Config VM au moment du backup
+                'vm_config': {...},  # Config VM au moment du backup
+                'location': '/mnt/fast/VM_full_...'  # Dossier du point de restauration
             }
 
         Returns:
@@ -139,6 +146,8 @@ class BackupChainManager:
             'integrity_verified': backup_data.get('integrity_verified', False),
             'files': backup_data.get('files', []),
         }
+        if backup_data.get('location'):
+            backup_entry['location'] = backup_data['location']
 
         # Champs spécifiques au type
         if backup_data['type'] == 'full':
@@ -195,6 +204,43 @@ class BackupChainManager:
         chain = self.load_chain()
         return next((b for b in chain['backups'] if b['id'] == backup_id), None)
 
+    def backup_folder(self, backup) -> str:
+        """
+        Dossier d'un point de restauration
+
+        Le dossier est enregistré dans la chaîne ('location'): il peut se
+        trouver sur un autre chemin que le dossier de la VM (placement
+        automatique, déplacement vers un tier de stockage moins cher). Les
+        entrées antérieures sont dans le dossier de la VM.
+
+        Args:
+            backup: Entrée de la chaîne ou ID de la sauvegarde
+
+        Returns:
+            str: Chemin du dossier
+        """
+        if isinstance(backup, str):
+            backup = self.get_backup(backup) or {'id': backup}
+        return backup.get('location') or self.backend.join(self.vm_folder, backup['id'])
+
+    def set_backup_location(self, backup_id: str, location: str) -> bool:
+        """
+        Enregistre le nouveau dossier d'un point de restauration déplacé
+
+        Returns:
+            bool: True si l'entrée existe
+        """
+        chain = self.load_chain()
+        backup = next((b for b in chain['backups'] if b['id'] == backup_id), None)
+        if not backup:
+            logger.warning(f"[CHAIN] Backup {backup_id} introuvable, emplacement non mis à jour")
+            return False
+
+        backup['location'] = location
+        self.save_chain(chain)
+        logger.info(f"[CHAIN] Backup {backup_id} déplacé vers {location}")
+        return True
+
     def get_latest_full_backup(self) -> Optional[Dict[str, Any]]:
         """
         Récupère la dernière sauvegarde complète
@@ -416,8 +462,8 @@ class BackupChainManager:
 
         # Vérifier l'existence physique des dossiers
         for backup in chain['backups']:
-            backup_folder = os.path.join(self.vm_folder, backup['id'])
-            if not os.path.exists(backup_folder):
+            backup_folder = self.backup_folder(backup)
+            if not backend_for_path(backup_folder).exists(backup_folder):
                 results['valid'] = False
                 results['errors'].append(f"Dossier {backup['id']} introuvable")
 
@@ -3,12 +3,13 @@ Integrity Checker - Vérification de l'intégrité des sauvegardes
 Calcul et vérification de checksums (MD5, SHA256)
 """
 
-import os
 import json
 import hashlib
 import logging
 from typing import Dict, List, Any, Optional
 
+from backups.storage_backends import backend_for_path
+
 logger = logging.getLogger(__name__)
 
 
@@ -21,6 +22,10 @@ class IntegrityChecker:
     - Vérification intégrité fichiers
     - Validation structure OVF
     - Génération rapports d'intégrité
+
+    Les fichiers sont lus par le backend de leur dossier (système de fichiers
+    ou S3): un point de restauration peut être sur un autre stockage que
+    chain.json.
     """
 
     def __init__(self, chain_manager):
@@ -53,35 +58,34 @@ class IntegrityChecker:
                 }
             }
         """
-        if not os.path.exists(backup_folder):
+        backend = backend_for_path(backup_folder)
+        if not backend.exists(backup_folder):
             raise FileNotFoundError(f"Dossier introuvable: {backup_folder}")
 
         checksums = {}
 
         logger.info(f"[INTEGRITY] Calcul checksums ({algorithm}) pour: {backup_folder}")
 
-        for root, _, files in os.walk(backup_folder):
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                relative_path = os.path.relpath(file_path, backup_folder)
+        for relative_path, info in backend.list_files(backup_folder).items():
+            file_path = backend.join(backup_folder, relative_path)
 
-                try:
-                    checksum, file_size = self._calculate_file_checksum(file_path, algorithm)
+            try:
+                checksum, file_size = self._calculate_file_checksum(file_path, algorithm)
 
-                    checksums[relative_path] = {
-                        'size': file_size,
-                        'checksum': checksum,
-                        'algorithm': algorithm,
-                        'modified': os.path.getmtime(file_path)
-                    }
+                checksums[relative_path] = {
+                    'size': file_size,
+                    'checksum': checksum,
+                    'algorithm': algorithm,
+                    'modified': info['modified']
+                }
 
-                    logger.debug(f"[INTEGRITY]   {relative_path}: {checksum[:16]}...")
+                logger.debug(f"[INTEGRITY]   {relative_path}: {checksum[:16]}...")
 
-                except Exception as e:
-                    logger.error(f"[INTEGRITY] Erreur calcul {relative_path}: {e}")
-                    checksums[relative_path] = {
-                        'error': str(e)
-                    }
+            except Exception as e:
+                logger.error(f"[INTEGRITY] Erreur calcul {relative_path}: {e}")
+                checksums[relative_path] = {
+                    'error': str(e)
+                }
 
         logger.info(f"[INTEGRITY] ✓ Checksums calculés: {len(checksums)} fichiers")
 
@@ -104,8 +108,9 @@ class IntegrityChecker:
                 'errors': List[str]
             }
         """
-        backup_folder = os.path.join(self.chain_manager.vm_folder, backup_id)
-        metadata_file = os.path.join(backup_folder, 'metadata.json')
+        backup_folder = self.chain_manager.backup_folder(backup_id)
+        backend = backend_for_path(backup_folder)
+        metadata_file = backend.join(backup_folder, 'metadata.json')
 
         logger.info(f"[INTEGRITY] Vérification intégrité: {backup_id}")
 
@@ -119,38 +124,37 @@ class IntegrityChecker:
         }
 
         # Vérifier que le dossier existe
-        if not os.path.exists(backup_folder):
+        if not backend.exists(backup_folder):
             results['valid'] = False
             results['errors'].append(f"Dossier de sauvegarde introuvable: {backup_folder}")
             logger.error(f"[INTEGRITY] ✗ {results['errors'][-1]}")
             return results
 
         # Charger les métadonnées si elles existent
-        if not os.path.exists(metadata_file):
+        if not backend.exists(metadata_file):
             logger.warning(f"[INTEGRITY] Pas de metadata.json, vérification limitée")
             # Vérification basique sans métadonnées
             return self._basic_verification(backup_folder, results)
 
         try:
-            with open(metadata_file, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
+            metadata = json.loads(backend.read_bytes(metadata_file).decode('utf-8'))
 
             stored_checksums = metadata.get('checksums', {})
             results['total_files'] = len(stored_checksums)
 
             # Vérifier chaque fichier
             for filename, stored_info in stored_checksums.items():
-                file_path = os.path.join(backup_folder, filename)
+                file_path = backend.join(backup_folder, filename)
 
                 # Vérifier existence
-                if not os.path.exists(file_path):
+                if not backend.exists(file_path):
                     results['valid'] = False
                     results['missing_files'].append(filename)
                     logger.error(f"[INTEGRITY] ✗ Fichier manquant: {filename}")
                     continue
 
                 # Vérifier taille
-                actual_size = os.path.getsize(file_path)
+                actual_size = backend.size(file_path)
                 expected_size = stored_info.get('size', 0)
 
                 if actual_size != expected_size:
@@ -224,9 +228,9 @@ class IntegrityChecker:
         }
 
         # Sauvegarder
-        metadata_file = os.path.join(backup_folder, 'metadata.json')
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        backend = backend_for_path(backup_folder)
+        metadata_file = backend.join(backup_folder, 'metadata.json')
+        backend.write_bytes(metadata_file, json.dumps(metadata, indent=2, ensure_ascii=False).encode('utf-8'))
 
         logger.info(f"[INTEGRITY] ✓ Manifest créé: {metadata_file}")
 
@@ -290,13 +294,9 @@ class IntegrityChecker:
 
         file_size = 0
 
-        with open(file_path, 'rb') as f:
-            while True:
-                chunk = f.read(8192)  # 8KB chunks
-                if not chunk:
-                    break
-                hasher.update(chunk)
-                file_size += len(chunk)
+        for chunk in backend_for_path(file_path).iter_chunks(file_path):
+            hasher.update(chunk)
+            file_size += len(chunk)
 
         return hasher.hexdigest(), file_size
 
@@ -318,12 +318,11 @@ class IntegrityChecker:
 
         found_essential = []
 
-        for root, _, files in os.walk(backup_folder):
-            for file in files:
-                for ext in essential_files:
-                    if file.endswith(ext):
-                        found_essential.append(ext)
-                        break
+        for file in backend_for_path(backup_folder).list_files(backup_folder):
+            for ext in essential_files:
+                if file.endswith(ext):
+                    found_essential.append(ext)
+                    break
 
         if not found_essential:
             results['valid'] = False
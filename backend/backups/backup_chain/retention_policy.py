@@ -3,12 +3,12 @@ Retention Policy Manager - Gestion automatique de la rétention des sauvegardes
 Applique des politiques de nettoyage (30 jours, conservation mensuelle, etc.)
 """
 
-import os
-import shutil
 import logging
 from datetime import datetime, timedelta
 from typing import List, Dict, Any
 
+from backups.storage_backends import backend_for_path
+
 logger = logging.getLogger(__name__)
 
 
@@ -255,15 +255,16 @@ class RetentionPolicyManager:
         Returns:
             True si suppression réussie
         """
-        backup_folder = os.path.join(self.chain_manager.vm_folder, backup['id'])
+        backup_folder = self.chain_manager.backup_folder(backup)
+        storage = backend_for_path(backup_folder)
 
-        if not os.path.exists(backup_folder):
+        if not storage.exists(backup_folder):
             logger.warning(f"[RETENTION] Dossier introuvable: {backup_folder}")
             return False
 
         try:
             # Supprimer récursivement
-            shutil.rmtree(backup_folder)
+            storage.delete(backup_folder)
             logger.info(f"[RETENTION] Dossier supprimé: {backup_folder}")
             return True
 
@@ -15,6 +15,8 @@ from backups.backup_chain.chain_manager import BackupChainManager
 from backups.backup_chain.integrity_checker import IntegrityChecker
 from backups.backup_chain.retention_policy import RetentionPolicyManager
 from backups.notification_service import notification_service
+from backups.remote_storage import mount_manager
+from backups.remote_storage.storage_manager import StorageConnectionError
 
 logger = logging.getLogger(__name__)
 
@@ -61,6 +63,7 @@ class BackupService:
         self.chain_manager = None
         self.integrity_checker = None
         self.retention_manager = None
+        self.remote_storage = None
 
         self._init_chain_managers()
 
@@ -86,6 +89,7 @@ class BackupService:
             if remote_storage:
                 logger.info(f"[BACKUP-CHAIN] Initialisation des managers pour {self.vm.name}")
 
+                self.remote_storage = remote_storage
                 self.chain_manager = BackupChainManager(remote_storage, self.vm.name)
                 self.integrity_checker = IntegrityChecker(self.chain_manager)
                 self.retention_manager = RetentionPolicyManager(self.chain_manager)
@@ -136,7 +140,17 @@ class BackupService:
             self.job.save()
             logger.info("[BACKUP] Job marqué comme 'running'")
 
+        storage_mounted = False
         try:
+            # Montage partagé du stockage de la chaîne (vérifié par mount_manager)
+            if self.remote_storage:
+                try:
+                    mount_manager.acquire(self.remote_storage)
+                    storage_mounted = True
+                except StorageConnectionError as e:
+                    logger.error(f"[BACKUP-CHAIN] {e}, la chaîne ne sera pas mise à jour")
+                    self.chain_manager = self.integrity_checker = self.retention_manager = None
+
             # Normaliser et définir le chemin de destination du backup
             normalized_location = normalize_windows_path(self.job.backup_location)
 
@@ -365,6 +379,8 @@ class BackupService:
             return False
 
         finally:
+            if storage_mounted:
+                mount_manager.release(self.remote_storage)
             logger.info("[BACKUP] Déconnexion de l'ESXi")
             vmware.disconnect()
 
@@ -414,6 +430,7 @@ class BackupService:
                 'size_bytes': size_bytes,
                 'files': files,
                 'vm_uuid': self.vm.vm_id,
+                'location': backup_dir,
             }
 
             if backup_type == 'incremental' and base_backup_id:
@@ -0,0 +1,437 @@
+"""
+Staging local des backups de VM destinés à une cible réseau lente
+
+Sur un partage SMB (ou NFS), download_vmdk_file avance au rythme des écritures
+distantes: la lecture HTTP depuis ESXi ralentit d'autant, le snapshot reste
+ouvert plus longtemps et son delta grossit. Avec BACKUP_STAGING_DIR (disque
+local rapide, SSD), les fichiers d'un backup vers une cible de
+BACKUP_STAGING_PROTOCOLS sont d'abord écrits dans le staging: les lectures se
+font à pleine vitesse et le snapshot est supprimé dès qu'elles sont terminées.
+Un mover copie ensuite les fichiers vers la cible, au débit de l'organisation.
+
+Journal (un fichier JSON par job à côté de son dossier, remplacé atomiquement):
+- state 'writing': backup en cours d'écriture dans le staging;
+- state 'sealed': lectures terminées; chaque fichier a sa taille et son SHA-256
+  (calculé pendant le téléchargement) et est marqué 'verified' une fois copié.
+
+Copie d'un fichier: écriture de <fichier>.part sur la cible, relecture et
+comparaison du SHA-256, puis renommage atomique. Après un arrêt (worker
+redémarré, cible injoignable), la copie reprend au premier fichier non
+vérifié; un fichier partiel n'apparaît jamais sous son nom final. Le job reste
+'running' jusqu'à la fin de la copie, puis passe 'completed'.
+
+La copie passe par le dispatcher de jobs (classe 'backup': concurrence bornée,
+attente à l'arrêt du processus). Les copies interrompues par un arrêt sont
+reprises au démarrage du processus suivant (resume_pending, worker_ready) et
+par la tâche périodique drain_backup_staging.
+
+Un verrou sur le journal (fcntl, msvcrt sous Windows) empêche deux processus
+de copier le même job; il est libéré automatiquement si le processus meurt.
+"""
+import hashlib
+import json
+import logging
+import os
+import platform
+import shutil
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from backups.storage_backends import backend_for_path, local_backend
+from backups.storage_capacity import GB
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_SUFFIX = '.staging.json'
+LOCK_SUFFIX = '.lock'
+PART_SUFFIX = '.part'
+
+
+def _sha256(backend, path):
+    digest = hashlib.sha256()
+    for chunk in backend.iter_chunks(path):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _limited(reader, limiter):
+    for chunk in reader:
+        if limiter is not None:
+            limiter.consume(len(chunk))
+        yield chunk
+
+
+class StagingArea:
+    """
+    Dossier de staging d'un backup en cours d'écriture
+
+    Le service de backup écrit dans `path` (driver local) au lieu de la
+    destination, puis appelle seal() une fois les lectures terminées.
+    """
+
+    def __init__(self, job_id, path, destination):
+        self.job_id = job_id
+        self.path = path
+        self.destination = destination
+        self.journal_path = path + JOURNAL_SUFFIX
+        self._checksums = {}
+
+    def record_checksum(self, file_path, sha256):
+        """SHA-256 d'un fichier, calculé pendant son téléchargement"""
+        self._checksums[os.path.relpath(file_path, self.path).replace(os.sep, '/')] = sha256
+
+    def seal(self):
+        """
+        Fin des écritures: enregistre les fichiers à copier vers la destination
+
+        Les fichiers sans checksum enregistré (petits fichiers de configuration)
+        sont hachés ici, sur le disque local.
+
+        Returns:
+            int: Octets à copier
+        """
+        files = {}
+        for relative, info in local_backend.list_files(self.path).items():
+            sha256 = self._checksums.get(relative)
+            if sha256 is None:
+                sha256 = _sha256(local_backend, os.path.join(self.path, *relative.split('/')))
+            files[relative] = {'size': info['size'], 'sha256': sha256, 'verified': False}
+
+        journal = backup_staging.read_journal(self.journal_path)
+        journal.update({'state': 'sealed', 'sealed_at': timezone.now().isoformat(), 'files': files})
+        backup_staging.write_journal(self.journal_path, journal)
+        return sum(entry['size'] for entry in files.values())
+
+    def discard(self):
+        """Supprime le dossier et le journal (backup annulé ou en échec)"""
+        backup_staging.discard(self.journal_path)
+
+
+class BackupStagingService:
+    """
+    Ouverture des zones de staging et copie (mover) vers les cibles
+    """
+
+    @staticmethod
+    def root():
+        """Dossier de staging (None = staging désactivé)"""
+        return getattr(settings, 'BACKUP_STAGING_DIR', '') or None
+
+    # ------------------------------------------------------------------
+    # Journal
+    # ------------------------------------------------------------------
+    @staticmethod
+    def read_journal(journal_path):
+        with open(journal_path, 'rb') as f:
+            return json.load(f)
+
+    @staticmethod
+    def write_journal(journal_path, journal):
+        """Remplacement atomique (fichier temporaire synchronisé puis rename)"""
+        tmp_path = journal_path + '.tmp'
+        local_backend.write_stream(tmp_path, [json.dumps(journal, indent=2).encode('utf-8')], fsync=True)
+        local_backend.rename_atomic(tmp_path, journal_path)
+
+    def journals(self):
+        root = self.root()
+        if not root or not os.path.isdir(root):
+            return []
+        return sorted(os.path.join(root, name) for name in os.listdir(root) if name.endswith(JOURNAL_SUFFIX))
+
+    def pending_bytes(self):
+        """Taille prévue des backups en cours d'écriture dans le staging"""
+        total = 0
+        for journal_path in self.journals():
+            try:
+                journal = self.read_journal(journal_path)
+            except (OSError, ValueError):
+                continue
+            if journal.get('state') == 'writing':
+                total += journal.get('expected_bytes') or 0
+        return total
+
+    @staticmethod
+    def discard(journal_path):
+        local_backend.delete(journal_path[:-len(JOURNAL_SUFFIX)])
+        for path in (journal_path, journal_path + LOCK_SUFFIX):
+            local_backend.delete(path)
+
+    @staticmethod
+    def _lock(journal_path):
+        """Verrou exclusif non bloquant du journal (None si déjà pris)"""
+        fd = os.open(journal_path + LOCK_SUFFIX, os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            if platform.system() == 'Windows':
+                import msvcrt
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return None
+        return fd
+
+    @staticmethod
+    def _unlock(fd):
+        """Libère le verrou du journal et ferme son descripteur"""
+        try:
+            if platform.system() == 'Windows':
+                import msvcrt
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    # ------------------------------------------------------------------
+    # Ouverture
+    # ------------------------------------------------------------------
+    def open(self, backup_job):
+        """
+        Zone de staging d'un VMBackupJob dont la cible est lente
+
+        Returns:
+            StagingArea ou None (écriture directe sur la destination: staging
+            désactivé, cible rapide ou staging sans la place nécessaire)
+        """
+        root = self.root()
+        destination = backup_job.backup_full_path
+        if not root or not destination:
+            return None
+
+        protocol = backend_for_path(destination).protocol
+        if protocol not in getattr(settings, 'BACKUP_STAGING_PROTOCOLS', ('smb', 'nfs')):
+            return None
+
+        from backups.storage_capacity import storage_capacity
+
+        expected = storage_capacity.predict_size_bytes(
+            backup_job.virtual_machine, 'vm_backup', incremental=backup_job.backup_type == 'incremental'
+        )
+        local_backend.makedirs(root)
+        free = shutil.disk_usage(root).free
+        min_free = getattr(settings, 'BACKUP_STAGING_MIN_FREE_GB', 20) * GB
+        if free - self.pending_bytes() - min_free < expected:
+            logger.warning(
+                f"[BACKUP-STAGING] Staging insuffisant ({free / GB:.1f} GB libres, {expected / GB:.1f} GB prévus), "
+                f"écriture directe sur la cible {protocol}"
+            )
+            return None
+
+        path = os.path.join(root, f'vm_backup_{backup_job.id}')
+        local_backend.delete(path)
+        local_backend.makedirs(path)
+        area = StagingArea(backup_job.id, path, destination)
+        self.write_journal(area.journal_path, {
+            'job_id': backup_job.id,
+            'created_by_id': backup_job.created_by_id,
+            'destination': destination,
+            'state': 'writing',
+            'expected_bytes': expected,
+            'created_at': timezone.now().isoformat(),
+            'attempts': 0,
+            'files': {},
+        })
+        logger.info(f"[BACKUP-STAGING] VMBackup #{backup_job.id}: écriture dans {path} (cible {protocol}: {destination})")
+        return area
+
+    # ------------------------------------------------------------------
+    # Mover
+    # ------------------------------------------------------------------
+    def start_drain(self, area, created_by_id=None, size_bytes=None):
+        """
+        Confie la copie d'un backup scellé au dispatcher (classe 'backup' du processus courant)
+
+        Returns:
+            Future, ou None si le processus s'arrête (copie reprise au démarrage suivant)
+        """
+        return self._submit_drain(area.journal_path, area.job_id, created_by_id, size_bytes)
+
+    def _submit_drain(self, journal_path, job_id, created_by_id, size_bytes):
+        from backups.job_dispatcher import JobDispatcherShutdown, job_dispatcher
+        from backups.tenant_scheduler import tenant_scheduler
+
+        try:
+            return job_dispatcher.submit(
+                'backup', self.drain, journal_path,
+                description=f'staging VMBackup #{job_id}',
+                tenant=tenant_scheduler.profile(created_by_id),
+                cost=(size_bytes or 0) / GB
+            )
+        except JobDispatcherShutdown:
+            logger.warning(f"[BACKUP-STAGING] VMBackup #{job_id}: arrêt en cours, copie reprise au démarrage suivant")
+            return None
+
+    def resume_pending(self):
+        """
+        Relance les copies des backups scellés (démarrage du processus)
+
+        Une copie interrompue par l'arrêt du processus laisserait sinon son job
+        'running' jusqu'au prochain drain_backup_staging (Celery Beat). Une copie
+        déjà en cours dans un autre processus est ignorée (verrou du journal).
+
+        Returns:
+            int: Nombre de copies relancées
+        """
+        resumed = 0
+        for journal_path in self.journals():
+            try:
+                journal = self.read_journal(journal_path)
+            except (OSError, ValueError):
+                continue
+            if journal.get('state') != 'sealed':
+                continue
+            size_bytes = sum(entry['size'] for entry in journal['files'].values() if not entry['verified'])
+            if self._submit_drain(journal_path, journal['job_id'], journal.get('created_by_id'), size_bytes):
+                resumed += 1
+        if resumed:
+            logger.info(f"[BACKUP-STAGING] {resumed} copie(s) du staging reprise(s) au démarrage")
+        return resumed
+
+    def drain(self, journal_path):
+        """
+        Copie vers la destination les fichiers d'un backup scellé, puis termine le job
+
+        Le staging d'un job supprimé, annulé ou en échec est supprimé (ainsi
+        que les fichiers déjà copiés si le job a été annulé).
+
+        Returns:
+            str: 'completed', 'retry', 'failed', 'cancelled', 'discarded', ou
+            None (journal verrouillé par un autre processus ou backup en cours d'écriture)
+        """
+        from backups.models import VMBackupJob
+
+        if not os.path.exists(journal_path):
+            return None
+        fd = self._lock(journal_path)
+        if fd is None:
+            return None
+
+        try:
+            if not os.path.exists(journal_path):
+                return None
+            journal = self.read_journal(journal_path)
+            job = VMBackupJob.objects.filter(id=journal['job_id']).first()
+
+            if job is None or job.status in ('completed', 'failed'):
+                self.discard(journal_path)
+                return 'discarded'
+            if job.status == 'cancelled':
+                self._cancel(journal_path, journal)
+                return 'cancelled'
+            if journal['state'] != 'sealed':
+                return None
+
+            try:
+                return self._copy(journal_path, journal, job)
+            except Exception as e:
+                return self._copy_failed(journal_path, journal, job, e)
+        finally:
+            self._unlock(fd)
+
+    def drain_all(self):
+        """
+        Reprend la copie de tous les backups scellés (tâche périodique)
+
+        Returns:
+            dict: {statut: nombre de journaux}
+        """
+        results = {}
+        for journal_path in self.journals():
+            try:
+                status = self.drain(journal_path)
+            except Exception as e:
+                logger.error(f"[BACKUP-STAGING] Erreur copie {journal_path}: {e}", exc_info=True)
+                status = 'error'
+            key = status or 'skipped'
+            results[key] = results.get(key, 0) + 1
+        return results
+
+    def _cancel(self, journal_path, journal):
+        if journal['state'] == 'sealed':
+            destination = journal['destination']
+            try:
+                backend_for_path(destination).delete(destination)
+            except Exception as e:
+                logger.warning(f"[BACKUP-STAGING] Erreur suppression de {destination}: {e}")
+        self.discard(journal_path)
+        logger.info(f"[BACKUP-STAGING] VMBackup #{journal['job_id']} annulé, staging supprimé")
+
+    def _copy(self, journal_path, journal, job):
+        from backups.tenant_scheduler import tenant_scheduler
+
+        staging_path = journal_path[:-len(JOURNAL_SUFFIX)]
+        destination = journal['destination']
+        storage = backend_for_path(destination)
+        limiter = tenant_scheduler.bandwidth_limiter(job.created_by_id)
+        verify = getattr(settings, 'BACKUP_STAGING_VERIFY', True)
+
+        storage.makedirs(destination)
+        remaining = {relative: entry for relative, entry in journal['files'].items() if not entry['verified']}
+        logger.info(
+            f"[BACKUP-STAGING] VMBackup #{job.id}: copie de {len(remaining)} fichier(s) vers {destination}"
+            + (f" (reprise, {len(journal['files']) - len(remaining)} déjà copiés)" if len(remaining) < len(journal['files']) else '')
+        )
+
+        for relative, entry in sorted(remaining.items()):
+            job.refresh_from_db(fields=['status'])
+            if job.status == 'cancelled':
+                self._cancel(journal_path, journal)
+                return 'cancelled'
+
+            parts = relative.split('/')
+            if len(parts) > 1:
+                storage.makedirs(storage.join(destination, *parts[:-1]))
+            target = storage.join(destination, *parts)
+            partial = target + PART_SUFFIX
+
+            with local_backend.open_range(os.path.join(staging_path, *parts)) as reader:
+                written = storage.write_stream(partial, _limited(reader, limiter), fsync=True, size_hint=entry['size'])
+            if written != entry['size'] or (verify and _sha256(storage, partial) != entry['sha256']):
+                storage.delete(partial)
+                raise IOError(f"Vérification de {target} en échec (taille ou SHA-256 différent)")
+            storage.rename_atomic(partial, target)
+
+            entry['verified'] = True
+            self.write_journal(journal_path, journal)
+
+        total = sum(entry['size'] for entry in journal['files'].values())
+        job.backup_size_mb = total / (1024 * 1024)
+        job.progress_percentage = 100
+        job.status = 'completed'
+        job.completed_at = timezone.now()
+        job.calculate_duration()
+
+        self.discard(journal_path)
+        logger.info(f"[BACKUP-STAGING] VMBackup #{job.id} copié et vérifié sur {destination} ({total / GB:.2f} GB)")
+        return 'completed'
+
+    def _copy_failed(self, journal_path, journal, job, error):
+        """Copie en échec: nouvelle tentative au prochain passage, ou job en échec"""
+        max_attempts = getattr(settings, 'BACKUP_STAGING_MAX_ATTEMPTS', 5)
+        journal['attempts'] = journal.get('attempts', 0) + 1
+        journal['last_error'] = str(error)
+
+        if journal['attempts'] < max_attempts:
+            self.write_journal(journal_path, journal)
+            logger.warning(
+                f"[BACKUP-STAGING] VMBackup #{job.id}: copie en échec ({journal['attempts']}/{max_attempts}), "
+                f"reprise au prochain passage: {error}"
+            )
+            return 'retry'
+
+        logger.error(f"[BACKUP-STAGING] VMBackup #{job.id}: copie abandonnée après {max_attempts} tentatives: {error}")
+        job.status = 'failed'
+        job.error_message = f"Copie du staging vers {journal['destination']} en échec: {error}"
+        job.completed_at = timezone.now()
+        job.calculate_duration()
+        self.discard(journal_path)
+        return 'failed'
+
+
+# Instance globale
+backup_staging = BackupStagingService()
@@ -0,0 +1,32 @@
+"""
+Checks Django de l'application backups
+"""
+from django.conf import settings
+from django.core.checks import Error, Warning, register
+
+# Backends dont le contenu n'est visible que du processus courant
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Le cache par défaut doit être partagé entre le web et les workers Celery
+
+    Les verrous d'admission de storage_capacity et l'état / les références de
+    mount_manager reposent sur cache.add / cache.incr: avec un cache propre au
+    processus, deux workers admettent des jobs sur la même marge et check_all
+    peut démonter une cible encore utilisée par un autre processus.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+
+    message = f"Le cache par défaut ({backend}) n'est pas partagé entre les processus"
+    hint = "Configurer un cache partagé (CACHE_BACKEND=redis, CACHE_REDIS_URL)."
+    if settings.DEBUG:
+        return [Warning(message, hint=hint, id='backups.W001')]
+    return [Error(message, hint=hint, id='backups.E001')]
@@ -0,0 +1,124 @@
+"""
+Résumé du dashboard (statistiques et sauvegardes récentes)
+
+Une requête d'agrégation conditionnelle par modèle, résultat mis en cache par
+tenant. Le cache est invalidé à chaque changement de statut d'un job de backup
+(signal, voir backups.signals): le rafraîchissement automatique du dashboard
+ne relit la base qu'après un changement d'état, quel que soit le volume de
+l'historique.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_CACHE_VERSION_KEY = 'dashboard_summary_version'
+
+
+def invalidate_dashboard_cache():
+    """Invalide les résumés du dashboard en cache (tous tenants)"""
+    cache.set(DASHBOARD_CACHE_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+class DashboardSummaryService:
+    """
+    Calcul et cache des données du dashboard
+    """
+
+    CACHE_PREFIX = 'dashboard_summary'
+
+    # Les jobs en cours changent de progression sans changer de statut
+    RUNNING_TTL_SECONDS = 5
+
+    def __init__(self, ttl_seconds=None):
+        """
+        Args:
+            ttl_seconds: Durée de validité en cache (None = settings.DASHBOARD_CACHE_TTL_SECONDS)
+        """
+        self.ttl_seconds = (
+            ttl_seconds if ttl_seconds is not None
+            else getattr(settings, 'DASHBOARD_CACHE_TTL_SECONDS', 60)
+        )
+
+    def _cache_key(self, name, tenant_id):
+        version = cache.get(DASHBOARD_CACHE_VERSION_KEY, 0)
+        return f'{self.CACHE_PREFIX}_{name}_{version}_{tenant_id or "global"}'
+
+    def _cached(self, name, tenant_id, compute, ttl_for=None):
+        key = self._cache_key(name, tenant_id)
+        data = cache.get(key)
+        if data is None:
+            data = compute()
+            cache.set(key, data, timeout=ttl_for(data) if ttl_for else self.ttl_seconds)
+        return data
+
+    @staticmethod
+    def compute_stats():
+        """
+        Statistiques du dashboard, une requête par modèle
+
+        Returns:
+            dict: champs de DashboardStatsSerializer
+        """
+        from backups.models import BackupJob, BackupSchedule
+        from backups.rollup_service import rollup_service
+        from esxi.models import ESXiServer, VirtualMachine
+
+        jobs = BackupJob.objects.aggregate(
+            total=Count('id'),
+            completed=Count('id', filter=Q(status='completed')),
+            failed=Count('id', filter=Q(status='failed')),
+            running=Count('id', filter=Q(status='running'))
+        )
+        servers = ESXiServer.objects.aggregate(active=Count('id', filter=Q(is_active=True)))
+        vms = VirtualMachine.objects.aggregate(total=Count('id'))
+        schedules = BackupSchedule.objects.aggregate(active=Count('id', filter=Q(is_active=True)))
+
+        # Volume: agrégats journaliers plutôt que tout l'historique
+        total_size_mb = rollup_service.totals(operations=['backup_job'])['bytes_moved'] / (1024 ** 2)
+
+        return {
+            'total_servers': servers['active'],
+            'total_vms': vms['total'],
+            'total_backups': jobs['total'],
+            'successful_backups': jobs['completed'],
+            'failed_backups': jobs['failed'],
+            'running_backups': jobs['running'],
+            'total_backup_size_gb': round(total_size_mb / 1024, 2),
+            'active_schedules': schedules['active'],
+        }
+
+    @staticmethod
+    def compute_recent_backups(limit=10):
+        """
+        Derniers jobs de backup sérialisés (une requête)
+
+        Returns:
+            list: données BackupJobSerializer
+        """
+        from api.serializers import BackupJobSerializer
+        from backups.models import BackupJob
+
+        recent = BackupJob.objects.select_related('virtual_machine', 'base_backup').order_by('-created_at')[:limit]
+        return list(BackupJobSerializer(recent, many=True).data)
+
+    def get_stats(self, tenant_id=None):
+        """Statistiques du dashboard (cache par tenant)"""
+        return self._cached('stats', tenant_id, self.compute_stats)
+
+    def get_recent_backups(self, tenant_id=None, limit=10):
+        """Sauvegardes récentes (cache par tenant, plus court si un job est en cours)"""
+        def ttl_for(jobs):
+            if any(job['status'] == 'running' for job in jobs):
+                return min(self.ttl_seconds, self.RUNNING_TTL_SECONDS)
+            return self.ttl_seconds
+
+        return self._cached(f'recent_{limit}', tenant_id, lambda: self.compute_recent_backups(limit), ttl_for)
+
+
+# Instance globale du service
+dashboard_summary = DashboardSummaryService()
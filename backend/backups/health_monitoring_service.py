@@ -1,18 +1,39 @@
 """
 Service de monitoring de santé des backups
 Analyse l'état global des backups et détecte les problèmes potentiels
+
+Toutes les vérifications sont calculées à partir d'un même chargement
+(quelques requêtes groupées/annotées et les agrégats BackupRollup, voir _load_snapshot). Avec un
+tenant, ce chargement est limité aux objets créés par les membres de l'organisation. Le résultat est
+mis en cache par tenant pendant HEALTH_CACHE_TTL_SECONDS et invalidé dès
+qu'un job de backup se termine (signal post_save, voir backups.signals).
 """
 import logging
+import time
 from datetime import datetime, timedelta
-from django.db.models import Count, Q, Avg, Sum, Max
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Avg, Sum, Max, OuterRef, Subquery
 from django.utils import timezone
 from .models import (
     BackupJob, BackupSchedule, NotificationConfig
 )
+from .rollup_service import rollup_service
+from .tenant_scheduler import tenant_scheduler
 from esxi.models import VirtualMachine, DatastoreInfo
 
 logger = logging.getLogger(__name__)
 
+HEALTH_CACHE_VERSION_KEY = 'backup_health_version'
+
+# Statuts de job qui modifient le résultat des vérifications
+HEALTH_FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+def invalidate_health_cache():
+    """Invalide les résultats de santé en cache (tous tenants)"""
+    cache.set(HEALTH_CACHE_VERSION_KEY, time.time_ns(), timeout=None)
+
 
 class HealthStatus:
     """États de santé possibles"""
@@ -28,13 +49,32 @@ class BackupHealthMonitor:
     Fournit des métriques et détecte les problèmes
     """
 
-    def __init__(self):
-        self.now = timezone.now()
+    CACHE_PREFIX = 'backup_health'
+
+    def __init__(self, ttl_seconds=None):
+        """
+        Args:
+            ttl_seconds: Durée de validité du résultat en cache (None = settings.HEALTH_CACHE_TTL_SECONDS)
+        """
+        self.ttl_seconds = (
+            ttl_seconds if ttl_seconds is not None
+            else getattr(settings, 'HEALTH_CACHE_TTL_SECONDS', 60)
+        )
+
+    def _cache_key(self, tenant_id):
+        version = cache.get(HEALTH_CACHE_VERSION_KEY, 0)
+        return f'{self.CACHE_PREFIX}_{version}_{tenant_id or "global"}'
 
-    def get_overall_health(self):
+    def get_overall_health(self, tenant_id=None, use_cache=True):
         """
         Retourne l'état de santé global du système de backup
 
+        Les endpoints overall, issues et metrics partagent le même résultat en cache.
+
+        Args:
+            tenant_id: Organisation du demandeur (périmètre et clé de cache, None = global)
+            use_cache: False pour forcer un nouveau calcul (tâche périodique)
+
         Returns:
             dict: {
                 'status': 'healthy'|'warning'|'critical',
@@ -44,12 +84,131 @@ class BackupHealthMonitor:
                 'recommendations': [...]
             }
         """
+        cache_key = self._cache_key(tenant_id)
+        if use_cache:
+            health = cache.get(cache_key)
+            if health is not None:
+                return health
+
+        health = self.evaluate(tenant_id)
+        cache.set(cache_key, health, timeout=self.ttl_seconds)
+        return health
+
+    def _load_snapshot(self, now, tenant_id=None):
+        """
+        Charge en une fois toutes les données nécessaires aux vérifications
+
+        Args:
+            now: Instant de référence de l'évaluation
+            tenant_id: Organisation (None = toutes les données)
+
+        Returns:
+            dict: vms, job_stats, rollup_totals, failed_jobs, broken_jobs, schedules, datastores, storage_mounts
+        """
+        last_24h = now - timedelta(hours=24)
+        last_7d = now - timedelta(days=7)
+
+        jobs = BackupJob.objects.all()
+        vm_queryset = VirtualMachine.objects.all()
+        schedule_queryset = BackupSchedule.objects.all()
+        datastore_queryset = DatastoreInfo.objects.all()
+        member_ids = None
+        if tenant_id:
+            # Objets créés par le propriétaire et les membres actifs de l'organisation
+            member_ids = tenant_scheduler.tenant_user_ids(tenant_id)
+            jobs = jobs.filter(created_by_id__in=member_ids)
+            vm_queryset = vm_queryset.filter(server__created_by_id__in=member_ids)
+            schedule_queryset = schedule_queryset.filter(created_by_id__in=member_ids)
+            datastore_queryset = datastore_queryset.filter(server__created_by_id__in=member_ids)
+
+        # Dernier backup terminé de chaque VM (date + CBT), en une requête
+        latest_completed = BackupJob.objects.filter(
+            virtual_machine=OuterRef('pk'),
+            status='completed',
+            completed_at__isnull=False
+        ).order_by('-completed_at')
+        vms = list(
+            vm_queryset.annotate(
+                last_backup_at=Subquery(latest_completed.values('completed_at')[:1]),
+                last_backup_cbt=Subquery(latest_completed.values('is_cbt_enabled')[:1])
+            ).values('id', 'name', 'last_backup_at', 'last_backup_cbt')
+        )
+
+        # Compteurs des jobs, en une requête
+        completed = Q(status='completed')
+        recent = Q(created_at__gte=last_24h)
+        job_stats = jobs.aggregate(
+            total=Count('id'),
+            completed=Count('id', filter=completed),
+            jobs_24h=Count('id', filter=recent),
+            success_24h=Count('id', filter=recent & completed),
+            failed_24h=Count('id', filter=recent & Q(status='failed')),
+            success_7d=Count('id', filter=Q(created_at__gte=last_7d) & completed)
+        )
+
+        # Durée moyenne et volume: agrégats journaliers plutôt que tout l'historique
+        rollup_totals = rollup_service.totals(
+            operations=['backup_job'],
+            dimension='tenant' if tenant_id else 'global',
+            dimension_id=tenant_id or 0
+        )
+
+        failed_jobs = list(
+            jobs.filter(created_at__gte=last_24h, status='failed').order_by('-created_at').values(
+                'id', 'virtual_machine__name', 'error_message', 'created_at'
+            )[:10]  # Limite aux 10 derniers échecs
+        )
+
+        # Incrementals sans base valide
+        broken_jobs = list(
+            jobs.filter(job_type='incremental', status='completed').filter(
+                Q(base_backup__isnull=True) | ~Q(base_backup__status='completed')
+            ).values('id', 'virtual_machine__name', 'created_at', 'base_backup_id', 'base_backup__status')
+        )
+
+        schedules = list(
+            schedule_queryset.filter(is_active=True, is_enabled=True).values(
+                'id', 'virtual_machine__name', 'frequency', 'interval_hours', 'last_run_at'
+            )
+        )
+
+        datastores = list(datastore_queryset.values('name', 'capacity_gb', 'free_space_gb'))
+
+        # État des montages des stockages distants (cache du contrôle périodique)
+        from backups.remote_storage import mount_manager
+        storage_mounts = mount_manager.status_all(created_by_ids=member_ids)
+
+        return {
+            'vms': vms,
+            'job_stats': job_stats,
+            'rollup_totals': rollup_totals,
+            'failed_jobs': failed_jobs,
+            'broken_jobs': broken_jobs,
+            'schedules': schedules,
+            'datastores': datastores,
+            'storage_mounts': storage_mounts,
+        }
+
+    def evaluate(self, tenant_id=None):
+        """
+        Calcule l'état de santé global (sans cache)
+
+        Args:
+            tenant_id: Organisation (None = toutes les données)
+
+        Returns:
+            dict: voir get_overall_health
+        """
+        # Instant local: l'instance globale est partagée entre les threads
+        now = timezone.now()
+        snapshot = self._load_snapshot(now, tenant_id)
+
         issues = []
         warnings = []
         score = 100
 
         # 1. Vérifier les VMs sans backup récent
-        stale_vms = self._check_stale_backups()
+        stale_vms = self._check_stale_backups(snapshot['vms'], now)
         if stale_vms:
             issues.append({
                 'type': 'stale_backups',
@@ -61,7 +220,7 @@ class BackupHealthMonitor:
             score -= len(stale_vms) * 5
 
         # 2. Vérifier les échecs récents
-        recent_failures = self._check_recent_failures()
+        recent_failures = self._check_recent_failures(snapshot['job_stats'], snapshot['failed_jobs'])
         if recent_failures['count'] > 0:
             severity = 'critical' if recent_failures['rate'] > 0.3 else 'warning'
             issues.append({
@@ -75,7 +234,7 @@ class BackupHealthMonitor:
             score -= recent_failures['count'] * 10
 
         # 3. Vérifier les chaînes de backup cassées
-        broken_chains = self._check_broken_chains()
+        broken_chains = self._check_broken_chains(snapshot['broken_jobs'])
         if broken_chains:
             issues.append({
                 'type': 'broken_chains',
@@ -87,7 +246,7 @@ class BackupHealthMonitor:
             score -= len(broken_chains) * 15
 
         # 4. Vérifier les schedules inactifs/manqués
-        inactive_schedules = self._check_inactive_schedules()
+        inactive_schedules = self._check_inactive_schedules(snapshot['schedules'], now)
         if inactive_schedules:
             issues.append({
                 'type': 'inactive_schedules',
@@ -99,7 +258,7 @@ class BackupHealthMonitor:
             score -= len(inactive_schedules) * 3
 
         # 5. Vérifier l'espace disque des datastores
-        storage_warnings = self._check_storage_capacity()
+        storage_warnings = self._check_storage_capacity(snapshot['datastores'])
         if storage_warnings:
             for warning in storage_warnings:
                 severity = 'critical' if warning['usage_percent'] > 90 else 'warning'
@@ -113,8 +272,19 @@ class BackupHealthMonitor:
                 })
                 score -= 10 if severity == 'critical' else 5
 
-        # 6. Vérifier les backups sans snapshot (CBT non activé)
-        cbt_disabled = self._check_cbt_status()
+        # 6. Vérifier les montages des stockages distants
+        for name, mount in snapshot['storage_mounts'].items():
+            if mount.get('healthy') is False:
+                issues.append({
+                    'type': 'storage_mount',
+                    'severity': 'critical',
+                    'storage': name,
+                    'message': f"Stockage {name} indisponible: {mount.get('error')}"
+                })
+                score -= 15
+
+        # 7. Vérifier les backups sans snapshot (CBT non activé)
+        cbt_disabled = self._check_cbt_status(snapshot['vms'])
         if cbt_disabled:
             warnings.append({
                 'type': 'cbt_disabled',
@@ -138,7 +308,7 @@ class BackupHealthMonitor:
         recommendations = self._generate_recommendations(issues, warnings)
 
         # Métriques additionnelles
-        metrics = self._get_summary_metrics()
+        metrics = self._get_summary_metrics(snapshot)
 
         return {
             'status': status,
@@ -147,74 +317,60 @@ class BackupHealthMonitor:
             'warnings': warnings,
             'metrics': metrics,
             'recommendations': recommendations,
-            'last_check': self.now.isoformat()
+            'last_check': now.isoformat()
         }
 
-    def _check_stale_backups(self, days=7):
+    def _check_stale_backups(self, vms, now, days=7):
         """
         Vérifie les VMs sans backup récent
 
+        Args:
+            vms: Lignes VM annotées avec last_backup_at
+            now: Instant de référence de l'évaluation
+
         Returns:
             list: VMs sans backup depuis N jours
         """
-        threshold = self.now - timedelta(days=days)
+        threshold = now - timedelta(days=days)
         stale_vms = []
 
-        # Récupérer toutes les VMs avec leurs derniers backups
-        vms = VirtualMachine.objects.all()
-
         for vm in vms:
-            last_backup = BackupJob.objects.filter(
-                virtual_machine=vm,
-                status='completed'
-            ).order_by('-completed_at').first()
-
-            if not last_backup:
+            last_backup_at = vm['last_backup_at']
+            if not last_backup_at:
                 stale_vms.append({
-                    'id': vm.id,
-                    'name': vm.name,
+                    'id': vm['id'],
+                    'name': vm['name'],
                     'last_backup': None,
                     'days_ago': 'never'
                 })
-            elif last_backup.completed_at < threshold:
-                days_ago = (self.now - last_backup.completed_at).days
+            elif last_backup_at < threshold:
                 stale_vms.append({
-                    'id': vm.id,
-                    'name': vm.name,
-                    'last_backup': last_backup.completed_at.isoformat(),
-                    'days_ago': days_ago
+                    'id': vm['id'],
+                    'name': vm['name'],
+                    'last_backup': last_backup_at.isoformat(),
+                    'days_ago': (now - last_backup_at).days
                 })
 
         return stale_vms
 
-    def _check_recent_failures(self, hours=24):
+    def _check_recent_failures(self, job_stats, failed_jobs):
         """
-        Vérifie les échecs de backup récents
+        Vérifie les échecs de backup récents (24h)
 
         Returns:
             dict: Statistiques des échecs récents
         """
-        threshold = self.now - timedelta(hours=hours)
-
-        recent_jobs = BackupJob.objects.filter(
-            created_at__gte=threshold
-        )
-
-        total = recent_jobs.count()
-        failed = recent_jobs.filter(status='failed').count()
-
-        failed_jobs = recent_jobs.filter(status='failed').values(
-            'id', 'virtual_machine__name', 'error_message', 'created_at'
-        )[:10]  # Limite aux 10 derniers échecs
+        total = job_stats['jobs_24h']
+        failed = job_stats['failed_24h']
 
         return {
             'count': failed,
             'total': total,
             'rate': failed / total if total > 0 else 0,
-            'jobs': list(failed_jobs)
+            'jobs': failed_jobs
         }
 
-    def _check_broken_chains(self):
+    def _check_broken_chains(self, broken_jobs):
         """
         Vérifie les chaînes de backup cassées (incrementals sans base valide)
 
@@ -223,32 +379,21 @@ class BackupHealthMonitor:
         """
         broken = []
 
-        # Trouver tous les backups incrementals
-        incremental_jobs = BackupJob.objects.filter(
-            job_type='incremental',
-            status='completed'
-        ).select_related('virtual_machine', 'base_backup')
-
-        for job in incremental_jobs:
-            # Vérifier si le base_backup existe et est valide
-            if not job.base_backup:
-                broken.append({
-                    'id': job.id,
-                    'vm_name': job.virtual_machine.name,
-                    'created_at': job.created_at.isoformat(),
-                    'issue': 'Aucun backup de base référencé'
-                })
-            elif job.base_backup.status != 'completed':
-                broken.append({
-                    'id': job.id,
-                    'vm_name': job.virtual_machine.name,
-                    'created_at': job.created_at.isoformat(),
-                    'issue': f"Backup de base invalide (status: {job.base_backup.status})"
-                })
+        for job in broken_jobs:
+            if not job['base_backup_id']:
+                issue = 'Aucun backup de base référencé'
+            else:
+                issue = f"Backup de base invalide (status: {job['base_backup__status']})"
+            broken.append({
+                'id': job['id'],
+                'vm_name': job['virtual_machine__name'],
+                'created_at': job['created_at'].isoformat(),
+                'issue': issue
+            })
 
         return broken
 
-    def _check_inactive_schedules(self):
+    def _check_inactive_schedules(self, schedules, now):
         """
         Vérifie les schedules inactifs ou qui n'ont pas été exécutés récemment
 
@@ -257,29 +402,27 @@ class BackupHealthMonitor:
         """
         inactive = []
 
-        schedules = BackupSchedule.objects.filter(is_active=True, is_enabled=True)
-
         for schedule in schedules:
             # Vérifier si le schedule a déjà été exécuté
-            if not schedule.last_run_at:
+            if not schedule['last_run_at']:
                 inactive.append({
-                    'id': schedule.id,
-                    'vm_name': schedule.virtual_machine.name,
-                    'frequency': schedule.frequency,
+                    'id': schedule['id'],
+                    'vm_name': schedule['virtual_machine__name'],
+                    'frequency': schedule['frequency'],
                     'issue': 'Jamais exécuté'
                 })
             else:
                 # Vérifier si le schedule est en retard
                 expected_interval = self._get_expected_interval(schedule)
                 if expected_interval:
-                    threshold = self.now - timedelta(hours=expected_interval * 1.5)
-                    if schedule.last_run_at < threshold:
-                        hours_ago = (self.now - schedule.last_run_at).total_seconds() / 3600
+                    threshold = now - timedelta(hours=expected_interval * 1.5)
+                    if schedule['last_run_at'] < threshold:
+                        hours_ago = (now - schedule['last_run_at']).total_seconds() / 3600
                         inactive.append({
-                            'id': schedule.id,
-                            'vm_name': schedule.virtual_machine.name,
-                            'frequency': schedule.frequency,
-                            'last_run': schedule.last_run_at.isoformat(),
+                            'id': schedule['id'],
+                            'vm_name': schedule['virtual_machine__name'],
+                            'frequency': schedule['frequency'],
+                            'last_run': schedule['last_run_at'].isoformat(),
                             'hours_ago': round(hours_ago, 1),
                             'issue': f'Pas exécuté depuis {round(hours_ago, 1)}h (attendu: {expected_interval}h)'
                         })
@@ -288,8 +431,8 @@ class BackupHealthMonitor:
 
     def _get_expected_interval(self, schedule):
         """Retourne l'intervalle attendu en heures pour un schedule"""
-        if schedule.interval_hours:
-            return schedule.interval_hours
+        if schedule['interval_hours']:
+            return schedule['interval_hours']
 
         frequency_map = {
             'hourly': 1,
@@ -297,9 +440,9 @@ class BackupHealthMonitor:
             'weekly': 168,
             'monthly': 720
         }
-        return frequency_map.get(schedule.frequency)
+        return frequency_map.get(schedule['frequency'])
 
-    def _check_storage_capacity(self):
+    def _check_storage_capacity(self, datastores):
         """
         Vérifie l'espace disque disponible sur les datastores
 
@@ -308,48 +451,36 @@ class BackupHealthMonitor:
         """
         warnings = []
 
-        datastores = DatastoreInfo.objects.all()
-
         for ds in datastores:
-            if ds.capacity_gb > 0:
-                usage_percent = ((ds.capacity_gb - ds.free_space_gb) / ds.capacity_gb) * 100
+            if ds['capacity_gb'] > 0:
+                usage_percent = ((ds['capacity_gb'] - ds['free_space_gb']) / ds['capacity_gb']) * 100
 
                 if usage_percent > 80:  # Seuil de 80%
                     warnings.append({
-                        'name': ds.name,
+                        'name': ds['name'],
                         'usage_percent': round(usage_percent, 1),
-                        'free_gb': round(ds.free_space_gb, 2),
-                        'capacity_gb': round(ds.capacity_gb, 2)
+                        'free_gb': round(ds['free_space_gb'], 2),
+                        'capacity_gb': round(ds['capacity_gb'], 2)
                     })
 
         return warnings
 
-    def _check_cbt_status(self):
+    def _check_cbt_status(self, vms):
         """
-        Vérifie les VMs sans CBT activé
+        Vérifie les VMs dont le dernier backup n'utilisait pas CBT
 
         Returns:
             list: VMs sans CBT
         """
-        cbt_disabled = []
-
-        # Récupérer les derniers backups par VM
-        vms = VirtualMachine.objects.all()
-
-        for vm in vms:
-            last_job = BackupJob.objects.filter(
-                virtual_machine=vm,
-                status='completed'
-            ).order_by('-completed_at').first()
-
-            if last_job and not last_job.is_cbt_enabled:
-                cbt_disabled.append({
-                    'id': vm.id,
-                    'name': vm.name,
-                    'last_backup': last_job.completed_at.isoformat()
-                })
-
-        return cbt_disabled
+        return [
+            {
+                'id': vm['id'],
+                'name': vm['name'],
+                'last_backup': vm['last_backup_at'].isoformat()
+            }
+            for vm in vms
+            if vm['last_backup_at'] and not vm['last_backup_cbt']
+        ]
 
     def _generate_recommendations(self, issues, warnings):
         """
@@ -389,6 +520,13 @@ class BackupHealthMonitor:
                     'action': 'cleanup_storage'
                 })
 
+            elif issue['type'] == 'storage_mount':
+                recommendations.append({
+                    'priority': 'critical',
+                    'message': f"Vérifier l'accès au stockage {issue['storage']} (réseau, identifiants, partage)",
+                    'action': 'check_storage'
+                })
+
         for warning in warnings:
             if warning['type'] == 'cbt_disabled':
                 recommendations.append({
@@ -399,76 +537,59 @@ class BackupHealthMonitor:
 
         return recommendations
 
-    def _get_summary_metrics(self):
+    def _get_summary_metrics(self, snapshot):
         """
         Retourne des métriques résumées du système
 
         Returns:
             dict: Métriques générales
         """
-        # Statistiques globales
-        total_vms = VirtualMachine.objects.count()
-        total_jobs = BackupJob.objects.count()
-        completed_jobs = BackupJob.objects.filter(status='completed').count()
-
-        # Dernières 24h
-        last_24h = self.now - timedelta(hours=24)
-        jobs_24h = BackupJob.objects.filter(created_at__gte=last_24h)
-        success_24h = jobs_24h.filter(status='completed').count()
-        failed_24h = jobs_24h.filter(status='failed').count()
-
-        # Derniers 7 jours
-        last_7d = self.now - timedelta(days=7)
-        jobs_7d = BackupJob.objects.filter(created_at__gte=last_7d)
-        success_7d = jobs_7d.filter(status='completed').count()
-
-        # Durée moyenne des backups
-        avg_duration = BackupJob.objects.filter(
-            status='completed',
-            duration_seconds__gt=0
-        ).aggregate(Avg('duration_seconds'))['duration_seconds__avg'] or 0
+        stats = snapshot['job_stats']
+        total_jobs = stats['total']
+        completed_jobs = stats['completed']
+        jobs_24h = stats['jobs_24h']
+        success_24h = stats['success_24h']
 
-        # Taille totale des backups (en MB, converti en bytes)
-        total_size_mb = BackupJob.objects.filter(
-            status='completed'
-        ).aggregate(Sum('backup_size_mb'))['backup_size_mb__sum'] or 0
-        total_size = total_size_mb * (1024**2)  # Convert MB to bytes
+        avg_duration = snapshot['rollup_totals']['avg_duration_seconds']
 
-        # Schedules actifs
-        active_schedules = BackupSchedule.objects.filter(
-            is_active=True,
-            is_enabled=True
-        ).count()
+        # Taille totale des backups (en bytes)
+        total_size = snapshot['rollup_totals']['bytes_moved']
 
         return {
-            'total_vms': total_vms,
+            'total_vms': len(snapshot['vms']),
             'total_jobs': total_jobs,
             'completed_jobs': completed_jobs,
             'success_rate_overall': round((completed_jobs / total_jobs * 100) if total_jobs > 0 else 0, 1),
-            'jobs_last_24h': jobs_24h.count(),
+            'jobs_last_24h': jobs_24h,
             'success_last_24h': success_24h,
-            'failed_last_24h': failed_24h,
-            'success_rate_24h': round((success_24h / jobs_24h.count() * 100) if jobs_24h.count() > 0 else 0, 1),
-            'success_last_7d': success_7d,
+            'failed_last_24h': stats['failed_24h'],
+            'success_rate_24h': round((success_24h / jobs_24h * 100) if jobs_24h > 0 else 0, 1),
+            'success_last_7d': stats['success_7d'],
             'avg_duration_seconds': round(avg_duration, 0),
             'avg_duration_minutes': round(avg_duration / 60, 1),
             'total_backup_size_bytes': total_size,
             'total_backup_size_gb': round(total_size / (1024**3), 2),
-            'active_schedules': active_schedules
+            'active_schedules': len(snapshot['schedules'])
         }
 
-    def get_vm_health(self, vm_id):
+    def get_vm_health(self, vm_id, tenant_id=None):
         """
         Retourne l'état de santé d'une VM spécifique
 
         Args:
             vm_id: ID de la VM
+            tenant_id: Organisation du demandeur (None = toutes les VMs)
 
         Returns:
             dict: État de santé détaillé de la VM
         """
+        now = timezone.now()
+
+        vm_queryset = VirtualMachine.objects.all()
+        if tenant_id:
+            vm_queryset = vm_queryset.filter(server__created_by_id__in=tenant_scheduler.tenant_user_ids(tenant_id))
         try:
-            vm = VirtualMachine.objects.get(id=vm_id)
+            vm = vm_queryset.get(id=vm_id)
         except VirtualMachine.DoesNotExist:
             return {'error': 'VM not found'}
 
@@ -492,7 +613,7 @@ class BackupHealthMonitor:
 
         # Déterminer le statut
         if last_backup:
-            days_since = (self.now - last_backup.completed_at).days
+            days_since = (now - last_backup.completed_at).days
             if days_since <= 1:
                 status = HealthStatus.HEALTHY
             elif days_since <= 7:
@@ -511,7 +632,7 @@ class BackupHealthMonitor:
             'failed_backups': failed,
             'success_rate': round((successful / total_backups * 100) if total_backups > 0 else 0, 1),
             'last_backup': last_backup.completed_at.isoformat() if last_backup else None,
-            'days_since_last_backup': (self.now - last_backup.completed_at).days if last_backup else None,
+            'days_since_last_backup': (now - last_backup.completed_at).days if last_backup else None,
             'next_scheduled_backup': next_schedule.next_run.isoformat() if next_schedule else None,
             'has_active_schedule': next_schedule is not None,
             'cbt_enabled': last_backup.is_cbt_enabled if last_backup else False
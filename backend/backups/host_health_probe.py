@@ -0,0 +1,261 @@
+"""
+Sonde de santé des hôtes ESXi pour la détection de failover
+
+Chaque hôte distinct est sondé une seule fois par intervalle (TCP puis HTTPS,
+puis une requête PropertyCollector unique via une session poolée). Le résultat
+est mis en cache et partagé par toutes les réplications de cet hôte.
+"""
+import logging
+import socket
+from datetime import datetime
+
+import requests
+import urllib3
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from esxi.session_pool import session_pool
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+logger = logging.getLogger(__name__)
+
+POWERED_ON = 'poweredOn'
+
+
+class HostHealthProbe:
+    """
+    Sonde légère de disponibilité des hôtes ESXi
+
+    Le snapshot d'un hôte a la forme:
+        {
+            'server_id': int,
+            'hostname': str,
+            'reachable': bool,       # TCP + HTTPS OK
+            'session_ok': bool,      # Requête vSphere OK
+            'vm_power_states': {nom_vm: powerState},
+            'error': str|None,
+            'probed_at': iso8601,
+            'unreachable_since': iso8601|None
+        }
+    """
+
+    CACHE_PREFIX = 'host_health_probe'
+
+    def __init__(self, interval_seconds=None, timeout_seconds=None):
+        """
+        Args:
+            interval_seconds: Durée de validité d'un snapshot (= latence de détection)
+            timeout_seconds: Timeout des tests TCP/HTTPS
+        """
+        self.interval_seconds = interval_seconds or getattr(settings, 'FAILOVER_PROBE_INTERVAL_SECONDS', 30)
+        self.timeout_seconds = timeout_seconds or getattr(settings, 'FAILOVER_PROBE_TIMEOUT_SECONDS', 5)
+
+    def _cache_key(self, server):
+        return f'{self.CACHE_PREFIX}_{server.id}'
+
+    def _check_tcp(self, server):
+        """Test de connexion TCP brute sur le port de l'API vSphere"""
+        try:
+            with socket.create_connection((server.hostname, server.port or 443), timeout=self.timeout_seconds):
+                return True, None
+        except OSError as e:
+            return False, f"TCP {server.hostname}:{server.port or 443} injoignable: {e}"
+
+    def _check_https(self, server):
+        """
+        Test HTTPS sur un endpoint non authentifié de l'API vSphere
+        (prouve que hostd répond, pas seulement la pile réseau)
+        """
+        url = f"https://{server.hostname}:{server.port or 443}/sdk/vimServiceVersions.xml"
+        try:
+            response = requests.get(url, verify=False, timeout=self.timeout_seconds)
+            if response.status_code < 500:
+                return True, None
+            return False, f"HTTPS {url}: statut {response.status_code}"
+        except requests.RequestException as e:
+            return False, f"HTTPS {url} injoignable: {e}"
+
+    def _collect_power_states(self, server):
+        """États d'alimentation de toutes les VMs de l'hôte via la session poolée"""
+        service = None
+        try:
+            service = session_pool.acquire(server, timeout=self.timeout_seconds * 2)
+            return service.get_vm_power_states(), None
+        except Exception as e:
+            # La session est peut-être morte: forcer une reconnexion au prochain sondage
+            session_pool.invalidate(server)
+            return None, f"Session vSphere {server.hostname}: {e}"
+        finally:
+            session_pool.release(service)
+
+    def probe_server(self, server):
+        """
+        Sonde un hôte ESXi et met à jour son snapshot en cache
+
+        Args:
+            server: Instance ESXiServer
+
+        Returns:
+            dict: Snapshot de santé de l'hôte
+        """
+        previous = cache.get(self._cache_key(server)) or {}
+        now = timezone.now()
+
+        snapshot = {
+            'server_id': server.id,
+            'hostname': server.hostname,
+            'reachable': False,
+            'session_ok': False,
+            'vm_power_states': {},
+            'error': None,
+            'probed_at': now.isoformat(),
+            'unreachable_since': None,
+        }
+
+        reachable, error = self._check_tcp(server)
+        if reachable:
+            reachable, error = self._check_https(server)
+
+        if reachable:
+            snapshot['reachable'] = True
+            power_states, error = self._collect_power_states(server)
+            if power_states is not None:
+                snapshot['session_ok'] = True
+                snapshot['vm_power_states'] = power_states
+
+        snapshot['error'] = error
+
+        if not snapshot['session_ok']:
+            # Conserver le début de la panne entre deux sondages
+            snapshot['unreachable_since'] = previous.get('unreachable_since') or now.isoformat()
+            logger.warning(f"[HEALTH_PROBE] {server.hostname} KO: {error}")
+        else:
+            logger.debug(f"[HEALTH_PROBE] {server.hostname} OK ({len(snapshot['vm_power_states'])} VMs)")
+
+        # Garder le snapshot plus longtemps que l'intervalle pour suivre unreachable_since
+        cache.set(self._cache_key(server), snapshot, timeout=max(self.interval_seconds * 10, 600))
+        return snapshot
+
+    def get_snapshot(self, server):
+        """
+        Retourne le snapshot de l'hôte, en le sondant s'il date de plus d'un intervalle
+
+        Args:
+            server: Instance ESXiServer
+
+        Returns:
+            dict: Snapshot de santé de l'hôte
+        """
+        snapshot = cache.get(self._cache_key(server))
+        if snapshot:
+            age = (timezone.now() - datetime.fromisoformat(snapshot['probed_at'])).total_seconds()
+            if age < self.interval_seconds:
+                return snapshot
+        return self.probe_server(server)
+
+    def get_snapshots(self, servers):
+        """
+        Sonde un ensemble de serveurs, chaque hôte distinct une seule fois
+
+        Args:
+            servers: Itérable d'instances ESXiServer (doublons autorisés)
+
+        Returns:
+            dict: {server_id: snapshot}
+        """
+        snapshots = {}
+        for server in servers:
+            if server.id not in snapshots:
+                snapshots[server.id] = self.get_snapshot(server)
+        return snapshots
+
+    @staticmethod
+    def _minutes_since_last_replication(replication):
+        if not replication.last_replication_at:
+            return None
+        return (timezone.now() - replication.last_replication_at).total_seconds() / 60
+
+    def evaluate_failover(self, replication, snapshot):
+        """
+        Décide si un failover automatique doit être déclenché à partir du snapshot partagé
+
+        Args:
+            replication: Instance VMReplication
+            snapshot: Snapshot de l'hôte source
+
+        Returns:
+            dict: {'should_failover': bool, 'reason': str}
+        """
+        if replication.failover_mode != 'automatic':
+            return {'should_failover': False, 'reason': 'Mode automatique non activé'}
+
+        if replication.failover_active:
+            return {'should_failover': False, 'reason': 'Failover déjà actif'}
+
+        minutes_since_last = self._minutes_since_last_replication(replication)
+        threshold_reached = (
+            minutes_since_last is not None and
+            minutes_since_last >= replication.auto_failover_threshold_minutes
+        )
+
+        if not snapshot['session_ok']:
+            if threshold_reached:
+                return {
+                    'should_failover': True,
+                    'reason': f'Serveur source inaccessible depuis {minutes_since_last:.0f} minutes'
+                }
+            return {
+                'should_failover': False,
+                'reason': f"Serveur source inaccessible (en attente du délai): {snapshot['error']}"
+            }
+
+        vm_name = replication.virtual_machine.name
+        power_state = snapshot['vm_power_states'].get(vm_name)
+
+        if power_state is None:
+            return {'should_failover': False, 'reason': 'VM non trouvée'}
+
+        if power_state != POWERED_ON and threshold_reached:
+            return {
+                'should_failover': True,
+                'reason': f'VM éteinte depuis {minutes_since_last:.0f} minutes'
+            }
+
+        return {'should_failover': False, 'reason': 'VM en fonctionnement normal'}
+
+    def evaluate_failback(self, replication, snapshot):
+        """
+        Décide si un failback automatique doit être déclenché (master revenue en ligne)
+
+        Args:
+            replication: Instance VMReplication
+            snapshot: Snapshot de l'hôte source
+
+        Returns:
+            dict: {'should_failback': bool, 'reason': str}
+        """
+        if not replication.failback_enabled:
+            return {'should_failback': False, 'reason': 'Failback automatique désactivé'}
+
+        if not replication.failover_active:
+            return {'should_failback': False, 'reason': 'Aucun failover actif'}
+
+        if not snapshot['session_ok']:
+            return {'should_failback': False, 'reason': f"Serveur source inaccessible: {snapshot['error']}"}
+
+        vm_name = replication.virtual_machine.name
+        power_state = snapshot['vm_power_states'].get(vm_name)
+
+        if power_state is None:
+            return {'should_failback': False, 'reason': 'VM master non trouvée'}
+
+        if power_state == POWERED_ON:
+            return {'should_failback': True, 'reason': f'VM master {vm_name} revenue en ligne'}
+
+        return {'should_failback': False, 'reason': 'VM master toujours éteinte'}
+
+
+# Instance globale de la sonde
+host_health_probe = HostHealthProbe()
@@ -0,0 +1,321 @@
+"""
+Dispatcher unifié des jobs longs (backup, export, restauration, réplication, snapshot)
+
+Chaque classe de job a sa propre file:
+- avec Celery: la tâche est envoyée dans la queue Celery du même nom, si au
+  moins un worker consomme cette queue;
+- sans Celery (broker ou worker absent): exécution dans un pool de threads
+  borné propre à la classe de job (JOB_DISPATCHER_CONCURRENCY), au lieu d'un
+  thread par requête qui concurrence le traitement des requêtes HTTP.
+
+Dans chaque classe, les jobs en attente sont servis par file équitable
+pondérée entre organisations (poids et nombre de jobs simultanés du plan,
+voir backups.tenant_scheduler): un job de coût c d'une organisation de poids w
+reçoit l'étiquette de fin max(temps virtuel, fin précédente de l'organisation)
++ c / w, et la place libérée va à la plus petite étiquette parmi les
+organisations sous leur limite.
+
+À l'arrêt du processus, le dispatcher n'accepte plus de job, annule ceux qui
+attendent encore dans les files et laisse les jobs en cours se terminer
+(JOB_DISPATCHER_DRAIN_TIMEOUT_SECONDS). Les jobs tournent dans des threads
+démons (au plus la concurrence de leur classe) et l'attente est enregistrée
+avec threading._register_atexit: elle s'exécute avant la jointure des threads
+non démons, et un job encore en cours à l'échéance n'empêche pas la sortie.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, wait
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+JOB_CLASSES = ('backup', 'export', 'restore', 'replication', 'snapshot')
+
+DEFAULT_CONCURRENCY = {
+    'backup': 2,
+    'export': 2,
+    'restore': 2,
+    'replication': 4,
+    'snapshot': 4,
+}
+
+
+class JobDispatcherShutdown(RuntimeError):
+    """Le dispatcher est en cours d'arrêt et n'accepte plus de job"""
+
+
+class JobDispatcher:
+    """
+    Routage des jobs vers Celery ou vers un pool de threads borné par classe de job
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {job_class: set() for job_class in JOB_CLASSES}
+        self._running = {job_class: 0 for job_class in JOB_CLASSES}
+        # File équitable: {job_class: {tenant: deque}}, étiquettes de fin et temps virtuel
+        self._queues = {job_class: {} for job_class in JOB_CLASSES}
+        self._finish_tags = {job_class: {} for job_class in JOB_CLASSES}
+        self._virtual_time = {job_class: 0.0 for job_class in JOB_CLASSES}
+        self._tenant_running = {}
+        self._draining = False
+        self._exit_hook_registered = False
+        self._celery_queues = set()
+        self._celery_checked_at = None
+
+    @staticmethod
+    def _check_class(job_class):
+        if job_class not in JOB_CLASSES:
+            raise ValueError(f"Classe de job inconnue: {job_class} (attendu: {', '.join(JOB_CLASSES)})")
+
+    @staticmethod
+    def concurrency(job_class):
+        configured = getattr(settings, 'JOB_DISPATCHER_CONCURRENCY', {})
+        return max(1, configured.get(job_class, DEFAULT_CONCURRENCY[job_class]))
+
+    # ------------------------------------------------------------------
+    # Celery
+    # ------------------------------------------------------------------
+    def celery_queues(self):
+        """
+        Queues Celery consommées par au moins un worker (résultat mis en cache)
+
+        Remplace le ping du broker (inspect().active(), 1 s) fait auparavant à
+        chaque lancement de job.
+        """
+        ttl = getattr(settings, 'JOB_DISPATCHER_CELERY_CHECK_SECONDS', 30)
+        now = time.monotonic()
+        with self._lock:
+            if self._celery_checked_at is not None and now - self._celery_checked_at < ttl:
+                return self._celery_queues
+
+        queues = set()
+        if getattr(settings, 'JOB_DISPATCHER_USE_CELERY', True):
+            try:
+                from celery import current_app
+                replies = current_app.control.inspect(timeout=1.0).active_queues() or {}
+                queues = {queue['name'] for worker_queues in replies.values() for queue in worker_queues}
+            except Exception as e:
+                logger.warning(f"[JOB-DISPATCHER] Celery non disponible ({e}), exécution locale")
+
+        with self._lock:
+            self._celery_queues = queues
+            self._celery_checked_at = now
+        return queues
+
+    def dispatch(self, job_class, task, args=(), description=None, expected_size_gb=None, tenant=None):
+        """
+        Lance une tâche Celery (@shared_task) dans la queue de sa classe, ou localement
+
+        Args:
+            job_class: 'backup' | 'export' | 'restore' | 'replication' | 'snapshot'
+            task: Tâche Celery; exécutée directement dans le pool local si aucun worker ne consomme la queue
+            args: Arguments de la tâche (sérialisables JSON)
+            description: Libellé pour les logs
+            expected_size_gb: Taille attendue du transfert (limites de temps Celery, voir task_routing)
+            tenant: Profil de l'organisation (tenant_scheduler.profile) pour la file locale
+
+        Returns:
+            str: 'celery' ou 'thread'
+        """
+        self._check_class(job_class)
+        description = description or f'{task.name}{tuple(args)}'
+
+        if job_class in self.celery_queues():
+            try:
+                from backups.task_routing import transfer_time_limits
+                task.apply_async(args=list(args), queue=job_class, **transfer_time_limits(expected_size_gb))
+                logger.info(f"[JOB-DISPATCHER] {description} -> queue Celery '{job_class}'")
+                return 'celery'
+            except Exception as e:
+                logger.warning(f"[JOB-DISPATCHER] Envoi Celery échoué ({e}), exécution locale de {description}")
+                with self._lock:
+                    self._celery_checked_at = None
+
+        self.submit(job_class, task, *args, description=description, tenant=tenant, cost=expected_size_gb)
+        return 'thread'
+
+    # ------------------------------------------------------------------
+    # Exécution locale
+    # ------------------------------------------------------------------
+    def _accept(self):
+        """Refuse les jobs pendant l'arrêt; enregistre l'attente des jobs à la sortie (appelé avec self._lock)"""
+        if self._draining:
+            raise JobDispatcherShutdown("Arrêt en cours: aucun nouveau job accepté")
+        if not self._exit_hook_registered:
+            # Exécuté par threading._shutdown, avant la jointure des threads et les handlers atexit
+            threading._register_atexit(self.shutdown)
+            self._exit_hook_registered = True
+
+    def submit(self, job_class, func, *args, description=None, tenant=None, cost=None):
+        """
+        Exécute une fonction dans le pool local de la classe de job
+
+        Les jobs au-delà de la concurrence de la classe (ou du nombre de jobs
+        simultanés de leur organisation) attendent dans la file équitable.
+
+        Args:
+            tenant: Profil de l'organisation (tenant_scheduler.profile), None = sans limite, poids 1
+            cost: Coût du job pour le partage (taille attendue en GB), 1 par défaut
+
+        Returns:
+            concurrent.futures.Future
+        """
+        self._check_class(job_class)
+        description = description or getattr(func, '__name__', repr(func))
+        tenant = tenant or {}
+        tenant_key = tenant.get('tenant_id')
+        weight = max(1, tenant.get('weight') or 1)
+        cost = max(1.0, float(cost or 1))
+
+        future = Future()
+        with self._lock:
+            self._accept()
+            start = max(self._virtual_time[job_class], self._finish_tags[job_class].get(tenant_key, 0.0))
+            finish = start + cost / weight
+            self._finish_tags[job_class][tenant_key] = finish
+            self._queues[job_class].setdefault(tenant_key, deque()).append({
+                'future': future,
+                'func': func,
+                'args': args,
+                'description': description,
+                'start': start,
+                'finish': finish,
+                'limit': tenant.get('max_concurrent_jobs') or 0,
+            })
+            self._futures[job_class].add(future)
+            self._pump(job_class)
+        future.add_done_callback(lambda done: self._forget(job_class, done))
+
+        logger.info(f"[JOB-DISPATCHER] {description} -> file locale '{job_class}' ({self.stats()[job_class]})")
+        return future
+
+    def _pump(self, job_class):
+        """
+        Démarre les jobs en attente tant qu'il reste des places (appelé avec self._lock)
+
+        Sert la plus petite étiquette de fin parmi les organisations sous leur limite.
+        Pendant l'arrêt, plus aucun job n'est démarré (shutdown annule la file).
+        """
+        queues = self._queues[job_class]
+        while not self._draining and self._running[job_class] < self.concurrency(job_class):
+            chosen = None
+            for tenant_key, queue in queues.items():
+                while queue and queue[0]['future'].cancelled():
+                    queue.popleft()
+                if not queue:
+                    continue
+                head = queue[0]
+                if head['limit'] and self._tenant_running.get(tenant_key, 0) >= head['limit']:
+                    continue
+                if chosen is None or head['finish'] < chosen[1]['finish']:
+                    chosen = (tenant_key, head)
+            if chosen is None:
+                break
+
+            tenant_key, job = chosen
+            queues[tenant_key].popleft()
+            if not queues[tenant_key]:
+                del queues[tenant_key]
+            if not job['future'].set_running_or_notify_cancel():
+                continue
+
+            self._virtual_time[job_class] = job['start']
+            self._running[job_class] += 1
+            self._tenant_running[tenant_key] = self._tenant_running.get(tenant_key, 0) + 1
+            threading.Thread(
+                target=self._run,
+                args=(job_class, tenant_key, job),
+                name=f'job-{job_class}',
+                daemon=True
+            ).start()
+
+    def _run(self, job_class, tenant_key, job):
+        close_old_connections()
+        result = None
+        try:
+            result = job['func'](*job['args'])
+        except Exception as e:
+            logger.error(f"[JOB-DISPATCHER] Erreur {job_class} ({job['description']}): {e}", exc_info=True)
+        finally:
+            close_old_connections()
+            with self._lock:
+                self._running[job_class] -= 1
+                self._tenant_running[tenant_key] -= 1
+                if not self._tenant_running[tenant_key]:
+                    del self._tenant_running[tenant_key]
+
+        # Le job est terminé avant de démarrer les suivants (shutdown le compte comme fini)
+        job['future'].set_result(result)
+
+        with self._lock:
+            # Une place d'organisation libérée peut débloquer une autre classe
+            for other_class in JOB_CLASSES:
+                self._pump(other_class)
+
+    def _forget(self, job_class, future):
+        with self._lock:
+            self._futures[job_class].discard(future)
+
+    def stats(self):
+        """
+        État des files locales
+
+        Returns:
+            dict: {job_class: {'running': int, 'queued': int, 'concurrency': int, 'tenants_waiting': int}}
+        """
+        with self._lock:
+            return {
+                job_class: {
+                    'running': self._running[job_class],
+                    'queued': sum(
+                        1 for queue in self._queues[job_class].values()
+                        for job in queue if not job['future'].cancelled()
+                    ),
+                    'concurrency': self.concurrency(job_class),
+                    'tenants_waiting': len(self._queues[job_class]),
+                }
+                for job_class in JOB_CLASSES
+            }
+
+    def shutdown(self, timeout=None):
+        """
+        Arrêt progressif: refuse les nouveaux jobs, annule ceux en file, attend ceux en cours
+
+        Args:
+            timeout: Attente maximale en secondes (None = settings.JOB_DISPATCHER_DRAIN_TIMEOUT_SECONDS)
+
+        Returns:
+            dict: {'cancelled': int, 'unfinished': int}
+        """
+        if timeout is None:
+            timeout = getattr(settings, 'JOB_DISPATCHER_DRAIN_TIMEOUT_SECONDS', 300)
+
+        with self._lock:
+            self._draining = True
+            queued = [job['future'] for queues in self._queues.values() for queue in queues.values() for job in queue]
+            for queues in self._queues.values():
+                queues.clear()
+            pending = [future for futures in self._futures.values() for future in futures]
+
+        cancelled = sum(1 for future in queued if future.cancel())
+
+        running = [future for future in pending if not future.cancelled()]
+        if running:
+            logger.info(f"[JOB-DISPATCHER] Arrêt: attente de {len(running)} job(s) en cours (max {timeout}s)")
+        _, unfinished = wait(running, timeout=timeout)
+
+        if cancelled or unfinished:
+            logger.warning(
+                f"[JOB-DISPATCHER] Arrêt: {cancelled} job(s) en file annulé(s), "
+                f"{len(unfinished)} job(s) encore en cours"
+            )
+        return {'cancelled': cancelled, 'unfinished': len(unfinished)}
+
+
+# Instance globale du dispatcher
+job_dispatcher = JobDispatcher()
@@ -0,0 +1,300 @@
+"""
+Archivage des journaux (BackupLog, ReplicationLog, NotificationLog)
+
+Les lignes plus anciennes que LOG_RETENTION_DAYS sont écrites dans des
+fichiers JSONL compressés (gzip), un fichier par type de journal et par mois,
+puis supprimées par lots courts (pas de verrou long sur la table). Les
+endpoints de journaux relisent les archives lorsque la période demandée
+(paramètre `since`) remonte avant la limite de rétention.
+
+Arborescence:
+    LOG_ARCHIVE_DIR/<type>/<type>-AAAA-MM.jsonl.gz
+    LOG_ARCHIVE_DIR/<type>/manifest.json   (nombre de lignes archivées par mois)
+
+Chaque lot est ajouté comme un nouveau membre gzip (ajout sans réécriture du
+fichier). Un arrêt entre l'écriture et la suppression peut dupliquer un lot:
+la lecture dédoublonne par id.
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_LOCK_KEY = 'log_archive_lock'
+
+# type -> (modèle, champ de date, {champ API: lookup ORM})
+# Les champs reprennent la sortie des serializers de l'API; les noms (VM,
+# configuration...) sont dénormalisés car les objets liés peuvent disparaître.
+LOG_SOURCES = {
+    'backup_log': ('BackupLog', 'timestamp', {
+        'id': 'id',
+        'job': 'job_id',
+        'level': 'level',
+        'message': 'message',
+        'timestamp': 'timestamp',
+    }),
+    'replication_log': ('ReplicationLog', 'started_at', {
+        'id': 'id',
+        'replication': 'replication_id',
+        'vm_name': 'replication__virtual_machine__name',
+        'replication_name': 'replication__name',
+        'status': 'status',
+        'started_at': 'started_at',
+        'completed_at': 'completed_at',
+        'duration_seconds': 'duration_seconds',
+        'progress_percentage': 'progress_percentage',
+        'replicated_size_mb': 'replicated_size_mb',
+        'message': 'message',
+        'error_details': 'error_details',
+        'source_vm_power_state': 'source_vm_power_state',
+        'triggered_by': 'triggered_by',
+    }),
+    'notification_log': ('NotificationLog', 'sent_at', {
+        'id': 'id',
+        'config': 'config_id',
+        'config_name': 'config__name',
+        'vm_name': 'virtual_machine__name',
+        'job_type': 'backup_job__job_type',
+        'event_type': 'event_type',
+        'backup_job': 'backup_job_id',
+        'virtual_machine': 'virtual_machine_id',
+        'status': 'status',
+        'subject': 'subject',
+        'message': 'message',
+        'recipient': 'recipient',
+        'response': 'response',
+        'sent_at': 'sent_at',
+    }),
+}
+
+_datetime_field = serializers.DateTimeField()
+
+
+class LogArchiveService:
+    """
+    Archivage et relecture des journaux anciens
+    """
+
+    def __init__(self, archive_dir=None, retention_days=None, batch_size=None):
+        """
+        Args:
+            archive_dir: Dossier des archives (None = settings.LOG_ARCHIVE_DIR)
+            retention_days: Jours conservés en base (None = settings.LOG_RETENTION_DAYS)
+            batch_size: Lignes archivées puis supprimées par transaction (None = settings.LOG_ARCHIVE_BATCH_SIZE)
+        """
+        self._archive_dir = archive_dir
+        self._retention_days = retention_days
+        self._batch_size = batch_size
+
+    @property
+    def archive_dir(self):
+        return str(self._archive_dir or getattr(settings, 'LOG_ARCHIVE_DIR', settings.BASE_DIR / 'log_archives'))
+
+    @property
+    def retention_days(self):
+        return self._retention_days or getattr(settings, 'LOG_RETENTION_DAYS', 90)
+
+    @property
+    def batch_size(self):
+        return self._batch_size or getattr(settings, 'LOG_ARCHIVE_BATCH_SIZE', 1000)
+
+    def cutoff(self, now=None):
+        """Date avant laquelle les journaux sont archivés"""
+        return (now or timezone.now()) - timedelta(days=self.retention_days)
+
+    @staticmethod
+    def _model(kind):
+        from django.apps import apps
+        return apps.get_model('backups', LOG_SOURCES[kind][0])
+
+    def _kind_dir(self, kind):
+        return os.path.join(self.archive_dir, kind)
+
+    def _month_path(self, kind, month):
+        return os.path.join(self._kind_dir(kind), f'{kind}-{month}.jsonl.gz')
+
+    def _manifest_path(self, kind):
+        return os.path.join(self._kind_dir(kind), 'manifest.json')
+
+    def read_manifest(self, kind):
+        """Nombre de lignes archivées par mois: {'AAAA-MM': int}"""
+        try:
+            with open(self._manifest_path(kind), encoding='utf-8') as manifest:
+                return json.load(manifest)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, kind, manifest):
+        path = self._manifest_path(kind)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as tmp:
+            json.dump(manifest, tmp, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def archived_count(self, kind):
+        return sum(self.read_manifest(kind).values())
+
+    # ------------------------------------------------------------------
+    # Archivage
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _to_row(kind, values):
+        _, time_field, fields = LOG_SOURCES[kind]
+        row = {api_name: values[lookup] for api_name, lookup in fields.items()}
+        for name in (time_field, 'completed_at'):
+            if row.get(name) is not None:
+                row[name] = _datetime_field.to_representation(row[name])
+        if kind == 'replication_log':
+            from backups.models import ReplicationLog
+            row['status_display'] = dict(ReplicationLog.STATUS_CHOICES).get(row['status'], row['status'])
+        return row
+
+    def _append(self, kind, rows_by_month):
+        os.makedirs(self._kind_dir(kind), exist_ok=True)
+        for month, rows in rows_by_month.items():
+            payload = ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows).encode('utf-8')
+            # Nouveau membre gzip en fin de fichier: les membres précédents ne sont pas réécrits
+            with open(self._month_path(kind, month), 'ab') as archive:
+                archive.write(gzip.compress(payload))
+                archive.flush()
+                os.fsync(archive.fileno())
+
+    def archive_kind(self, kind, now=None):
+        """
+        Archive puis supprime les lignes d'un type de journal plus anciennes que la rétention
+
+        Returns:
+            int: Nombre de lignes archivées
+        """
+        model = self._model(kind)
+        _, time_field, fields = LOG_SOURCES[kind]
+        threshold = self.cutoff(now)
+        lookups = list(dict.fromkeys(fields.values()))
+        manifest = self.read_manifest(kind)
+        total = 0
+
+        while True:
+            batch = list(
+                model.objects.filter(**{f'{time_field}__lt': threshold})
+                .order_by(time_field, 'id')
+                .values(*lookups)[:self.batch_size]
+            )
+            if not batch:
+                break
+
+            rows_by_month = {}
+            for values in batch:
+                month = values[time_field].astimezone(dt_timezone.utc).strftime('%Y-%m')
+                rows_by_month.setdefault(month, []).append(self._to_row(kind, values))
+
+            # Écriture durable avant suppression: au pire un lot dupliqué, jamais perdu
+            self._append(kind, rows_by_month)
+            with transaction.atomic():
+                model.objects.filter(id__in=[values['id'] for values in batch]).delete()
+
+            for month, rows in rows_by_month.items():
+                manifest[month] = manifest.get(month, 0) + len(rows)
+            self._write_manifest(kind, manifest)
+            total += len(batch)
+
+        if total:
+            logger.info(f"[LOG-ARCHIVE] {kind}: {total} ligne(s) archivée(s) (< {threshold:%Y-%m-%d})")
+        return total
+
+    def archive(self, kinds=None, now=None):
+        """
+        Archive tous les types de journaux (un seul processus à la fois)
+
+        Returns:
+            dict: {type: lignes archivées} ou {'skipped': True} si un archivage est déjà en cours
+        """
+        if not cache.add(ARCHIVE_LOCK_KEY, True, timeout=6 * 3600):
+            logger.info("[LOG-ARCHIVE] Archivage déjà en cours, ignoré")
+            return {'skipped': True}
+        try:
+            return {kind: self.archive_kind(kind, now) for kind in (kinds or LOG_SOURCES)}
+        finally:
+            cache.delete(ARCHIVE_LOCK_KEY)
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+    def needs_archive(self, kind, since):
+        """La période commençant à `since` remonte-t-elle dans les archives de ce type ?"""
+        return since is not None and since < self.cutoff() and bool(self.read_manifest(kind))
+
+    def _months(self, kind, since, until):
+        months = sorted(self.read_manifest(kind))
+        low = since.astimezone(dt_timezone.utc).strftime('%Y-%m') if since else None
+        high = until.astimezone(dt_timezone.utc).strftime('%Y-%m') if until else None
+        return [m for m in months if (low is None or m >= low) and (high is None or m <= high)]
+
+    def iter_archive(self, kind, since=None, until=None, filters=None):
+        """
+        Lignes archivées d'un type de journal sur [since, until[ (dédoublonnées par id)
+
+        Args:
+            filters: {champ API: valeur} comparés en texte (ex: {'status': 'failed', 'config': '3'})
+        """
+        _, time_field, _ = LOG_SOURCES[kind]
+        filters = {key: str(value) for key, value in (filters or {}).items() if value not in (None, '')}
+        seen = set()
+
+        for month in self._months(kind, since, until):
+            path = self._month_path(kind, month)
+            if not os.path.exists(path):
+                continue
+            with gzip.open(path, 'rt', encoding='utf-8') as archive:
+                for line in archive:
+                    row = json.loads(line)
+                    if row['id'] in seen:
+                        continue
+                    if any(str(row.get(key)) != value for key, value in filters.items()):
+                        continue
+                    moment = parse_datetime(row[time_field])
+                    if (since and moment < since) or (until and moment >= until):
+                        continue
+                    seen.add(row['id'])
+                    yield row
+
+    @staticmethod
+    def query_limit(limit=None):
+        """Nombre maximal de lignes d'une requête base + archives (None = settings.LOG_ARCHIVE_QUERY_LIMIT)"""
+        return limit or getattr(settings, 'LOG_ARCHIVE_QUERY_LIMIT', 1000)
+
+    def merge_with_archive(self, kind, live_rows, since=None, until=None, filters=None, limit=None):
+        """
+        Complète des lignes sérialisées de la base avec les archives, du plus récent au plus ancien
+
+        Les lignes de la base doivent être triées du plus récent au plus ancien et
+        limitées à query_limit() avant sérialisation: les suivantes ne peuvent pas
+        figurer dans le résultat.
+
+        Returns:
+            list: au plus `limit` lignes (None = settings.LOG_ARCHIVE_QUERY_LIMIT)
+        """
+        _, time_field, _ = LOG_SOURCES[kind]
+        limit = self.query_limit(limit)
+
+        live_ids = {row['id'] for row in live_rows}
+        rows = list(live_rows) + [
+            dict(row, archived=True)
+            for row in self.iter_archive(kind, since, until, filters)
+            if row['id'] not in live_ids
+        ]
+        rows.sort(key=lambda row: (parse_datetime(row[time_field]), row['id']), reverse=True)
+        return rows[:limit]
+
+
+# Instance globale du service
+log_archive_service = LogArchiveService()
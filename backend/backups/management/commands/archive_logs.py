@@ -0,0 +1,30 @@
+"""
+Management command to archive old backup, replication and notification logs
+"""
+from django.core.management.base import BaseCommand
+
+from backups.log_archive_service import LOG_SOURCES, LogArchiveService
+
+
+class Command(BaseCommand):
+    help = 'Move log rows older than the retention period into monthly gzip JSONL archives'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kind',
+            action='append',
+            choices=sorted(LOG_SOURCES),
+            help='Limit to one log type (repeatable)'
+        )
+        parser.add_argument('--days', type=int, help='Retention in days (default: LOG_RETENTION_DAYS)')
+        parser.add_argument('--batch-size', type=int)
+
+    def handle(self, *args, **options):
+        service = LogArchiveService(retention_days=options['days'], batch_size=options['batch_size'])
+        results = service.archive(kinds=options['kind'])
+        if results.get('skipped'):
+            self.stdout.write(self.style.WARNING('Another archival run is in progress'))
+            return
+        for kind, archived in results.items():
+            self.stdout.write(f'{kind}: {archived} row(s) archived')
+        self.stdout.write(self.style.SUCCESS(f'Archives written to {service.archive_dir}'))
@@ -0,0 +1,73 @@
+"""
+Management command to check the S3 multipart writer against an in-memory client
+
+Writes objects of the boundary sizes (empty, exactly one minimum part,
+several parts) through MultipartUploadWriter into FakeS3Client, then a
+failing upload, and fails if an object differs from what was written or an
+upload is left open.
+"""
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from backups.storage_backends.fake_s3 import FakeS3Client
+from backups.storage_backends.s3 import MIN_PART_BYTES, MultipartUploadWriter
+
+BUCKET = 'check'
+
+# Nom -> (taille écrite, nombre de parts attendu; 0 = un seul PUT)
+UPLOADS = {
+    'empty': (0, 0),
+    'exactly 5 MiB': (MIN_PART_BYTES, 1),
+    'multi-part': (2 * MIN_PART_BYTES + 12345, 3),
+}
+
+
+def write_object(client, key, data, chunk_size=1024 * 1024 + 7):
+    """Écrit data par morceaux irréguliers, comme un téléchargement VMDK"""
+    with MultipartUploadWriter(client, BUCKET, key, MIN_PART_BYTES, workers=2) as writer:
+        for offset in range(0, len(data), chunk_size):
+            writer.write(data[offset:offset + chunk_size])
+    return writer
+
+
+class Command(BaseCommand):
+    help = 'Fail if the S3 multipart writer corrupts an object or leaves an upload open'
+
+    def handle(self, *args, **options):
+        failures = []
+
+        for name, (size, expected_parts) in UPLOADS.items():
+            client = FakeS3Client()
+            data = os.urandom(size)
+            writer = write_object(client, name, data)
+
+            stored = client.objects.get((BUCKET, name))
+            if stored != data:
+                failures.append(f'{name}: stored object differs from the {size} bytes written')
+            elif writer._part_number != expected_parts:
+                failures.append(f'{name}: {writer._part_number} part(s) sent, expected {expected_parts}')
+            elif client.uploads:
+                failures.append(f'{name}: {len(client.uploads)} upload(s) left open')
+            else:
+                self.stdout.write(f'{name}: {size} bytes, {expected_parts} part(s)')
+
+        # Échec d'une part: l'upload est abandonné, aucun objet partiel
+        client = FakeS3Client(fail_on_part=2)
+        try:
+            write_object(client, 'failure', os.urandom(3 * MIN_PART_BYTES))
+            failures.append('failure: the failing part did not raise')
+        except Exception as e:
+            if client.objects or client.uploads or len(client.aborted) != 1:
+                failures.append(
+                    f'failure: {len(client.objects)} object(s), {len(client.uploads)} open upload(s), '
+                    f'{len(client.aborted)} aborted after {e}'
+                )
+            else:
+                self.stdout.write(f'failure: upload aborted after {e}')
+
+        for failure in failures:
+            self.stdout.write(self.style.ERROR(failure))
+        if failures:
+            raise CommandError(f'{len(failures)} multipart upload check(s) failed')
+        self.stdout.write(self.style.SUCCESS('Multipart uploads complete and abort cleanly'))
@@ -0,0 +1,25 @@
+"""
+Management command to backfill backup rollups from the job history
+"""
+from django.core.management.base import BaseCommand
+
+from backups.rollup_service import JOB_SOURCES, rollup_service
+
+
+class Command(BaseCommand):
+    help = 'Add finished backup/export jobs that are not yet counted to the hourly and daily rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--operation',
+            action='append',
+            choices=sorted(JOB_SOURCES),
+            help='Limit to one job type (repeatable)'
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        results = rollup_service.rebuild(operations=options['operation'], batch_size=options['batch_size'])
+        for operation, added in results.items():
+            self.stdout.write(f'{operation}: {added} job(s) added')
+        self.stdout.write(self.style.SUCCESS('Rollups up to date'))
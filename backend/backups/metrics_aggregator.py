@@ -0,0 +1,344 @@
+"""
+Agrégation des métriques Prometheus (/api/metrics)
+
+Chaque modèle est lu avec une seule requête groupée (par statut, par état
+d'alimentation, ...) au lieu d'un COUNT par valeur. Le texte Prometheus
+produit est mis en cache METRICS_CACHE_TTL_SECONDS: les scrapes rapprochés
+(plusieurs Prometheus, rafraîchissements Grafana) ne touchent pas la base.
+
+Les durées et débits des sauvegardes sont exposés en histogrammes
+(_bucket / _sum / _count) lus dans les agrégats journaliers (BackupRollup).
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from backups.rollup_service import (
+    DURATION_BUCKETS_SECONDS, THROUGHPUT_BUCKETS_MB_PER_SECOND, rollup_service
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsAggregator:
+    """
+    Construction et cache du texte d'exposition Prometheus
+    """
+
+    CACHE_KEY = 'prometheus_metrics_snapshot'
+    LOCK_KEY = 'prometheus_metrics_lock'
+
+    def __init__(self, ttl_seconds=None):
+        """
+        Args:
+            ttl_seconds: Durée de validité d'un instantané (None = settings.METRICS_CACHE_TTL_SECONDS)
+        """
+        self.ttl_seconds = (
+            ttl_seconds if ttl_seconds is not None
+            else getattr(settings, 'METRICS_CACHE_TTL_SECONDS', 30)
+        )
+
+    # ------------------------------------------------------------------
+    # Requêtes groupées
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _count_by(queryset, field):
+        """{valeur: nombre} en une requête GROUP BY"""
+        return {
+            row[field]: row['n']
+            for row in queryset.order_by().values(field).annotate(n=Count('id'))
+        }
+
+    @staticmethod
+    def _job_status_counts(model, since, size_field=None):
+        """
+        Compteurs par statut d'un modèle de job, plus le volume des jobs terminés
+
+        Returns:
+            dict: {'by_status': {...}, 'total': int, 'recent': int, 'completed_size_mb': float}
+        """
+        annotations = {'n': Count('id'), 'recent': Count('id', filter=Q(created_at__gte=since))}
+        if size_field:
+            annotations['size_mb'] = Sum(size_field, filter=Q(status='completed'))
+
+        by_status = {}
+        recent = 0
+        completed_size_mb = 0
+        for row in model.objects.order_by().values('status').annotate(**annotations):
+            by_status[row['status']] = row['n']
+            recent += row['recent']
+            completed_size_mb += row.get('size_mb') or 0
+
+        return {
+            'by_status': by_status,
+            'total': sum(by_status.values()),
+            'recent': recent,
+            'completed_size_mb': completed_size_mb,
+        }
+
+    @staticmethod
+    def _cumulative(histogram, bounds):
+        """Comptes par case (agrégats) -> comptes cumulés par borne (format Prometheus)"""
+        cumulative, running = [], 0
+        for i in range(len(bounds)):
+            running += histogram[i] if i < len(histogram) else 0
+            cumulative.append(running)
+        return cumulative
+
+    @classmethod
+    def _histograms(cls):
+        """
+        Histogrammes durée / débit par opération, depuis les agrégats journaliers globaux
+
+        Returns:
+            list: [(operation, {'duration': {...}, 'throughput': {...}}), ...]
+        """
+        histograms = []
+        for operation, totals in rollup_service.totals_by_operation().items():
+            histograms.append((operation, {
+                'duration': {
+                    'buckets': cls._cumulative(totals['duration_histogram'], DURATION_BUCKETS_SECONDS),
+                    'sum': float(totals['duration_seconds_sum']),
+                    'count': totals['timed_jobs'],
+                },
+                'throughput': {
+                    'buckets': cls._cumulative(totals['throughput_histogram'], THROUGHPUT_BUCKETS_MB_PER_SECOND),
+                    'sum': totals['throughput_mbps_sum'],
+                    'count': totals['timed_jobs'],
+                },
+            }))
+        return histograms
+
+    # ------------------------------------------------------------------
+    # Rendu
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @staticmethod
+    def _gauge(lines, name, value, help_text=None, metric_type='gauge', fmt='{}'):
+        if help_text:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+        lines.append(f'{name} {fmt.format(value)}')
+
+    @classmethod
+    def _render_histogram(cls, lines, name, help_text, bounds, series):
+        """
+        Args:
+            series: [(operation, {'buckets': [...], 'sum': float, 'count': int}), ...]
+        """
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} histogram')
+        for operation, data in series:
+            label = f'operation="{cls._escape(operation)}"'
+            for bound, cumulative in zip(bounds, data['buckets']):
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label},le="+Inf"}} {data["count"]}')
+            lines.append(f'{name}_sum{{{label}}} {data["sum"]:.2f}')
+            lines.append(f'{name}_count{{{label}}} {data["count"]}')
+
+    def collect(self):
+        """
+        Interroge la base et produit le texte d'exposition Prometheus
+
+        Returns:
+            str
+        """
+        from backups.models import (
+            BackupJob, OVFExportJob, VMReplication, FailoverEvent, BackupVerification,
+            Snapshot, SnapshotSchedule, StoragePath
+        )
+        from esxi.models import ESXiServer, VirtualMachine, DatastoreInfo
+
+        started = time.monotonic()
+        lines = []
+        last_24h = timezone.now() - timedelta(hours=24)
+
+        # ===== MÉTRIQUES BACKUPS =====
+        backups = self._job_status_counts(BackupJob, last_24h)
+        b = backups['by_status']
+        completed = b.get('completed', 0)
+        self._gauge(lines, 'esxi_backups_total', backups['total'], 'Nombre total de jobs de backup')
+        self._gauge(lines, 'esxi_backups_completed_total', completed, 'Jobs de backup terminés')
+        self._gauge(lines, 'esxi_backups_failed_total', b.get('failed', 0), 'Jobs de backup échoués')
+        self._gauge(lines, 'esxi_backups_pending_total', b.get('pending', 0), 'Jobs de backup en attente')
+        self._gauge(lines, 'esxi_backups_running_total', b.get('running', 0), 'Jobs de backup en cours')
+        self._gauge(lines, 'esxi_backups_running', b.get('running', 0))
+        self._gauge(lines, 'esxi_backups_last_24h', backups['recent'], 'Jobs de backup créés sur 24h')
+        success_rate = (completed / backups['total'] * 100) if backups['total'] else 0
+        self._gauge(lines, 'esxi_backups_success_rate', success_rate, 'Taux de succès des backups (%)', fmt='{:.2f}')
+
+        # ===== MÉTRIQUES EXPORTS OVF =====
+        exports = self._job_status_counts(OVFExportJob, last_24h, size_field='export_size_mb')
+        e = exports['by_status']
+        self._gauge(lines, 'esxi_ovf_exports_total', exports['total'], 'Nombre total d\'exports OVF')
+        self._gauge(lines, 'esxi_ovf_exports_completed_total', e.get('completed', 0), 'Exports OVF terminés')
+        self._gauge(lines, 'esxi_ovf_exports_failed_total', e.get('failed', 0), 'Exports OVF échoués')
+        self._gauge(lines, 'esxi_ovf_exports_running', e.get('running', 0), 'Exports OVF en cours')
+        self._gauge(
+            lines, 'esxi_ovf_total_exported_gb', exports['completed_size_mb'] / 1024,
+            'Volume total exporté (GB)', fmt='{:.2f}'
+        )
+
+        # ===== MÉTRIQUES SERVEURS ESXi =====
+        servers = self._count_by(ESXiServer.objects.all(), 'is_active')
+        self._gauge(lines, 'esxi_servers_total', sum(servers.values()), 'Serveurs ESXi configurés')
+        self._gauge(lines, 'esxi_servers_active', servers.get(True, 0), 'Serveurs ESXi actifs')
+
+        # ===== MÉTRIQUES VMS =====
+        vms = self._count_by(VirtualMachine.objects.all(), 'power_state')
+        self._gauge(lines, 'esxi_vms_total', sum(vms.values()), 'Machines virtuelles inventoriées')
+        self._gauge(lines, 'esxi_vms_powered_on', vms.get('poweredOn', 0), 'VMs allumées')
+        self._gauge(lines, 'esxi_vms_powered_off', vms.get('poweredOff', 0), 'VMs éteintes')
+
+        # ===== MÉTRIQUES RÉPLICATION =====
+        replications = {
+            (row['status'], row['is_active']): row['n']
+            for row in VMReplication.objects.order_by().values('status', 'is_active').annotate(n=Count('id'))
+        }
+
+        def replication_count(status):
+            return sum(n for (s, _), n in replications.items() if s == status)
+
+        self._gauge(lines, 'esxi_replications_total', sum(replications.values()), 'Réplications configurées')
+        self._gauge(lines, 'esxi_replications_active', replications.get(('active', True), 0), 'Réplications actives')
+        self._gauge(lines, 'esxi_replications_paused', replication_count('paused'), 'Réplications en pause')
+        self._gauge(lines, 'esxi_replications_error', replication_count('error'), 'Réplications en erreur')
+        self._gauge(lines, 'esxi_replications_syncing', replication_count('syncing'), 'Synchronisations en cours')
+
+        durations = VMReplication.objects.order_by().filter(
+            last_replication_duration_seconds__gt=0
+        ).values_list('virtual_machine__name', 'last_replication_duration_seconds')
+        lines.append('# HELP esxi_replication_duration_seconds Durée de la dernière réplication par VM')
+        lines.append('# TYPE esxi_replication_duration_seconds gauge')
+        for vm_name, duration in durations:
+            lines.append(f'esxi_replication_duration_seconds{{vm="{self._escape(vm_name)}"}} {duration}')
+
+        # Failovers
+        failovers = self._count_by(FailoverEvent.objects.all(), 'status')
+        failovers_total = sum(failovers.values())
+        self._gauge(lines, 'esxi_failover_events_total', failovers_total, 'Événements de failover')
+        self._gauge(lines, 'esxi_failover_events_completed', failovers.get('completed', 0), 'Failovers réussis')
+        self._gauge(lines, 'esxi_failover_events_failed', failovers.get('failed', 0), 'Failovers échoués')
+        self._gauge(lines, 'esxi_failovers_total', failovers_total)
+        self._gauge(lines, 'esxi_failovers_completed', failovers.get('completed', 0))
+        self._gauge(lines, 'esxi_failovers_failed', failovers.get('failed', 0))
+
+        # ===== MÉTRIQUES SUREBACKUP =====
+        verifications = self._count_by(BackupVerification.objects.all(), 'status')
+        verifications_total = sum(verifications.values())
+        passed = verifications.get('passed', 0)
+        self._gauge(lines, 'esxi_verifications_total', verifications_total, 'Vérifications SureBackup')
+        self._gauge(lines, 'esxi_verifications_passed', passed, 'Vérifications réussies')
+        self._gauge(lines, 'esxi_verifications_failed', verifications.get('failed', 0), 'Vérifications échouées')
+        self._gauge(lines, 'esxi_verifications_pending', verifications.get('pending', 0), 'Vérifications en attente')
+        self._gauge(lines, 'esxi_verifications_running', verifications.get('running', 0), 'Vérifications en cours')
+        verification_rate = (passed / verifications_total * 100) if verifications_total else 0
+        self._gauge(
+            lines, 'esxi_verifications_success_rate', verification_rate,
+            'Taux de succès des vérifications (%)', fmt='{:.2f}'
+        )
+
+        # ===== MÉTRIQUES DATASTORES =====
+        datastores = DatastoreInfo.objects.order_by().filter(capacity_gb__gt=0).values_list(
+            'name', 'capacity_gb', 'free_space_gb'
+        )
+        used_lines, capacity_lines, free_lines = [], [], []
+        for name, capacity_gb, free_gb in datastores:
+            label = f'datastore="{self._escape(name)}"'
+            used_percent = (capacity_gb - free_gb) / capacity_gb * 100
+            used_lines.append(f'esxi_datastore_used_percent{{{label}}} {used_percent:.2f}')
+            capacity_lines.append(f'esxi_datastore_capacity_gb{{{label}}} {capacity_gb:.2f}')
+            free_lines.append(f'esxi_datastore_free_gb{{{label}}} {free_gb:.2f}')
+        for name, help_text, series in (
+            ('esxi_datastore_used_percent', 'Utilisation du datastore (%)', used_lines),
+            ('esxi_datastore_capacity_gb', 'Capacité du datastore (GB)', capacity_lines),
+            ('esxi_datastore_free_gb', 'Espace libre du datastore (GB)', free_lines),
+        ):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.extend(series)
+
+        # ===== MÉTRIQUES SNAPSHOTS / STOCKAGE =====
+        self._gauge(lines, 'esxi_snapshots_total', Snapshot.objects.count(), 'Snapshots enregistrés')
+        self._gauge(
+            lines, 'esxi_snapshot_schedules_active',
+            SnapshotSchedule.objects.filter(is_active=True).count(), 'Planifications de snapshots actives'
+        )
+        storage_paths = self._count_by(StoragePath.objects.all(), 'is_active')
+        self._gauge(lines, 'esxi_storage_paths_total', sum(storage_paths.values()), 'Chemins de stockage configurés')
+        self._gauge(lines, 'esxi_storage_paths_active', storage_paths.get(True, 0), 'Chemins de stockage actifs')
+
+        # ===== MÉTRIQUES PERFORMANCES =====
+        histograms = self._histograms()
+        self._render_histogram(
+            lines, 'esxi_backup_duration_seconds', 'Durée des sauvegardes terminées',
+            DURATION_BUCKETS_SECONDS, [(op, h['duration']) for op, h in histograms]
+        )
+        self._render_histogram(
+            lines, 'esxi_backup_throughput_mb_per_second', 'Débit moyen des sauvegardes terminées (MB/s)',
+            THROUGHPUT_BUCKETS_MB_PER_SECOND, [(op, h['throughput']) for op, h in histograms]
+        )
+
+        # Moyennes conservées pour les tableaux de bord existants
+        by_operation = dict(histograms)
+        for name, operation in (
+            ('esxi_backup_avg_duration_seconds', 'backup_job'),
+            ('esxi_ovf_export_avg_duration_seconds', 'ovf_export'),
+        ):
+            duration = by_operation[operation]['duration']
+            average = duration['sum'] / duration['count'] if duration['count'] else 0
+            self._gauge(lines, name, average, fmt='{:.2f}')
+
+        self._gauge(
+            lines, 'esxi_metrics_collection_duration_seconds', time.monotonic() - started,
+            'Durée de calcul de cet instantané', fmt='{:.3f}'
+        )
+        self._gauge(
+            lines, 'esxi_metrics_generated_timestamp_seconds', time.time(),
+            'Horodatage de calcul de cet instantané', fmt='{:.0f}'
+        )
+
+        return '\n'.join(lines) + '\n'
+
+    def get_metrics(self):
+        """
+        Texte Prometheus, depuis le cache tant qu'il a moins de ttl_seconds
+
+        Un seul processus recalcule à l'expiration; les autres servent
+        l'instantané précédent pendant ce temps.
+        """
+        snapshot = cache.get(self.CACHE_KEY)
+        now = time.time()
+        if snapshot and now - snapshot['generated_at'] < self.ttl_seconds:
+            return snapshot['text']
+
+        if snapshot and not cache.add(self.LOCK_KEY, 1, timeout=max(self.ttl_seconds, 10)):
+            return snapshot['text']
+
+        try:
+            text = self.collect()
+            cache.set(
+                self.CACHE_KEY,
+                {'generated_at': time.time(), 'text': text},
+                timeout=max(self.ttl_seconds * 10, 60)
+            )
+            return text
+        except Exception as e:
+            logger.error(f"[METRICS] Erreur calcul des métriques: {e}", exc_info=True)
+            if snapshot:
+                return snapshot['text']
+            raise
+        finally:
+            cache.delete(self.LOCK_KEY)
+
+
+# Instance globale de l'agrégateur
+metrics_aggregator = MetricsAggregator()
@@ -0,0 +1,114 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('backups', '0021_add_backup_location_to_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecoveryPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Nom du plan de reprise', max_length=200, unique=True)),
+                ('description', models.TextField(blank=True)),
+                ('target_rto_minutes', models.IntegerField(default=15, help_text='Objectif de temps de reprise (RTO) en minutes')),
+                ('max_parallel_per_tier', models.IntegerField(default=20, help_text='Nombre maximal de VMs démarrées simultanément dans un palier')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recovery_plans', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Plan de reprise',
+                'verbose_name_plural': 'Plans de reprise',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='vmreplication',
+            name='failback_enabled',
+            field=models.BooleanField(default=True, help_text='Activer le failback automatique quand master revient'),
+        ),
+        migrations.AddField(
+            model_name='vmreplication',
+            name='failover_active',
+            field=models.BooleanField(default=False, help_text='Failover actuellement actif (VM master arrêtée, slave active)'),
+        ),
+        migrations.CreateModel(
+            name='RecoveryPlanExecution',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'En attente'), ('running', 'En cours'), ('completed', 'Terminé'), ('partial', 'Partiel'), ('failed', 'Échoué')], default='pending', max_length=20)),
+                ('test_mode', models.BooleanField(default=False, help_text='Mode test: les VMs source ne sont pas arrêtées')),
+                ('target_rto_minutes', models.IntegerField(help_text="Objectif RTO du plan au moment de l'exécution")),
+                ('rto_seconds', models.FloatField(blank=True, help_text='Temps de reprise mesuré (début -> dernière VM démarrée)', null=True)),
+                ('rto_met', models.BooleanField(blank=True, help_text='Objectif RTO atteint (toutes les VMs démarrées dans le délai)', null=True)),
+                ('total_vms', models.IntegerField(default=0)),
+                ('succeeded_vms', models.IntegerField(default=0)),
+                ('failed_vms', models.IntegerField(default=0)),
+                ('skipped_vms', models.IntegerField(default=0)),
+                ('tier_report', models.JSONField(blank=True, default=list, help_text='Durée et résultat de chaque palier')),
+                ('error_message', models.TextField(blank=True)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='executions', to='backups.recoveryplan')),
+                ('triggered_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Exécution de plan de reprise',
+                'verbose_name_plural': 'Exécutions de plans de reprise',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='failoverevent',
+            name='recovery_execution',
+            field=models.ForeignKey(blank=True, help_text='Exécution de plan de reprise ayant déclenché ce failover', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='failover_events', to='backups.recoveryplanexecution'),
+        ),
+        migrations.CreateModel(
+            name='ReplicationLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('started', 'Démarré'), ('in_progress', 'En cours'), ('completed', 'Terminé'), ('failed', 'Échoué'), ('cancelled', 'Annulé')], default='started', max_length=20)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('duration_seconds', models.IntegerField(blank=True, help_text='Durée de la réplication en secondes', null=True)),
+                ('progress_percentage', models.IntegerField(default=0)),
+                ('replicated_size_mb', models.FloatField(default=0, help_text='Taille répliquée en MB')),
+                ('message', models.TextField(blank=True, help_text="Message de status ou d'erreur")),
+                ('error_details', models.TextField(blank=True, help_text="Détails de l'erreur si échec")),
+                ('source_vm_power_state', models.CharField(blank=True, help_text='État de la VM source au moment de la réplication', max_length=20)),
+                ('triggered_by', models.CharField(default='automatic', help_text='Comment la réplication a été déclenchée (automatic, manual, api)', max_length=50)),
+                ('replication', models.ForeignKey(help_text='Réplication associée', on_delete=django.db.models.deletion.CASCADE, related_name='replication_logs', to='backups.vmreplication')),
+            ],
+            options={
+                'verbose_name': 'Historique Réplication',
+                'verbose_name_plural': 'Historique Réplications',
+                'ordering': ['-started_at'],
+                'indexes': [models.Index(fields=['replication', '-started_at'], name='backups_rep_replica_fe116d_idx'), models.Index(fields=['status', '-started_at'], name='backups_rep_status_9fba46_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RecoveryPlanItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tier', models.PositiveIntegerField(default=1, help_text='Palier de démarrage (1 = démarré en premier)')),
+                ('depends_on', models.ManyToManyField(blank=True, help_text='Éléments (paliers inférieurs) devant avoir basculé avec succès avant celui-ci', related_name='dependents', to='backups.recoveryplanitem')),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='backups.recoveryplan')),
+                ('replication', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recovery_plan_items', to='backups.vmreplication')),
+            ],
+            options={
+                'verbose_name': 'Élément de plan de reprise',
+                'verbose_name_plural': 'Éléments de plan de reprise',
+                'ordering': ['plan', 'tier', 'id'],
+                'unique_together': {('plan', 'replication')},
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0022_recovery_plans'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackupRollupSource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operation', models.CharField(choices=[('backup_job', 'Backup'), ('vm_backup', 'Backup VM'), ('ovf_export', 'Export OVF')], max_length=20)),
+                ('job_id', models.PositiveIntegerField()),
+                ('status', models.CharField(max_length=50)),
+                ('recorded_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Job agrégé',
+                'verbose_name_plural': 'Jobs agrégés',
+                'unique_together': {('operation', 'job_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='BackupRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Heure'), ('day', 'Jour')], max_length=10)),
+                ('bucket_start', models.DateTimeField(help_text='Début de la période (heure ou jour, UTC)')),
+                ('dimension', models.CharField(choices=[('global', 'Global'), ('vm', 'Machine virtuelle'), ('server', 'Serveur ESXi'), ('storage', 'Stockage distant'), ('tenant', 'Organisation')], max_length=20)),
+                ('dimension_id', models.PositiveIntegerField(default=0, help_text="ID de la VM, du serveur, du stockage ou de l'organisation (0 pour global)")),
+                ('operation', models.CharField(choices=[('backup_job', 'Backup'), ('vm_backup', 'Backup VM'), ('ovf_export', 'Export OVF')], max_length=20)),
+                ('jobs_completed', models.PositiveIntegerField(default=0)),
+                ('jobs_failed', models.PositiveIntegerField(default=0)),
+                ('jobs_cancelled', models.PositiveIntegerField(default=0)),
+                ('bytes_moved', models.BigIntegerField(default=0, help_text='Volume des jobs terminés avec succès')),
+                ('duration_seconds_sum', models.BigIntegerField(default=0)),
+                ('duration_seconds_max', models.PositiveIntegerField(default=0)),
+                ('throughput_mbps_sum', models.FloatField(default=0, help_text='Somme des débits (MB/s) des jobs chronométrés')),
+                ('incremental_jobs', models.PositiveIntegerField(default=0)),
+                ('incremental_bytes', models.BigIntegerField(default=0, help_text='Volume des backups incrémentaux (taux de changement)')),
+                ('duration_histogram', models.JSONField(blank=True, default=list)),
+                ('throughput_histogram', models.JSONField(blank=True, default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Agrégat Backups',
+                'verbose_name_plural': 'Agrégats Backups',
+                'ordering': ['-bucket_start'],
+                'indexes': [models.Index(fields=['granularity', 'dimension', 'dimension_id', 'bucket_start'], name='backups_bac_granula_4b8c56_idx')],
+                'unique_together': {('granularity', 'dimension', 'dimension_id', 'operation', 'bucket_start')},
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0023_backup_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='backupjob',
+            index=models.Index(fields=['-created_at', '-id'], name='backupjob_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='backupjob',
+            index=models.Index(fields=['virtual_machine', '-created_at', '-id'], name='backupjob_vm_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='backupjob',
+            index=models.Index(fields=['status', '-created_at', '-id'], name='backupjob_status_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='backuplog',
+            index=models.Index(fields=['job', '-timestamp', '-id'], name='backuplog_job_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='failoverevent',
+            index=models.Index(fields=['-started_at', '-id'], name='failover_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='failoverevent',
+            index=models.Index(fields=['replication', '-started_at', '-id'], name='failover_repl_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='failoverevent',
+            index=models.Index(fields=['status', '-started_at', '-id'], name='failover_status_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationlog',
+            index=models.Index(fields=['-sent_at', '-id'], name='notiflog_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationlog',
+            index=models.Index(fields=['virtual_machine', '-sent_at', '-id'], name='notiflog_vm_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notificationlog',
+            index=models.Index(fields=['status', '-sent_at', '-id'], name='notiflog_status_cursor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='replicationlog',
+            index=models.Index(fields=['replication', '-started_at', '-id'], name='repllog_cursor_idx'),
+        ),
+    ]
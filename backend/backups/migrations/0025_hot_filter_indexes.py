@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0024_history_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vmbackupjob',
+            index=models.Index(fields=['virtual_machine', 'status'], name='vmbackup_vm_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vmreplication',
+            index=models.Index(fields=['is_active', 'last_replication_at'], name='replication_due_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0025_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backuprollup',
+            name='dimension',
+            field=models.CharField(choices=[('global', 'Global'), ('vm', 'Machine virtuelle'), ('server', 'Serveur ESXi'), ('storage', 'Stockage distant'), ('storage_path', 'Chemin de sauvegarde'), ('tenant', 'Organisation')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='backuprollup',
+            name='dimension_id',
+            field=models.PositiveIntegerField(default=0, help_text="ID de la VM, du serveur, du stockage, du chemin ou de l'organisation (0 pour global)"),
+        ),
+        migrations.CreateModel(
+            name='StorageReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_key', models.CharField(help_text='Cible: remote:<id>, path:<id> ou dir:<chemin>', max_length=255)),
+                ('operation', models.CharField(choices=[('backup_job', 'Backup'), ('vm_backup', 'Backup VM'), ('ovf_export', 'Export OVF'), ('replication', 'Réplication')], max_length=20)),
+                ('job_id', models.PositiveIntegerField()),
+                ('reserved_bytes', models.BigIntegerField(help_text='Taille prévue du job')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(help_text='Fin de la limite de temps du job')),
+            ],
+            options={
+                'verbose_name': 'Réservation de stockage',
+                'verbose_name_plural': 'Réservations de stockage',
+                'indexes': [models.Index(fields=['target_key', 'expires_at'], name='backups_sto_target__399396_idx')],
+                'unique_together': {('operation', 'job_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0026_storage_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storagepath',
+            name='tier',
+            field=models.CharField(choices=[('performance', 'Performance (nouveaux backups)'), ('capacity', 'Capacité (backups anciens)')], default='performance', help_text='Tier de stockage: les backups anciens sont déplacés du tier performance vers le tier capacité', max_length=20),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0027_storagepath_tier'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='remotestorageconfig',
+            name='region',
+            field=models.CharField(blank=True, default='', help_text="Région S3 (optionnel, ex: 'eu-west-3')", max_length=64),
+        ),
+        migrations.AddField(
+            model_name='remotestorageconfig',
+            name='use_ssl',
+            field=models.BooleanField(default=True, help_text='Endpoint S3 en HTTPS'),
+        ),
+        migrations.AlterField(
+            model_name='remotestorageconfig',
+            name='protocol',
+            field=models.CharField(choices=[('smb', 'SMB/CIFS (Windows Share/Samba)'), ('nfs', 'NFS (Network File System)'), ('s3', 'S3 (Object Storage: AWS, MinIO, Ceph)'), ('local', 'Local Path (Development only)')], default='smb', help_text='Protocole de connexion au stockage distant', max_length=10),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0028_remotestorage_s3'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vmbackupjob',
+            name='consolidation_seconds',
+            field=models.FloatField(default=0, help_text='Durée de suppression/consolidation du snapshot'),
+        ),
+        migrations.AddField(
+            model_name='vmbackupjob',
+            name='snapshot_delta_bytes',
+            field=models.BigIntegerField(default=0, help_text='Taille maximale mesurée des deltas du snapshot'),
+        ),
+        migrations.AddField(
+            model_name='vmbackupjob',
+            name='snapshot_open_seconds',
+            field=models.FloatField(default=0, help_text="Durée d'ouverture du snapshot (création -> suppression)"),
+        ),
+    ]
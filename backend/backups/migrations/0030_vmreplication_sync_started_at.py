@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0029_vmbackupjob_snapshot_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vmreplication',
+            name='sync_started_at',
+            field=models.DateTimeField(blank=True, help_text='Début de la synchronisation en cours (détection des synchronisations interrompues)', null=True),
+        ),
+    ]
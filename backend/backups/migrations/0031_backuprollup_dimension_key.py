@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-19 02:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backups', '0030_vmreplication_sync_started_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='backuprollup',
+            name='backups_bac_granula_4b8c56_idx',
+        ),
+        migrations.AlterUniqueTogether(
+            name='backuprollup',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='backuprollup',
+            name='dimension_key',
+            field=models.CharField(blank=True, default='', help_text="UUID de l'organisation (dimension 'tenant'), vide pour les autres dimensions", max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='backuprollup',
+            name='dimension_id',
+            field=models.PositiveIntegerField(default=0, help_text='ID de la VM, du serveur, du stockage ou du chemin (0 pour global et organisation)'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='backuprollup',
+            unique_together={('granularity', 'dimension', 'dimension_id', 'dimension_key', 'operation', 'bucket_start')},
+        ),
+        migrations.AddIndex(
+            model_name='backuprollup',
+            index=models.Index(fields=['granularity', 'dimension', 'dimension_id', 'dimension_key', 'bucket_start'], name='backups_bac_granula_0fbd83_idx'),
+        ),
+    ]
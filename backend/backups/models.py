@@ -13,12 +13,17 @@ logger = logging.getLogger(__name__)
 
 class RemoteStorageConfig(models.Model):
     """
-    Configuration pour stockage distant (SMB/CIFS, NFS)
+    Configuration pour stockage distant (SMB/CIFS, NFS, S3)
     Gestion sécurisée des credentials avec chiffrement Fernet
+
+    S3: share_name = bucket, base_path = préfixe des objets, username /
+    mot de passe = clé d'accès / clé secrète, host:port = endpoint
+    (AWS, MinIO, Ceph RGW...).
     """
     PROTOCOL_CHOICES = [
         ('smb', 'SMB/CIFS (Windows Share/Samba)'),
         ('nfs', 'NFS (Network File System)'),
+        ('s3', 'S3 (Object Storage: AWS, MinIO, Ceph)'),
         ('local', 'Local Path (Development only)')
     ]
 
@@ -79,6 +84,19 @@ class RemoteStorageConfig(models.Model):
         help_text="Domaine Windows (optionnel, défaut: WORKGROUP)"
     )
 
+    # Paramètres S3
+    region = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        help_text="Région S3 (optionnel, ex: 'eu-west-3')"
+    )
+
+    use_ssl = models.BooleanField(
+        default=True,
+        help_text="Endpoint S3 en HTTPS"
+    )
+
     # Status et tests
     is_active = models.BooleanField(
         default=True,
@@ -187,6 +205,12 @@ class RemoteStorageConfig(models.Model):
             if self.base_path:
                 path = f"{path}/{self.base_path}"
             return path
+        elif self.protocol == 's3':
+            # Format objet: s3://bucket/prefix
+            path = f"s3://{self.share_name}"
+            if self.base_path.strip('/'):
+                path = f"{path}/{self.base_path.strip('/')}"
+            return path
         elif self.protocol == 'local':
             # Pour développement uniquement
             return self.base_path if self.base_path else '/tmp/backups'
@@ -204,8 +228,15 @@ class RemoteStorageConfig(models.Model):
             return f"smb://{self.username}@{self.host}/{self.share_name}"
         elif self.protocol == 'nfs':
             return f"nfs://{self.host}/{self.share_name}"
+        elif self.protocol == 's3':
+            return f"{self.get_endpoint_url()}/{self.share_name}"
         return self.get_full_path()
 
+    def get_endpoint_url(self):
+        """Endpoint HTTP(S) d'un stockage S3"""
+        scheme = 'https' if self.use_ssl else 'http'
+        return f"{scheme}://{self.host}:{self.port}"
+
     def save(self, *args, **kwargs):
         """
         Override save pour gérer le flag is_default unique
@@ -236,6 +267,12 @@ class BackupLog(models.Model):
     message = models.TextField(default='')
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Pagination par curseur (timestamp, id) du journal d'un job
+        indexes = [
+            models.Index(fields=['job', '-timestamp', '-id'], name='backuplog_job_cursor_idx'),
+        ]
+
     def __str__(self):
         return f"{self.job} - {self.level}: {self.message[:50]} at {self.timestamp}"
 
@@ -307,6 +344,14 @@ class BackupJob(models.Model):
     completed_at = models.DateTimeField(null=True, blank=True)
     duration_seconds = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        # Pagination par curseur (created_at, id), globale et filtrée par VM / statut
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='backupjob_cursor_idx'),
+            models.Index(fields=['virtual_machine', '-created_at', '-id'], name='backupjob_vm_cursor_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='backupjob_status_cursor_idx'),
+        ]
+
     def calculate_duration(self):
         if self.started_at and self.completed_at:
             delta = self.completed_at - self.started_at
@@ -455,6 +500,9 @@ class VMBackupJob(models.Model):
     # Snapshot info
     snapshot_name = models.CharField(max_length=255, blank=True, help_text="Nom du snapshot créé")
     snapshot_id = models.CharField(max_length=255, blank=True, help_text="ID du snapshot VMware")
+    snapshot_open_seconds = models.FloatField(default=0, help_text="Durée d'ouverture du snapshot (création -> suppression)")
+    snapshot_delta_bytes = models.BigIntegerField(default=0, help_text="Taille maximale mesurée des deltas du snapshot")
+    consolidation_seconds = models.FloatField(default=0, help_text="Durée de suppression/consolidation du snapshot")
 
     # Pour backups incrémentaux
     base_backup = models.ForeignKey(
@@ -494,6 +542,12 @@ class VMBackupJob(models.Model):
     completed_at = models.DateTimeField(null=True, blank=True)
     duration_seconds = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # Dernier backup / backups en cours par VM (health, dashboard, chaînes incrémentales)
+            models.Index(fields=['virtual_machine', 'status'], name='vmbackup_vm_status_idx'),
+        ]
+
     def calculate_duration(self):
         if self.started_at and self.completed_at:
             delta = self.completed_at - self.started_at
@@ -1090,6 +1144,12 @@ class NotificationLog(models.Model):
         verbose_name = "Notification Log"
         verbose_name_plural = "Notification Logs"
         ordering = ['-sent_at']
+        # Pagination par curseur (sent_at, id), globale et filtrée par VM / statut
+        indexes = [
+            models.Index(fields=['-sent_at', '-id'], name='notiflog_cursor_idx'),
+            models.Index(fields=['virtual_machine', '-sent_at', '-id'], name='notiflog_vm_cursor_idx'),
+            models.Index(fields=['status', '-sent_at', '-id'], name='notiflog_status_cursor_idx'),
+        ]
 
     def __str__(self):
         return f"{self.event_type} - {self.status} - {self.sent_at.strftime('%Y-%m-%d %H:%M')}"
@@ -1111,6 +1171,11 @@ class StoragePath(models.Model):
         ('other', 'Autre')
     ]
 
+    TIER_CHOICES = [
+        ('performance', 'Performance (nouveaux backups)'),
+        ('capacity', 'Capacité (backups anciens)')
+    ]
+
     name = models.CharField(
         max_length=100,
         unique=True,
@@ -1129,6 +1194,13 @@ class StoragePath(models.Model):
         help_text="Type de stockage"
     )
 
+    tier = models.CharField(
+        max_length=20,
+        choices=TIER_CHOICES,
+        default='performance',
+        help_text="Tier de stockage: les backups anciens sont déplacés du tier performance vers le tier capacité"
+    )
+
     description = models.TextField(
         blank=True,
         help_text="Description optionnelle du chemin de sauvegarde"
@@ -1251,6 +1323,12 @@ class VMReplication(models.Model):
         help_text="Durée de la dernière réplication en secondes"
     )
 
+    sync_started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Début de la synchronisation en cours (détection des synchronisations interrompues)"
+    )
+
     total_replicated_size_mb = models.FloatField(
         default=0,
         help_text="Taille totale répliquée en MB"
@@ -1279,6 +1357,10 @@ class VMReplication(models.Model):
         verbose_name_plural = "Réplications VM"
         ordering = ['-created_at']
         unique_together = ['virtual_machine', 'destination_server']
+        indexes = [
+            # Sélection des réplications dues (orchestrateur) et vérification RPO
+            models.Index(fields=['is_active', 'last_replication_at'], name='replication_due_idx'),
+        ]
 
     def __str__(self):
         return f"Replication: {self.virtual_machine.name} -> {self.destination_server.name}"
@@ -1417,6 +1499,15 @@ class FailoverEvent(models.Model):
         help_text="Message d'erreur si échec"
     )
 
+    recovery_execution = models.ForeignKey(
+        'RecoveryPlanExecution',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='failover_events',
+        help_text="Exécution de plan de reprise ayant déclenché ce failover"
+    )
+
     started_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
 
@@ -1424,11 +1515,177 @@ class FailoverEvent(models.Model):
         verbose_name = "Événement Failover"
         verbose_name_plural = "Événements Failover"
         ordering = ['-started_at']
+        # Pagination par curseur (started_at, id), globale et filtrée par réplication / statut
+        indexes = [
+            models.Index(fields=['-started_at', '-id'], name='failover_cursor_idx'),
+            models.Index(fields=['replication', '-started_at', '-id'], name='failover_repl_cursor_idx'),
+            models.Index(fields=['status', '-started_at', '-id'], name='failover_status_cursor_idx'),
+        ]
 
     def __str__(self):
         return f"Failover {self.failover_type}: {self.replication.virtual_machine.name} ({self.status})"
 
 
+class RecoveryPlan(models.Model):
+    """
+    Plan de reprise d'activité (runbook) pour un failover de site
+    Regroupe des réplications en paliers de démarrage (tiers): toutes les VMs d'un
+    palier démarrent en parallèle, les paliers s'enchaînent dans l'ordre croissant.
+    """
+    name = models.CharField(
+        max_length=200,
+        unique=True,
+        help_text="Nom du plan de reprise"
+    )
+
+    description = models.TextField(blank=True)
+
+    target_rto_minutes = models.IntegerField(
+        default=15,
+        help_text="Objectif de temps de reprise (RTO) en minutes"
+    )
+
+    max_parallel_per_tier = models.IntegerField(
+        default=20,
+        help_text="Nombre maximal de VMs démarrées simultanément dans un palier"
+    )
+
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='recovery_plans'
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Plan de reprise"
+        verbose_name_plural = "Plans de reprise"
+        ordering = ['name']
+
+    def __str__(self):
+        return f"Plan de reprise: {self.name}"
+
+
+class RecoveryPlanItem(models.Model):
+    """
+    Réplication incluse dans un plan de reprise, avec son palier et ses dépendances
+    """
+    plan = models.ForeignKey(
+        RecoveryPlan,
+        on_delete=models.CASCADE,
+        related_name='items'
+    )
+
+    replication = models.ForeignKey(
+        VMReplication,
+        on_delete=models.CASCADE,
+        related_name='recovery_plan_items'
+    )
+
+    tier = models.PositiveIntegerField(
+        default=1,
+        help_text="Palier de démarrage (1 = démarré en premier)"
+    )
+
+    depends_on = models.ManyToManyField(
+        'self',
+        symmetrical=False,
+        blank=True,
+        related_name='dependents',
+        help_text="Éléments (paliers inférieurs) devant avoir basculé avec succès avant celui-ci"
+    )
+
+    class Meta:
+        verbose_name = "Élément de plan de reprise"
+        verbose_name_plural = "Éléments de plan de reprise"
+        ordering = ['plan', 'tier', 'id']
+        unique_together = ['plan', 'replication']
+
+    def __str__(self):
+        return f"{self.plan.name} - palier {self.tier}: {self.replication.virtual_machine.name}"
+
+
+class RecoveryPlanExecution(models.Model):
+    """
+    Exécution d'un plan de reprise avec mesure du RTO et rapport par palier
+    """
+    STATUS_CHOICES = [
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('completed', 'Terminé'),
+        ('partial', 'Partiel'),
+        ('failed', 'Échoué')
+    ]
+
+    plan = models.ForeignKey(
+        RecoveryPlan,
+        on_delete=models.CASCADE,
+        related_name='executions'
+    )
+
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending'
+    )
+
+    test_mode = models.BooleanField(
+        default=False,
+        help_text="Mode test: les VMs source ne sont pas arrêtées"
+    )
+
+    triggered_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True
+    )
+
+    target_rto_minutes = models.IntegerField(
+        help_text="Objectif RTO du plan au moment de l'exécution"
+    )
+
+    rto_seconds = models.FloatField(
+        null=True,
+        blank=True,
+        help_text="Temps de reprise mesuré (début -> dernière VM démarrée)"
+    )
+
+    rto_met = models.BooleanField(
+        null=True,
+        blank=True,
+        help_text="Objectif RTO atteint (toutes les VMs démarrées dans le délai)"
+    )
+
+    total_vms = models.IntegerField(default=0)
+    succeeded_vms = models.IntegerField(default=0)
+    failed_vms = models.IntegerField(default=0)
+    skipped_vms = models.IntegerField(default=0)
+
+    tier_report = models.JSONField(
+        default=list,
+        blank=True,
+        help_text="Durée et résultat de chaque palier"
+    )
+
+    error_message = models.TextField(blank=True)
+
+    started_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Exécution de plan de reprise"
+        verbose_name_plural = "Exécutions de plans de reprise"
+        ordering = ['-started_at']
+
+    def __str__(self):
+        return f"{self.plan.name} ({self.status})"
+
+
 class ReplicationLog(models.Model):
     """
     Historique des tentatives de réplication
@@ -1500,6 +1757,8 @@ class ReplicationLog(models.Model):
         indexes = [
             models.Index(fields=['replication', '-started_at']),
             models.Index(fields=['status', '-started_at']),
+            # Pagination par curseur (started_at, id) de l'historique d'une réplication
+            models.Index(fields=['replication', '-started_at', '-id'], name='repllog_cursor_idx'),
         ]
 
     def __str__(self):
@@ -1728,3 +1987,148 @@ class BackupVerificationSchedule(models.Model):
         vm_name = self.virtual_machine.name if self.virtual_machine else "Toutes les VMs"
         return f"{self.name} - {vm_name} ({self.frequency})"
 
+
+
+# ==========================================================
+# 🔹 ROLLUPS - Agrégats horaires/journaliers des jobs de backup
+# ==========================================================
+class BackupRollup(models.Model):
+    """
+    Agrégat des jobs terminés sur une période (heure ou jour), pour une dimension
+
+    Alimenté au fil de l'eau à la fin de chaque job (voir backups.rollup_service).
+    Les statistiques (dashboard, santé, facturation, Prometheus) lisent ces
+    lignes au lieu de parcourir tout l'historique des jobs.
+    """
+    GRANULARITY_CHOICES = [
+        ('hour', 'Heure'),
+        ('day', 'Jour')
+    ]
+
+    DIMENSION_CHOICES = [
+        ('global', 'Global'),
+        ('vm', 'Machine virtuelle'),
+        ('server', 'Serveur ESXi'),
+        ('storage', 'Stockage distant'),
+        ('storage_path', 'Chemin de sauvegarde'),
+        ('tenant', 'Organisation')
+    ]
+
+    OPERATION_CHOICES = [
+        ('backup_job', 'Backup'),
+        ('vm_backup', 'Backup VM'),
+        ('ovf_export', 'Export OVF')
+    ]
+
+    granularity = models.CharField(max_length=10, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField(help_text="Début de la période (heure ou jour, UTC)")
+    dimension = models.CharField(max_length=20, choices=DIMENSION_CHOICES)
+    dimension_id = models.PositiveIntegerField(
+        default=0,
+        help_text="ID de la VM, du serveur, du stockage ou du chemin (0 pour global et organisation)"
+    )
+    dimension_key = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        help_text="UUID de l'organisation (dimension 'tenant'), vide pour les autres dimensions"
+    )
+    operation = models.CharField(max_length=20, choices=OPERATION_CHOICES)
+
+    jobs_completed = models.PositiveIntegerField(default=0)
+    jobs_failed = models.PositiveIntegerField(default=0)
+    jobs_cancelled = models.PositiveIntegerField(default=0)
+
+    bytes_moved = models.BigIntegerField(default=0, help_text="Volume des jobs terminés avec succès")
+    duration_seconds_sum = models.BigIntegerField(default=0)
+    duration_seconds_max = models.PositiveIntegerField(default=0)
+    throughput_mbps_sum = models.FloatField(default=0, help_text="Somme des débits (MB/s) des jobs chronométrés")
+
+    incremental_jobs = models.PositiveIntegerField(default=0)
+    incremental_bytes = models.BigIntegerField(default=0, help_text="Volume des backups incrémentaux (taux de changement)")
+
+    # Comptes par intervalle (bornes dans backups.rollup_service), dernier élément = au-delà
+    duration_histogram = models.JSONField(default=list, blank=True)
+    throughput_histogram = models.JSONField(default=list, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Agrégat Backups"
+        verbose_name_plural = "Agrégats Backups"
+        ordering = ['-bucket_start']
+        unique_together = ['granularity', 'dimension', 'dimension_id', 'dimension_key', 'operation', 'bucket_start']
+        indexes = [
+            models.Index(fields=['granularity', 'dimension', 'dimension_id', 'dimension_key', 'bucket_start']),
+        ]
+
+    def __str__(self):
+        dimension = self.dimension_key or self.dimension_id
+        return f"{self.operation} {self.dimension}:{dimension} {self.granularity} {self.bucket_start:%Y-%m-%d %H:%M}"
+
+    @property
+    def timed_jobs(self):
+        """Jobs terminés avec une durée mesurée (base des histogrammes)"""
+        return sum(self.duration_histogram or [])
+
+    @property
+    def avg_duration_seconds(self):
+        timed = self.timed_jobs
+        return self.duration_seconds_sum / timed if timed else 0
+
+    @property
+    def throughput_mbps(self):
+        """Débit agrégé de la période (volume total / durée totale)"""
+        if not self.duration_seconds_sum:
+            return 0
+        return self.bytes_moved / (1024 ** 2) / self.duration_seconds_sum
+
+
+class BackupRollupSource(models.Model):
+    """
+    Jobs déjà comptabilisés dans les agrégats (évite un double comptage
+    quand un job terminé est sauvegardé plusieurs fois)
+    """
+    operation = models.CharField(max_length=20, choices=BackupRollup.OPERATION_CHOICES)
+    job_id = models.PositiveIntegerField()
+    status = models.CharField(max_length=50)
+    recorded_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Job agrégé"
+        verbose_name_plural = "Jobs agrégés"
+        unique_together = ['operation', 'job_id']
+
+    def __str__(self):
+        return f"{self.operation} #{self.job_id} ({self.status})"
+
+
+class StorageReservation(models.Model):
+    """
+    Espace réservé sur une cible de sauvegarde par un job admis et non terminé
+
+    Créée à l'admission du job (taille prévue), supprimée quand le job se
+    termine (voir backups.storage_capacity). Les réservations expirées (worker
+    mort sans terminer le job) ne sont plus comptées.
+    """
+    OPERATION_CHOICES = BackupRollup.OPERATION_CHOICES + [
+        ('replication', 'Réplication')
+    ]
+
+    target_key = models.CharField(max_length=255, help_text="Cible: remote:<id>, path:<id> ou dir:<chemin>")
+    operation = models.CharField(max_length=20, choices=OPERATION_CHOICES)
+    job_id = models.PositiveIntegerField()
+    reserved_bytes = models.BigIntegerField(help_text="Taille prévue du job")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(help_text="Fin de la limite de temps du job")
+
+    class Meta:
+        verbose_name = "Réservation de stockage"
+        verbose_name_plural = "Réservations de stockage"
+        unique_together = ['operation', 'job_id']
+        indexes = [
+            models.Index(fields=['target_key', 'expires_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.operation} #{self.job_id} -> {self.target_key} ({self.reserved_bytes / (1024 ** 3):.1f} GB)"
@@ -12,6 +12,9 @@ from django.utils import timezone
 from pyVim.task import WaitForTask
 from pyVmomi import vim
 
+from backups.storage_backends import backend_for_path, write_tar
+from backups.tenant_scheduler import tenant_scheduler
+
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
@@ -33,6 +36,12 @@ class OVFExportLeaseService:
         self.export_job = export_job
         self.vm_name = vm_obj.name
 
+        # Débit maximal de l'organisation (None = non limité)
+        self.bandwidth_limiter = tenant_scheduler.bandwidth_limiter(export_job.created_by_id)
+
+        # Export destination backend (filesystem or S3)
+        self.storage = backend_for_path(export_job.export_full_path)
+
         # Get ESXi credentials
         esxi_server = export_job.virtual_machine.server
         self.esxi_host = esxi_server.hostname
@@ -65,7 +74,7 @@ class OVFExportLeaseService:
 
             # Create export directory
             export_dir = self.export_job.export_full_path
-            os.makedirs(export_dir, exist_ok=True)
+            self.storage.makedirs(export_dir)
             logger.info(f"[OVF-EXPORT] Export directory: {export_dir}")
 
             # Step 1: Create export lease
@@ -141,7 +150,7 @@ class OVFExportLeaseService:
                     else:
                         filename = target_id or f"file-{i}"
 
-                dest_path = os.path.join(export_dir, filename)
+                dest_path = self.storage.join(export_dir, filename)
 
                 logger.info(f"[OVF-EXPORT] Downloading {filename}...")
                 logger.info(f"[OVF-EXPORT] URL: {url}")
@@ -159,7 +168,7 @@ class OVFExportLeaseService:
                     )
 
                     # Get actual file size after download
-                    actual_size_bytes = os.path.getsize(dest_path)
+                    actual_size_bytes = self.storage.size(dest_path)
                     actual_size_mb = actual_size_bytes / (1024 * 1024)
 
                     downloaded_files.append({
@@ -198,13 +207,13 @@ class OVFExportLeaseService:
                 # Generate OVF descriptor manually
                 logger.info(f"[OVF-EXPORT] Generating OVF descriptor...")
                 ovf_content = self._generate_ovf_descriptor(downloaded_files)
-                ovf_file = os.path.join(export_dir, f"{self.vm_name}.ovf")
-                with open(ovf_file, 'w', encoding='utf-8') as f:
-                    f.write(ovf_content)
+                ovf_file = self.storage.join(export_dir, f"{self.vm_name}.ovf")
+                ovf_bytes = ovf_content.encode('utf-8')
+                self.storage.write_bytes(ovf_file, ovf_bytes)
                 logger.info(f"[OVF-EXPORT] OVF descriptor created: {ovf_file}")
                 downloaded_files.append({
                     'filename': f"{self.vm_name}.ovf",
-                    'size_mb': os.path.getsize(ovf_file) / (1024 * 1024),
+                    'size_mb': len(ovf_bytes) / (1024 * 1024),
                     'path': ovf_file
                 })
 
@@ -252,7 +261,7 @@ class OVFExportLeaseService:
                     logger.info(f"[OVF-EXPORT] OVA created: {ova_path}")
                     # Update export path to point to OVA file
                     self.export_job.export_full_path = ova_path
-                    ova_size_mb = os.path.getsize(ova_path) / (1024 * 1024)
+                    ova_size_mb = self.storage.size(ova_path) / (1024 * 1024)
                     self.export_job.export_size_mb = ova_size_mb
                     # Ensure progress stays at 100% after OVA conversion
                     self.export_job.progress_percentage = 100
@@ -362,11 +371,13 @@ class OVFExportLeaseService:
         start_time = time.time()
         last_speed_update = start_time
 
-        with open(dest_path, 'wb') as f:
+        with self.storage.open_write(dest_path, size_hint=file_size or None) as f:
             for chunk in response.iter_content(chunk_size=1024 * 1024):  # 1MB chunks
                 if chunk:
                     f.write(chunk)
                     downloaded += len(chunk)
+                    if self.bandwidth_limiter:
+                        self.bandwidth_limiter.consume(len(chunk))
 
                     # Calculer la progression
                     global_downloaded = downloaded_so_far + downloaded
@@ -552,31 +563,31 @@ class OVFExportLeaseService:
         """
         Generate .mf manifest file with SHA256 checksums
         """
-        manifest_file = os.path.join(export_dir, f"{self.vm_name}.mf")
+        manifest_file = self.storage.join(export_dir, f"{self.vm_name}.mf")
 
         logger.info(f"[OVF-EXPORT] Generating manifest with checksums...")
 
-        with open(manifest_file, 'w') as mf:
-            for file_info in downloaded_files:
-                filename = file_info['filename']
-                filepath = file_info['path']
+        lines = []
+        for file_info in downloaded_files:
+            filename = file_info['filename']
+            filepath = file_info['path']
 
-                if os.path.exists(filepath):
-                    logger.info(f"[OVF-EXPORT] Calculating SHA256 for {filename}...")
-                    checksum = self._calculate_checksum(filepath)
-                    mf.write(f"SHA256({filename})= {checksum}\n")
-                    logger.info(f"[OVF-EXPORT] {filename}: {checksum[:16]}...")
+            if self.storage.exists(filepath):
+                logger.info(f"[OVF-EXPORT] Calculating SHA256 for {filename}...")
+                checksum = self._calculate_checksum(filepath)
+                lines.append(f"SHA256({filename})= {checksum}\n")
+                logger.info(f"[OVF-EXPORT] {filename}: {checksum[:16]}...")
+        self.storage.write_bytes(manifest_file, ''.join(lines).encode('utf-8'))
 
         logger.info(f"[OVF-EXPORT] Manifest created: {manifest_file}")
 
     def _calculate_checksum(self, filepath):
         """
-        Calculate SHA256 checksum of a file
+        Calculate SHA256 checksum of a file (read-ahead while hashing)
         """
         sha256_hash = hashlib.sha256()
-        with open(filepath, "rb") as f:
-            for byte_block in iter(lambda: f.read(4096), b""):
-                sha256_hash.update(byte_block)
+        for byte_block in self.storage.iter_chunks(filepath):
+            sha256_hash.update(byte_block)
         return sha256_hash.hexdigest()
 
     def _convert_to_ova(self, export_dir, downloaded_files):
@@ -590,61 +601,54 @@ class OVFExportLeaseService:
         Returns:
             str: Path to created OVA file, or None if failed
         """
-        import tarfile
-        import shutil
-
         try:
             # OVA file path (same location as export_dir, but with .ova extension)
             parent_dir = os.path.dirname(export_dir)
             ova_filename = f"{self.vm_name}.ova"
-            ova_path = os.path.join(parent_dir, ova_filename)
+            ova_path = self.storage.join(parent_dir, ova_filename)
 
             logger.info(f"[OVF-EXPORT] Creating OVA archive: {ova_path}")
 
-            # Create tar archive
-            # Note: OVA is a tar file (not tar.gz) according to OVF specification
-            with tarfile.open(ova_path, 'w') as tar:
-                # OVA spec requires files in specific order:
-                # 1. .ovf file first
-                # 2. .mf file (if exists)
-                # 3. all other files (.vmdk, etc.)
-
-                # Sort files: .ovf first, then .mf, then others
-                ovf_files = [f for f in downloaded_files if f['filename'].endswith('.ovf')]
-                mf_files = [f for f in downloaded_files if f['filename'].endswith('.mf')]
-                other_files = [f for f in downloaded_files if not f['filename'].endswith(('.ovf', '.mf'))]
-
-                # Also check for .mf file in export_dir (generated separately)
-                mf_path = os.path.join(export_dir, f"{self.vm_name}.mf")
-                if os.path.exists(mf_path) and not any(f['filename'].endswith('.mf') for f in mf_files):
-                    mf_files.append({
-                        'filename': f"{self.vm_name}.mf",
-                        'path': mf_path,
-                        'size_mb': os.path.getsize(mf_path) / (1024 * 1024)
-                    })
+            # OVA spec requires files in specific order:
+            # 1. .ovf file first
+            # 2. .mf file (if exists)
+            # 3. all other files (.vmdk, etc.)
 
-                ordered_files = ovf_files + mf_files + other_files
+            # Sort files: .ovf first, then .mf, then others
+            ovf_files = [f for f in downloaded_files if f['filename'].endswith('.ovf')]
+            mf_files = [f for f in downloaded_files if f['filename'].endswith('.mf')]
+            other_files = [f for f in downloaded_files if not f['filename'].endswith(('.ovf', '.mf'))]
+
+            # Also check for .mf file in export_dir (generated separately)
+            mf_path = self.storage.join(export_dir, f"{self.vm_name}.mf")
+            if self.storage.exists(mf_path) and not any(f['filename'].endswith('.mf') for f in mf_files):
+                mf_files.append({
+                    'filename': f"{self.vm_name}.mf",
+                    'path': mf_path,
+                    'size_mb': self.storage.size(mf_path) / (1024 * 1024)
+                })
 
-                # Add files to tar in correct order
-                for file_info in ordered_files:
-                    filepath = file_info['path']
-                    filename = file_info['filename']
+            members = []
+            for file_info in ovf_files + mf_files + other_files:
+                if self.storage.exists(file_info['path']):
+                    logger.info(f"[OVF-EXPORT] Adding to OVA: {file_info['filename']}")
+                    # Add file to tar with just the filename (no directory structure)
+                    members.append((file_info['path'], file_info['filename']))
+                else:
+                    logger.warning(f"[OVF-EXPORT] File not found, skipping: {file_info['path']}")
 
-                    if os.path.exists(filepath):
-                        logger.info(f"[OVF-EXPORT] Adding to OVA: {filename}")
-                        # Add file to tar with just the filename (no directory structure)
-                        tar.add(filepath, arcname=filename)
-                    else:
-                        logger.warning(f"[OVF-EXPORT] File not found, skipping: {filepath}")
+            # Create tar archive
+            # Note: OVA is a tar file (not tar.gz) according to OVF specification
+            write_tar(self.storage, ova_path, members)
 
             # Verify OVA was created
-            if os.path.exists(ova_path):
-                ova_size_mb = os.path.getsize(ova_path) / (1024 * 1024)
+            if self.storage.exists(ova_path):
+                ova_size_mb = self.storage.size(ova_path) / (1024 * 1024)
                 logger.info(f"[OVF-EXPORT] OVA created successfully: {ova_size_mb:.2f} MB")
 
                 # Clean up OVF directory
                 logger.info(f"[OVF-EXPORT] Cleaning up OVF directory...")
-                shutil.rmtree(export_dir)
+                self.storage.delete(export_dir)
                 logger.info(f"[OVF-EXPORT] ✓ OVF directory removed, keeping only OVA file")
 
                 return ova_path
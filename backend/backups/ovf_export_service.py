@@ -9,6 +9,7 @@ import hashlib
 from datetime import datetime
 from django.utils import timezone
 
+from backups.storage_backends import backend_for_path, write_tar
 # Import the proven VMBackupService
 from backups.vm_backup_service import VMBackupService
 
@@ -31,6 +32,9 @@ class OVFExportService:
         self.export_job = export_job
         self.vm_name = vm_obj.name
 
+        # Export destination backend (filesystem or S3)
+        self.storage = backend_for_path(export_job.export_full_path)
+
     def export_ovf(self):
         """
         Export VM to OVF format
@@ -56,7 +60,7 @@ class OVFExportService:
                 logger.warning(f"[OVF-EXPORT] For best results, consolidate snapshots before export")
 
             # Create export directory
-            os.makedirs(self.export_job.export_full_path, exist_ok=True)
+            self.storage.makedirs(self.export_job.export_full_path)
             logger.info(f"[OVF-EXPORT] Export directory: {self.export_job.export_full_path}")
 
             # Step 1: Create snapshot for consistency (10% progress)
@@ -228,7 +232,7 @@ class OVFExportService:
                 # Download descriptor file (always needed for OVF)
                 logger.info(f"[OVF-EXPORT] Downloading descriptor: {descriptor_path}")
                 desc_url = f"https://{esxi_host}/folder/{descriptor_path}?dcPath={dc.name}&dsName={datastore_name}"
-                desc_dest = os.path.join(export_dir, os.path.basename(descriptor_path))
+                desc_dest = self.storage.join(export_dir, os.path.basename(descriptor_path))
 
                 self._download_file(desc_url, desc_dest, esxi_user, esxi_pass)
                 logger.info(f"[OVF-EXPORT] ✓ Descriptor downloaded")
@@ -237,7 +241,7 @@ class OVFExportService:
                 total_vmdk_size = 0
                 if flat_exists:
                     logger.info(f"[OVF-EXPORT] Downloading flat disk: {flat_file_path}")
-                    flat_dest = os.path.join(export_dir, os.path.basename(flat_file_path))
+                    flat_dest = self.storage.join(export_dir, os.path.basename(flat_file_path))
 
                     try:
                         response = requests.get(
@@ -255,7 +259,7 @@ class OVFExportService:
 
                         logger.info(f"[OVF-EXPORT] Flat file size: {total_size / (1024*1024):.2f} MB")
 
-                        with open(flat_dest, 'wb') as f:
+                        with self.storage.open_write(flat_dest, size_hint=total_size or None) as f:
                             for chunk in response.iter_content(chunk_size=8192 * 1024):  # 8MB chunks
                                 if chunk:
                                     f.write(chunk)
@@ -276,7 +280,7 @@ class OVFExportService:
                                             logger.info(f"[OVF-EXPORT] Download: {download_progress:.1f}% ({downloaded / (1024*1024):.1f} MB / {total_size / (1024*1024):.1f} MB) - Global: {global_progress}%")
                                             last_logged_progress = int(download_progress / 5) * 5
 
-                        flat_size_mb = os.path.getsize(flat_dest) / (1024 * 1024)
+                        flat_size_mb = self.storage.size(flat_dest) / (1024 * 1024)
                         logger.info(f"[OVF-EXPORT] ✓ Flat disk downloaded: {flat_size_mb:.2f} MB")
                         total_vmdk_size = flat_size_mb
 
@@ -285,7 +289,7 @@ class OVFExportService:
                         raise
                 else:
                     logger.warning(f"[OVF-EXPORT] No flat file found - disk might be thin provisioned or use different format")
-                    total_vmdk_size = os.path.getsize(desc_dest) / (1024 * 1024)
+                    total_vmdk_size = self.storage.size(desc_dest) / (1024 * 1024)
 
                 vmdk_info = {
                     'filename': descriptor_path,
@@ -313,15 +317,14 @@ class OVFExportService:
         )
         response.raise_for_status()
 
-        with open(dest_path, 'wb') as f:
-            f.write(response.content)
+        self.storage.write_bytes(dest_path, response.content)
 
         return dest_path
 
     def _save_vm_config(self):
         """Save VM configuration to JSON"""
         import json
-        config_file = os.path.join(self.export_job.export_full_path, 'vm_config.json')
+        config_file = self.storage.join(self.export_job.export_full_path, 'vm_config.json')
 
         vm_config = {
             'name': self.vm.name,
@@ -332,8 +335,7 @@ class OVFExportService:
             'version': self.vm.config.version
         }
 
-        with open(config_file, 'w') as f:
-            json.dump(vm_config, f, indent=2)
+        self.storage.write_bytes(config_file, json.dumps(vm_config, indent=2).encode('utf-8'))
 
         logger.info(f"[OVF-EXPORT] VM configuration saved: {config_file}")
 
@@ -371,8 +373,8 @@ class OVFExportService:
             vmdk_files: List of VMDK file info dicts
         """
         export_dir = self.export_job.export_full_path
-        ovf_file = os.path.join(export_dir, f"{self.vm_name}.ovf")
-        mf_file = os.path.join(export_dir, f"{self.vm_name}.mf")
+        ovf_file = self.storage.join(export_dir, f"{self.vm_name}.ovf")
+        mf_file = self.storage.join(export_dir, f"{self.vm_name}.mf")
 
         # Generate OVF descriptor
         logger.info(f"[OVF-EXPORT] Generating OVF descriptor...")
@@ -395,8 +397,8 @@ class OVFExportService:
             for idx, vmdk in enumerate(vmdk_files):
                 # Get the actual filename (basename)
                 vmdk_filename = os.path.basename(vmdk['filename'])
-                file_path = os.path.join(os.path.dirname(ovf_file), vmdk_filename)
-                file_size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+                file_info = self.storage.stat(self.storage.join(os.path.dirname(ovf_file), vmdk_filename))
+                file_size = file_info['size'] if file_info else 0
                 # Use actual VMDK file size instead of provisioned capacity
                 # This ensures the restored VM shows the real disk size, not the provisioned size
                 capacity = file_size
@@ -476,8 +478,7 @@ class OVFExportService:
 """
 
             # Write OVF file
-            with open(ovf_file, 'w', encoding='utf-8') as f:
-                f.write(ovf_content)
+            self.storage.write_bytes(ovf_file, ovf_content.encode('utf-8'))
 
             logger.info(f"[OVF-EXPORT] ✓ OVF descriptor created: {ovf_file}")
 
@@ -488,22 +489,24 @@ class OVFExportService:
     def _generate_manifest(self, export_dir, mf_file):
         """Generate manifest file with SHA256 checksums"""
         try:
-            with open(mf_file, 'w') as mf:
-                # Calculate checksum for OVF and VMDK files
-                for filename in sorted(os.listdir(export_dir)):
-                    if filename.endswith(('.ovf', '.vmdk')):
-                        file_path = os.path.join(export_dir, filename)
-                        sha256_hash = hashlib.sha256()
+            lines = []
+            # Calculate checksum for OVF and VMDK files (read-ahead while hashing)
+            for entry in self.storage.list(export_dir):
+                filename = entry['name']
+                if filename.endswith(('.ovf', '.vmdk')):
+                    file_path = self.storage.join(export_dir, filename)
+                    sha256_hash = hashlib.sha256()
+
+                    logger.info(f"[OVF-EXPORT] Calculating SHA256 for {filename}...")
 
-                        logger.info(f"[OVF-EXPORT] Calculating SHA256 for {filename}...")
+                    for chunk in self.storage.iter_chunks(file_path):
+                        sha256_hash.update(chunk)
 
-                        with open(file_path, 'rb') as f:
-                            for chunk in iter(lambda: f.read(8192 * 1024), b""):
-                                sha256_hash.update(chunk)
+                    checksum = sha256_hash.hexdigest()
+                    lines.append(f"SHA256({filename})= {checksum}\n")
+                    logger.info(f"[OVF-EXPORT] ✓ {filename}: {checksum[:16]}...")
 
-                        checksum = sha256_hash.hexdigest()
-                        mf.write(f"SHA256({filename})= {checksum}\n")
-                        logger.info(f"[OVF-EXPORT] ✓ {filename}: {checksum[:16]}...")
+            self.storage.write_bytes(mf_file, ''.join(lines).encode('utf-8'))
 
             logger.info(f"[OVF-EXPORT] ✓ Manifest created: {mf_file}")
 
@@ -513,19 +516,8 @@ class OVFExportService:
             pass
 
     def _calculate_directory_size(self, directory):
-        """Calculate total directory size in MB"""
-        # Si c'est un fichier (OVA), retourner sa taille directement
-        if os.path.isfile(directory):
-            return os.path.getsize(directory) / (1024 * 1024)
-
-        # Sinon calculer la taille du répertoire
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(directory):
-            for filename in filenames:
-                file_path = os.path.join(dirpath, filename)
-                if os.path.exists(file_path):
-                    total_size += os.path.getsize(file_path)
-
+        """Calculate total directory (or OVA file) size in MB"""
+        total_size = sum(f['size'] for f in self.storage.list_files(directory).values())
         return total_size / (1024 * 1024)
 
     def _create_ova_archive(self):
@@ -536,11 +528,9 @@ class OVFExportService:
         Returns:
             str: Path to the created OVA file
         """
-        import tarfile
-
         export_dir = self.export_job.export_full_path
         ova_filename = f"{self.vm_name}.ova"
-        ova_path = os.path.join(os.path.dirname(export_dir), ova_filename)
+        ova_path = self.storage.join(os.path.dirname(export_dir), ova_filename)
 
         logger.info(f"[OVF-EXPORT] Creating OVA archive: {ova_path}")
 
@@ -557,9 +547,9 @@ class OVFExportService:
             other_files = []
 
             # Scan directory and categorize files
-            for filename in os.listdir(export_dir):
-                file_path = os.path.join(export_dir, filename)
-                if os.path.isfile(file_path):
+            for entry in self.storage.list(export_dir):
+                filename = entry['name']
+                if not entry['is_dir']:
                     if filename.endswith('.ovf'):
                         ovf_file = filename
                     elif filename.endswith('.mf'):
@@ -581,23 +571,22 @@ class OVFExportService:
             for f in files_to_archive:
                 logger.info(f"[OVF-EXPORT]   - {f}")
 
-            # Create TAR archive
-            with tarfile.open(ova_path, 'w') as tar:
-                for filename in files_to_archive:
-                    file_path = os.path.join(export_dir, filename)
-                    file_size_mb = os.path.getsize(file_path) / (1024 * 1024)
-                    logger.info(f"[OVF-EXPORT] Adding to archive: {filename} ({file_size_mb:.2f} MB)")
+            # Create TAR archive (streamed to the destination backend)
+            members = []
+            for filename in files_to_archive:
+                file_path = self.storage.join(export_dir, filename)
+                file_size_mb = self.storage.size(file_path) / (1024 * 1024)
+                logger.info(f"[OVF-EXPORT] Adding to archive: {filename} ({file_size_mb:.2f} MB)")
 
-                    # Add file to tar with just the filename (no directory structure)
-                    tar.add(file_path, arcname=filename)
+                # Add file to tar with just the filename (no directory structure)
+                members.append((file_path, filename))
 
-            ova_size_mb = os.path.getsize(ova_path) / (1024 * 1024)
+            ova_size_mb = write_tar(self.storage, ova_path, members) / (1024 * 1024)
             logger.info(f"[OVF-EXPORT] ✓ OVA archive created: {ova_size_mb:.2f} MB")
 
             # Clean up the OVF directory (keep only the OVA file)
             logger.info(f"[OVF-EXPORT] Cleaning up OVF directory...")
-            import shutil
-            shutil.rmtree(export_dir)
+            self.storage.delete(export_dir)
             logger.info(f"[OVF-EXPORT] ✓ OVF directory removed")
 
             return ova_path
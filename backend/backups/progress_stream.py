@@ -0,0 +1,360 @@
+"""
+Diffusion temps réel de la progression des opérations (SSE)
+
+Les services (backup, export OVF, restauration, réplication, plans de reprise)
+publient leurs événements de progression ici; l'endpoint SSE /api/progress/stream
+les pousse aux navigateurs abonnés, filtrés par tenant. Les événements dont le
+tenant n'a pu être déterminé ne sont diffusés qu'aux abonnés all_tenants.
+
+EventSource ne pouvant pas envoyer d'en-têtes, le navigateur ouvre le flux avec
+un ticket à usage unique et de courte durée (issue_stream_ticket), jamais avec
+son token d'authentification.
+
+Transport:
+- Redis pub/sub (PROGRESS_STREAM_REDIS_URL) quand il est joignable: les workers
+  Celery et les processus web publient vers les processus ASGI
+- Sinon, diffusion en mémoire limitée au processus courant (exécution par threads)
+"""
+import asyncio
+import json
+import logging
+import secrets
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Statuts terminaux: toujours publiés, même si l'événement précédent est très récent
+FINAL_STATUSES = {'completed', 'success', 'error', 'failed', 'cancelled', 'partial'}
+
+GLOBAL_CHANNEL = 'global'
+
+STREAM_TICKET_PREFIX = 'progress_stream_ticket'
+
+# Objets parents portant le créateur (plan de reprise, VM, serveur ESXi)
+OWNER_PARENTS = ('plan', 'virtual_machine', 'server')
+
+
+class ProgressBroker:
+    """
+    Publication/abonnement des événements de progression
+
+    Un événement a la forme:
+        {
+            'kind': 'replication' | 'restore' | 'backup_job' | 'ovf_export' | 'vm_backup' | 'recovery_plan',
+            'id': str,
+            'tenant_id': int|None,
+            'data': {...},       # même contenu que l'endpoint de polling correspondant
+            'timestamp': iso8601
+        }
+    """
+
+    CHANNEL_PREFIX = 'progress'
+
+    def __init__(self, redis_url=None, min_interval=None):
+        """
+        Args:
+            redis_url: URL Redis pour la diffusion inter-processus (None = settings)
+            min_interval: Délai minimal en secondes entre deux événements d'une même opération
+        """
+        self.redis_url = redis_url or getattr(
+            settings, 'PROGRESS_STREAM_REDIS_URL', getattr(settings, 'CELERY_BROKER_URL', None)
+        )
+        self.min_interval = (
+            min_interval if min_interval is not None
+            else getattr(settings, 'PROGRESS_STREAM_MIN_INTERVAL_SECONDS', 0.25)
+        )
+
+        self._redis = None
+        self._redis_retry_at = 0
+        self._lock = threading.Lock()
+        self._last_published = {}  # (kind, id) -> (monotonic, status)
+        self._local_subscribers = set()  # {(loop, asyncio.Queue)}
+
+    def channel_for(self, tenant_id):
+        return f'{self.CHANNEL_PREFIX}:{tenant_id if tenant_id else GLOBAL_CHANNEL}'
+
+    def _get_redis(self):
+        """Client Redis synchrone, ou None si indisponible (nouvel essai après 30 s)"""
+        if not self.redis_url or not self.redis_url.startswith('redis'):
+            return None
+        if self._redis is not None:
+            return self._redis
+        if time.monotonic() < self._redis_retry_at:
+            return None
+        try:
+            import redis
+            client = redis.Redis.from_url(self.redis_url, socket_connect_timeout=1, socket_timeout=2)
+            client.ping()
+            self._redis = client
+            logger.info("[PROGRESS-STREAM] Diffusion via Redis pub/sub")
+        except Exception as e:
+            self._redis_retry_at = time.monotonic() + 30
+            logger.debug(f"[PROGRESS-STREAM] Redis indisponible, diffusion locale: {e}")
+        return self._redis
+
+    def _should_publish(self, key, status):
+        now = time.monotonic()
+        with self._lock:
+            previous = self._last_published.get(key)
+            if previous and status not in FINAL_STATUSES and status == previous[1]:
+                if now - previous[0] < self.min_interval:
+                    return False
+            if status in FINAL_STATUSES:
+                self._last_published.pop(key, None)
+            else:
+                self._last_published[key] = (now, status)
+        return True
+
+    def publish(self, kind, object_id, data, tenant_id=None):
+        """
+        Publie un événement de progression (ne lève jamais d'exception)
+
+        Args:
+            kind: Type d'opération
+            object_id: Identifiant de l'opération (clé utilisée par l'endpoint de polling)
+            data: Données de progression (dict sérialisable JSON)
+            tenant_id: Organisation propriétaire (None = visible des seuls abonnés all_tenants)
+        """
+        try:
+            if not self._should_publish((kind, str(object_id)), data.get('status')):
+                return
+
+            event = {
+                'kind': kind,
+                'id': str(object_id),
+                'tenant_id': tenant_id,
+                'data': data,
+                'timestamp': timezone.now().isoformat()
+            }
+
+            client = self._get_redis()
+            if client is not None:
+                try:
+                    client.publish(self.channel_for(tenant_id), json.dumps(event, default=str))
+                    return
+                except Exception as e:
+                    logger.warning(f"[PROGRESS-STREAM] Échec publication Redis, diffusion locale: {e}")
+                    self._redis = None
+                    self._redis_retry_at = time.monotonic() + 30
+
+            self._publish_local(event)
+        except Exception as e:
+            logger.debug(f"[PROGRESS-STREAM] Publication ignorée: {e}")
+
+    def _publish_local(self, event):
+        with self._lock:
+            subscribers = list(self._local_subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self._offer, queue, event)
+            except RuntimeError:
+                # Boucle fermée: l'abonné a disparu
+                with self._lock:
+                    self._local_subscribers.discard((loop, queue))
+
+    @staticmethod
+    def _offer(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Abonné trop lent: l'événement suivant de la même opération le remplacera
+            pass
+
+    @staticmethod
+    def is_visible(event, tenant_id, all_tenants=False):
+        """Un abonné voit les événements de son tenant (tous avec all_tenants)"""
+        if all_tenants:
+            return True
+        event_tenant = event.get('tenant_id')
+        # Comparaison en texte: l'UUID est sérialisé en chaîne via Redis
+        return bool(tenant_id) and event_tenant is not None and str(event_tenant) == str(tenant_id)
+
+    async def subscribe(self, tenant_id=None, all_tenants=False, heartbeat_seconds=15):
+        """
+        Générateur asynchrone d'événements pour un abonné
+
+        Produit None toutes les heartbeat_seconds sans événement (keep-alive SSE).
+
+        Args:
+            tenant_id: Organisation de l'abonné
+            all_tenants: True pour un superutilisateur sans tenant sélectionné
+        """
+        if not all_tenants and not tenant_id:
+            # Aucun tenant: aucun événement visible, keep-alive seulement
+            while True:
+                await asyncio.sleep(heartbeat_seconds)
+                yield None
+
+        if self._get_redis() is not None:
+            async for event in self._subscribe_redis(tenant_id, all_tenants, heartbeat_seconds):
+                yield event
+            return
+
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=1000)
+        subscriber = (loop, queue)
+        with self._lock:
+            self._local_subscribers.add(subscriber)
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if self.is_visible(event, tenant_id, all_tenants):
+                    yield event
+        finally:
+            with self._lock:
+                self._local_subscribers.discard(subscriber)
+
+    async def _subscribe_redis(self, tenant_id, all_tenants, heartbeat_seconds):
+        import redis.asyncio as aioredis
+
+        client = aioredis.Redis.from_url(self.redis_url)
+        pubsub = client.pubsub()
+        try:
+            if all_tenants:
+                await pubsub.psubscribe(f'{self.CHANNEL_PREFIX}:*')
+            else:
+                await pubsub.subscribe(self.channel_for(tenant_id))
+
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=heartbeat_seconds)
+                if message is None:
+                    yield None
+                    continue
+                try:
+                    yield json.loads(message['data'])
+                except (TypeError, ValueError):
+                    continue
+        finally:
+            await (pubsub.aclose() if hasattr(pubsub, 'aclose') else pubsub.close())
+            await (client.aclose() if hasattr(client, 'aclose') else client.close())
+
+
+# Instance globale du broker (une par processus)
+progress_broker = ProgressBroker()
+
+
+def publish_progress(kind, object_id, data, tenant_id=None):
+    """Raccourci: publie un événement de progression via le broker global"""
+    progress_broker.publish(kind, object_id, data, tenant_id=tenant_id)
+
+
+def tenant_for_user(user):
+    """
+    Organisation d'un utilisateur pour le filtrage des événements
+
+    S'appuie sur le cache des contextes tenant (tenants.context_cache), invalidé
+    par signaux: aucune requête par événement en régime établi.
+
+    Args:
+        user: Instance User, ID utilisateur ou None
+
+    Returns:
+        UUID ou None
+    """
+    if user is None:
+        return None
+    if not isinstance(user, int) and getattr(user, 'id', None) is None:
+        return None
+
+    from tenants.context_cache import get_tenant_context
+
+    try:
+        return get_tenant_context(user)['organization_id']
+    except Exception:
+        return None
+
+
+def tenant_for_owner(owner):
+    """
+    Organisation propriétaire d'un objet
+
+    Créateur de l'objet, sinon celui de son parent (plan de reprise, VM puis
+    serveur ESXi): une réplication est rattachée au créateur du serveur de sa VM.
+
+    Args:
+        owner: Instance de modèle (job, réplication, exécution de plan, VM, serveur) ou None
+
+    Returns:
+        UUID ou None
+    """
+    while owner is not None:
+        created_by_id = getattr(owner, 'created_by_id', None)
+        if created_by_id:
+            return tenant_for_user(created_by_id)
+        owner = next(
+            (getattr(owner, parent) for parent in OWNER_PARENTS if getattr(owner, f'{parent}_id', None)),
+            None
+        )
+    return None
+
+
+def issue_stream_ticket(user, organization_id=None):
+    """
+    Crée un ticket d'ouverture du flux SSE (usage unique, PROGRESS_STREAM_TICKET_SECONDS)
+
+    Args:
+        user: Utilisateur authentifié
+        organization_id: Organisation à suivre (optionnel)
+
+    Returns:
+        str: Ticket à passer en paramètre ?ticket=
+    """
+    from django.core.cache import cache
+
+    ticket = secrets.token_urlsafe(32)
+    cache.set(
+        f'{STREAM_TICKET_PREFIX}:{ticket}',
+        {'user_id': user.id, 'organization_id': str(organization_id) if organization_id else None},
+        timeout=getattr(settings, 'PROGRESS_STREAM_TICKET_SECONDS', 30)
+    )
+    return ticket
+
+
+def consume_stream_ticket(ticket):
+    """
+    Consomme un ticket d'ouverture du flux SSE
+
+    Le premier appel qui supprime la clé l'emporte: un ticket rejoué ou expiré est refusé.
+
+    Returns:
+        dict: {'user_id', 'organization_id'} ou None
+    """
+    from django.core.cache import cache
+
+    if not ticket:
+        return None
+    key = f'{STREAM_TICKET_PREFIX}:{ticket}'
+    payload = cache.get(key)
+    if payload is None or not cache.delete(key):
+        return None
+    return payload
+
+
+def set_progress(kind, object_id, data, timeout=3600, user=None, tenant_id=None, owner=None):
+    """
+    Enregistre la progression dans le cache (endpoint de polling, clé {kind}_progress_{id})
+    et la publie sur le flux SSE
+
+    Args:
+        kind: 'restore', 'replication', ...
+        object_id: Identifiant de l'opération
+        data: Données de progression
+        timeout: Durée de conservation dans le cache
+        user: Utilisateur déclencheur (sert à déterminer le tenant si tenant_id est absent)
+        tenant_id: Organisation propriétaire
+        owner: Objet concerné (tenant de son créateur si ni tenant_id ni user n'en donnent un)
+    """
+    from django.core.cache import cache
+
+    cache.set(f'{kind}_progress_{object_id}', data, timeout=timeout)
+    if tenant_id is None:
+        tenant_id = tenant_for_user(user) or tenant_for_owner(owner)
+    publish_progress(kind, object_id, data, tenant_id=tenant_id)
@@ -0,0 +1,350 @@
+"""
+Exécution des plans de reprise d'activité (failover de site)
+
+Les paliers (tiers) sont exécutés dans l'ordre croissant; toutes les VMs d'un
+palier basculent en parallèle. Un élément dont une dépendance n'a pas basculé
+avec succès est ignoré. Le RTO mesuré et la durée de chaque palier sont
+enregistrés sur l'exécution, la progression agrégée est publiée dans le cache.
+"""
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from backups.models import FailoverEvent, RecoveryPlanExecution
+from backups.progress_stream import set_progress
+
+logger = logging.getLogger(__name__)
+
+SUCCESS = 'success'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class RecoveryPlanExecutor:
+    """
+    Exécuteur de plan de reprise
+
+    Le ReplicationService est injectable: execute_failover(failover_event, test_mode,
+    source_reachable) est le seul appel vSphere effectué, ce qui permet d'exécuter un
+    plan contre un vSphere simulé. Les hôtes source sont sondés une seule fois par
+    exécution (host_health_probe): une source hors ligne n'est pas recontactée VM par VM.
+    """
+
+    PROGRESS_CACHE_PREFIX = 'recovery_plan_progress'
+
+    def __init__(self, service=None, max_parallel=None):
+        """
+        Args:
+            service: ReplicationService (par défaut: service partageant le pool de sessions)
+            max_parallel: Surcharge du nombre de VMs démarrées simultanément par palier
+        """
+        if service is None:
+            from backups.replication_service import ReplicationService
+            from esxi.session_pool import session_pool
+            service = ReplicationService(session_pool=session_pool)
+        self.service = service
+        self.max_parallel = max_parallel
+
+    @staticmethod
+    def validate_plan(plan):
+        """
+        Vérifie la cohérence des paliers et dépendances d'un plan
+
+        Une dépendance doit appartenir au même plan et à un palier strictement inférieur
+        (ce qui exclut aussi les cycles).
+
+        Returns:
+            list: Messages d'erreur (vide si le plan est valide)
+        """
+        errors = []
+        items = list(plan.items.select_related('replication__virtual_machine').prefetch_related('depends_on'))
+        if not items:
+            errors.append("Le plan ne contient aucune réplication")
+
+        for item in items:
+            vm_name = item.replication.virtual_machine.name
+            for dependency in item.depends_on.all():
+                if dependency.plan_id != plan.id:
+                    errors.append(f"{vm_name}: dépendance hors du plan (élément {dependency.id})")
+                elif dependency.tier >= item.tier:
+                    errors.append(
+                        f"{vm_name} (palier {item.tier}) dépend d'un élément du palier {dependency.tier}"
+                    )
+        return errors
+
+    @staticmethod
+    def build_tiers(items):
+        """
+        Regroupe les éléments par palier, dans l'ordre croissant
+
+        Returns:
+            OrderedDict: {tier: [RecoveryPlanItem, ...]}
+        """
+        tiers = OrderedDict()
+        for item in sorted(items, key=lambda i: (i.tier, i.id)):
+            tiers.setdefault(item.tier, []).append(item)
+        return tiers
+
+    @classmethod
+    def get_progress(cls, execution_id):
+        """Progression agrégée d'une exécution (None si inconnue ou expirée)"""
+        return cache.get(f'{cls.PROGRESS_CACHE_PREFIX}_{execution_id}')
+
+    def _publish_progress(self, execution, state):
+        done = state['succeeded'] + state['failed'] + state['skipped']
+        elapsed = time.monotonic() - state['started_monotonic']
+        set_progress('recovery_plan', execution.id, {
+            'execution_id': execution.id,
+            'plan': execution.plan.name,
+            'status': state['status'],
+            'current_tier': state['current_tier'],
+            'total_tiers': state['total_tiers'],
+            'total_vms': state['total_vms'],
+            'completed_vms': done,
+            'succeeded_vms': state['succeeded'],
+            'failed_vms': state['failed'],
+            'skipped_vms': state['skipped'],
+            'progress': int(done * 100 / state['total_vms']) if state['total_vms'] else 100,
+            'elapsed_seconds': round(elapsed, 1),
+            'target_rto_seconds': execution.target_rto_minutes * 60,
+            'updated_at': timezone.now().isoformat()
+        }, timeout=3600 * 6, user=execution.triggered_by_id, owner=execution.plan)
+
+    @staticmethod
+    def probe_sources(items):
+        """
+        Sonde chaque hôte source distinct du plan une seule fois
+
+        Returns:
+            dict: {server_id: bool joignable}
+        """
+        from backups.host_health_probe import host_health_probe
+
+        servers = [item.replication.get_source_server for item in items]
+        snapshots = host_health_probe.get_snapshots(servers)
+        for snapshot in snapshots.values():
+            if not snapshot['reachable']:
+                logger.warning(
+                    f"[RECOVERY-PLAN] Source {snapshot['hostname']} hors ligne: "
+                    f"aucun arrêt côté source pour ses VMs ({snapshot['error']})"
+                )
+        return {server_id: snapshot['reachable'] for server_id, snapshot in snapshots.items()}
+
+    def _failover_item(self, execution, item, source_reachable=True):
+        """Bascule une VM du plan; retourne le résultat pour le rapport de palier"""
+        replication = item.replication
+        vm_name = replication.virtual_machine.name
+        started = time.monotonic()
+
+        close_old_connections()
+        try:
+            failover_event = FailoverEvent.objects.create(
+                replication=replication,
+                failover_type='test' if execution.test_mode else 'manual',
+                status='initiated',
+                triggered_by=execution.triggered_by,
+                reason=f"Plan de reprise: {execution.plan.name} (palier {item.tier})",
+                recovery_execution=execution
+            )
+            result = self.service.execute_failover(
+                failover_event,
+                test_mode=execution.test_mode,
+                source_reachable=source_reachable
+            )
+            status = SUCCESS if result.get('success') else FAILED
+            error = result.get('error')
+        except Exception as e:
+            logger.error(f"[RECOVERY-PLAN] Erreur failover {vm_name}: {e}", exc_info=True)
+            status, error = FAILED, str(e)
+        finally:
+            close_old_connections()
+
+        return {
+            'item_id': item.id,
+            'replication_id': replication.id,
+            'vm_name': vm_name,
+            'status': status,
+            'duration_seconds': round(time.monotonic() - started, 1),
+            'error': error
+        }
+
+    def _skipped_item(self, item, reason):
+        return {
+            'item_id': item.id,
+            'replication_id': item.replication_id,
+            'vm_name': item.replication.virtual_machine.name,
+            'status': SKIPPED,
+            'duration_seconds': 0,
+            'error': reason
+        }
+
+    def execute(self, execution):
+        """
+        Exécute un plan de reprise
+
+        Args:
+            execution: Instance RecoveryPlanExecution (status 'pending')
+
+        Returns:
+            dict: {'success': bool, 'message': str, 'rto_seconds': float, 'rto_met': bool, 'tiers': [...]}
+        """
+        plan = execution.plan
+        items = list(
+            plan.items.select_related(
+                'replication__virtual_machine__server',
+                'replication__source_server',
+                'replication__destination_server'
+            ).prefetch_related('depends_on')
+        )
+        tiers = self.build_tiers(items)
+        max_parallel = max(1, self.max_parallel or plan.max_parallel_per_tier)
+
+        logger.info(
+            f"[RECOVERY-PLAN] Démarrage plan '{plan.name}': {len(items)} VM(s), {len(tiers)} palier(s), "
+            f"RTO cible {execution.target_rto_minutes} min{' (mode test)' if execution.test_mode else ''}"
+        )
+
+        execution.status = 'running'
+        execution.total_vms = len(items)
+        execution.save(update_fields=['status', 'total_vms'])
+
+        state = {
+            'status': 'running',
+            'current_tier': None,
+            'total_tiers': len(tiers),
+            'total_vms': len(items),
+            'succeeded': 0,
+            'failed': 0,
+            'skipped': 0,
+            'started_monotonic': time.monotonic()
+        }
+        self._publish_progress(execution, state)
+
+        outcomes = {}  # item_id -> SUCCESS/FAILED/SKIPPED
+        tier_report = []
+
+        try:
+            sources_reachable = self.probe_sources(items)
+
+            for tier, tier_items in tiers.items():
+                state['current_tier'] = tier
+                tier_started_at = timezone.now()
+                tier_started = time.monotonic()
+                self._publish_progress(execution, state)
+
+                runnable = []
+                results = []
+                for item in tier_items:
+                    blocking = [d for d in item.depends_on.all() if outcomes.get(d.id) != SUCCESS]
+                    if blocking:
+                        names = ', '.join(str(d.id) for d in blocking)
+                        results.append(self._skipped_item(item, f"Dépendance(s) non basculée(s): {names}"))
+                    else:
+                        runnable.append(item)
+
+                logger.info(f"[RECOVERY-PLAN] Palier {tier}: {len(runnable)} VM(s) à démarrer en parallèle")
+
+                if runnable:
+                    with ThreadPoolExecutor(
+                        max_workers=min(max_parallel, len(runnable)),
+                        thread_name_prefix=f'recovery-tier-{tier}'
+                    ) as executor:
+                        futures = [
+                            executor.submit(
+                                self._failover_item,
+                                execution,
+                                item,
+                                sources_reachable.get(item.replication.get_source_server.id, True)
+                            )
+                            for item in runnable
+                        ]
+                        for future in futures:
+                            result = future.result()
+                            results.append(result)
+                            state['succeeded' if result['status'] == SUCCESS else 'failed'] += 1
+                            outcomes[result['item_id']] = result['status']
+                            self._publish_progress(execution, state)
+
+                for result in results:
+                    if result['status'] == SKIPPED:
+                        state['skipped'] += 1
+                        outcomes[result['item_id']] = SKIPPED
+
+                tier_duration = time.monotonic() - tier_started
+                tier_report.append({
+                    'tier': tier,
+                    'vm_count': len(tier_items),
+                    'succeeded': sum(1 for r in results if r['status'] == SUCCESS),
+                    'failed': sum(1 for r in results if r['status'] == FAILED),
+                    'skipped': sum(1 for r in results if r['status'] == SKIPPED),
+                    'started_at': tier_started_at.isoformat(),
+                    'duration_seconds': round(tier_duration, 1),
+                    'vms': sorted(results, key=lambda r: r['item_id'])
+                })
+                logger.info(f"[RECOVERY-PLAN] Palier {tier} terminé en {tier_duration:.1f}s")
+
+                execution.tier_report = tier_report
+                execution.save(update_fields=['tier_report'])
+
+        except Exception as e:
+            logger.error(f"[RECOVERY-PLAN] Erreur exécution plan '{plan.name}': {e}", exc_info=True)
+            execution.error_message = str(e)
+
+        rto_seconds = time.monotonic() - state['started_monotonic']
+        all_ok = state['succeeded'] == len(items) and not execution.error_message
+
+        if all_ok:
+            status = 'completed'
+        elif state['succeeded']:
+            status = 'partial'
+        else:
+            status = 'failed'
+
+        execution.status = status
+        execution.rto_seconds = round(rto_seconds, 1)
+        execution.rto_met = all_ok and rto_seconds <= execution.target_rto_minutes * 60
+        execution.succeeded_vms = state['succeeded']
+        execution.failed_vms = state['failed']
+        execution.skipped_vms = state['skipped']
+        execution.tier_report = tier_report
+        execution.completed_at = timezone.now()
+        execution.save()
+
+        state['status'] = status
+        self._publish_progress(execution, state)
+
+        message = (
+            f"Plan '{plan.name}' {execution.get_status_display().lower()}: "
+            f"{state['succeeded']}/{len(items)} VM(s) en {rto_seconds:.0f}s "
+            f"(RTO cible {execution.target_rto_minutes * 60}s, {'atteint' if execution.rto_met else 'non atteint'})"
+        )
+        logger.info(f"[RECOVERY-PLAN] {message}")
+
+        return {
+            'success': all_ok,
+            'message': message,
+            'rto_seconds': execution.rto_seconds,
+            'rto_met': execution.rto_met,
+            'tiers': tier_report
+        }
+
+
+def start_recovery_plan(plan, triggered_by=None, test_mode=False):
+    """
+    Crée une exécution de plan de reprise (à lancer ensuite avec RecoveryPlanExecutor.execute)
+
+    Returns:
+        RecoveryPlanExecution
+    """
+    return RecoveryPlanExecution.objects.create(
+        plan=plan,
+        status='pending',
+        test_mode=test_mode,
+        triggered_by=triggered_by,
+        target_rto_minutes=plan.target_rto_minutes
+    )
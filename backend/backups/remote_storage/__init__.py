@@ -4,5 +4,6 @@ Support SMB/CIFS et NFS
 """
 
 from .storage_manager import RemoteStorageManager
+from .mount_manager import StorageMountManager, mount_manager
 
-__all__ = ['RemoteStorageManager']
+__all__ = ['RemoteStorageManager', 'StorageMountManager', 'mount_manager']
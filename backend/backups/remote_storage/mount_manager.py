@@ -0,0 +1,352 @@
+"""
+Storage Mount Manager - Montages persistants des stockages distants
+
+RemoteStorageManager.connect() enchaîne à chaque appel les tests de
+connectivité, d'authentification, d'écriture et d'espace libre (plusieurs
+secondes, appels à mount / net use / smbclient). Le gestionnaire de montages
+garde les cibles montées et vérifiées pour tous les jobs:
+
+- acquire / release (ou mounted()): un job prend une référence sur le montage;
+  la vérification complète n'est refaite que si elle date de plus de
+  STORAGE_MOUNT_VERIFY_SECONDS ou si le montage a été vu en échec;
+- release ne démonte pas: le montage reste en place pour les jobs suivants;
+- check_all (tâche check_storage_mounts): sonde de latence légère à chaque
+  intervalle, remontage et vérification complète si besoin, mesure du débit
+  d'écriture (partagée avec backups.storage_placement), démontage des
+  configurations désactivées qui n'ont plus de référence.
+
+L'état et le nombre de références sont dans le cache Django: ils ne sont
+partagés entre le processus web et les workers Celery qu'avec un cache commun
+(Redis, CACHES dans settings; un cache LocMem est refusé hors DEBUG par le check
+backups.E001). Avec un cache propre au processus, status_all ne verrait jamais
+l'état écrit par check_all et check_all pourrait démonter une cible encore
+référencée par un autre processus. Les montages NFS et les sessions SMB restent
+propres à l'hôte (_is_fresh revérifie le chemin local).
+"""
+import logging
+import os
+import platform
+import socket
+import subprocess
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from backups.storage_backends import backend_for_config
+
+from .storage_manager import RemoteStorageManager, StorageConnectionError
+
+logger = logging.getLogger(__name__)
+
+
+class StorageMountManager:
+    """
+    Montages partagés et vérifiés des RemoteStorageConfig
+    """
+
+    STATE_PREFIX = 'storage_mount'
+    REFS_PREFIX = 'storage_mount_refs'
+    LOCK_PREFIX = 'storage_mount:lock'
+
+    # ------------------------------------------------------------------
+    # État partagé
+    # ------------------------------------------------------------------
+    def state(self, config):
+        """Dernier état connu du montage (None si jamais vérifié)"""
+        return cache.get(f'{self.STATE_PREFIX}:{config.id}')
+
+    def _save_state(self, config, state):
+        cache.set(f'{self.STATE_PREFIX}:{config.id}', state, timeout=None)
+
+    def references(self, config):
+        """Nombre de jobs qui utilisent le montage"""
+        return cache.get(f'{self.REFS_PREFIX}:{config.id}') or 0
+
+    @contextmanager
+    def _lock(self, config, wait_seconds=60):
+        """Une seule vérification / un seul montage à la fois par cible"""
+        key = f'{self.LOCK_PREFIX}:{config.id}'
+        deadline = time.monotonic() + wait_seconds
+        acquired = cache.add(key, 1, timeout=120)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(0.1)
+            acquired = cache.add(key, 1, timeout=120)
+        if not acquired:
+            logger.warning(f"[STORAGE-MOUNT] Verrou {config.name} non obtenu, vérification sans verrou")
+        try:
+            yield
+        finally:
+            if acquired:
+                cache.delete(key)
+
+    # ------------------------------------------------------------------
+    # Montage
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _mount_root(config):
+        """Point de montage NFS (chemin de la configuration sans base_path)"""
+        return f"/mnt/{config.host.replace('.', '_')}_{config.share_name}"
+
+    def _mount(self, config):
+        """
+        Monte la cible si elle ne l'est pas déjà
+
+        - NFS: mount -t nfs host:/share sur /mnt/host_share
+        - SMB sous Windows: session net use sur le partage UNC
+        - SMB sous Linux, local, S3: pas de montage (le chemin est utilisé tel quel)
+
+        Returns:
+            bool: True si le gestionnaire a créé le montage
+        """
+        if config.protocol == 'nfs':
+            root = self._mount_root(config)
+            if os.path.ismount(root):
+                return False
+            os.makedirs(root, exist_ok=True)
+            options = getattr(settings, 'STORAGE_NFS_MOUNT_OPTIONS', 'rw,hard')
+            export = f"{config.host}:/{config.share_name.lstrip('/')}"
+            result = subprocess.run(
+                ['mount', '-t', 'nfs', '-o', options, export, root],
+                capture_output=True, text=True, timeout=60
+            )
+            if result.returncode != 0:
+                raise StorageConnectionError(
+                    f"Échec montage NFS {export}: {result.stderr.strip() or result.stdout.strip()}"
+                )
+            logger.info(f"[STORAGE-MOUNT] {export} monté sur {root}")
+            return True
+
+        if config.protocol == 'smb' and platform.system() == 'Windows':
+            return RemoteStorageManager(config).test_authentication()
+        return False
+
+    def _unmount(self, config):
+        """Démonte une cible montée par le gestionnaire"""
+        try:
+            if config.protocol == 'nfs':
+                subprocess.run(['umount', self._mount_root(config)], capture_output=True, timeout=60)
+            else:
+                RemoteStorageManager(config).disconnect()
+            logger.info(f"[STORAGE-MOUNT] {config.name} démonté")
+        except Exception as e:
+            logger.warning(f"[STORAGE-MOUNT] Erreur démontage de {config.name}: {e}")
+
+    # ------------------------------------------------------------------
+    # Sondes
+    # ------------------------------------------------------------------
+    @staticmethod
+    def probe_latency(config, timeout=5):
+        """
+        Sonde légère: connexion TCP au serveur et stat du chemin (HEAD du
+        bucket pour S3)
+
+        Returns:
+            dict: {'tcp_ms', 'stat_ms', 'ok', 'error'}
+        """
+        result = {'tcp_ms': None, 'stat_ms': None, 'ok': False, 'error': None}
+        try:
+            if config.protocol != 'local':
+                start = time.monotonic()
+                with socket.create_connection((config.host, config.port), timeout=timeout):
+                    pass
+                result['tcp_ms'] = round((time.monotonic() - start) * 1000, 1)
+
+            start = time.monotonic()
+            if not backend_for_config(config).is_available(config.get_full_path()):
+                raise StorageConnectionError(f"Chemin inaccessible: {config.get_full_path()}")
+            result['stat_ms'] = round((time.monotonic() - start) * 1000, 1)
+            result['ok'] = True
+        except Exception as e:
+            result['error'] = str(e)
+        return result
+
+    @staticmethod
+    def probe_throughput(config):
+        """
+        Débit d'écriture de la cible (sonde de backups.storage_placement)
+
+        Le résultat est gardé par storage_placement sous la clé de la cible
+        'remote:{id}' et utilisé pour le placement.
+
+        Returns:
+            dict: {'free_bytes', 'write_mbps', 'probed_at', 'error'}
+        """
+        from backups.storage_capacity import storage_capacity
+        from backups.storage_placement import storage_placement
+
+        return storage_placement.probe(storage_capacity.target_for_remote_storage(config))
+
+    # ------------------------------------------------------------------
+    # Vérification
+    # ------------------------------------------------------------------
+    def verify(self, config, force=False):
+        """
+        Monte et vérifie la cible (RemoteStorageManager.connect, test
+        d'écriture seul pour un stockage local)
+
+        Sans force, un montage sain vérifié depuis moins de
+        STORAGE_MOUNT_VERIFY_SECONDS et dont le chemin est accessible est
+        réutilisé sans nouveau test.
+
+        Returns:
+            dict: État du montage
+        """
+        ttl = getattr(settings, 'STORAGE_MOUNT_VERIFY_SECONDS', 600)
+        state = self.state(config)
+        if not force and self._is_fresh(config, state, ttl):
+            return state
+
+        with self._lock(config):
+            # Un autre processus a pu vérifier pendant l'attente du verrou
+            state = self.state(config)
+            if not force and self._is_fresh(config, state, ttl):
+                return state
+
+            state = dict(state or {}, path=config.get_full_path())
+            try:
+                state['mounted_by_manager'] = self._mount(config) or state.get('mounted_by_manager', False)
+                manager = RemoteStorageManager(config)
+                if config.protocol == 'local':
+                    manager.test_write_permissions()
+                else:
+                    manager.connect()
+                state.update(healthy=True, error=None)
+                state['latency'] = self.probe_latency(config)
+                state['write_mbps'] = self.probe_throughput(config).get('write_mbps')
+            except Exception as e:
+                state.update(healthy=False, error=str(e))
+                logger.error(f"[STORAGE-MOUNT] Vérification de {config.name} en échec: {e}")
+            state['verified_at'] = time.time()
+            self._save_state(config, state)
+
+        type(config).objects.filter(id=config.id).update(
+            last_test_at=timezone.now(),
+            last_test_success=state['healthy'],
+            last_test_message=state['error'] or "Montage vérifié",
+        )
+        return state
+
+    @staticmethod
+    def _is_fresh(config, state, ttl):
+        return bool(
+            state and state.get('healthy')
+            and time.time() - state.get('verified_at', 0) < ttl
+            and backend_for_config(config).is_available(config.get_full_path())
+        )
+
+    # ------------------------------------------------------------------
+    # Références des jobs
+    # ------------------------------------------------------------------
+    def acquire(self, config):
+        """
+        Prend une référence sur le montage d'une cible (montée et vérifiée)
+
+        Returns:
+            str: Chemin de la cible
+
+        Raises:
+            StorageConnectionError: Si la cible n'est pas utilisable
+        """
+        state = self.verify(config)
+        if not state.get('healthy'):
+            raise StorageConnectionError(f"Stockage {config.name} indisponible: {state.get('error')}")
+
+        key = f'{self.REFS_PREFIX}:{config.id}'
+        # Les références d'un processus tué expirent avec la durée maximale d'un transfert
+        cache.add(key, 0, timeout=getattr(settings, 'TRANSFER_TIME_LIMIT_MAX_SECONDS', 48 * 3600))
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=getattr(settings, 'TRANSFER_TIME_LIMIT_MAX_SECONDS', 48 * 3600))
+        return state['path']
+
+    def release(self, config):
+        """Rend la référence d'un job (le montage reste en place)"""
+        key = f'{self.REFS_PREFIX}:{config.id}'
+        try:
+            if cache.decr(key) < 0:
+                cache.set(key, 0, timeout=getattr(settings, 'TRANSFER_TIME_LIMIT_MAX_SECONDS', 48 * 3600))
+        except ValueError:
+            pass
+
+    @contextmanager
+    def mounted(self, config):
+        """Contexte d'utilisation d'une cible: with mount_manager.mounted(config) as path"""
+        path = self.acquire(config)
+        try:
+            yield path
+        finally:
+            self.release(config)
+
+    # ------------------------------------------------------------------
+    # Contrôle périodique
+    # ------------------------------------------------------------------
+    def check(self, config):
+        """
+        Contrôle d'une cible: sonde de latence, vérification complète si la
+        sonde échoue ou si la dernière vérification a expiré
+
+        Returns:
+            dict: État du montage
+        """
+        latency = self.probe_latency(config)
+        state = self.state(config)
+        if latency['ok'] and state and state.get('healthy'):
+            state['latency'] = latency
+            self._save_state(config, state)
+        if not latency['ok']:
+            logger.warning(f"[STORAGE-MOUNT] Sonde de {config.name} en échec: {latency['error']}, remontage")
+        return self.verify(config, force=not latency['ok'])
+
+    def check_all(self):
+        """
+        Contrôle toutes les cibles actives et démonte les cibles désactivées
+        qui n'ont plus de référence
+
+        Returns:
+            dict: {nom: {'healthy', 'error', 'references'}}
+        """
+        from backups.models import RemoteStorageConfig
+
+        results = {}
+        for config in RemoteStorageConfig.objects.all():
+            if config.is_active:
+                state = self.check(config)
+                results[config.name] = {
+                    'healthy': state.get('healthy'),
+                    'error': state.get('error'),
+                    'references': self.references(config),
+                }
+                continue
+
+            state = self.state(config)
+            if state and not self.references(config):
+                if state.get('mounted_by_manager'):
+                    self._unmount(config)
+                cache.delete(f'{self.STATE_PREFIX}:{config.id}')
+        return results
+
+    def status(self, config):
+        """État du montage et références (sans sonde)"""
+        return dict(self.state(config) or {'healthy': None}, references=self.references(config))
+
+    def status_all(self, created_by_ids=None):
+        """
+        État des montages des cibles actives (lecture du cache partagé seulement)
+
+        Args:
+            created_by_ids: Limite aux cibles créées par ces utilisateurs (None = toutes)
+        """
+        from backups.models import RemoteStorageConfig
+
+        configs = RemoteStorageConfig.objects.filter(is_active=True)
+        if created_by_ids is not None:
+            configs = configs.filter(created_by_id__in=created_by_ids)
+        return {config.name: self.status(config) for config in configs}
+
+
+# Instance globale
+mount_manager = StorageMountManager()
@@ -1,6 +1,6 @@
 """
 Remote Storage Manager - Gestion professionnelle du stockage distant
-Support SMB/CIFS avec authentification sécurisée
+Support SMB/CIFS, NFS et S3 avec authentification sécurisée
 """
 
 import os
@@ -38,6 +38,9 @@ class RemoteStorageManager:
     - Calcul espace disponible
     - Montage automatique SMB/NFS
     - Gestion des credentials
+
+    Les jobs passent par mount_manager (montage partagé, vérifié
+    périodiquement) plutôt que par connect()/disconnect() à chaque usage.
     """
 
     def __init__(self, storage_config):
@@ -154,6 +157,8 @@ class RemoteStorageManager:
             return self._test_smb_authentication()
         elif self.protocol == 'nfs':
             return self._test_nfs_authentication()
+        elif self.protocol == 's3':
+            return self._test_s3_authentication()
         elif self.protocol == 'local':
             return True  # Pas d'auth pour local
 
@@ -294,6 +299,17 @@ class RemoteStorageManager:
         logger.info(f"[STORAGE] ✓ Point de montage NFS accessible: {mount_point}")
         return True
 
+    def _test_s3_authentication(self) -> bool:
+        """Test des clés d'accès: HEAD du bucket"""
+        from backups.storage_backends import backend_for_config
+
+        if not backend_for_config(self.config).is_available(self.get_base_path()):
+            raise StorageAuthenticationError(
+                f"Bucket {self.share_name} inaccessible (clés d'accès, région ou endpoint)"
+            )
+        logger.info(f"[STORAGE] ✓ Bucket S3 accessible: {self.share_name}")
+        return True
+
     def test_write_permissions(self) -> bool:
         """
         Teste les permissions d'écriture sur le stockage
@@ -309,6 +325,9 @@ class RemoteStorageManager:
 
         logger.info(f"[STORAGE] Test permissions d'écriture sur {base_path}...")
 
+        if self.protocol == 's3':
+            return self._test_s3_write_permissions(base_path)
+
         try:
             # Créer les dossiers si nécessaire
             os.makedirs(base_path, exist_ok=True)
@@ -342,14 +361,37 @@ class RemoteStorageManager:
             logger.error(f"[STORAGE] ✗ {error_msg}")
             raise StoragePermissionError(error_msg)
 
+    def _test_s3_write_permissions(self, base_path: str) -> bool:
+        """Écriture, relecture et suppression d'un objet test"""
+        from backups.storage_backends import backend_for_config
+
+        backend = backend_for_config(self.config)
+        test_key = backend.join(base_path, '.write_test_esxi_backup')
+        try:
+            backend.write_bytes(test_key, b'test write permission')
+            if backend.read_bytes(test_key) != b'test write permission':
+                raise StoragePermissionError("Contenu objet test incorrect")
+            backend.delete(test_key)
+        except StoragePermissionError:
+            raise
+        except Exception as e:
+            error_msg = f"Erreur lors du test d'écriture S3: {e}"
+            logger.error(f"[STORAGE] ✗ {error_msg}")
+            raise StoragePermissionError(error_msg)
+
+        logger.info("[STORAGE] ✓ Permissions d'écriture validées")
+        return True
+
     def get_available_space(self) -> int:
         """
         Calcule l'espace disponible sur le stockage
 
         Returns:
-            int: Espace disponible en bytes
+            int: Espace disponible en bytes (0 si non mesurable: S3)
         """
         base_path = self.get_base_path()
+        if self.protocol == 's3':
+            return 0
 
         try:
             if platform.system() == 'Windows':
@@ -405,7 +447,7 @@ class RemoteStorageManager:
                 raise StorageConnectionError(f"Échec tests connectivité: {errors}")
 
             # 2. Test authentification
-            if self.protocol in ['smb', 'nfs']:
+            if self.protocol in ['smb', 'nfs', 's3']:
                 auth_success = self.test_authentication()
                 if not auth_success:
                     raise StorageAuthenticationError("Échec authentification")
@@ -413,9 +455,9 @@ class RemoteStorageManager:
             # 3. Test permissions
             self.test_write_permissions()
 
-            # 4. Vérifier espace disponible
+            # 4. Vérifier espace disponible (pas de limite en stockage objet)
             available_space = self.get_available_space()
-            if available_space < 1024 * 1024 * 1024:  # 1 GB minimum
+            if self.protocol != 's3' and available_space < 1024 * 1024 * 1024:  # 1 GB minimum
                 logger.warning(f"[STORAGE] ⚠ Espace disponible faible: {available_space / (1024**3):.2f} GB")
 
             self.is_connected = True
@@ -0,0 +1,411 @@
+"""
+Orchestrateur de réplications multi-VM
+
+Regroupe les réplications dues par couple (hôte source, hôte destination),
+les ordonne par marge RPO (la plus en retard d'abord) et les exécute en
+parallèle avec un nombre borné de VMs par couple. Les sessions vSphere et
+les connexions HTTP sont partagées entre toutes les VMs d'un même couple.
+"""
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from backups.progress_stream import set_progress
+from backups.task_routing import transfer_time_limits, vm_transfer_size_gb
+from esxi.email_service import EmailNotificationService
+from esxi.session_pool import session_pool
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicationOrchestrator:
+    """
+    Exécution groupée des réplications par couple d'hôtes
+    """
+
+    def __init__(self, max_parallel_per_pair=None):
+        """
+        Args:
+            max_parallel_per_pair: Nombre maximal de VMs répliquées simultanément par couple d'hôtes
+        """
+        self.max_parallel_per_pair = max(1, (
+            max_parallel_per_pair or getattr(settings, 'REPLICATION_MAX_PARALLEL_PER_PAIR', 4)
+        ))
+
+    @staticmethod
+    def rpo_slack(replication, now=None):
+        """
+        Marge restante avant l'échéance RPO (négative si en retard)
+
+        Returns:
+            timedelta ou None si la réplication n'a jamais été exécutée
+        """
+        if not replication.last_replication_at:
+            return None
+        now = now or timezone.now()
+        deadline = replication.last_replication_at + timedelta(minutes=replication.replication_interval_minutes)
+        return deadline - now
+
+    @classmethod
+    def _sort_key(cls, replication, now):
+        slack = cls.rpo_slack(replication, now)
+        # Jamais répliquées en premier, puis par marge croissante
+        return (slack is not None, slack.total_seconds() if slack is not None else 0)
+
+    @staticmethod
+    def _pair_time_limits():
+        """
+        Limite de temps hard maximale d'un lot, par couple d'hôtes
+
+        Calculée sur toutes les réplications actives du couple: un lot n'en
+        contient qu'une partie, c'est donc un majorant de sa limite réelle.
+
+        Returns:
+            dict: {(source_id, destination_id): secondes}
+        """
+        from backups.models import VMReplication
+
+        sizes = {}
+        for replication in VMReplication.objects.filter(is_active=True).select_related('virtual_machine'):
+            key = (replication.source_server_id or replication.virtual_machine.server_id, replication.destination_server_id)
+            sizes[key] = sizes.get(key, 0) + vm_transfer_size_gb(replication.virtual_machine)
+        return {key: transfer_time_limits(size_gb)['time_limit'] for key, size_gb in sizes.items()}
+
+    def exclude_running(self, replications, now=None):
+        """
+        Retire les réplications en cours ('syncing'), sauf les synchronisations
+        interrompues
+
+        Un worker tué (limite hard, OOM, redémarrage) laisse la réplication en
+        'syncing': passé la limite de temps de son lot, elle est considérée
+        comme interrompue et redevient éligible. Une réplication 'syncing' sans
+        sync_started_at date d'avant ce suivi et est aussi réadmise.
+        """
+        now = now or timezone.now()
+        limits = None
+        admitted = []
+        for replication in replications:
+            if replication.status != 'syncing':
+                admitted.append(replication)
+                continue
+
+            if limits is None:
+                limits = self._pair_time_limits()
+            key = (replication.get_source_server.id, replication.destination_server_id)
+            limit = timedelta(seconds=limits.get(key, transfer_time_limits(None)['time_limit']))
+            started = replication.sync_started_at
+            if started and now - started <= limit:
+                continue
+
+            logger.warning(
+                f"[REPLICATION-ORCHESTRATOR] Réplication {replication.id} bloquée en 'syncing' depuis "
+                f"{started.isoformat() if started else 'une date inconnue'} (limite {limit}): réadmise"
+            )
+            admitted.append(replication)
+        return admitted
+
+    def get_due_replications(self, now=None):
+        """
+        Réplications actives dont l'intervalle est écoulé, triées par marge RPO
+
+        Les réplications déjà en cours ('syncing') sont ignorées pour éviter
+        qu'un cycle lent ne soit relancé par le cycle suivant, sauf si leur
+        synchronisation a dépassé la limite de temps de son lot (exclude_running).
+        """
+        from backups.models import VMReplication
+
+        now = now or timezone.now()
+        replications = VMReplication.objects.filter(is_active=True).select_related(
+            'source_server', 'destination_server', 'virtual_machine', 'virtual_machine__server'
+        )
+
+        due = []
+        for replication in self.exclude_running(replications, now):
+            slack = self.rpo_slack(replication, now)
+            if slack is None or slack <= timedelta(0):
+                due.append(replication)
+
+        due.sort(key=lambda r: self._sort_key(r, now))
+        return due
+
+    @staticmethod
+    def claim(replications, now=None):
+        """
+        Passe atomiquement en 'syncing' les réplications à mettre en file
+
+        La mise à jour est conditionnée au statut et au sync_started_at lus par
+        get_due_replications: une réplication réclamée entre-temps par un autre
+        cycle (ou une autre instance du dispatcher) est écartée et n'est jamais
+        envoyée deux fois.
+
+        Args:
+            replications: Réplications dues (lues par get_due_replications)
+            now: Horodatage de la réclamation (sync_started_at)
+
+        Returns:
+            list: Réplications réclamées, dans l'ordre d'entrée
+        """
+        from backups.models import VMReplication
+
+        now = now or timezone.now()
+        claimed = []
+        for replication in replications:
+            updated = VMReplication.objects.filter(
+                id=replication.id,
+                status=replication.status,
+                sync_started_at=replication.sync_started_at
+            ).update(status='syncing', sync_started_at=now)
+            if not updated:
+                logger.info(f"[REPLICATION-ORCHESTRATOR] Réplication {replication.id} déjà réclamée, ignorée")
+                continue
+            replication.status = 'syncing'
+            replication.sync_started_at = now
+            claimed.append(replication)
+        return claimed
+
+    @staticmethod
+    def release_claims(replication_ids, claimed_at, status='error'):
+        """Libère des réclamations qui n'ont pas pu être mises en file"""
+        from backups.models import VMReplication
+
+        VMReplication.objects.filter(
+            id__in=replication_ids, status='syncing', sync_started_at=claimed_at
+        ).update(status=status)
+
+    @staticmethod
+    def take_claims(replication_ids, claimed_at):
+        """
+        Prend en charge, dans la tâche, les réplications réclamées par le dispatcher
+
+        La réclamation n'est prise qu'une fois (sync_started_at est avancé
+        atomiquement): une tâche relivrée (acks_late) ou une réplication
+        réclamée à nouveau par un cycle suivant est ignorée.
+
+        Returns:
+            list: IDs des réplications prises en charge, dans l'ordre d'entrée
+        """
+        from backups.models import VMReplication
+
+        taken = []
+        for replication_id in replication_ids:
+            updated = VMReplication.objects.filter(
+                id=replication_id, status='syncing', sync_started_at=claimed_at
+            ).update(sync_started_at=timezone.now())
+            if updated:
+                taken.append(replication_id)
+            else:
+                logger.warning(
+                    f"[REPLICATION-ORCHESTRATOR] Réplication {replication_id} déjà prise en charge, ignorée"
+                )
+        return taken
+
+    @staticmethod
+    def _release(replication, status='active'):
+        """Libère une réplication réclamée qui ne sera pas exécutée"""
+        if replication.status == 'syncing':
+            replication.status = status
+            replication.save(update_fields=['status'])
+
+    @staticmethod
+    def group_by_host_pair(replications):
+        """
+        Regroupe les réplications par couple (source_id, destination_id)
+
+        L'ordre d'entrée est conservé dans chaque groupe, et les groupes sont
+        ordonnés selon leur réplication la plus urgente.
+
+        Returns:
+            OrderedDict: {(source_id, destination_id): [VMReplication, ...]}
+        """
+        groups = OrderedDict()
+        for replication in replications:
+            key = (replication.get_source_server.id, replication.destination_server_id)
+            groups.setdefault(key, []).append(replication)
+        return groups
+
+    def run_pair(self, replications):
+        """
+        Exécute les réplications d'un couple d'hôtes en parallèle
+
+        Args:
+            replications: Liste de VMReplication (même source et même destination), déjà triée
+
+        Returns:
+            dict: {'success': int, 'failed': int, 'skipped': int, 'results': [...]}
+        """
+        from backups.replication_service import ReplicationService
+
+        if not replications:
+            return {'success': 0, 'failed': 0, 'skipped': 0, 'results': []}
+
+        workers = min(self.max_parallel_per_pair, len(replications))
+        service = ReplicationService(session_pool=session_pool, http_pool_size=workers * 2)
+
+        source = replications[0].get_source_server
+        destination = replications[0].destination_server
+        logger.info(
+            f"[REPLICATION-ORCHESTRATOR] Couple {source.hostname} -> {destination.hostname}: "
+            f"{len(replications)} VM(s), {workers} en parallèle"
+        )
+
+        def worker(replication):
+            close_old_connections()
+            try:
+                return self.run_replication(replication, service)
+            finally:
+                close_old_connections()
+
+        results = []
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='replication') as executor:
+            # Soumission dans l'ordre de marge RPO: les plus urgentes démarrent en premier
+            futures = [executor.submit(worker, replication) for replication in replications]
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logger.error(f"[REPLICATION-ORCHESTRATOR] Erreur inattendue: {e}", exc_info=True)
+                    results.append({'status': 'failed', 'error': str(e)})
+
+        service.http_session.close()
+
+        summary = {
+            'success': sum(1 for r in results if r['status'] == 'success'),
+            'failed': sum(1 for r in results if r['status'] == 'failed'),
+            'skipped': sum(1 for r in results if r['status'] in ('skipped', 'cancelled')),
+            'results': results,
+        }
+        logger.info(
+            f"[REPLICATION-ORCHESTRATOR] Couple {source.hostname} -> {destination.hostname} terminé: "
+            f"{summary['success']} succès, {summary['failed']} échec(s), {summary['skipped']} ignorée(s)"
+        )
+        return summary
+
+    def run_replication(self, replication, service):
+        """
+        Exécute une réplication avec un ReplicationService (éventuellement partagé)
+
+        Une replica déjà présente sur la destination annule la réplication
+        automatique (évite l'écrasement), avec notification par email.
+
+        Returns:
+            dict: {'status': 'success'|'skipped'|'cancelled'|'failed', 'replication_id': int, ...}
+        """
+        replication_id = replication.id
+        vm_name = replication.virtual_machine.name
+        logger.info(f"[CELERY-REPLICATION-EXEC] === DÉBUT RÉPLICATION {replication_id} ===")
+        logger.info(f"[CELERY-REPLICATION-EXEC] VM: {vm_name}, Intervalle: {replication.replication_interval_minutes} min")
+
+        try:
+            if not replication.is_active:
+                logger.warning(f"[CELERY-REPLICATION-EXEC] Réplication {replication_id} désactivée, annulation")
+                self._release(replication)
+                return {'status': 'cancelled', 'reason': 'Replication is inactive', 'replication_id': replication_id}
+
+            # TOUJOURS vérifier si une replica existe déjà (même VM)
+            replica_vm_name = f"{vm_name}_replica"
+
+            try:
+                dest_si = service._connect_to_server(replication.destination_server)
+                try:
+                    existing_replica = service._get_vm_by_name(dest_si, replica_vm_name)
+                finally:
+                    service._disconnect(dest_si)
+
+                if existing_replica:
+                    logger.warning(f"[CELERY-REPLICATION-EXEC] ⚠️ REPLICA EXISTANTE DÉTECTÉE: {replica_vm_name}")
+                    logger.warning("[CELERY-REPLICATION-EXEC] La réplication automatique est ANNULÉE pour éviter l'écrasement")
+                    logger.warning("[CELERY-REPLICATION-EXEC] Action requise: Supprimez manuellement la replica ou lancez une réplication manuelle")
+
+                    try:
+                        EmailNotificationService.send_replication_failure_notification(
+                            vm_name=vm_name,
+                            source_server=replication.source_server.hostname,
+                            destination_server=replication.destination_server.hostname,
+                            error_message=f"Une replica '{replica_vm_name}' existe déjà sur {replication.destination_server.hostname}. "
+                                         f"Supprimez-la manuellement avant de lancer une nouvelle réplication."
+                        )
+                    except Exception as email_error:
+                        logger.warning(f"[CELERY-REPLICATION-EXEC] Email notification failed: {email_error}")
+
+                    self._release(replication)
+                    return {
+                        'status': 'skipped',
+                        'reason': f'Replica {replica_vm_name} already exists on destination server. Manual deletion required.',
+                        'replication_id': replication_id
+                    }
+            except Exception as check_error:
+                logger.warning(f"[CELERY-REPLICATION-EXEC] Erreur vérification replica: {check_error}")
+                # En cas d'erreur de vérification, continuer quand même (pour ne pas bloquer)
+
+            logger.info("[CELERY-REPLICATION-EXEC] ✓ Aucune replica existante, démarrage de la réplication...")
+
+            replication.status = 'syncing'
+            replication.sync_started_at = timezone.now()
+            replication.save(update_fields=['status', 'sync_started_at'])
+
+            def progress_callback(progress_percent, status_val, message):
+                logger.info(f"[CELERY-REPLICATION-EXEC] {replication_id}: {progress_percent}% - {status_val} - {message}")
+                set_progress('replication', replication_id, {
+                    'progress': int(progress_percent) if progress_percent >= 0 else 0,
+                    'status': status_val,
+                    'message': message,
+                    'vm_name': vm_name,
+                    'updated_at': timezone.now().isoformat()
+                }, owner=replication)
+
+            service.replicate_vm(
+                replication,
+                progress_callback=progress_callback,
+                replication_id=None  # Pas d'ID pour annulation dans le contexte Celery
+            )
+
+            logger.info(f"[CELERY-REPLICATION-EXEC] ✓ Réplication terminée avec succès: {vm_name}")
+
+            # S'assurer que le statut est bien 'active' après le succès
+            replication.refresh_from_db()
+            if replication.status == 'syncing':
+                replication.status = 'active'
+                replication.save(update_fields=['status'])
+                logger.info("[CELERY-REPLICATION-EXEC] Statut remis à 'active'")
+
+            try:
+                EmailNotificationService.send_replication_success_notification(
+                    vm_name=vm_name,
+                    source_server=replication.source_server.hostname,
+                    destination_server=replication.destination_server.hostname,
+                    duration_seconds=replication.last_replication_duration_seconds or None
+                )
+            except Exception as email_error:
+                logger.warning(f"[CELERY-REPLICATION-EXEC] Email notification failed: {email_error}")
+
+            return {'status': 'success', 'replication_id': replication_id}
+
+        except Exception as e:
+            logger.error(f"[CELERY-REPLICATION-EXEC] ✗ Erreur réplication {replication_id}: {e}", exc_info=True)
+
+            try:
+                replication.status = 'error'
+                replication.save(update_fields=['status'])
+
+                try:
+                    EmailNotificationService.send_replication_failure_notification(
+                        vm_name=vm_name,
+                        source_server=replication.source_server.hostname,
+                        destination_server=replication.destination_server.hostname,
+                        error_message=str(e)
+                    )
+                except Exception as email_error:
+                    logger.warning(f"[CELERY-REPLICATION-EXEC] Email notification failed: {email_error}")
+            except Exception:
+                pass
+
+            return {'status': 'failed', 'error': str(e), 'replication_id': replication_id}
+
+
+# Instance globale de l'orchestrateur
+replication_orchestrator = ReplicationOrchestrator()
@@ -5,19 +5,22 @@ import logging
 import os
 import tempfile
 import shutil
+import time
 import requests
 import urllib3
 import xml.etree.ElementTree as ET
 from datetime import datetime
 from django.utils import timezone
-from pyVim.connect import SmartConnect, Disconnect
+from pyVim.connect import Disconnect
 from pyVmomi import vim
 import ssl
 import atexit
 
 from esxi.models import VirtualMachine, ESXiServer
 from backups.models import VMReplication, FailoverEvent
+from backups.storage_capacity import storage_capacity
 from esxi.vmware_service import VMwareService
+from esxi.vm_index import drop_vm_index, get_vm_index
 
 # Désactiver les warnings SSL
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -28,9 +31,60 @@ logger = logging.getLogger(__name__)
 class ReplicationService:
     """Service de réplication et failover de VMs"""
 
-    def __init__(self):
+    def __init__(self, session_pool=None, http_pool_size=10):
+        """
+        Args:
+            session_pool: ESXiSessionPool optionnel; si fourni, les sessions vSphere
+                sont partagées entre réplications et ne sont pas fermées après usage
+            http_pool_size: Nombre de connexions HTTP keep-alive par hôte pour les téléchargements NFC
+        """
         self.context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
         self.context.verify_mode = ssl.CERT_NONE
+        self.session_pool = session_pool
+
+        # Session HTTP réutilisée pour tous les téléchargements VMDK (keep-alive vers l'hôte source)
+        self.http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=http_pool_size, pool_maxsize=http_pool_size)
+        self.http_session.mount('https://', adapter)
+
+    def _get_vmware_service(self, esxi_server):
+        """
+        Retourne un VMwareService connecté (poolé si un pool est configuré)
+
+        Raises:
+            Exception: Si la connexion échoue
+        """
+        if self.session_pool:
+            return self.session_pool.acquire(esxi_server)
+
+        vmware_service = VMwareService(
+            host=esxi_server.hostname,
+            user=esxi_server.username,
+            password=esxi_server.password,
+            port=esxi_server.port or 443
+        )
+        if not vmware_service.connect():
+            raise Exception(f"Impossible de se connecter au serveur {esxi_server.hostname}")
+        return vmware_service
+
+    def _release_vmware_service(self, vmware_service):
+        """Ferme un VMwareService, ou rend son bail s'il appartient au pool"""
+        if not vmware_service:
+            return
+        if self.session_pool:
+            self.session_pool.release(vmware_service)
+        else:
+            vmware_service.disconnect()
+
+    def _disconnect(self, si):
+        """Ferme une session pyVmomi, ou rend son bail si elle appartient au pool"""
+        if not si:
+            return
+        if self.session_pool:
+            self.session_pool.release(si)
+        else:
+            drop_vm_index(si)
+            Disconnect(si)
 
     def _connect_to_server(self, esxi_server):
         """
@@ -46,6 +100,9 @@ class ReplicationService:
         Raises:
             Exception: Si la connexion échoue
         """
+        if self.session_pool:
+            return self.session_pool.acquire(esxi_server).service_instance
+
         try:
             logger.info(f"[REPLICATION] Connexion à {esxi_server.hostname} via VMwareService...")
 
@@ -74,7 +131,8 @@ class ReplicationService:
 
     def _get_vm_by_name(self, si, vm_name):
         """
-        Récupérer une VM par son nom
+        Récupérer une VM par son nom via l'index de la session
+        (construit une fois, puis rafraîchi de manière incrémentale)
 
         Args:
             si: ServiceInstance
@@ -83,18 +141,7 @@ class ReplicationService:
         Returns:
             vim.VirtualMachine ou None
         """
-        content = si.RetrieveContent()
-        container = content.viewManager.CreateContainerView(
-            content.rootFolder, [vim.VirtualMachine], True
-        )
-
-        for vm in container.view:
-            if vm.name == vm_name:
-                container.Destroy()
-                return vm
-
-        container.Destroy()
-        return None
+        return get_vm_index(si).find_by_name(vm_name)
 
     def _download_vmdk_with_retry(self, url, local_path, esxi_user, esxi_pass, device_url,
                                     downloaded, file_index, total_size, last_lease_update, last_ui_update,
@@ -158,7 +205,7 @@ class ReplicationService:
                         file_downloaded = bytes_already_downloaded
                         logger.info(f"[REPLICATION] [RETRY] Reprise à {bytes_already_downloaded / (1024*1024):.1f} MB (tentative {retry_count + 1}/{max_retries + 1})")
 
-                        response = requests.get(
+                        response = self.http_session.get(
                             url,
                             auth=(esxi_user, esxi_pass),
                             verify=False,
@@ -178,7 +225,7 @@ class ReplicationService:
                         if retry_count > 0:
                             logger.info(f"[REPLICATION] [RETRY] Nouvelle tentative {retry_count + 1}/{max_retries + 1}")
 
-                        response = requests.get(
+                        response = self.http_session.get(
                             url,
                             auth=(esxi_user, esxi_pass),
                             verify=False,
@@ -438,7 +485,7 @@ class ReplicationService:
                     url = device_url.url.replace('*', esxi_host)
                     try:
                         # HEAD request pour obtenir Content-Length sans télécharger
-                        head_response = requests.head(
+                        head_response = self.http_session.head(
                             url,
                             auth=(esxi_user, esxi_pass),
                             verify=False,
@@ -671,6 +718,7 @@ class ReplicationService:
             dict: Résultat de la réplication
         """
         temp_dir = None
+        source_si = dest_si = None
         try:
             import time
             start_time = timezone.now()
@@ -684,6 +732,12 @@ class ReplicationService:
             vm_name = replication.virtual_machine.name
             replica_vm_name = f"{vm_name}_replica"
 
+            # Place de l'export temporaire réservée avant tout transfert (sinon ENOSPC après des heures)
+            storage_capacity.admit(
+                'replication', replication.id, replication.virtual_machine,
+                storage_capacity.resolve_target(tempfile.gettempdir())
+            )
+
             # Progression graduelle 1-24% (affichage incrémental clair)
             if progress_callback:
                 for pct in range(1, 3):
@@ -787,7 +841,8 @@ class ReplicationService:
                     time.sleep(0.1)
 
             # Déconnexion du serveur source
-            Disconnect(source_si)
+            self._disconnect(source_si)
+            source_si = None
 
             # Déployer sur le serveur destination avec le nom "_replica" (63-70%)
             logger.info(f"[REPLICATION] Déploiement sur serveur destination: {destination_server.hostname}")
@@ -796,13 +851,6 @@ class ReplicationService:
                     progress_callback(pct, 'deploying', f'Préparation du déploiement... {pct}%')
                     time.sleep(0.1)
 
-            vmware_service = VMwareService(
-                host=destination_server.hostname,
-                user=destination_server.username,
-                password=destination_server.password,
-                port=destination_server.port or 443
-            )
-
             # SE CONNECTER au serveur de destination
             logger.info(f"[REPLICATION] Connexion au serveur de destination {destination_server.hostname}...")
             if progress_callback:
@@ -810,8 +858,7 @@ class ReplicationService:
                     progress_callback(pct, 'deploying', f'Connexion au serveur de destination... {pct}%')
                     time.sleep(0.1)
 
-            if not vmware_service.connect():
-                raise Exception(f"Impossible de se connecter au serveur de destination {destination_server.hostname}")
+            vmware_service = self._get_vmware_service(destination_server)
             logger.info(f"[REPLICATION] [OK] Connecté au serveur de destination")
 
             # Utiliser le datastore configuré dans la réplication (69-73%)
@@ -910,7 +957,8 @@ class ReplicationService:
                 progress_callback(99, 'disconnecting', 'Déconnexion des serveurs... 99%')
 
             # Déconnexion
-            Disconnect(dest_si)
+            self._disconnect(dest_si)
+            dest_si = None
 
             if progress_callback:
                 time.sleep(0.2)
@@ -918,7 +966,7 @@ class ReplicationService:
 
             # Déconnecter le service VMware de destination
             try:
-                vmware_service.disconnect()
+                self._release_vmware_service(vmware_service)
                 logger.info(f"[REPLICATION] Déconnecté du serveur de destination")
             except:
                 pass
@@ -961,7 +1009,7 @@ class ReplicationService:
             # Déconnecter le service VMware de destination si créé
             try:
                 if 'vmware_service' in locals():
-                    vmware_service.disconnect()
+                    self._release_vmware_service(vmware_service)
                     logger.info(f"[REPLICATION] Déconnecté du serveur de destination (erreur)")
             except:
                 pass
@@ -982,17 +1030,26 @@ class ReplicationService:
                 'message': user_message
             }
 
-    def execute_failover(self, failover_event, test_mode=False):
+        finally:
+            # Sessions encore ouvertes après une erreur (baux rendus au pool)
+            self._disconnect(source_si)
+            self._disconnect(dest_si)
+            storage_capacity.release('replication', replication.id)
+
+    def execute_failover(self, failover_event, test_mode=False, source_reachable=True):
         """
         Exécuter un failover (basculement)
 
         Args:
             failover_event: Instance FailoverEvent
             test_mode: Si True, ne pas arrêter la VM source
+            source_reachable: False si la source est déjà connue hors ligne (sondée une
+                fois par l'appelant): aucune connexion ni arrêt côté source
 
         Returns:
             dict: Résultat du failover
         """
+        source_si = dest_si = None
         try:
             logger.info(f"Démarrage failover: {failover_event.id}")
             failover_event.status = 'in_progress'
@@ -1004,14 +1061,23 @@ class ReplicationService:
             vm_name = replication.virtual_machine.name
 
             # Se connecter aux serveurs
-            logger.info(f"Connexion au serveur source: {source_server.hostname}")
-            source_si = self._connect_to_server(source_server)
+            # Le serveur source peut être hors ligne (panne de site): le failover continue sans lui
+            source_si = None
+            source_vm = None
+            if not source_reachable:
+                logger.warning(f"Serveur source {source_server.hostname} hors ligne (sondé), failover sans arrêt de la source")
+            else:
+                logger.info(f"Connexion au serveur source: {source_server.hostname}")
+                try:
+                    source_si = self._connect_to_server(source_server)
+                    source_vm = self._get_vm_by_name(source_si, vm_name)
+                except Exception as source_error:
+                    logger.warning(f"Serveur source {source_server.hostname} injoignable, failover sans arrêt de la source: {source_error}")
 
             logger.info(f"Connexion au serveur destination: {destination_server.hostname}")
             dest_si = self._connect_to_server(destination_server)
 
-            # Récupérer les VMs
-            source_vm = self._get_vm_by_name(source_si, vm_name)
+            # Récupérer la VM de destination
             dest_vm = self._get_vm_by_name(dest_si, f"{vm_name}_replica")
 
             if not dest_vm:
@@ -1029,7 +1095,7 @@ class ReplicationService:
 
                     # Attendre la fin de l'arrêt
                     while power_off_task.info.state not in [vim.TaskInfo.State.success, vim.TaskInfo.State.error]:
-                        pass
+                        time.sleep(0.5)
 
                     if power_off_task.info.state == vim.TaskInfo.State.error:
                         raise Exception(f"Erreur arrêt VM source: {power_off_task.info.error}")
@@ -1047,7 +1113,7 @@ class ReplicationService:
 
                 # Attendre le démarrage
                 while power_on_task.info.state not in [vim.TaskInfo.State.success, vim.TaskInfo.State.error]:
-                    pass
+                    time.sleep(0.5)
 
                 if power_on_task.info.state == vim.TaskInfo.State.error:
                     raise Exception(f"Erreur démarrage VM destination: {power_on_task.info.error}")
@@ -1071,8 +1137,8 @@ class ReplicationService:
             logger.info(f"Failover actif marqué pour réplication {replication.id}")
 
             # Déconnexion
-            Disconnect(source_si)
-            Disconnect(dest_si)
+            self._disconnect(source_si)
+            self._disconnect(dest_si)
 
             logger.info(f"Failover terminé avec succès: {failover_event.id}")
 
@@ -1085,6 +1151,8 @@ class ReplicationService:
 
         except Exception as e:
             logger.error(f"Erreur lors du failover {failover_event.id}: {e}")
+            self._disconnect(source_si)
+            self._disconnect(dest_si)
 
             failover_event.status = 'failed'
             failover_event.error_message = str(e)
@@ -1097,61 +1165,32 @@ class ReplicationService:
                 'message': f"Erreur lors du failover: {e}"
             }
 
-    def check_and_trigger_auto_failover(self, replication):
+    def check_and_trigger_auto_failover(self, replication, snapshot=None):
         """
         Vérifier si un failover automatique doit être déclenché
 
+        S'appuie sur le snapshot partagé de la sonde de santé (un sondage par hôte
+        et par intervalle) au lieu d'une connexion vSphere complète par réplication.
+
         Args:
             replication: Instance VMReplication
+            snapshot: Snapshot de santé de l'hôte source (sondé si absent)
 
         Returns:
             dict: Résultat de la vérification
         """
+        from backups.host_health_probe import host_health_probe
+
         if replication.failover_mode != 'automatic':
             return {'should_failover': False, 'reason': 'Mode automatique non activé'}
 
-        # Vérifier si le serveur source est indisponible
-        source_server = replication.get_source_server
-
-        try:
-            # Tenter de se connecter au serveur source
-            si = self._connect_to_server(source_server)
+        if snapshot is None:
+            snapshot = host_health_probe.get_snapshot(replication.get_source_server)
 
-            # Vérifier la VM
-            vm = self._get_vm_by_name(si, replication.virtual_machine.name)
-
-            if not vm:
-                return {'should_failover': False, 'reason': 'VM non trouvée'}
-
-            # Vérifier l'état de la VM
-            if vm.runtime.powerState != vim.VirtualMachinePowerState.poweredOn:
-                # VM éteinte, vérifier le délai
-                if replication.last_replication_at:
-                    minutes_since_last = (timezone.now() - replication.last_replication_at).total_seconds() / 60
-
-                    if minutes_since_last >= replication.auto_failover_threshold_minutes:
-                        return {
-                            'should_failover': True,
-                            'reason': f'VM éteinte depuis {minutes_since_last:.0f} minutes'
-                        }
-
-            Disconnect(si)
-            return {'should_failover': False, 'reason': 'VM en fonctionnement normal'}
-
-        except Exception as e:
-            logger.error(f"Erreur vérification auto-failover pour {replication.name}: {e}")
-
-            # Serveur source inaccessible
-            if replication.last_replication_at:
-                minutes_since_last = (timezone.now() - replication.last_replication_at).total_seconds() / 60
-
-                if minutes_since_last >= replication.auto_failover_threshold_minutes:
-                    return {
-                        'should_failover': True,
-                        'reason': f'Serveur source inaccessible depuis {minutes_since_last:.0f} minutes'
-                    }
-
-            return {'should_failover': False, 'reason': f'Serveur source inaccessible (en attente du délai): {e}'}
+        result = host_health_probe.evaluate_failover(replication, snapshot)
+        if not snapshot['session_ok']:
+            logger.error(f"Erreur vérification auto-failover pour {replication.name}: {snapshot['error']}")
+        return result
 
     def execute_failback(self, replication, triggered_by=None):
         """
@@ -1165,6 +1204,7 @@ class ReplicationService:
         Returns:
             dict: Résultat du failback
         """
+        source_si = dest_si = None
         try:
             logger.info(f"[FAILBACK] === DÉBUT FAILBACK pour réplication {replication.id} ===")
 
@@ -1198,8 +1238,8 @@ class ReplicationService:
 
             if not source_vm:
                 logger.error(f"[FAILBACK] VM source non trouvée: {vm_name}")
-                Disconnect(source_si)
-                Disconnect(dest_si)
+                self._disconnect(source_si)
+                self._disconnect(dest_si)
                 return {
                     'success': False,
                     'error': 'VM source non trouvée',
@@ -1213,7 +1253,7 @@ class ReplicationService:
 
                 # Attendre la fin de l'arrêt
                 while power_off_task.info.state not in [vim.TaskInfo.State.success, vim.TaskInfo.State.error]:
-                    pass
+                    time.sleep(0.5)
 
                 if power_off_task.info.state == vim.TaskInfo.State.error:
                     raise Exception(f"Erreur arrêt VM slave: {power_off_task.info.error}")
@@ -1229,7 +1269,7 @@ class ReplicationService:
 
                 # Attendre le démarrage
                 while power_on_task.info.state not in [vim.TaskInfo.State.success, vim.TaskInfo.State.error]:
-                    pass
+                    time.sleep(0.5)
 
                 if power_on_task.info.state == vim.TaskInfo.State.error:
                     raise Exception(f"Erreur démarrage VM master: {power_on_task.info.error}")
@@ -1244,8 +1284,8 @@ class ReplicationService:
             logger.info(f"[FAILBACK] Failover désactivé pour réplication {replication.id}")
 
             # Déconnexion
-            Disconnect(source_si)
-            Disconnect(dest_si)
+            self._disconnect(source_si)
+            self._disconnect(dest_si)
 
             logger.info(f"[FAILBACK] === FAILBACK TERMINÉ AVEC SUCCÈS ===")
 
@@ -1258,6 +1298,8 @@ class ReplicationService:
 
         except Exception as e:
             logger.error(f"[FAILBACK] ✗ Erreur lors du failback: {e}", exc_info=True)
+            self._disconnect(source_si)
+            self._disconnect(dest_si)
 
             return {
                 'success': False,
@@ -1265,17 +1307,20 @@ class ReplicationService:
                 'message': f"Erreur lors du failback: {e}"
             }
 
-    def check_and_trigger_auto_failback(self, replication):
+    def check_and_trigger_auto_failback(self, replication, snapshot=None):
         """
         Vérifier si un failback automatique doit être déclenché
         (quand master revient en ligne après un failover)
 
         Args:
             replication: Instance VMReplication
+            snapshot: Snapshot de santé de l'hôte source (sondé si absent)
 
         Returns:
             dict: Résultat de la vérification
         """
+        from backups.host_health_probe import host_health_probe
+
         # Vérifier que le failback automatique est activé
         if not replication.failback_enabled:
             return {'should_failback': False, 'reason': 'Failback automatique désactivé'}
@@ -1284,35 +1329,13 @@ class ReplicationService:
         if not replication.failover_active:
             return {'should_failback': False, 'reason': 'Aucun failover actif'}
 
-        # Vérifier que la VM master est revenue en ligne
-        source_server = replication.get_source_server
-
-        try:
-            # Tenter de se connecter au serveur source
-            si = self._connect_to_server(source_server)
-
-            # Vérifier la VM
-            vm = self._get_vm_by_name(si, replication.virtual_machine.name)
-
-            if not vm:
-                Disconnect(si)
-                return {'should_failback': False, 'reason': 'VM master non trouvée'}
+        if snapshot is None:
+            snapshot = host_health_probe.get_snapshot(replication.get_source_server)
 
-            # Vérifier l'état de la VM
-            if vm.runtime.powerState == vim.VirtualMachinePowerState.poweredOn:
-                # VM master revenue en ligne !
-                Disconnect(si)
-                return {
-                    'should_failback': True,
-                    'reason': f'VM master {replication.virtual_machine.name} revenue en ligne'
-                }
-
-            Disconnect(si)
-            return {'should_failback': False, 'reason': 'VM master toujours éteinte'}
-
-        except Exception as e:
-            logger.error(f"[FAILBACK-CHECK] Erreur vérification auto-failback pour {replication.name}: {e}")
-            return {'should_failback': False, 'reason': f'Serveur source inaccessible: {e}'}
+        result = host_health_probe.evaluate_failback(replication, snapshot)
+        if not snapshot['session_ok']:
+            logger.error(f"[FAILBACK-CHECK] Erreur vérification auto-failback pour {replication.name}: {snapshot['error']}")
+        return result
 
     def delete_replicated_vm(self, replication):
         """
@@ -1343,7 +1366,7 @@ class ReplicationService:
 
             if not vm:
                 logger.warning(f"[REPLICATION DELETE] VM replica {replica_vm_name} non trouvée sur le serveur de destination")
-                Disconnect(si)
+                self._disconnect(si)
                 return {
                     'success': True,
                     'message': f'VM replica {replica_vm_name} non trouvée sur le serveur de destination (peut-être déjà supprimée)'
@@ -1389,7 +1412,7 @@ class ReplicationService:
                     elapsed += 1
                     if elapsed >= timeout:
                         logger.error(f"[REPLICATION DELETE] Timeout lors de la suppression de la VM replica")
-                        Disconnect(si)
+                        self._disconnect(si)
                         return {
                             'success': False,
                             'message': f'Timeout lors de la suppression de la VM replica {replica_vm_name}'
@@ -1398,14 +1421,14 @@ class ReplicationService:
                 if task.info.state == vim.TaskInfo.State.error:
                     error_msg = str(task.info.error.msg) if task.info.error else 'Erreur inconnue'
                     logger.error(f"[REPLICATION DELETE] Erreur lors de la suppression: {error_msg}")
-                    Disconnect(si)
+                    self._disconnect(si)
                     return {
                         'success': False,
                         'message': f'Erreur lors de la suppression de la VM replica {replica_vm_name}: {error_msg}'
                     }
 
                 logger.info(f"[REPLICATION DELETE] VM replica {replica_vm_name} supprimée avec succès du serveur {dest_server.hostname}")
-                Disconnect(si)
+                self._disconnect(si)
                 return {
                     'success': True,
                     'message': f'VM replica {replica_vm_name} supprimée avec succès du serveur de destination'
@@ -1413,7 +1436,7 @@ class ReplicationService:
 
             except Exception as e:
                 logger.error(f"[REPLICATION DELETE] Exception lors de la suppression de la VM: {e}", exc_info=True)
-                Disconnect(si)
+                self._disconnect(si)
                 return {
                     'success': False,
                     'message': f'Exception lors de la suppression de la VM replica {replica_vm_name}: {str(e)}'
@@ -12,6 +12,8 @@ import subprocess
 from typing import Dict, List, Optional, Any, Callable
 from pathlib import Path
 
+from backups.storage_backends import backend_for_path
+
 logger = logging.getLogger(__name__)
 
 
@@ -230,13 +232,11 @@ class FileRecoveryService:
 
         # Si c'est une full backup simple, utiliser directement
         if len(restore_chain) == 1 and restore_chain[0]['type'] == 'full':
-            base_folder = os.path.join(
-                self.chain_manager.vm_folder,
-                restore_chain[0]['id']
-            )
-            source_vmdk = os.path.join(base_folder, vmdk_filename)
+            base_folder = self.chain_manager.backup_folder(restore_chain[0])
+            storage = backend_for_path(base_folder)
+            source_vmdk = storage.join(base_folder, vmdk_filename)
 
-            if not os.path.exists(source_vmdk):
+            if not storage.exists(source_vmdk):
                 logger.error(f"[FILE-RECOVERY] VMDK introuvable: {source_vmdk}")
                 return None
 
@@ -244,7 +244,7 @@ class FileRecoveryService:
             temp_dir = tempfile.gettempdir()
             temp_vmdk = os.path.join(temp_dir, f"recovery_{vmdk_filename}")
 
-            shutil.copy2(source_vmdk, temp_vmdk)
+            storage.download(source_vmdk, temp_vmdk)
             logger.info(f"[FILE-RECOVERY] VMDK copié: {temp_vmdk}")
 
             return temp_vmdk
@@ -257,13 +257,11 @@ class FileRecoveryService:
 
         try:
             # Copier la base
-            base_folder = os.path.join(
-                self.chain_manager.vm_folder,
-                restore_chain[0]['id']
-            )
-            source_vmdk = os.path.join(base_folder, vmdk_filename)
+            base_folder = self.chain_manager.backup_folder(restore_chain[0])
+            storage = backend_for_path(base_folder)
+            source_vmdk = storage.join(base_folder, vmdk_filename)
 
-            shutil.copy2(source_vmdk, temp_vmdk)
+            storage.download(source_vmdk, temp_vmdk)
 
             # Appliquer les incrémentales
             total_incrementals = len(restore_chain) - 1
@@ -10,6 +10,8 @@ import tempfile
 from typing import Dict, Any, Optional
 from pathlib import Path
 
+from backups.storage_backends import backend_for_path, copy_file, copy_tree, is_object_path, local_backend
+
 logger = logging.getLogger(__name__)
 
 
@@ -173,29 +175,39 @@ class VMRestoreService:
         Returns:
             bool: True si succès
         """
-        backup_folder = os.path.join(self.chain_manager.vm_folder, backup['id'])
+        backup_folder = self.chain_manager.backup_folder(backup)
+        storage = backend_for_path(backup_folder)
 
         logger.info(f"[RESTORE_VM] Dossier source: {backup_folder}")
 
         # Vérifier que le dossier existe
-        if not os.path.exists(backup_folder):
+        if not storage.exists(backup_folder):
             logger.error(f"[RESTORE_VM] Dossier introuvable: {backup_folder}")
             return False
 
         # Trouver le fichier OVF
-        ovf_files = [f for f in os.listdir(backup_folder) if f.endswith('.ovf')]
+        ovf_files = [e['name'] for e in storage.list(backup_folder) if e['name'].endswith('.ovf')]
 
         if not ovf_files:
             logger.error("[RESTORE_VM] Aucun fichier OVF trouvé")
             return False
 
-        ovf_file = os.path.join(backup_folder, ovf_files[0])
-        logger.info(f"[RESTORE_VM] Fichier OVF: {ovf_file}")
-
-        if progress_callback:
-            progress_callback(20)
+        temp_dir = None
 
         try:
+            # L'import OVF lit des fichiers locaux: copie préalable depuis un stockage objet
+            local_folder = backup_folder
+            if is_object_path(backup_folder):
+                temp_dir = tempfile.mkdtemp(prefix='vm_restore_')
+                local_folder = os.path.join(temp_dir, 'vm_data')
+                copy_tree(backup_folder, local_folder, src_backend=storage, dst_backend=local_backend)
+
+            ovf_file = os.path.join(local_folder, ovf_files[0])
+            logger.info(f"[RESTORE_VM] Fichier OVF: {ovf_file}")
+
+            if progress_callback:
+                progress_callback(20)
+
             # Importer l'OVF dans ESXi
             logger.info(f"[RESTORE_VM] Import OVF vers datastore '{target_datastore}'...")
 
@@ -235,6 +247,10 @@ class VMRestoreService:
             logger.exception(f"[RESTORE_VM] Erreur import OVF: {e}")
             return False
 
+        finally:
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
     def _restore_from_incremental_chain(
         self,
         restore_chain: list,
@@ -270,14 +286,14 @@ class VMRestoreService:
         try:
             # 1. Copier la Full backup
             base_backup = restore_chain[0]
-            base_folder = os.path.join(self.chain_manager.vm_folder, base_backup['id'])
+            base_folder = self.chain_manager.backup_folder(base_backup)
 
             logger.info(f"[RESTORE_VM] Copie base backup: {base_backup['id']}")
 
             if progress_callback:
                 progress_callback(20)
 
-            shutil.copytree(base_folder, os.path.join(temp_dir, 'vm_data'))
+            copy_tree(base_folder, os.path.join(temp_dir, 'vm_data'), dst_backend=local_backend)
 
             if progress_callback:
                 progress_callback(40)
@@ -353,7 +369,7 @@ class VMRestoreService:
         Returns:
             bool: True si succès
         """
-        incr_folder = os.path.join(self.chain_manager.vm_folder, incremental['id'])
+        incr_folder = self.chain_manager.backup_folder(incremental)
 
         logger.info(f"[RESTORE_VM] Application incrémentale depuis: {incr_folder}")
 
@@ -370,17 +386,16 @@ class VMRestoreService:
     def _apply_ovf_incremental(self, vm_folder: str, incr_folder: str) -> bool:
         """Applique une incrémentale OVF (copie fichiers)"""
         try:
+            storage = backend_for_path(incr_folder)
+
             # Pour OVF incrémental, les fichiers modifiés écrasent les anciens
-            for file in os.listdir(incr_folder):
-                if file == 'metadata.json':
+            for entry in storage.list(incr_folder):
+                file = entry['name']
+                if file == 'metadata.json' or entry['is_dir']:
                     continue
 
-                src = os.path.join(incr_folder, file)
-                dst = os.path.join(vm_folder, file)
-
-                if os.path.isfile(src):
-                    shutil.copy2(src, dst)
-                    logger.debug(f"[RESTORE_VM]   Copié: {file}")
+                copy_file(storage, storage.join(incr_folder, file), local_backend, os.path.join(vm_folder, file))
+                logger.debug(f"[RESTORE_VM]   Copié: {file}")
 
             return True
 
@@ -391,18 +406,19 @@ class VMRestoreService:
     def _apply_cbt_incremental(self, vm_folder: str, incr_folder: str) -> bool:
         """Applique une incrémentale CBT (blocs modifiés)"""
         try:
+            storage = backend_for_path(incr_folder)
+
             # Charger la carte des blocs
-            block_map_file = os.path.join(incr_folder, 'block_map.json')
-            if not os.path.exists(block_map_file):
+            block_map_file = storage.join(incr_folder, 'block_map.json')
+            if not storage.exists(block_map_file):
                 logger.error("[RESTORE_VM] block_map.json introuvable")
                 return False
 
             import json
-            with open(block_map_file, 'r') as f:
-                block_map = json.load(f)
+            block_map = json.loads(storage.read_bytes(block_map_file))
 
-            changed_blocks_file = os.path.join(incr_folder, 'changed_blocks.dat')
-            if not os.path.exists(changed_blocks_file):
+            changed_blocks_file = storage.join(incr_folder, 'changed_blocks.dat')
+            if not storage.exists(changed_blocks_file):
                 logger.error("[RESTORE_VM] changed_blocks.dat introuvable")
                 return False
 
@@ -415,22 +431,20 @@ class VMRestoreService:
             vmdk_file = os.path.join(vm_folder, vmdk_files[0])
             logger.info(f"[RESTORE_VM] Application CBT sur: {vmdk_file}")
 
-            # Appliquer les blocs modifiés
-            with open(changed_blocks_file, 'rb') as f_blocks:
-                with open(vmdk_file, 'r+b') as f_vmdk:
-                    for block in block_map.get('changed_blocks', []):
-                        offset = block['offset']
-                        length = block['length']
+            # Appliquer les blocs modifiés (lecture partielle de changed_blocks.dat)
+            with open(vmdk_file, 'r+b') as f_vmdk:
+                for block in block_map.get('changed_blocks', []):
+                    offset = block['offset']
+                    length = block['length']
 
-                        # Lire le bloc depuis changed_blocks.dat
-                        f_blocks.seek(block['data_offset'])
-                        block_data = f_blocks.read(length)
+                    # Lire le bloc depuis changed_blocks.dat
+                    block_data = storage.read_range(changed_blocks_file, block['data_offset'], length)
 
-                        # Écrire dans le VMDK
-                        f_vmdk.seek(offset)
-                        f_vmdk.write(block_data)
+                    # Écrire dans le VMDK
+                    f_vmdk.seek(offset)
+                    f_vmdk.write(block_data)
 
-                        logger.debug(f"[RESTORE_VM]   Bloc appliqué: offset={offset}, length={length}")
+                    logger.debug(f"[RESTORE_VM]   Bloc appliqué: offset={offset}, length={length}")
 
             logger.info(f"[RESTORE_VM] ✓ CBT appliqué: {len(block_map.get('changed_blocks', []))} blocs")
             return True
@@ -483,9 +497,9 @@ class VMRestoreService:
 
         # Vérifier l'existence physique des backups
         for backup in restore_chain:
-            backup_folder = os.path.join(self.chain_manager.vm_folder, backup['id'])
+            backup_folder = self.chain_manager.backup_folder(backup)
 
-            if not os.path.exists(backup_folder):
+            if not backend_for_path(backup_folder).exists(backup_folder):
                 validation['valid'] = False
                 validation['errors'].append(f"Dossier manquant: {backup['id']}")
             else:
@@ -10,6 +10,8 @@ import logging
 from typing import Dict, List, Optional, Any, Callable
 from pathlib import Path
 
+from backups.storage_backends import backend_for_path, is_object_path
+
 logger = logging.getLogger(__name__)
 
 
@@ -165,10 +167,11 @@ class VMDKRestoreService:
         Returns:
             bool: True si succès
         """
-        backup_folder = os.path.join(self.chain_manager.vm_folder, backup['id'])
-        source_vmdk = os.path.join(backup_folder, vmdk_filename)
+        backup_folder = self.chain_manager.backup_folder(backup)
+        storage = backend_for_path(backup_folder)
+        source_vmdk = storage.join(backup_folder, vmdk_filename)
 
-        if not os.path.exists(source_vmdk):
+        if not storage.exists(source_vmdk):
             logger.error(f"[VMDK-RESTORE] VMDK introuvable: {source_vmdk}")
             results['errors'].append(f"VMDK {vmdk_filename} introuvable dans le backup")
             return False
@@ -179,20 +182,31 @@ class VMDKRestoreService:
         logger.info(f"[VMDK-RESTORE] Source: {source_vmdk}")
         logger.info(f"[VMDK-RESTORE] Destination: {target_datastore}/{vmdk_name}")
 
+        temp_dir = None
+        local_vmdk = source_vmdk
+
         try:
+            # Stockage objet: seul ce VMDK est téléchargé (GET partiels parallèles)
+            if is_object_path(source_vmdk):
+                if progress_callback:
+                    progress_callback(10, f"Téléchargement de {vmdk_filename}...")
+                temp_dir = tempfile.mkdtemp(prefix='vmdk_restore_')
+                local_vmdk = os.path.join(temp_dir, vmdk_filename)
+                storage.download(source_vmdk, local_vmdk)
+
             # Upload du VMDK vers le datastore
             if progress_callback:
                 progress_callback(30, f"Upload du VMDK vers {target_datastore}...")
 
             vmdk_path = self.vmware.upload_vmdk_to_datastore(
-                source_vmdk,
+                local_vmdk,
                 target_datastore,
                 vmdk_name
             )
 
             results['vmdk_path'] = vmdk_path
             results['vmdk_name'] = vmdk_name
-            results['size_bytes'] = os.path.getsize(source_vmdk)
+            results['size_bytes'] = storage.size(source_vmdk)
 
             if progress_callback:
                 progress_callback(80, "Upload terminé")
@@ -222,6 +236,10 @@ class VMDKRestoreService:
             results['errors'].append(f"Erreur upload: {e}")
             return False
 
+        finally:
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
     def _restore_vmdk_from_chain(
         self,
         restore_chain: List[Dict],
@@ -256,10 +274,11 @@ class VMDKRestoreService:
 
             # 1. Copier le VMDK de base
             base_backup = restore_chain[0]
-            base_folder = os.path.join(self.chain_manager.vm_folder, base_backup['id'])
-            source_vmdk = os.path.join(base_folder, vmdk_filename)
+            base_folder = self.chain_manager.backup_folder(base_backup)
+            storage = backend_for_path(base_folder)
+            source_vmdk = storage.join(base_folder, vmdk_filename)
 
-            if not os.path.exists(source_vmdk):
+            if not storage.exists(source_vmdk):
                 results['errors'].append(f"VMDK {vmdk_filename} introuvable dans la base")
                 return False
 
@@ -267,7 +286,7 @@ class VMDKRestoreService:
                 progress_callback(20, "Copie du VMDK de base...")
 
             temp_vmdk = os.path.join(temp_dir, vmdk_filename)
-            shutil.copy2(source_vmdk, temp_vmdk)
+            storage.download(source_vmdk, temp_vmdk)
 
             logger.info(f"[VMDK-RESTORE] VMDK de base copié: {temp_vmdk}")
 
@@ -357,15 +376,16 @@ class VMDKRestoreService:
         Returns:
             bool: True si succès
         """
-        incr_folder = os.path.join(self.chain_manager.vm_folder, incremental['id'])
+        incr_folder = self.chain_manager.backup_folder(incremental)
+        storage = backend_for_path(incr_folder)
 
         if incremental['mode'] == 'ovf':
             # Mode OVF: remplacer le VMDK s'il existe dans l'incrémentale
-            incr_vmdk = os.path.join(incr_folder, vmdk_filename)
+            incr_vmdk = storage.join(incr_folder, vmdk_filename)
 
-            if os.path.exists(incr_vmdk):
+            if storage.exists(incr_vmdk):
                 logger.info(f"[VMDK-RESTORE] Remplacement du VMDK depuis OVF incremental")
-                shutil.copy2(incr_vmdk, vmdk_path)
+                storage.download(incr_vmdk, vmdk_path)
                 return True
             else:
                 # Pas de modification de ce VMDK dans cette incrémentale
@@ -389,6 +409,9 @@ class VMDKRestoreService:
         """
         Applique les blocs CBT à un VMDK
 
+        changed_blocks.dat est lu en flux avec lecture anticipée (open_range):
+        seuls les blocs modifiés sont lus, jamais le disque complet.
+
         Args:
             vmdk_path: Chemin du VMDK
             incr_folder: Dossier de l'incrémentale
@@ -398,16 +421,17 @@ class VMDKRestoreService:
             bool: True si succès
         """
         # Chercher le fichier de block map pour ce VMDK
+        storage = backend_for_path(incr_folder)
         vmdk_base = os.path.splitext(vmdk_filename)[0]
-        block_map_file = os.path.join(incr_folder, f"{vmdk_base}_block_map.json")
-        changed_blocks_file = os.path.join(incr_folder, f"{vmdk_base}_changed_blocks.dat")
+        block_map_file = storage.join(incr_folder, f"{vmdk_base}_block_map.json")
+        changed_blocks_file = storage.join(incr_folder, f"{vmdk_base}_changed_blocks.dat")
 
-        if not os.path.exists(block_map_file):
+        if not storage.exists(block_map_file):
             # Pas de modifications CBT pour ce VMDK
             logger.debug(f"[VMDK-RESTORE] Pas de block_map pour {vmdk_filename}")
             return True
 
-        if not os.path.exists(changed_blocks_file):
+        if not storage.exists(changed_blocks_file):
             logger.error(f"[VMDK-RESTORE] changed_blocks.dat manquant pour {vmdk_filename}")
             return False
 
@@ -415,17 +439,18 @@ class VMDKRestoreService:
             import json
 
             # Charger la block map
-            with open(block_map_file, 'r') as f:
-                block_map = json.load(f)
+            block_map = json.loads(storage.read_bytes(block_map_file))
 
             logger.info(f"[VMDK-RESTORE] Application de {len(block_map.get('changed_blocks', []))} blocs CBT")
 
-            # Appliquer les blocs modifiés
-            with open(changed_blocks_file, 'rb') as f_blocks:
+            # Appliquer les blocs modifiés (stockés bout à bout dans changed_blocks.dat)
+            with storage.open_range(changed_blocks_file) as f_blocks:
                 with open(vmdk_path, 'r+b') as f_vmdk:
                     for block in block_map['changed_blocks']:
                         # Lire les données du bloc
                         block_data = f_blocks.read(block['length'])
+                        if len(block_data) != block['length']:
+                            raise IOError(f"changed_blocks.dat tronqué (bloc offset {block['offset']})")
 
                         # Écrire au bon offset dans le VMDK
                         f_vmdk.seek(block['offset'])
@@ -515,10 +540,7 @@ class VMDKRestoreService:
         vmdk_found = False
 
         for backup_in_chain in restore_chain:
-            backup_folder = os.path.join(
-                self.chain_manager.vm_folder,
-                backup_in_chain['id']
-            )
+            backup_folder = self.chain_manager.backup_folder(backup_in_chain)
             vmdk_path = os.path.join(backup_folder, vmdk_filename)
 
             if os.path.exists(vmdk_path):
@@ -557,7 +579,7 @@ class VMDKRestoreService:
         if not backup:
             return []
 
-        backup_folder = os.path.join(self.chain_manager.vm_folder, backup['id'])
+        backup_folder = self.chain_manager.backup_folder(backup)
         vmdks = []
 
         try:
@@ -0,0 +1,408 @@
+"""
+Agrégats horaires et journaliers des jobs de backup
+
+Chaque job terminé (backup, backup VM, export OVF) est ajouté une seule fois
+aux agrégats de sa période, pour chaque dimension: global, VM, serveur ESXi,
+stockage distant, chemin de sauvegarde et organisation (UUID dans
+dimension_key, les autres dimensions ont un ID entier). Les lectures (dashboard, santé, facturation,
+Prometheus) coûtent O(périodes) au lieu de O(jobs).
+
+Les jobs antérieurs à la mise en place des agrégats sont repris avec:
+    python manage.py rebuild_backup_rollups
+"""
+import logging
+from datetime import timedelta, timezone as dt_timezone
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Bornes supérieures des histogrammes (la dernière case compte les valeurs au-delà)
+DURATION_BUCKETS_SECONDS = (60, 300, 600, 1800, 3600, 7200, 14400, 28800)
+THROUGHPUT_BUCKETS_MB_PER_SECOND = (1, 5, 10, 25, 50, 100, 250, 500)
+
+FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+# Opération -> (modèle, champ taille en MB, champ type full/incremental)
+JOB_SOURCES = {
+    'backup_job': ('backups.BackupJob', 'backup_size_mb', 'job_type'),
+    'vm_backup': ('backups.VMBackupJob', 'backup_size_mb', 'backup_type'),
+    'ovf_export': ('backups.OVFExportJob', 'export_size_mb', None),
+}
+
+GRANULARITIES = ('hour', 'day')
+
+
+def _bucket_index(bounds, value):
+    for i, bound in enumerate(bounds):
+        if value <= bound:
+            return i
+    return len(bounds)
+
+
+def _merge_histograms(target, source):
+    """Additionne deux histogrammes (listes de comptes de même longueur ou vides)"""
+    if not source:
+        return target
+    if not target:
+        return list(source)
+    return [a + b for a, b in zip(target, source)]
+
+
+def histogram_percentile(histogram, bounds, quantile):
+    """
+    Estime un quantile à partir d'un histogramme (interpolation linéaire dans la case)
+
+    Returns:
+        float ou None si l'histogramme est vide
+    """
+    total = sum(histogram or [])
+    if not total:
+        return None
+
+    rank = quantile * total
+    cumulative = 0
+    lower = 0
+    for i, count in enumerate(histogram):
+        upper = bounds[i] if i < len(bounds) else bounds[-1]
+        if count and cumulative + count >= rank:
+            if i >= len(bounds):
+                return float(bounds[-1])
+            return lower + (upper - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = upper
+    return float(bounds[-1])
+
+
+class BackupRollupService:
+    """
+    Alimentation et lecture des agrégats BackupRollup
+    """
+
+    @staticmethod
+    def bucket_start(moment, granularity):
+        """Début de la période (UTC) contenant moment"""
+        moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+        if granularity == 'day':
+            moment = moment.replace(hour=0)
+        return moment
+
+    @staticmethod
+    def job_dimensions(job):
+        """
+        Dimensions auxquelles un job contribue
+
+        Returns:
+            list: [(dimension, dimension_id), ...] (UUID de l'organisation pour 'tenant')
+        """
+        from backups.progress_stream import tenant_for_user
+
+        dimensions = [('global', 0)]
+        if job.virtual_machine_id:
+            dimensions.append(('vm', job.virtual_machine_id))
+            server_id = job.virtual_machine.server_id
+            if server_id:
+                dimensions.append(('server', server_id))
+        if getattr(job, 'remote_storage_id', None):
+            dimensions.append(('storage', job.remote_storage_id))
+        # Chemin de sauvegarde (prévision de saturation, voir backups.storage_capacity)
+        from backups.storage_capacity import storage_capacity
+        location = getattr(job, 'backup_location', None) or getattr(job, 'export_location', None)
+        storage_path = storage_capacity.match_storage_path(location)
+        if storage_path is not None:
+            dimensions.append(('storage_path', storage_path.id))
+        tenant_id = tenant_for_user(job.created_by_id)
+        if tenant_id:
+            dimensions.append(('tenant', tenant_id))
+        return dimensions
+
+    @staticmethod
+    def dimension_lookup(dimension_id):
+        """Champs d'une dimension: ID entier, ou UUID d'organisation dans dimension_key"""
+        if isinstance(dimension_id, int):
+            return {'dimension_id': dimension_id, 'dimension_key': ''}
+        return {'dimension_id': 0, 'dimension_key': str(dimension_id)}
+
+    @staticmethod
+    def job_measures(operation, job):
+        """
+        Valeurs apportées par un job aux agrégats
+
+        Returns:
+            dict: status, size_mb, duration, throughput (MB/s ou None), incremental
+        """
+        _, size_field, type_field = JOB_SOURCES[operation]
+        size_mb = getattr(job, size_field) or 0
+        duration = job.duration_seconds or 0
+        completed = job.status == 'completed'
+        return {
+            'status': job.status,
+            'size_mb': size_mb if completed else 0,
+            'duration': duration if completed else 0,
+            'throughput': size_mb / duration if completed and duration > 0 else None,
+            'incremental': completed and type_field is not None and getattr(job, type_field) == 'incremental',
+        }
+
+    def _apply(self, operation, measures, moment, dimensions):
+        from backups.models import BackupRollup
+
+        bytes_moved = int(measures['size_mb'] * 1024 * 1024)
+        for granularity in GRANULARITIES:
+            bucket_start = self.bucket_start(moment, granularity)
+            for dimension, dimension_id in dimensions:
+                rollup, _ = BackupRollup.objects.select_for_update().get_or_create(
+                    granularity=granularity,
+                    bucket_start=bucket_start,
+                    dimension=dimension,
+                    operation=operation,
+                    **self.dimension_lookup(dimension_id),
+                    defaults={
+                        'duration_histogram': [0] * (len(DURATION_BUCKETS_SECONDS) + 1),
+                        'throughput_histogram': [0] * (len(THROUGHPUT_BUCKETS_MB_PER_SECOND) + 1),
+                    }
+                )
+
+                status = measures['status']
+                if status == 'completed':
+                    rollup.jobs_completed += 1
+                    rollup.bytes_moved += bytes_moved
+                    if measures['incremental']:
+                        rollup.incremental_jobs += 1
+                        rollup.incremental_bytes += bytes_moved
+                    if measures['throughput'] is not None:
+                        duration = measures['duration']
+                        rollup.duration_seconds_sum += duration
+                        rollup.duration_seconds_max = max(rollup.duration_seconds_max, duration)
+                        rollup.throughput_mbps_sum += measures['throughput']
+                        rollup.duration_histogram[_bucket_index(DURATION_BUCKETS_SECONDS, duration)] += 1
+                        rollup.throughput_histogram[
+                            _bucket_index(THROUGHPUT_BUCKETS_MB_PER_SECOND, measures['throughput'])
+                        ] += 1
+                elif status == 'failed':
+                    rollup.jobs_failed += 1
+                else:
+                    rollup.jobs_cancelled += 1
+                rollup.save()
+
+    def record_job(self, operation, job):
+        """
+        Ajoute un job terminé aux agrégats (idempotent)
+
+        Args:
+            operation: 'backup_job' | 'vm_backup' | 'ovf_export'
+            job: Instance du job (statut final)
+
+        Returns:
+            bool: True si le job a été comptabilisé par cet appel
+        """
+        from backups.models import BackupRollupSource
+
+        if job.status not in FINAL_STATUSES:
+            return False
+
+        with transaction.atomic():
+            _, created = BackupRollupSource.objects.get_or_create(
+                operation=operation,
+                job_id=job.id,
+                defaults={'status': job.status}
+            )
+            if not created:
+                return False
+
+            measures = self.job_measures(operation, job)
+            self._apply(
+                operation,
+                measures,
+                job.completed_at or timezone.now(),
+                self.job_dimensions(job)
+            )
+
+        # Compteurs d'usage de l'organisation (une seule fois par job, comme les agrégats)
+        from tenants.services.usage_service import usage_service
+        try:
+            usage_service.record_job(job, measures['size_mb'])
+        except Exception as e:
+            logger.error(f"[ROLLUP] Erreur comptabilisation usage {operation} #{job.id}: {e}", exc_info=True)
+        return True
+
+    def rebuild(self, operations=None, batch_size=500):
+        """
+        Reprend les jobs terminés qui ne figurent pas encore dans les agrégats
+
+        Returns:
+            dict: {operation: nombre de jobs ajoutés}
+        """
+        from backups.models import BackupRollupSource
+
+        results = {}
+        for operation in operations or JOB_SOURCES:
+            model = apps.get_model(JOB_SOURCES[operation][0])
+            recorded = BackupRollupSource.objects.filter(operation=operation).values('job_id')
+            jobs = model.objects.filter(status__in=FINAL_STATUSES).exclude(id__in=recorded).select_related(
+                'virtual_machine'
+            ).order_by('id')
+
+            added = 0
+            for job in jobs.iterator(chunk_size=batch_size):
+                if self.record_job(operation, job):
+                    added += 1
+            results[operation] = added
+            logger.info(f"[ROLLUP] {operation}: {added} job(s) ajouté(s) aux agrégats")
+        return results
+
+    def prune(self, hourly_retention_days=None):
+        """
+        Supprime les agrégats horaires plus anciens que la rétention (les journaliers sont conservés)
+
+        Returns:
+            int: Nombre de lignes supprimées
+        """
+        from backups.models import BackupRollup
+
+        days = hourly_retention_days or getattr(settings, 'ROLLUP_HOURLY_RETENTION_DAYS', 31)
+        threshold = timezone.now() - timedelta(days=days)
+        deleted, _ = BackupRollup.objects.filter(granularity='hour', bucket_start__lt=threshold).delete()
+        if deleted:
+            logger.info(f"[ROLLUP] {deleted} agrégat(s) horaire(s) supprimé(s) (> {days} jours)")
+        return deleted
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+    def _queryset(self, operations=None, dimension='global', dimension_id=0, granularity='day', since=None, until=None):
+        from backups.models import BackupRollup
+
+        queryset = BackupRollup.objects.filter(
+            granularity=granularity, dimension=dimension, **self.dimension_lookup(dimension_id)
+        )
+        if operations:
+            queryset = queryset.filter(operation__in=operations)
+        if since:
+            queryset = queryset.filter(bucket_start__gte=since)
+        if until:
+            queryset = queryset.filter(bucket_start__lt=until)
+        return queryset
+
+    @staticmethod
+    def _summarize(rows):
+        summary = {
+            'jobs_completed': 0,
+            'jobs_failed': 0,
+            'jobs_cancelled': 0,
+            'bytes_moved': 0,
+            'duration_seconds_sum': 0,
+            'duration_seconds_max': 0,
+            'throughput_mbps_sum': 0.0,
+            'incremental_jobs': 0,
+            'incremental_bytes': 0,
+            'duration_histogram': [],
+            'throughput_histogram': [],
+        }
+        for row in rows:
+            for field in ('jobs_completed', 'jobs_failed', 'jobs_cancelled', 'bytes_moved',
+                          'duration_seconds_sum', 'throughput_mbps_sum', 'incremental_jobs', 'incremental_bytes'):
+                summary[field] += row[field]
+            summary['duration_seconds_max'] = max(summary['duration_seconds_max'], row['duration_seconds_max'])
+            summary['duration_histogram'] = _merge_histograms(summary['duration_histogram'], row['duration_histogram'])
+            summary['throughput_histogram'] = _merge_histograms(
+                summary['throughput_histogram'], row['throughput_histogram']
+            )
+
+        timed = sum(summary['duration_histogram'])
+        finished = summary['jobs_completed'] + summary['jobs_failed'] + summary['jobs_cancelled']
+        summary.update({
+            'timed_jobs': timed,
+            'avg_duration_seconds': summary['duration_seconds_sum'] / timed if timed else 0,
+            'p50_duration_seconds': histogram_percentile(summary['duration_histogram'], DURATION_BUCKETS_SECONDS, 0.5),
+            'p95_duration_seconds': histogram_percentile(summary['duration_histogram'], DURATION_BUCKETS_SECONDS, 0.95),
+            'avg_throughput_mbps': summary['throughput_mbps_sum'] / timed if timed else 0,
+            'failure_rate': summary['jobs_failed'] / finished if finished else 0,
+        })
+        return summary
+
+    _FIELDS = (
+        'operation', 'bucket_start', 'jobs_completed', 'jobs_failed', 'jobs_cancelled', 'bytes_moved',
+        'duration_seconds_sum', 'duration_seconds_max', 'throughput_mbps_sum', 'incremental_jobs',
+        'incremental_bytes', 'duration_histogram', 'throughput_histogram'
+    )
+
+    def totals(self, operations=None, dimension='global', dimension_id=0, since=None, until=None, granularity='day'):
+        """
+        Totaux sur une période (somme des agrégats)
+
+        Args:
+            operations: Liste d'opérations (None = toutes)
+            since/until: Bornes de la période (until exclue)
+
+        Returns:
+            dict: compteurs, volume, durées moyenne/p50/p95, débit moyen, taux d'échec
+        """
+        rows = self._queryset(operations, dimension, dimension_id, granularity, since, until).values(*self._FIELDS)
+        return self._summarize(rows)
+
+    def totals_by_operation(self, dimension='global', dimension_id=0, since=None, until=None, granularity='day'):
+        """
+        Returns:
+            dict: {operation: totaux} (toutes les opérations, même vides)
+        """
+        grouped = {operation: [] for operation in JOB_SOURCES}
+        rows = self._queryset(None, dimension, dimension_id, granularity, since, until).values(*self._FIELDS)
+        for row in rows:
+            grouped.setdefault(row['operation'], []).append(row)
+        return {operation: self._summarize(items) for operation, items in grouped.items()}
+
+    def series(self, operations=None, dimension='global', dimension_id=0, since=None, until=None, granularity='day'):
+        """
+        Série temporelle (une entrée par période, opérations cumulées)
+
+        Returns:
+            list: [{'bucket_start': iso, 'jobs_completed': ..., 'throughput_mbps': ..., 'p95_duration_seconds': ...}, ...]
+        """
+        grouped = {}
+        rows = self._queryset(operations, dimension, dimension_id, granularity, since, until).order_by(
+            'bucket_start'
+        ).values(*self._FIELDS)
+        for row in rows:
+            grouped.setdefault(row['bucket_start'], []).append(row)
+
+        series = []
+        hours = 24 if granularity == 'day' else 1
+        for bucket_start, items in grouped.items():
+            summary = self._summarize(items)
+            series.append({
+                'bucket_start': bucket_start.isoformat(),
+                'jobs_completed': summary['jobs_completed'],
+                'jobs_failed': summary['jobs_failed'],
+                'jobs_cancelled': summary['jobs_cancelled'],
+                'bytes_moved': summary['bytes_moved'],
+                'throughput_mbps': round(
+                    summary['bytes_moved'] / (1024 ** 2) / summary['duration_seconds_sum'], 2
+                ) if summary['duration_seconds_sum'] else 0,
+                'avg_duration_seconds': round(summary['avg_duration_seconds'], 1),
+                'p50_duration_seconds': summary['p50_duration_seconds'],
+                'p95_duration_seconds': summary['p95_duration_seconds'],
+                'change_rate_mb_per_hour': round(summary['incremental_bytes'] / (1024 ** 2) / hours, 2),
+                'failure_rate': round(summary['failure_rate'] * 100, 1),
+            })
+        return series
+
+    def tenant_usage(self, tenant_id, since, until=None):
+        """
+        Volume traité par une organisation sur une période (agrégats 'tenant')
+
+        Returns:
+            dict: {'backups_count': int, 'bytes_moved': int, 'storage_gb': float}
+        """
+        totals = self.totals(dimension='tenant', dimension_id=tenant_id, since=since, until=until)
+        return {
+            'backups_count': totals['jobs_completed'],
+            'bytes_moved': totals['bytes_moved'],
+            'storage_gb': round(totals['bytes_moved'] / (1024 ** 3), 2),
+        }
+
+
+# Instance globale du service
+rollup_service = BackupRollupService()
@@ -0,0 +1,108 @@
+"""
+Signaux de l'application backups
+
+Publie la progression des jobs (backup, export OVF, backup VM) sur le flux SSE
+à chaque sauvegarde du job, là où les services mettent déjà à jour progress_percentage.
+Invalide le cache de santé des backups quand un job de backup se termine, le
+résumé du dashboard à chaque changement de statut, ajoute chaque job terminé
+aux agrégats horaires/journaliers (BackupRollup) et libère sa réservation de
+stockage.
+"""
+import logging
+
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+
+from backups.models import BackupJob, OVFExportJob, VMBackupJob
+from backups.dashboard_service import invalidate_dashboard_cache
+from backups.health_monitoring_service import HEALTH_FINAL_STATUSES, invalidate_health_cache
+from backups.progress_stream import publish_progress, tenant_for_owner
+from backups.rollup_service import FINAL_STATUSES, rollup_service
+from backups.storage_capacity import storage_capacity
+
+logger = logging.getLogger(__name__)
+
+# Modèle -> type d'événement (clé 'kind' côté client)
+STREAMED_JOBS = {
+    BackupJob: 'backup_job',
+    OVFExportJob: 'ovf_export',
+    VMBackupJob: 'vm_backup',
+}
+
+PROGRESS_FIELDS = ['downloaded_bytes', 'total_bytes', 'download_speed_mbps', 'error_message']
+
+
+@receiver(post_save, sender=BackupJob)
+@receiver(post_save, sender=OVFExportJob)
+@receiver(post_save, sender=VMBackupJob)
+def publish_job_progress(sender, instance, **kwargs):
+    """Publie l'état courant d'un job (mêmes champs que l'endpoint de détail)"""
+    data = {
+        'id': instance.id,
+        'status': instance.status,
+        'progress': instance.progress_percentage,
+        'vm_name': instance.virtual_machine.name if instance.virtual_machine_id else None,
+    }
+    for field in PROGRESS_FIELDS:
+        if hasattr(instance, field):
+            data[field] = getattr(instance, field)
+
+    publish_progress(
+        STREAMED_JOBS[sender],
+        instance.id,
+        data,
+        tenant_id=tenant_for_owner(instance)
+    )
+
+
+@receiver(post_save, sender=BackupJob)
+@receiver(post_save, sender=OVFExportJob)
+@receiver(post_save, sender=VMBackupJob)
+def record_job_rollup(sender, instance, **kwargs):
+    """Ajoute un job terminé aux agrégats (une seule fois par job)"""
+    if instance.status not in FINAL_STATUSES:
+        return
+    try:
+        rollup_service.record_job(STREAMED_JOBS[sender], instance)
+    except Exception as e:
+        logger.error(f"[ROLLUP] Erreur agrégation {STREAMED_JOBS[sender]} #{instance.id}: {e}", exc_info=True)
+
+
+@receiver(post_save, sender=BackupJob)
+@receiver(post_save, sender=OVFExportJob)
+@receiver(post_save, sender=VMBackupJob)
+def release_storage_reservation(sender, instance, **kwargs):
+    """Un job terminé n'a plus besoin de l'espace réservé à son admission"""
+    if instance.status not in FINAL_STATUSES:
+        return
+    try:
+        storage_capacity.release(STREAMED_JOBS[sender], instance.id)
+    except Exception as e:
+        logger.error(f"[STORAGE-CAPACITY] Erreur libération réservation {STREAMED_JOBS[sender]} #{instance.id}: {e}")
+
+
+@receiver(post_save, sender=BackupJob)
+def invalidate_backup_health(sender, instance, **kwargs):
+    """
+    Un job terminé change les vérifications de santé: le résultat en cache est périmé
+    (connecté après record_job_rollup pour que le recalcul lise des agrégats à jour)
+    """
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'status' not in update_fields:
+        return
+    if instance.status in HEALTH_FINAL_STATUSES:
+        invalidate_health_cache()
+
+
+@receiver(post_init, sender=BackupJob)
+def remember_backup_status(sender, instance, **kwargs):
+    """Statut chargé, pour détecter les transitions sans requête supplémentaire"""
+    instance._loaded_status = instance.status
+
+
+@receiver(post_save, sender=BackupJob)
+def invalidate_dashboard_summary(sender, instance, created, **kwargs):
+    """Le résumé du dashboard ne change qu'à la création d'un job ou à un changement de statut"""
+    if created or instance.status != getattr(instance, '_loaded_status', None):
+        invalidate_dashboard_cache()
+    instance._loaded_status = instance.status
@@ -0,0 +1,204 @@
+"""
+Backends de stockage des sauvegardes
+
+Les services lisent et écrivent les fichiers de sauvegarde (chain.json,
+metadata.json, VMDK, exports OVF) par un driver choisi selon le chemin:
+- local, NFS, SMB: système de fichiers (voir filesystem.py);
+- S3 pour les chemins s3://bucket/clé (RemoteStorageConfig protocole 's3').
+
+Interface: stat, list, open_range, read_range, open_write, write_stream,
+delete, rename_atomic (voir base.StorageBackend). Les lectures séquentielles
+passent par un lecteur à lecture anticipée (prefetch.PrefetchReader).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .base import StorageBackend
+from .filesystem import FilesystemBackend, LocalBackend, NFSBackend, SMBBackend
+from .prefetch import PrefetchReader
+
+OBJECT_URL_PREFIX = 's3://'
+
+local_backend = LocalBackend()
+nfs_backend = NFSBackend()
+smb_backend = SMBBackend()
+
+FILESYSTEM_DRIVERS = {
+    'local': local_backend,
+    'nfs': nfs_backend,
+    'smb': smb_backend,
+}
+
+_s3_backends = {}
+_s3_lock = threading.Lock()
+
+# Configurations actives (chemin, config), relues toutes les STORAGE_BACKEND_CACHE_SECONDS
+_configs = {'expires': 0, 'items': []}
+_configs_lock = threading.Lock()
+
+
+def is_object_path(path):
+    """Chemin d'un stockage objet (s3://...)"""
+    return bool(path) and str(path).startswith(OBJECT_URL_PREFIX)
+
+
+def backend_for_config(storage_config):
+    """
+    Driver d'une RemoteStorageConfig
+
+    Les clients S3 sont partagés (thread-safe) et recréés quand la
+    configuration est modifiée.
+    """
+    if storage_config.protocol != 's3':
+        return FILESYSTEM_DRIVERS.get(storage_config.protocol, local_backend)
+
+    from .s3 import S3Backend
+
+    cache_key = (storage_config.id, storage_config.updated_at)
+    with _s3_lock:
+        backend = _s3_backends.get(cache_key)
+        if backend is None:
+            backend = S3Backend(storage_config)
+            if storage_config.id is not None:
+                _s3_backends[cache_key] = backend
+    return backend
+
+
+def _active_configs(refresh=False):
+    from backups.models import RemoteStorageConfig
+
+    with _configs_lock:
+        if refresh or time.monotonic() >= _configs['expires']:
+            _configs['items'] = [
+                (config.get_full_path(), config)
+                for config in RemoteStorageConfig.objects.filter(is_active=True)
+            ]
+            _configs['expires'] = time.monotonic() + getattr(settings, 'STORAGE_BACKEND_CACHE_SECONDS', 60)
+        return _configs['items']
+
+
+def _is_under(path, root):
+    root = root.rstrip('/\\')
+    return path == root or path.startswith(root + '/') or path.startswith(root + '\\')
+
+
+def backend_for_path(path):
+    """
+    Driver d'un chemin enregistré (job, chaîne, export)
+
+    Le chemin est associé à la configuration active dont il est sous le
+    chemin (la plus spécifique); un chemin hors configuration est local.
+
+    Raises:
+        StorageConnectionError: Chemin s3:// sans configuration S3 active
+    """
+    path = str(path)
+    for refresh in (False, True):
+        matches = [
+            (root, config) for root, config in _active_configs(refresh)
+            if (config.protocol == 's3') == is_object_path(path) and _is_under(path, root)
+        ]
+        if matches:
+            return backend_for_config(max(matches, key=lambda match: len(match[0]))[1])
+        if not is_object_path(path):
+            break
+
+    if is_object_path(path):
+        from backups.remote_storage.storage_manager import StorageConnectionError
+        raise StorageConnectionError(f"Aucun stockage S3 actif pour {path}")
+    if path.startswith('\\\\'):
+        return smb_backend
+    return local_backend
+
+
+def join(base, *parts):
+    """Jointure de chemin selon le type de stockage"""
+    if is_object_path(base):
+        return '/'.join([base.rstrip('/')] + [part.replace('\\', '/').strip('/') for part in parts])
+    return os.path.join(base, *parts)
+
+
+def copy_file(src_backend, src, dst_backend, dst, fsync=False):
+    """
+    Copie un fichier entre deux drivers (lecture anticipée côté source)
+
+    Returns:
+        int: Octets copiés
+    """
+    with src_backend.open_range(src) as reader:
+        return dst_backend.write_stream(dst, reader, fsync=fsync)
+
+
+def copy_tree(src, dst, src_backend=None, dst_backend=None, fsync=False):
+    """
+    Copie un dossier (ou un fichier) entre deux stockages
+
+    Les fichiers sont copiés en parallèle (STORAGE_COPY_WORKERS).
+
+    Returns:
+        int: Octets copiés
+    """
+    src_backend = src_backend or backend_for_path(src)
+    dst_backend = dst_backend or backend_for_path(dst)
+
+    info = src_backend.stat(src)
+    if info is None:
+        raise FileNotFoundError(src)
+    if not info['is_dir']:
+        return copy_file(src_backend, src, dst_backend, dst, fsync=fsync)
+
+    files = sorted(src_backend.list_files(src))
+    dst_backend.makedirs(dst)
+    for folder in sorted({relative.rsplit('/', 1)[0] for relative in files if '/' in relative}):
+        dst_backend.makedirs(dst_backend.join(dst, *folder.split('/')))
+
+    def copy_one(relative):
+        parts = relative.split('/')
+        return copy_file(src_backend, src_backend.join(src, *parts), dst_backend, dst_backend.join(dst, *parts), fsync)
+
+    workers = max(1, getattr(settings, 'STORAGE_COPY_WORKERS', 2))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='storage-copy') as executor:
+        return sum(executor.map(copy_one, files))
+
+
+def write_tar(backend, archive_path, members):
+    """
+    Écrit une archive tar (OVA) à partir de fichiers du même stockage
+
+    L'archive est écrite en flux (upload multipart sur S3), chaque membre
+    étant lu avec lecture anticipée: pas de copie locale intermédiaire.
+
+    Args:
+        members: [(chemin du fichier, nom dans l'archive)] dans l'ordre voulu
+
+    Returns:
+        int: Taille de l'archive en octets
+    """
+    import tarfile
+
+    # Taille de l'archive: en-tête de 512 octets et données alignées sur 512 par membre
+    sizes = [backend.size(path) for path, _ in members]
+    size_hint = sum(512 + -(-size // 512) * 512 for size in sizes) + tarfile.RECORDSIZE
+
+    with backend.open_write(archive_path, size_hint=size_hint) as writer:
+        with tarfile.open(fileobj=writer, mode='w|') as tar:
+            for path, arcname in members:
+                info = backend.stat(path)
+                member = tarfile.TarInfo(arcname)
+                member.size = info['size']
+                member.mtime = int(info['modified'] or time.time())
+                with backend.open_range(path, 0, info['size']) as reader:
+                    tar.addfile(member, reader)
+    return writer.bytes_written
+
+
+__all__ = [
+    'StorageBackend', 'FilesystemBackend', 'LocalBackend', 'NFSBackend', 'SMBBackend',
+    'PrefetchReader', 'local_backend', 'nfs_backend', 'smb_backend',
+    'is_object_path', 'backend_for_config', 'backend_for_path', 'join', 'copy_file', 'copy_tree',
+    'write_tar',
+]
@@ -0,0 +1,159 @@
+"""
+Interface commune des backends de stockage des sauvegardes
+"""
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from .prefetch import PrefetchReader
+
+
+class StorageBackend:
+    """
+    Opérations sur les fichiers d'une cible de sauvegarde
+
+    Les chemins sont ceux enregistrés dans les jobs et les chaînes: chemins
+    du système de fichiers (local, SMB, NFS) ou URL s3://bucket/clé.
+
+    Primitives à fournir par un driver: stat, list, read_range, open_write,
+    delete, rename_atomic, makedirs, is_available. Les autres opérations en
+    découlent; toute lecture séquentielle passe par open_range (lecture
+    anticipée de `readahead` blocs de `read_chunk_size` en parallèle).
+    """
+
+    # Protocole de la cible ('local', 'nfs', 'smb', 's3')
+    protocol = 'local'
+
+    # Taille d'une lecture et nombre de lectures anticipées (par driver)
+    read_chunk_size = 8 * 1024 * 1024
+    readahead = 2
+
+    def join(self, base: str, *parts: str) -> str:
+        raise NotImplementedError
+
+    def is_available(self, path: str) -> bool:
+        """La cible (dossier ou bucket) est joignable"""
+        raise NotImplementedError
+
+    # ------------------------------------------------------------------
+    # Primitives
+    # ------------------------------------------------------------------
+    def stat(self, path: str) -> Optional[Dict]:
+        """
+        Returns:
+            dict: {'size', 'modified', 'is_dir'} ou None si le chemin n'existe pas
+        """
+        raise NotImplementedError
+
+    def list(self, path: str) -> List[Dict]:
+        """
+        Entrées directes d'un dossier (non récursif), triées par nom
+
+        Returns:
+            list: [{'name', 'is_dir', 'size', 'modified'}]
+        """
+        raise NotImplementedError
+
+    def read_range(self, path: str, offset: int, length: int) -> bytes:
+        """Lit length octets à partir de offset (sans lire le reste du fichier)"""
+        raise NotImplementedError
+
+    def open_write(self, path: str, fsync: bool = False, size_hint: Optional[int] = None):
+        """
+        Flux d'écriture d'un fichier (write / close / abort, context manager)
+
+        En cas d'exception dans le bloc with, le fichier partiel est supprimé.
+        size_hint (taille attendue, si connue) dimensionne les parts d'un upload S3.
+        """
+        raise NotImplementedError
+
+    def delete(self, path: str):
+        """Supprime un fichier ou un dossier et son contenu"""
+        raise NotImplementedError
+
+    def rename_atomic(self, src: str, dst: str):
+        """
+        Remplace dst par src: un lecteur de dst voit l'ancien ou le nouveau
+        contenu complet, jamais un fichier partiel
+        """
+        raise NotImplementedError
+
+    def makedirs(self, path: str):
+        raise NotImplementedError
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+    def open_range(self, path: str, offset: int = 0, length: Optional[int] = None) -> PrefetchReader:
+        """Flux de lecture (read / itération / close) d'une plage d'un fichier"""
+        return PrefetchReader(self, path, offset, length, self.read_chunk_size, self.readahead)
+
+    def exists(self, path: str) -> bool:
+        """Un fichier ou un dossier (préfixe) existe"""
+        return self.stat(path) is not None
+
+    def size(self, path: str) -> int:
+        info = self.stat(path)
+        if info is None:
+            raise FileNotFoundError(path)
+        return info['size']
+
+    def read_bytes(self, path: str) -> bytes:
+        with self.open_range(path) as reader:
+            return reader.read()
+
+    def iter_chunks(self, path: str, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+        """Lecture séquentielle par blocs (avec lecture anticipée)"""
+        with PrefetchReader(self, path, 0, None, chunk_size or self.read_chunk_size, self.readahead) as reader:
+            yield from reader
+
+    def list_files(self, path: str) -> Dict[str, Dict]:
+        """
+        Fichiers sous un dossier (récursif)
+
+        Returns:
+            dict: {chemin relatif (séparateur '/'): {'size', 'modified'}}
+        """
+        info = self.stat(path)
+        if info is None:
+            return {}
+        if not info['is_dir']:
+            name = path.replace('\\', '/').rstrip('/').rsplit('/', 1)[-1]
+            return {name: {'size': info['size'], 'modified': info['modified']}}
+
+        files = {}
+        for entry in self.list(path):
+            if entry['is_dir']:
+                for relative, sub in self.list_files(self.join(path, entry['name'])).items():
+                    files[f"{entry['name']}/{relative}"] = sub
+            else:
+                files[entry['name']] = {'size': entry['size'], 'modified': entry['modified']}
+        return files
+
+    # ------------------------------------------------------------------
+    # Écriture
+    # ------------------------------------------------------------------
+    def write_stream(self, path: str, chunks: Iterable[bytes], fsync: bool = False,
+                     size_hint: Optional[int] = None) -> int:
+        """
+        Écrit un flux de blocs (générateur, lecteur open_range...)
+
+        La taille d'un lecteur open_range est utilisée si size_hint n'est pas donné.
+
+        Returns:
+            int: Octets écrits
+        """
+        if size_hint is None:
+            size_hint = getattr(chunks, 'size', None)
+        with self.open_write(path, fsync=fsync, size_hint=size_hint) as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+        return writer.bytes_written
+
+    def write_bytes(self, path: str, data: bytes):
+        self.write_stream(path, [data])
+
+    def download(self, path: str, local_path: str):
+        """Copie un fichier vers un chemin local"""
+        from . import local_backend
+
+        with self.open_range(path) as reader:
+            local_backend.write_stream(local_path, reader)
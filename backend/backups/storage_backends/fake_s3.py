@@ -0,0 +1,114 @@
+"""
+Client S3 en mémoire
+
+Implémente le sous-ensemble de l'API boto3 utilisé par MultipartUploadWriter
+(put_object, create/upload_part/complete/abort multipart, get_object) avec les
+contrôles de S3: parts d'au moins 5 Mo sauf la dernière, ETag vérifiés à la
+finalisation, upload inconnu refusé. Sert à vérifier l'écriture multipart sans
+stockage objet (commande check_s3_multipart).
+"""
+import hashlib
+import io
+import threading
+
+from .s3 import MIN_PART_BYTES
+
+
+class FakeS3Error(Exception):
+    """Erreur S3 (même forme de réponse que botocore.exceptions.ClientError)"""
+
+    def __init__(self, code, message=''):
+        super().__init__(f'{code}: {message}' if message else code)
+        self.response = {'Error': {'Code': code, 'Message': message}}
+
+
+class FakeS3Client:
+    """
+    Client S3 en mémoire, thread-safe (parts envoyées en parallèle)
+
+    Attributs:
+        objects: {(bucket, clé): bytes} des objets finalisés
+        uploads: {upload_id: {'bucket', 'key', 'parts': {numéro: (etag, bytes)}}} en cours
+        aborted: upload_ids abandonnés
+    """
+
+    def __init__(self, fail_on_part=None):
+        """
+        Args:
+            fail_on_part: Numéro de part dont l'envoi échoue (simulation d'une erreur réseau)
+        """
+        self.fail_on_part = fail_on_part
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.put_count = 0
+        self._lock = threading.Lock()
+        self._next_upload = 0
+
+    def put_object(self, Bucket, Key, Body):
+        with self._lock:
+            self.objects[(Bucket, Key)] = bytes(Body)
+            self.put_count += 1
+        return {'ETag': self._etag(Body)}
+
+    def get_object(self, Bucket, Key, Range=None):
+        with self._lock:
+            if (Bucket, Key) not in self.objects:
+                raise FakeS3Error('NoSuchKey', Key)
+            data = self.objects[(Bucket, Key)]
+        if Range:
+            start, _, end = Range[len('bytes='):].partition('-')
+            data = data[int(start):int(end) + 1]
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def create_multipart_upload(self, Bucket, Key):
+        with self._lock:
+            self._next_upload += 1
+            upload_id = f'upload-{self._next_upload}'
+            self.uploads[upload_id] = {'bucket': Bucket, 'key': Key, 'parts': {}}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_on_part:
+            raise FakeS3Error('InternalError', f'part {PartNumber}')
+        etag = self._etag(Body)
+        with self._lock:
+            self._upload(UploadId)['parts'][PartNumber] = (etag, bytes(Body))
+        return {'ETag': etag}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        requested = MultipartUpload['Parts']
+        with self._lock:
+            upload = self._upload(UploadId)
+            numbers = [part['PartNumber'] for part in requested]
+            if not numbers or numbers != sorted(set(numbers)):
+                raise FakeS3Error('InvalidPartOrder')
+
+            chunks = []
+            for position, part in enumerate(requested):
+                stored = upload['parts'].get(part['PartNumber'])
+                if stored is None or stored[0] != part['ETag']:
+                    raise FakeS3Error('InvalidPart', str(part['PartNumber']))
+                if position < len(requested) - 1 and len(stored[1]) < MIN_PART_BYTES:
+                    raise FakeS3Error('EntityTooSmall', str(part['PartNumber']))
+                chunks.append(stored[1])
+
+            self.objects[(Bucket, Key)] = b''.join(chunks)
+            del self.uploads[UploadId]
+        return {'Bucket': Bucket, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        with self._lock:
+            self._upload(UploadId)
+            del self.uploads[UploadId]
+            self.aborted.append(UploadId)
+        return {}
+
+    def _upload(self, upload_id):
+        if upload_id not in self.uploads:
+            raise FakeS3Error('NoSuchUpload', upload_id)
+        return self.uploads[upload_id]
+
+    @staticmethod
+    def _etag(body):
+        return f'"{hashlib.md5(bytes(body)).hexdigest()}"'
@@ -0,0 +1,144 @@
+"""
+Drivers système de fichiers: local, montage NFS et partage SMB
+
+Les trois drivers accèdent aux fichiers par le système de fichiers; ils
+diffèrent par la taille des lectures et la profondeur de lecture anticipée
+(la latence d'un aller-retour NFS ou SMB domine le débit d'une lecture
+séquentielle simple).
+"""
+import os
+import shutil
+
+from .base import StorageBackend
+
+
+class FileWriter:
+    """Flux d'écriture d'un fichier (interface commune avec les uploads S3)"""
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.bytes_written = 0
+        self._file = open(path, 'wb')
+
+    def write(self, data):
+        self._file.write(data)
+        self.bytes_written += len(data)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._file.close()
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class FilesystemBackend(StorageBackend):
+    """Accès direct par le système de fichiers"""
+
+    def join(self, base, *parts):
+        return os.path.join(base, *parts)
+
+    def is_available(self, path):
+        return os.path.isdir(path)
+
+    def stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        is_dir = os.path.isdir(path)
+        return {'size': 0 if is_dir else st.st_size, 'modified': st.st_mtime, 'is_dir': is_dir}
+
+    def list(self, path):
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                is_dir = entry.is_dir()
+                st = entry.stat()
+                entries.append({
+                    'name': entry.name,
+                    'is_dir': is_dir,
+                    'size': 0 if is_dir else st.st_size,
+                    'modified': st.st_mtime,
+                })
+        return sorted(entries, key=lambda e: e['name'])
+
+    def read_range(self, path, offset, length):
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def open_write(self, path, fsync=False, size_hint=None):
+        return FileWriter(path, fsync=fsync)
+
+    def makedirs(self, path):
+        os.makedirs(path, exist_ok=True)
+
+    def delete(self, path):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+    def rename_atomic(self, src, dst):
+        os.replace(src, dst)
+
+    def list_files(self, path):
+        if os.path.isfile(path):
+            return {os.path.basename(path): {'size': os.path.getsize(path), 'modified': os.path.getmtime(path)}}
+
+        files = {}
+        for root, _, names in os.walk(path):
+            for name in names:
+                file_path = os.path.join(root, name)
+                relative = os.path.relpath(file_path, path).replace(os.sep, '/')
+                files[relative] = {'size': os.path.getsize(file_path), 'modified': os.path.getmtime(file_path)}
+        return files
+
+
+class LocalBackend(FilesystemBackend):
+    """Disque local: lecture anticipée du noyau, un bloc d'avance suffit"""
+
+    readahead = 2
+
+
+class NFSBackend(FilesystemBackend):
+    """
+    Montage NFS
+
+    Le renommage est atomique sur un même export; les écritures sont
+    visibles des autres clients à la fermeture (close-to-open).
+    """
+
+    protocol = 'nfs'
+    readahead = 4
+
+
+class SMBBackend(FilesystemBackend):
+    """
+    Partage SMB/CIFS (chemin UNC ou montage cifs)
+
+    Lectures plus petites et plus nombreuses en parallèle: le débit d'une
+    session SMB est limité par les allers-retours (crédits SMB2).
+    """
+
+    protocol = 'smb'
+    read_chunk_size = 4 * 1024 * 1024
+    readahead = 8
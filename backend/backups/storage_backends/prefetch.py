@@ -0,0 +1,155 @@
+"""
+Lecteur avec lecture anticipée
+
+Les blocs suivants sont lus en arrière-plan (pool de threads) pendant que
+l'appelant traite le bloc courant: le débit d'une restauration, d'un calcul
+de checksum ou d'une copie n'est plus limité par la latence de chaque lecture
+(GET S3, aller-retour SMB/NFS).
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PrefetchReader:
+    """
+    Flux de lecture d'une plage d'un fichier (read / itération / close)
+
+    `readahead` lectures de `chunk_size` octets au plus sont en cours à la
+    fois; avec readahead=1 les lectures sont synchrones. Les petites lectures
+    (tarfile lit par blocs de 16 KB) avancent une position dans le bloc courant
+    sans recopier le reste du bloc.
+    """
+
+    def __init__(self, backend, path, offset=0, length=None, chunk_size=8 * 1024 * 1024, readahead=2):
+        self.backend = backend
+        self.path = path
+        if length is None:
+            length = max(0, backend.size(path) - offset)
+        self.size = length
+        self.chunk_size = max(1, chunk_size)
+        self.readahead = max(1, readahead)
+
+        self._next_offset = offset
+        self._end = offset + length
+        self._pending = deque()
+        self._chunk = b''  # bloc courant, consommé à partir de _chunk_pos
+        self._chunk_pos = 0
+        self._executor = None
+        if self.readahead > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.readahead, thread_name_prefix='storage-read')
+        self._closed = False
+
+    def _schedule(self):
+        while self._next_offset < self._end and len(self._pending) < self.readahead:
+            length = min(self.chunk_size, self._end - self._next_offset)
+            future = None
+            if self._executor:
+                future = self._executor.submit(self.backend.read_range, self.path, self._next_offset, length)
+            self._pending.append((self._next_offset, length, future))
+            self._next_offset += length
+
+    def next_chunk(self):
+        """Bloc suivant (b'' en fin de plage)"""
+        if self._closed:
+            raise ValueError("Lecture sur un flux fermé")
+        self._schedule()
+        if not self._pending:
+            return b''
+
+        offset, length, future = self._pending.popleft()
+        data = future.result() if future else self.backend.read_range(self.path, offset, length)
+        if len(data) < length:
+            # Fichier tronqué depuis le stat: arrêt après ce bloc
+            for _, _, pending in self._pending:
+                if pending:
+                    pending.cancel()
+            self._pending.clear()
+            self._end = self._next_offset = offset + len(data)
+        else:
+            self._schedule()
+        return data
+
+    def _take(self, size):
+        """Jusqu'à size octets du bloc courant (vue sans copie), en chargeant le bloc suivant si besoin"""
+        if self._chunk_pos >= len(self._chunk):
+            self._chunk = self.next_chunk()
+            self._chunk_pos = 0
+            if not self._chunk:
+                return None
+        view = memoryview(self._chunk)[self._chunk_pos:self._chunk_pos + size]
+        self._chunk_pos += len(view)
+        return view
+
+    def _rest_of_chunk(self):
+        """Reste du bloc courant (b'' s'il est entièrement consommé)"""
+        if self._chunk_pos >= len(self._chunk):
+            return b''
+        data = self._chunk if self._chunk_pos == 0 else self._chunk[self._chunk_pos:]
+        self._chunk, self._chunk_pos = b'', 0
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            parts = [self._rest_of_chunk()]
+            while True:
+                chunk = self.next_chunk()
+                if not chunk:
+                    break
+                parts.append(chunk)
+            return b''.join(parts)
+
+        view = self._take(size)
+        if view is None:
+            return b''
+        if len(view) == size:
+            return bytes(view)
+
+        # Lecture à cheval sur deux blocs
+        parts = [view]
+        remaining = size - len(view)
+        while remaining:
+            view = self._take(remaining)
+            if view is None:
+                break
+            parts.append(view)
+            remaining -= len(view)
+        return b''.join(parts)
+
+    def readinto(self, buffer):
+        """Remplit buffer (bytearray / memoryview) sans objet bytes intermédiaire"""
+        target = memoryview(buffer).cast('B')
+        filled = 0
+        while filled < len(target):
+            view = self._take(len(target) - filled)
+            if view is None:
+                break
+            target[filled:filled + len(view)] = view
+            filled += len(view)
+        return filled
+
+    def __iter__(self):
+        data = self._rest_of_chunk()
+        if data:
+            yield data
+        while True:
+            chunk = self.next_chunk()
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._executor:
+            for _, _, future in self._pending:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+        self._pending.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
@@ -0,0 +1,320 @@
+"""
+Backend stockage objet S3 (AWS, MinIO, Ceph RGW...)
+
+Les fichiers sont des objets s3://bucket/clé; les dossiers sont des préfixes.
+Les écritures en flux (VMDK téléchargés depuis ESXi) sont envoyées en upload
+multipart, S3_UPLOAD_WORKERS parts en parallèle, sans fichier local
+intermédiaire: la mémoire utilisée est bornée à (S3_UPLOAD_WORKERS + 1) parts
+de S3_MULTIPART_PART_MB, l'écriture bloque tant qu'aucune part n'est libérée.
+Un upload est limité à 10 000 parts: la taille des parts est augmentée selon la
+taille annoncée de l'objet, ou au fil de l'upload si elle est inconnue.
+Les lectures (open_range, bloc CBT, fichier isolé) sont des GET avec Range,
+S3_DOWNLOAD_WORKERS en parallèle.
+
+Dépendance optionnelle: boto3.
+"""
+import logging
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .base import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Taille minimale d'une part S3 (sauf la dernière)
+MIN_PART_BYTES = 5 * MB
+# Nombre maximal de parts d'un upload multipart
+MAX_PARTS = 10000
+# Taille inconnue: la taille des parts double toutes les PART_GROWTH_INTERVAL parts
+# (32 Mo de départ: ~2 To en 10 000 parts, parts de 512 Mo au plus)
+PART_GROWTH_INTERVAL = 2000
+
+
+def split_url(path):
+    """s3://bucket/clé -> (bucket, clé)"""
+    bucket, _, key = path[len('s3://'):].partition('/')
+    return bucket, key.strip('/')
+
+
+class MultipartUploadWriter:
+    """
+    Flux d'écriture d'un objet en upload multipart parallèle
+
+    Un objet plus petit qu'une part est envoyé en un seul PUT à la fermeture.
+    Avec size_hint, les parts sont assez grandes pour que l'objet tienne en
+    MAX_PARTS parts; au-delà de la taille annoncée (ou sans taille annoncée),
+    la taille des parts double toutes les PART_GROWTH_INTERVAL parts.
+    """
+
+    def __init__(self, client, bucket, key, part_size, workers, size_hint=None):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(MIN_PART_BYTES, part_size)
+        if size_hint:
+            # Marge de 1% sur le nombre de parts (taille annoncée approximative)
+            self.part_size = max(self.part_size, -(-size_hint // (MAX_PARTS * 99 // 100)))
+        self.base_part_size = self.part_size
+        self.bytes_written = 0
+
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._part_number = 0
+        self._futures = []
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='s3-upload')
+        self._slots = threading.BoundedSemaphore(workers + 1)
+        self._closed = False
+
+    def _next_part_size(self):
+        return self.base_part_size * 2 ** (self._part_number // PART_GROWTH_INTERVAL)
+
+    def write(self, data):
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit(part)
+            self.part_size = self._next_part_size()
+
+    def _submit(self, body):
+        for future in self._futures:
+            if future.done() and future.exception():
+                raise future.exception()
+
+        if self._upload_id is None:
+            self._upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+
+        if self._part_number >= MAX_PARTS:
+            raise IOError(f"Upload de {self.key}: limite de {MAX_PARTS} parts S3 atteinte")
+
+        self._slots.acquire()
+        self._part_number += 1
+        future = self._executor.submit(self._upload_part, self._part_number, body)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    def _upload_part(self, part_number, body):
+        response = self.client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            PartNumber=part_number, Body=body
+        )
+        return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+    def close(self):
+        if self._closed:
+            return
+        try:
+            if self._upload_id is None:
+                self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer))
+            else:
+                if self._buffer:
+                    self._submit(bytes(self._buffer))
+                parts = [future.result() for future in self._futures]
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+                    MultipartUpload={'Parts': sorted(parts, key=lambda p: p['PartNumber'])}
+                )
+        except Exception:
+            self.abort()
+            raise
+        self._buffer = bytearray()
+        self._closed = True
+        self._executor.shutdown(wait=True)
+
+    def abort(self):
+        if self._closed:
+            return
+        self._closed = True
+        for future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        if self._upload_id is not None:
+            try:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+            except Exception as e:
+                logger.warning(f"[S3] Abandon de l'upload {self.key} en échec: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class S3Backend(StorageBackend):
+    """Accès à une RemoteStorageConfig S3"""
+
+    protocol = 's3'
+
+    def __init__(self, storage_config):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            from backups.remote_storage.storage_manager import StorageConnectionError
+            raise StorageConnectionError("boto3 n'est pas installé (pip install boto3)")
+
+        self.workers = max(1, getattr(settings, 'S3_UPLOAD_WORKERS', 4))
+        self.part_size = getattr(settings, 'S3_MULTIPART_PART_MB', 32) * MB
+        # Lectures séquentielles: GET partiels d'une part, en parallèle
+        self.read_chunk_size = self.part_size
+        self.readahead = max(1, getattr(settings, 'S3_DOWNLOAD_WORKERS', 8))
+        self.client = boto3.client(
+            's3',
+            endpoint_url=storage_config.get_endpoint_url(),
+            aws_access_key_id=storage_config.username or None,
+            aws_secret_access_key=storage_config.get_password() or None,
+            region_name=storage_config.region or 'us-east-1',
+            config=Config(
+                max_pool_connections=max(10, self.workers * 2),
+                s3={'addressing_style': getattr(settings, 'S3_ADDRESSING_STYLE', 'path')},
+                retries={'max_attempts': 5, 'mode': 'standard'},
+            ),
+        )
+
+    # ------------------------------------------------------------------
+    # Chemins
+    # ------------------------------------------------------------------
+    def join(self, base, *parts):
+        return posixpath.join(base, *(part.replace('\\', '/').strip('/') for part in parts))
+
+    def _is_missing(self, error):
+        code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    # ------------------------------------------------------------------
+    # Lecture
+    # ------------------------------------------------------------------
+    def is_available(self, path):
+        bucket, _ = split_url(path)
+        try:
+            self.client.head_bucket(Bucket=bucket)
+            return True
+        except Exception:
+            return False
+
+    def stat(self, path):
+        """Objet (HEAD) ou préfixe non vide (dossier)"""
+        bucket, key = split_url(path)
+        if key:
+            try:
+                response = self.client.head_object(Bucket=bucket, Key=key)
+                return {
+                    'size': response['ContentLength'],
+                    'modified': response['LastModified'].timestamp(),
+                    'is_dir': False,
+                }
+            except Exception as e:
+                if not self._is_missing(e):
+                    raise
+        response = self.client.list_objects_v2(Bucket=bucket, Prefix=f'{key}/' if key else '', MaxKeys=1)
+        if response.get('KeyCount', 0) == 0:
+            return None
+        return {'size': 0, 'modified': response['Contents'][0]['LastModified'].timestamp(), 'is_dir': True}
+
+    def list(self, path):
+        bucket, key = split_url(path)
+        prefix = f'{key}/' if key else ''
+        entries = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter='/'):
+            for common in page.get('CommonPrefixes', []):
+                entries.append({
+                    'name': common['Prefix'][len(prefix):].rstrip('/'),
+                    'is_dir': True, 'size': 0, 'modified': None,
+                })
+            for obj in page.get('Contents', []):
+                entries.append({
+                    'name': obj['Key'][len(prefix):],
+                    'is_dir': False,
+                    'size': obj['Size'],
+                    'modified': obj['LastModified'].timestamp(),
+                })
+        return sorted(entries, key=lambda e: e['name'])
+
+    def read_bytes(self, path):
+        bucket, key = split_url(path)
+        return self.client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    def read_range(self, path, offset, length):
+        if length <= 0:
+            return b''
+        bucket, key = split_url(path)
+        response = self.client.get_object(Bucket=bucket, Key=key, Range=f'bytes={offset}-{offset + length - 1}')
+        return response['Body'].read()
+
+    def list_files(self, path):
+        bucket, key = split_url(path)
+        prefix = f'{key}/' if key else ''
+        files = {}
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                files[obj['Key'][len(prefix):]] = {
+                    'size': obj['Size'],
+                    'modified': obj['LastModified'].timestamp(),
+                }
+        return files
+
+    def download(self, path, local_path):
+        """Téléchargement en GET partiels parallèles (S3_DOWNLOAD_WORKERS)"""
+        from boto3.s3.transfer import TransferConfig
+
+        bucket, key = split_url(path)
+        self.client.download_file(bucket, key, local_path, Config=TransferConfig(
+            multipart_chunksize=self.part_size,
+            max_concurrency=self.readahead,
+        ))
+
+    # ------------------------------------------------------------------
+    # Écriture
+    # ------------------------------------------------------------------
+    def makedirs(self, path):
+        """Pas de dossiers en stockage objet"""
+
+    def write_bytes(self, path, data):
+        bucket, key = split_url(path)
+        self.client.put_object(Bucket=bucket, Key=key, Body=data)
+
+    def open_write(self, path, fsync=False, size_hint=None):
+        bucket, key = split_url(path)
+        return MultipartUploadWriter(self.client, bucket, key, self.part_size, self.workers, size_hint=size_hint)
+
+    def rename_atomic(self, src, dst):
+        """
+        Copie côté serveur puis suppression de la source
+
+        Un objet S3 est remplacé en une fois: les lecteurs de dst voient
+        l'ancien ou le nouvel objet complet.
+        """
+        from boto3.s3.transfer import TransferConfig
+
+        src_bucket, src_key = split_url(src)
+        dst_bucket, dst_key = split_url(dst)
+        self.client.copy(
+            {'Bucket': src_bucket, 'Key': src_key}, dst_bucket, dst_key,
+            Config=TransferConfig(multipart_chunksize=self.part_size, max_concurrency=self.workers),
+        )
+        self.client.delete_object(Bucket=src_bucket, Key=src_key)
+
+    def delete(self, path):
+        bucket, key = split_url(path)
+        self.client.delete_object(Bucket=bucket, Key=key)
+
+        batch = []
+        for page in self.client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=f'{key}/'):
+            for obj in page.get('Contents', []):
+                batch.append({'Key': obj['Key']})
+                if len(batch) == 1000:
+                    self.client.delete_objects(Bucket=bucket, Delete={'Objects': batch})
+                    batch = []
+        if batch:
+            self.client.delete_objects(Bucket=bucket, Delete={'Objects': batch})
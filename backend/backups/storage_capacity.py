@@ -0,0 +1,480 @@
+"""
+Capacité des cibles de sauvegarde: prévision, réservation et admission des jobs
+
+Auparavant l'espace libre n'était vérifié qu'à la connexion au stockage
+(avertissement sous 1 GB): un job lancé sur une cible presque pleine échouait
+sur ENOSPC après des heures de téléchargement. Chaque job est maintenant admis
+sur une cible avant le premier octet transféré:
+
+1. taille prévue: historique de la chaîne de la VM (derniers jobs du même type)
+   et, pour un incrémental, taux de changement CBT mesuré par les agrégats
+   (octets incrémentaux par heure x heures depuis le dernier backup), majorée
+   de STORAGE_CAPACITY_SAFETY_FACTOR;
+2. marge de la cible: espace libre - réservations des jobs en cours (moins ce
+   qu'ils ont déjà écrit) - STORAGE_CAPACITY_MIN_FREE_GB;
+3. si le job tient, une StorageReservation est créée (supprimée à la fin du
+   job); sinon le job est redirigé vers un autre chemin de sauvegarde actif
+   qui a la place (backups full sans stockage distant uniquement: une chaîne
+   incrémentale reste sur sa cible) ou refusé (StorageCapacityExceeded).
+
+Une cible est une RemoteStorageConfig (remote:<id>), un StoragePath
+(path:<id>) ou, à défaut, le dossier du job (dir:<chemin>). La prévision du
+nombre de jours avant saturation utilise le volume écrit par jour sur la cible
+(agrégats BackupRollup des dimensions 'storage' et 'storage_path').
+"""
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 ** 3
+
+# Opération -> champ du dossier de destination du job
+LOCATION_FIELDS = {
+    'backup_job': 'backup_location',
+    'vm_backup': 'backup_location',
+    'ovf_export': 'export_location',
+}
+
+
+class StorageCapacityExceeded(Exception):
+    """Aucune cible n'a la place pour la taille prévue du job"""
+
+
+def _normalize_path(path):
+    """Chemin comparable (séparateurs unifiés, sans séparateur final)"""
+    return str(path or '').replace('\\', '/').rstrip('/')
+
+
+class StorageCapacityService:
+    """
+    Modèle de capacité par cible de sauvegarde
+    """
+
+    LOCK_PREFIX = 'storage_capacity:lock'
+
+    # ------------------------------------------------------------------
+    # Cibles
+    # ------------------------------------------------------------------
+    @staticmethod
+    def target_for_remote_storage(config):
+        return {
+            'key': f'remote:{config.id}',
+            'kind': 'remote',
+            'id': config.id,
+            'name': config.name,
+            'path': config.get_full_path(),
+        }
+
+    @staticmethod
+    def target_for_storage_path(storage_path):
+        return {
+            'key': f'path:{storage_path.id}',
+            'kind': 'path',
+            'id': storage_path.id,
+            'name': storage_path.name,
+            'path': storage_path.path,
+            'root': storage_path.path,
+            'tier': storage_path.tier,
+        }
+
+    @staticmethod
+    def match_storage_path(location):
+        """
+        StoragePath actif contenant un dossier (préfixe le plus long)
+
+        Returns:
+            StoragePath ou None
+        """
+        from backups.models import StoragePath
+
+        location = _normalize_path(location)
+        if not location:
+            return None
+        best = None
+        for storage_path in StoragePath.objects.filter(is_active=True).only('id', 'name', 'path', 'tier'):
+            prefix = _normalize_path(storage_path.path)
+            if prefix and (location == prefix or location.startswith(prefix + '/')):
+                if best is None or len(prefix) > len(_normalize_path(best.path)):
+                    best = storage_path
+        return best
+
+    def resolve_target(self, location=None, remote_storage=None):
+        """
+        Cible d'un job à partir de son dossier de destination et de son stockage distant
+
+        Le dossier de destination est l'endroit où les fichiers sont écrits: il
+        sert à mesurer l'espace libre quand il est renseigné.
+        """
+        storage_path = self.match_storage_path(location)
+        if storage_path is not None:
+            target = self.target_for_storage_path(storage_path)
+        elif remote_storage is not None:
+            target = self.target_for_remote_storage(remote_storage)
+        else:
+            path = _normalize_path(location) or '/'
+            target = {'key': f'dir:{path}'[:255], 'kind': 'dir', 'id': None, 'name': path, 'path': path}
+        if location:
+            target['path'] = location
+        return target
+
+    def job_target(self, operation, job):
+        location = getattr(job, LOCATION_FIELDS[operation], None)
+        return self.resolve_target(location, job.remote_storage if job.remote_storage_id else None)
+
+    # ------------------------------------------------------------------
+    # Mesures
+    # ------------------------------------------------------------------
+    @staticmethod
+    def free_bytes(target):
+        """
+        Espace libre du système de fichiers de la cible (None si non mesurable)
+
+        Le dossier du job n'existe pas encore avant le premier backup: l'espace
+        est mesuré sur son plus proche parent existant. Un stockage objet (S3)
+        n'a pas de limite mesurable.
+        """
+        from backups.storage_backends import is_object_path
+
+        path = target['path']
+        if is_object_path(path):
+            return None
+        try:
+            while path and not os.path.exists(path):
+                parent = os.path.dirname(path.rstrip('/\\'))
+                if parent == path:
+                    break
+                path = parent
+            return shutil.disk_usage(path or '/').free
+        except Exception as e:
+            logger.warning(f"[STORAGE-CAPACITY] Espace libre non mesurable pour {target['name']}: {e}")
+            return None
+
+    @staticmethod
+    def reserved_bytes(target_key, exclude=None):
+        """
+        Espace encore réservé sur une cible par les jobs admis non terminés
+
+        Ce qu'un job a déjà écrit (downloaded_bytes) est déjà déduit de
+        l'espace libre: seul le reste de sa réservation est compté.
+
+        Args:
+            exclude: (operation, job_id) à ne pas compter
+        """
+        from django.apps import apps
+        from backups.models import StorageReservation
+        from backups.tenant_scheduler import TRANSFER_JOBS
+
+        reservations = StorageReservation.objects.filter(target_key=target_key, expires_at__gt=timezone.now())
+        if exclude:
+            reservations = reservations.exclude(operation=exclude[0], job_id=exclude[1])
+
+        by_operation = {}
+        for operation, job_id, reserved in reservations.values_list('operation', 'job_id', 'reserved_bytes'):
+            by_operation.setdefault(operation, {})[job_id] = reserved
+
+        total = 0
+        for operation, jobs in by_operation.items():
+            written = {}
+            if operation in TRANSFER_JOBS:
+                model = apps.get_model('backups', TRANSFER_JOBS[operation][0])
+                if hasattr(model, 'downloaded_bytes'):
+                    written = dict(model.objects.filter(id__in=jobs).values_list('id', 'downloaded_bytes'))
+            total += sum(max(0, reserved - (written.get(job_id) or 0)) for job_id, reserved in jobs.items())
+        return total
+
+    def headroom_bytes(self, target, exclude=None):
+        """Place disponible pour un nouveau job (None si l'espace libre n'est pas mesurable)"""
+        free = self.free_bytes(target)
+        if free is None:
+            return None
+        min_free = getattr(settings, 'STORAGE_CAPACITY_MIN_FREE_GB', 1) * GB
+        return free - self.reserved_bytes(target['key'], exclude=exclude) - min_free
+
+    # ------------------------------------------------------------------
+    # Taille prévue
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _change_rate_bytes_per_hour(vm):
+        """Taux de changement CBT de la VM (volume des incrémentaux / durée de la fenêtre)"""
+        from backups.rollup_service import rollup_service
+
+        days = getattr(settings, 'STORAGE_FORECAST_WINDOW_DAYS', 14)
+        totals = rollup_service.totals(
+            dimension='vm', dimension_id=vm.id, since=timezone.now() - timedelta(days=days)
+        )
+        return totals['incremental_bytes'] / (days * 24) if totals['incremental_jobs'] else 0
+
+    def predict_size_bytes(self, vm, operation, incremental=False):
+        """
+        Taille prévue d'un job
+
+        - full / export: plus grand des derniers jobs terminés du même type sur
+          la VM, sinon taille des disques;
+        - incrémental: plus grand des derniers incrémentaux et du taux de
+          changement CBT x heures écoulées depuis le dernier backup terminé;
+          sans historique, comme un full.
+
+        Returns:
+            int: Taille en octets, majorée de STORAGE_CAPACITY_SAFETY_FACTOR
+        """
+        from django.apps import apps
+        from backups.rollup_service import JOB_SOURCES
+
+        history = getattr(settings, 'STORAGE_CAPACITY_HISTORY_JOBS', 5)
+        factor = getattr(settings, 'STORAGE_CAPACITY_SAFETY_FACTOR', 1.2)
+        full_bytes = (vm.disk_gb or 0) * GB
+
+        if operation not in JOB_SOURCES:
+            return int(full_bytes * factor)
+
+        model_label, size_field, type_field = JOB_SOURCES[operation]
+        model = apps.get_model(model_label)
+        completed = model.objects.filter(virtual_machine=vm, status='completed')
+        same_type = completed
+        if type_field:
+            same_type = completed.filter(**{type_field: 'incremental' if incremental else 'full'})
+        sizes = list(same_type.order_by('-completed_at').values_list(size_field, flat=True)[:history])
+        history_bytes = max(sizes) * 1024 * 1024 if sizes and max(sizes) else 0
+
+        if not incremental:
+            return int((history_bytes or full_bytes) * factor)
+
+        estimate = history_bytes
+        last_completed_at = completed.order_by('-completed_at').values_list('completed_at', flat=True).first()
+        if last_completed_at:
+            hours = max(0.0, (timezone.now() - last_completed_at).total_seconds() / 3600)
+            estimate = max(estimate, self._change_rate_bytes_per_hour(vm) * hours)
+        if not estimate:
+            return self.predict_size_bytes(vm, operation, incremental=False)
+        return int(estimate * factor)
+
+    @staticmethod
+    def is_incremental(operation, job):
+        from backups.rollup_service import JOB_SOURCES
+
+        type_field = JOB_SOURCES.get(operation, (None, None, None))[2]
+        return bool(type_field) and getattr(job, type_field) == 'incremental'
+
+    # ------------------------------------------------------------------
+    # Admission
+    # ------------------------------------------------------------------
+    @contextmanager
+    def _target_lock(self, target_key, wait_seconds=10):
+        """
+        Section critique par cible entre processus (cache.add atomique sur le
+        cache partagé, voir le check backups.E001)
+
+        Deux admissions simultanées sur une même cible ne doivent pas voir
+        toutes les deux la même marge.
+        """
+        key = f'{self.LOCK_PREFIX}:{target_key}'
+        deadline = time.monotonic() + wait_seconds
+        acquired = cache.add(key, 1, timeout=30)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(0.05)
+            acquired = cache.add(key, 1, timeout=30)
+        if not acquired:
+            logger.warning(f"[STORAGE-CAPACITY] Verrou {target_key} non obtenu, admission sans verrou")
+        try:
+            yield
+        finally:
+            if acquired:
+                cache.delete(key)
+
+    @staticmethod
+    def _reserve(target_key, operation, job_id, size_bytes):
+        from backups.models import StorageReservation
+        from backups.task_routing import transfer_time_limits
+
+        now = timezone.now()
+        StorageReservation.objects.filter(target_key=target_key, expires_at__lte=now).delete()
+        lifetime = transfer_time_limits(size_bytes / GB)['time_limit']
+        StorageReservation.objects.update_or_create(
+            operation=operation,
+            job_id=job_id,
+            defaults={
+                'target_key': target_key,
+                'reserved_bytes': size_bytes,
+                'expires_at': now + timedelta(seconds=lifetime),
+            }
+        )
+
+    def reroute_candidates(self, current):
+        """Chemins de sauvegarde actifs autres que la cible courante"""
+        from backups.models import StoragePath
+
+        return [
+            self.target_for_storage_path(storage_path)
+            for storage_path in StoragePath.objects.filter(is_active=True).exclude(
+                id=current['id'] if current['kind'] == 'path' else None
+            )
+        ]
+
+    def admit(self, operation, job_id, vm, target, incremental=False, candidates=(), predicted=None):
+        """
+        Admet un job sur une cible (ou une cible de repli) et réserve sa taille prévue
+
+        Args:
+            operation: 'backup_job' | 'vm_backup' | 'ovf_export' | 'replication'
+            job_id: ID du job (clé de la réservation)
+            vm: VM sauvegardée, exportée ou répliquée
+            target: Cible demandée (resolve_target)
+            incremental: Job incrémental (taille prévue d'après le taux de changement)
+            candidates: Cibles de repli, essayées par marge décroissante
+            predicted: Taille prévue en octets (calculée si None)
+
+        Returns:
+            dict: Cible retenue
+
+        Raises:
+            StorageCapacityExceeded: Si aucune cible n'a la place
+        """
+        if not getattr(settings, 'STORAGE_CAPACITY_ENFORCED', True):
+            return target
+
+        if predicted is None:
+            predicted = self.predict_size_bytes(vm, operation, incremental=incremental)
+        exclude = (operation, job_id)
+
+        with self._target_lock(target['key']):
+            headroom = self.headroom_bytes(target, exclude=exclude)
+            if headroom is None or headroom >= predicted:
+                self._reserve(target['key'], operation, job_id, predicted)
+                return target
+
+        refused = [f"{target['name']}: {max(0, headroom) / GB:.1f} GB"]
+        ranked = sorted(
+            ((self.headroom_bytes(candidate, exclude=exclude), candidate) for candidate in candidates),
+            key=lambda item: -(item[0] or 0)
+        )
+        for _, candidate in ranked:
+            with self._target_lock(candidate['key']):
+                headroom = self.headroom_bytes(candidate, exclude=exclude)
+                if headroom is not None and headroom >= predicted:
+                    self._reserve(candidate['key'], operation, job_id, predicted)
+                    logger.warning(
+                        f"[STORAGE-CAPACITY] {operation} #{job_id} ({vm.name}, {predicted / GB:.1f} GB prévus) "
+                        f"redirigé de {target['name']} vers {candidate['name']}"
+                    )
+                    return candidate
+                refused.append(f"{candidate['name']}: {max(0, headroom or 0) / GB:.1f} GB")
+
+        message = (
+            f"Espace insuffisant pour {vm.name}: {predicted / GB:.1f} GB prévus, "
+            f"place disponible {', '.join(refused)}"
+        )
+        logger.warning(f"[STORAGE-CAPACITY] {operation} #{job_id} refusé: {message}")
+        raise StorageCapacityExceeded(message)
+
+    @staticmethod
+    def relocate(location, source, destination):
+        """Même sous-dossier que location (relatif à la cible source) sur la cible destination"""
+        relative = ''
+        root = _normalize_path(source.get('root'))
+        location = _normalize_path(location)
+        if root and location.startswith(root + '/'):
+            relative = location[len(root) + 1:]
+        return os.path.join(destination['root'], relative) if relative else destination['root']
+
+    def admit_job(self, operation, job):
+        """
+        Admet un job de backup/export avant son lancement
+
+        Un backup full sans stockage distant dont le dossier est sur un chemin
+        de sauvegarde est placé sur le meilleur chemin du même tier (voir
+        backups.storage_placement), puis redirigé vers un autre chemin actif
+        si aucun n'a la place. Son dossier de destination est alors modifié
+        (avant le calcul du chemin complet par l'appelant).
+
+        Raises:
+            StorageCapacityExceeded
+        """
+        incremental = self.is_incremental(operation, job)
+        requested = self.job_target(operation, job)
+        target, candidates, predicted = requested, [], None
+
+        if not incremental and not job.remote_storage_id:
+            if requested['kind'] == 'path' and getattr(settings, 'STORAGE_PLACEMENT_ENABLED', True):
+                from backups.storage_placement import storage_placement
+
+                predicted = self.predict_size_bytes(job.virtual_machine, operation)
+                ranked = storage_placement.rank(storage_placement.tier_pool(requested), predicted)
+                if ranked:
+                    target, candidates = ranked[0], ranked[1:]
+            if getattr(settings, 'STORAGE_CAPACITY_REROUTE', True):
+                tried = {target['key']} | {candidate['key'] for candidate in candidates}
+                candidates += [
+                    candidate for candidate in self.reroute_candidates(target) if candidate['key'] not in tried
+                ]
+
+        chosen = self.admit(
+            operation, job.id, job.virtual_machine, target, incremental, candidates, predicted=predicted
+        )
+        if chosen['key'] != requested['key']:
+            field = LOCATION_FIELDS[operation]
+            setattr(job, field, self.relocate(getattr(job, field), requested, chosen))
+            job.save(update_fields=[field])
+            logger.info(f"[STORAGE-CAPACITY] {operation} #{job.id} placé sur {chosen['name']}: {getattr(job, field)}")
+        return chosen
+
+    @staticmethod
+    def release(operation, job_id):
+        """Libère la réservation d'un job terminé"""
+        from backups.models import StorageReservation
+
+        StorageReservation.objects.filter(operation=operation, job_id=job_id).delete()
+
+    # ------------------------------------------------------------------
+    # Prévision
+    # ------------------------------------------------------------------
+    def forecast(self, target):
+        """
+        Prévision de saturation d'une cible
+
+        La croissance est le volume écrit par jour sur la fenêtre
+        STORAGE_FORECAST_WINDOW_DAYS (sans déduire les purges de rétention:
+        estimation prudente).
+
+        Returns:
+            dict: free_gb, reserved_gb, available_gb, daily_growth_gb, days_to_full (None si pas de croissance)
+        """
+        from backups.rollup_service import rollup_service
+
+        free = self.free_bytes(target)
+        reserved = self.reserved_bytes(target['key'])
+        days = getattr(settings, 'STORAGE_FORECAST_WINDOW_DAYS', 14)
+
+        dimension = {'remote': 'storage', 'path': 'storage_path'}.get(target['kind'])
+        daily_growth = 0
+        if dimension:
+            totals = rollup_service.totals(
+                dimension=dimension, dimension_id=target['id'], since=timezone.now() - timedelta(days=days)
+            )
+            daily_growth = totals['bytes_moved'] / days
+
+        available = None
+        if free is not None:
+            available = max(0, free - reserved - getattr(settings, 'STORAGE_CAPACITY_MIN_FREE_GB', 1) * GB)
+        return {
+            'target': target['key'],
+            'name': target['name'],
+            'free_gb': round(free / GB, 2) if free is not None else None,
+            'reserved_gb': round(reserved / GB, 2),
+            'available_gb': round(available / GB, 2) if available is not None else None,
+            'daily_growth_gb': round(daily_growth / GB, 2),
+            'days_to_full': round(available / daily_growth, 1) if available is not None and daily_growth else None,
+            'window_days': days,
+        }
+
+
+# Instance globale
+storage_capacity = StorageCapacityService()
@@ -0,0 +1,334 @@
+"""
+Placement automatique des backups sur les chemins de sauvegarde et tiering
+
+Plusieurs StoragePath peuvent être actifs, répartis en deux tiers:
+- performance: reçoit les nouveaux backups;
+- capacité: reçoit les backups plus anciens que STORAGE_TIERING_AGE_DAYS.
+
+Placement: un backup full dont le dossier est sur un chemin de sauvegarde est
+placé sur le chemin du même tier qui a la place et le meilleur débit attendu,
+débit d'écriture mesuré / (1 + jobs en cours sur le chemin). Le débit et
+l'espace libre sont mesurés par une sonde périodique (probe_storage_targets),
+la charge est le nombre de réservations de stockage en cours (voir
+backups.storage_capacity).
+
+Tiering: tier_aged_backups déplace les backups terminés anciens du tier
+performance vers le tier capacité, à débit limité (STORAGE_TIERING_MAX_MB_PER_SECOND)
+et dans la limite d'un volume par exécution. Le chemin du job et, pour les
+chaînes de backup, l'emplacement du point de restauration dans chain.json sont
+mis à jour: les restaurations lisent les données là où elles se trouvent.
+"""
+import logging
+import os
+import shutil
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from backups.storage_backends import FilesystemBackend, backend_for_path
+from backups.storage_capacity import GB, storage_capacity
+
+logger = logging.getLogger(__name__)
+
+PROBE_FILE = '.placement_probe'
+
+# Opération -> (modèle, champ dossier de base, champ chemin complet)
+TIERED_JOBS = {
+    'backup_job': ('BackupJob', 'backup_location', 'backup_full_path'),
+    'vm_backup': ('VMBackupJob', 'backup_location', 'backup_full_path'),
+    'ovf_export': ('OVFExportJob', 'export_location', 'export_full_path'),
+}
+
+
+def _tree_size(path):
+    return sum(f['size'] for f in backend_for_path(path).list_files(path).values())
+
+
+class StoragePlacementService:
+    """
+    Sonde des chemins de sauvegarde, choix de la cible d'un job et tiering
+    """
+
+    PROBE_PREFIX = 'storage_probe'
+
+    # ------------------------------------------------------------------
+    # Sonde
+    # ------------------------------------------------------------------
+    def probe(self, target):
+        """
+        Mesure l'espace libre et le débit d'écriture d'une cible
+
+        Écrit STORAGE_PROBE_WRITE_MB de données aléatoires (non compressibles)
+        avec fsync (upload sur un stockage S3), puis supprime le fichier. Le résultat est gardé en cache
+        pendant trois intervalles de sonde.
+
+        Returns:
+            dict: {'free_bytes', 'write_mbps', 'probed_at', 'error'}
+        """
+        from backups.storage_backends import backend_for_path
+
+        size_mb = max(1, getattr(settings, 'STORAGE_PROBE_WRITE_MB', 64))
+        result = {'free_bytes': None, 'write_mbps': None, 'probed_at': timezone.now().isoformat(), 'error': None}
+        backend = None
+
+        try:
+            backend = backend_for_path(target['path'])
+            probe_file = backend.join(target['path'], PROBE_FILE)
+            block = os.urandom(1024 * 1024)
+            start = time.monotonic()
+            with backend.open_write(probe_file, fsync=True) as f:
+                for _ in range(size_mb):
+                    f.write(block)
+            elapsed = max(time.monotonic() - start, 1e-6)
+            result['write_mbps'] = round(size_mb / elapsed, 1)
+            result['free_bytes'] = storage_capacity.free_bytes(target)
+        except Exception as e:
+            result['error'] = str(e)
+            logger.warning(f"[STORAGE-PLACEMENT] Sonde de {target['name']} en échec: {e}")
+        finally:
+            try:
+                if backend is not None:
+                    backend.delete(probe_file)
+            except Exception:
+                pass
+
+        interval = getattr(settings, 'STORAGE_PROBE_INTERVAL_SECONDS', 300)
+        cache.set(f"{self.PROBE_PREFIX}:{target['key']}", result, timeout=interval * 3)
+        return result
+
+    def probe_all(self):
+        """
+        Sonde tous les chemins de sauvegarde actifs
+
+        Returns:
+            dict: {nom du chemin: résultat de la sonde}
+        """
+        from backups.models import StoragePath
+
+        results = {}
+        for storage_path in StoragePath.objects.filter(is_active=True):
+            target = storage_capacity.target_for_storage_path(storage_path)
+            results[storage_path.name] = self.probe(target)
+        return results
+
+    def last_probe(self, target):
+        """Dernier résultat de sonde (None si expiré ou jamais sondé)"""
+        return cache.get(f"{self.PROBE_PREFIX}:{target['key']}")
+
+    # ------------------------------------------------------------------
+    # Placement
+    # ------------------------------------------------------------------
+    @staticmethod
+    def tier_pool(target, tier=None):
+        """Chemins de sauvegarde actifs du tier de la cible (ou du tier donné)"""
+        from backups.models import StoragePath
+
+        tier = tier or target.get('tier')
+        if not tier:
+            return [target]
+        return [
+            storage_capacity.target_for_storage_path(storage_path)
+            for storage_path in StoragePath.objects.filter(is_active=True, tier=tier)
+        ]
+
+    @staticmethod
+    def loads(target_keys):
+        """Jobs en cours (réservations non expirées) par cible"""
+        from backups.models import StorageReservation
+
+        rows = StorageReservation.objects.filter(
+            target_key__in=target_keys, expires_at__gt=timezone.now()
+        ).values('target_key').annotate(jobs=Count('id'))
+        return {row['target_key']: row['jobs'] for row in rows}
+
+    def rank(self, targets, size_bytes=0):
+        """
+        Classe des cibles pour un job de taille prévue size_bytes
+
+        Ordre: cibles saines qui ont la place, par débit attendu
+        (débit d'écriture mesuré / (1 + jobs en cours)) puis par marge;
+        ensuite les autres. Une cible jamais sondée est créditée de
+        STORAGE_PLACEMENT_DEFAULT_WRITE_MBPS.
+
+        Returns:
+            list: Cibles, la meilleure en premier
+        """
+        default_mbps = getattr(settings, 'STORAGE_PLACEMENT_DEFAULT_WRITE_MBPS', 100)
+        loads = self.loads([target['key'] for target in targets])
+
+        scored = []
+        for target in targets:
+            probe = self.last_probe(target) or {}
+            healthy = not probe.get('error')
+            headroom = storage_capacity.headroom_bytes(target)
+            fits = headroom is None or headroom >= size_bytes
+            throughput = (probe.get('write_mbps') or default_mbps) / (1 + loads.get(target['key'], 0))
+            target['expected_write_mbps'] = round(throughput, 1)
+            scored.append((healthy and fits, throughput, headroom or 0, target))
+
+        scored.sort(key=lambda item: (item[0], item[1], item[2]), reverse=True)
+        return [target for *_, target in scored]
+
+    # ------------------------------------------------------------------
+    # Tiering
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _copy(source, destination, limiter=None):
+        """
+        Copie un fichier ou un dossier par blocs (lecture anticipée côté
+        source), au débit du limiteur
+
+        Returns:
+            int: Octets copiés
+        """
+        src_backend = backend_for_path(source)
+        dst_backend = backend_for_path(destination)
+
+        if src_backend.stat(source)['is_dir']:
+            pairs = [
+                (src_backend.join(source, *relative.split('/')), dst_backend.join(destination, *relative.split('/')))
+                for relative in sorted(src_backend.list_files(source))
+            ]
+        else:
+            pairs = [(source, destination)]
+
+        def limited(reader):
+            for chunk in reader:
+                if limiter is not None:
+                    limiter.consume(len(chunk))
+                yield chunk
+
+        copied = 0
+        for src, dst in pairs:
+            dst_backend.makedirs(os.path.dirname(dst))
+            with src_backend.open_range(src) as reader:
+                copied += dst_backend.write_stream(dst, limited(reader), size_hint=reader.size)
+            if isinstance(src_backend, FilesystemBackend) and isinstance(dst_backend, FilesystemBackend):
+                shutil.copystat(src, dst)
+        return copied
+
+    @staticmethod
+    def _busy_vm_ids():
+        """VMs avec un job en attente ou en cours (chaîne en cours d'écriture)"""
+        from django.apps import apps
+        from backups.tenant_scheduler import IN_FLIGHT_STATUSES
+
+        busy = set()
+        for model_name, _, _ in TIERED_JOBS.values():
+            busy.update(apps.get_model('backups', model_name).objects.filter(
+                status__in=IN_FLIGHT_STATUSES
+            ).values_list('virtual_machine_id', flat=True))
+        return busy
+
+    def move_job(self, operation, job, source, destination, limiter=None):
+        """
+        Déplace les fichiers d'un job terminé vers une autre cible
+
+        Copie, vérifie la taille, met à jour le job (et la chaîne), puis
+        supprime la source. En cas d'échec, la source reste intacte.
+
+        Returns:
+            int: Octets déplacés
+        """
+        _, location_field, path_field = TIERED_JOBS[operation]
+        source_path = getattr(job, path_field)
+        destination_path = storage_capacity.relocate(source_path, source, destination)
+        expected = _tree_size(source_path)
+
+        try:
+            copied = self._copy(source_path, destination_path, limiter)
+            if copied != expected or _tree_size(destination_path) != expected:
+                raise IOError(f"Copie incomplète de {source_path} ({copied}/{expected} octets)")
+        except Exception:
+            try:
+                backend_for_path(destination_path).delete(destination_path)
+            except Exception as e:
+                logger.warning(f"[STORAGE-PLACEMENT] Nettoyage de {destination_path} en échec: {e}")
+            raise
+
+        setattr(job, location_field, storage_capacity.relocate(getattr(job, location_field), source, destination))
+        setattr(job, path_field, destination_path)
+        job.save(update_fields=[location_field, path_field])
+
+        if operation == 'backup_job' and job.remote_storage_id:
+            from backups.backup_chain import BackupChainManager
+
+            chain_manager = BackupChainManager(job.remote_storage, job.virtual_machine.name)
+            chain_manager.set_backup_location(os.path.basename(source_path.rstrip('/\\')), destination_path)
+
+        backend_for_path(source_path).delete(source_path)
+        logger.info(
+            f"[STORAGE-PLACEMENT] {operation} #{job.id} déplacé de {source['name']} vers "
+            f"{destination['name']} ({expected / GB:.2f} GB)"
+        )
+        return expected
+
+    def tier_aged_backups(self, max_bytes=None):
+        """
+        Déplace les backups anciens du tier performance vers le tier capacité
+
+        Les jobs d'une VM qui a un job en cours sont ignorés (chaîne en cours
+        d'écriture). S'arrête quand le volume par exécution est atteint ou
+        qu'aucun chemin du tier capacité n'a la place.
+
+        Returns:
+            dict: {'moved': int, 'bytes': int, 'failed': int}
+        """
+        from django.apps import apps
+        from backups.models import StoragePath
+        from backups.tenant_scheduler import TenantBandwidthLimiter
+
+        results = {'moved': 0, 'bytes': 0, 'failed': 0}
+        capacity_targets = self.tier_pool(None, tier='capacity')
+        if not capacity_targets:
+            return results
+
+        budget = max_bytes or getattr(settings, 'STORAGE_TIERING_MAX_GB_PER_RUN', 500) * GB
+        rate = getattr(settings, 'STORAGE_TIERING_MAX_MB_PER_SECOND', 50)
+        limiter = TenantBandwidthLimiter(rate) if rate else None
+        cutoff = timezone.now() - timedelta(days=getattr(settings, 'STORAGE_TIERING_AGE_DAYS', 30))
+        busy_vm_ids = self._busy_vm_ids()
+
+        for storage_path in StoragePath.objects.filter(is_active=True, tier='performance'):
+            source = storage_capacity.target_for_storage_path(storage_path)
+            for operation, (model_name, _, path_field) in TIERED_JOBS.items():
+                jobs = apps.get_model('backups', model_name).objects.filter(
+                    status='completed', completed_at__lt=cutoff,
+                    **{f'{path_field}__startswith': storage_path.path}
+                ).select_related('virtual_machine', 'remote_storage').order_by('completed_at')
+
+                for job in jobs.iterator():
+                    path = getattr(job, path_field)
+                    if job.virtual_machine_id in busy_vm_ids or not backend_for_path(path).exists(path):
+                        continue
+                    matched = storage_capacity.match_storage_path(path)
+                    if matched is None or matched.id != storage_path.id:
+                        continue
+
+                    size = _tree_size(path)
+                    if results['bytes'] + size > budget:
+                        logger.info(f"[STORAGE-PLACEMENT] Volume maximal de l'exécution atteint ({budget / GB:.0f} GB)")
+                        return results
+
+                    ranked = self.rank(capacity_targets, size)
+                    destination = ranked[0]
+                    headroom = storage_capacity.headroom_bytes(destination)
+                    if headroom is not None and headroom < size:
+                        logger.warning("[STORAGE-PLACEMENT] Tier capacité plein, tiering interrompu")
+                        return results
+
+                    try:
+                        results['bytes'] += self.move_job(operation, job, source, destination, limiter)
+                        results['moved'] += 1
+                    except Exception as e:
+                        results['failed'] += 1
+                        logger.error(f"[STORAGE-PLACEMENT] Échec déplacement {operation} #{job.id}: {e}", exc_info=True)
+        return results
+
+
+# Instance globale
+storage_placement = StoragePlacementService()
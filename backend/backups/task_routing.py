@@ -0,0 +1,94 @@
+"""
+Routage Celery: séparation des transferts longs et du plan de contrôle
+
+Queues (app.conf.task_routes dans sauvegarde/celery.py, voir CELERY_README.md):
+- control: détection de panne, failover/failback, déclenchement des planifications,
+  plans de reprise. Tâches courtes et urgentes, jamais derrière un transfert.
+- maintenance: purge, archivage, contrôle de santé (quotidien, peu urgent).
+- backup / export / restore / replication / snapshot: transferts longs, une
+  queue par classe de job (mêmes noms que backups.job_dispatcher), exécutés
+  avec acks_late et prefetch=1 pour qu'un worker ne réserve pas plusieurs
+  transferts de plusieurs heures pendant que d'autres workers sont libres.
+
+Les transferts reçoivent des limites de temps calculées à partir de la taille
+attendue (disques de la VM) plutôt qu'une limite fixe.
+"""
+from django.conf import settings
+
+CONTROL_QUEUE = 'control'
+MAINTENANCE_QUEUE = 'maintenance'
+DEFAULT_QUEUE = 'celery'
+TRANSFER_QUEUES = ('backup', 'export', 'restore', 'replication', 'snapshot')
+ALL_QUEUES = (CONTROL_QUEUE, MAINTENANCE_QUEUE, DEFAULT_QUEUE) + TRANSFER_QUEUES
+
+TASK_QUEUES = {
+    # Plan de contrôle
+    'backups.tasks.check_and_trigger_auto_failovers': CONTROL_QUEUE,
+    'backups.tasks.check_and_trigger_auto_failbacks': CONTROL_QUEUE,
+    'backups.tasks.execute_recovery_plan': CONTROL_QUEUE,
+    'backups.tasks.check_and_execute_schedules': CONTROL_QUEUE,
+    'backups.tasks.check_and_execute_snapshot_schedules': CONTROL_QUEUE,
+    'backups.tasks.check_and_execute_replications': CONTROL_QUEUE,
+    # Maintenance
+    'backups.tasks.cleanup_old_backups': MAINTENANCE_QUEUE,
+    'backups.tasks.prune_backup_rollups': MAINTENANCE_QUEUE,
+    'backups.tasks.archive_old_logs': MAINTENANCE_QUEUE,
+    'backups.tasks.check_backup_health': MAINTENANCE_QUEUE,
+    'backups.tasks.probe_storage_targets': MAINTENANCE_QUEUE,
+    'backups.tasks.check_storage_mounts': MAINTENANCE_QUEUE,
+    'backups.tasks.tier_aged_backups': MAINTENANCE_QUEUE,
+    'backups.tasks.drain_backup_staging': MAINTENANCE_QUEUE,
+    'tenants.tasks.flush_usage_counters': MAINTENANCE_QUEUE,
+    # Transferts
+    'backups.tasks.execute_backup_job': 'backup',
+    'backups.tasks.execute_vm_backup': 'backup',
+    'backups.tasks.execute_ovf_export': 'export',
+    'backups.tasks.execute_replication': 'replication',
+    'backups.tasks.execute_replication_batch': 'replication',
+    'backups.tasks.execute_snapshot': 'snapshot',
+}
+
+
+def task_routes():
+    """Table de routage Celery (app.conf.task_routes)"""
+    return {task_name: {'queue': queue} for task_name, queue in TASK_QUEUES.items()}
+
+
+def task_queues():
+    """
+    Queues déclarées (app.conf.task_queues)
+
+    Un worker démarré sans -Q consomme toutes les queues déclarées: un worker
+    unique exécute donc toutes les tâches; les profils dédiés se limitent avec -Q.
+    """
+    from kombu import Queue
+
+    return [Queue(name, routing_key=name) for name in ALL_QUEUES]
+
+
+def transfer_time_limits(size_gb):
+    """
+    Limites de temps Celery d'un transfert selon la taille attendue
+
+    soft = base + taille / débit minimal attendu (plafonné), hard = soft + marge.
+    La limite soft lève SoftTimeLimitExceeded dans la tâche, qui marque le job
+    en échec; la limite hard tue le processus si la tâche ne rend pas la main.
+
+    Args:
+        size_gb: Taille attendue du transfert (None ou 0 = limite de base)
+
+    Returns:
+        dict: {'soft_time_limit': int, 'time_limit': int} (arguments de apply_async)
+    """
+    base = getattr(settings, 'TRANSFER_TIME_LIMIT_BASE_SECONDS', 1800)
+    throughput = max(1, getattr(settings, 'TRANSFER_MIN_THROUGHPUT_MB_PER_SECOND', 10))
+    maximum = getattr(settings, 'TRANSFER_TIME_LIMIT_MAX_SECONDS', 48 * 3600)
+    grace = getattr(settings, 'TRANSFER_TIME_LIMIT_GRACE_SECONDS', 600)
+
+    soft = min(maximum, int(base + (size_gb or 0) * 1024 / throughput))
+    return {'soft_time_limit': soft, 'time_limit': soft + grace}
+
+
+def vm_transfer_size_gb(*vms):
+    """Taille attendue d'un transfert: somme des disques des VMs (GB)"""
+    return sum(vm.disk_gb or 0 for vm in vms)
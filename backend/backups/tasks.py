@@ -2,15 +2,19 @@ import logging
 from celery import shared_task
 from django.utils import timezone
 
-from backups.models import BackupJob, BackupSchedule, OVFExportJob, SnapshotSchedule, Snapshot
+from backups.models import BackupJob, BackupSchedule, OVFExportJob, SnapshotSchedule, Snapshot, VMBackupJob
 from backups.backup_service import BackupService
 from backups.backup_scheduler_service import BackupSchedulerService
+from backups.storage_capacity import StorageCapacityExceeded, storage_capacity
+from backups.task_routing import transfer_time_limits, vm_transfer_size_gb
+from backups.tenant_scheduler import TenantQuotaExceeded, tenant_fair_share, tenant_scheduler
 from esxi.email_service import EmailNotificationService
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task
+@shared_task(acks_late=True)
+@tenant_fair_share(BackupJob)
 def execute_backup_job(job_id):
     """
     Tâche Celery pour exécuter un backup job
@@ -62,21 +66,37 @@ def check_and_execute_schedules():
             if scheduler.should_run_now():
                 logger.info(f"[CELERY-SCHEDULER] ✓ Exécution du schedule {schedule.id}")
 
+                # Quota de stockage de l'organisation (taille prévue du backup)
+                tenant_scheduler.check_storage_quota(
+                    schedule.created_by_id, schedule.virtual_machine, 'backup_job'
+                )
+
                 # Créer le backup job
                 job = scheduler.create_scheduled_backup_job()
 
                 if job:
+                    # Place sur la cible réservée avant tout transfert (job retiré si aucune cible n'a la place)
+                    try:
+                        storage_capacity.admit_job(
+                            'ovf_export' if isinstance(job, OVFExportJob) else 'backup_job', job
+                        )
+                    except StorageCapacityExceeded:
+                        job.delete()
+                        raise
+
                     # Mettre à jour le schedule
                     schedule.last_run_at = timezone.now()
                     schedule.next_run = scheduler.get_next_run_time()
                     schedule.save()
 
                     # Exécuter le job de manière asynchrone selon le type
+                    # (limites de temps proportionnelles à la taille de la VM)
+                    limits = transfer_time_limits(vm_transfer_size_gb(job.virtual_machine))
                     if isinstance(job, OVFExportJob):
-                        execute_ovf_export.delay(job.id)
+                        execute_ovf_export.apply_async(args=[job.id], **limits)
                         logger.info(f"[CELERY-SCHEDULER] ✓ OVFExportJob {job.id} créé et lancé pour schedule {schedule.id}")
                     else:
-                        execute_backup_job.delay(job.id)
+                        execute_backup_job.apply_async(args=[job.id], **limits)
                         logger.info(f"[CELERY-SCHEDULER] ✓ BackupJob {job.id} créé et lancé pour schedule {schedule.id}")
 
                     executed_count += 1
@@ -87,6 +107,9 @@ def check_and_execute_schedules():
                 skipped_count += 1
                 logger.info(f"[CELERY-SCHEDULER] ⊘ Schedule {schedule.id} non éligible pour exécution")
 
+        except (TenantQuotaExceeded, StorageCapacityExceeded) as e:
+            skipped_count += 1
+            logger.warning(f"[CELERY-SCHEDULER] ⊘ Schedule {schedule.id} reporté: {e}")
         except Exception as e:
             failed_count += 1
             logger.error(
@@ -143,10 +166,13 @@ def check_and_execute_snapshot_schedules():
                 logger.info(f"[CELERY-SNAPSHOT-SCHEDULER] ✓ Exécution du snapshot schedule {schedule.id}")
 
                 # Lancer la tâche de création de snapshot
-                execute_snapshot.delay(
-                    schedule_id=schedule.id,
-                    vm_id=schedule.virtual_machine.id,
-                    include_memory=schedule.include_memory
+                execute_snapshot.apply_async(
+                    kwargs={
+                        'schedule_id': schedule.id,
+                        'vm_id': schedule.virtual_machine.id,
+                        'include_memory': schedule.include_memory,
+                    },
+                    **transfer_time_limits(0)
                 )
 
                 # Mettre à jour le schedule
@@ -180,8 +206,8 @@ def check_and_execute_snapshot_schedules():
     }
 
 
-@shared_task
-def execute_snapshot(schedule_id, vm_id, include_memory=False):
+@shared_task(acks_late=True)
+def execute_snapshot(schedule_id, vm_id, include_memory=False, snapshot_name=None):
     """
     Tâche pour créer un snapshot automatique
 
@@ -189,6 +215,7 @@ def execute_snapshot(schedule_id, vm_id, include_memory=False):
         schedule_id: ID du SnapshotSchedule
         vm_id: ID de la VirtualMachine
         include_memory: Inclure la mémoire RAM dans le snapshot
+        snapshot_name: Nom imposé (exécution manuelle), sinon auto-<vm>-<date>
     """
     from datetime import datetime
     from esxi.models import VirtualMachine
@@ -207,8 +234,9 @@ def execute_snapshot(schedule_id, vm_id, include_memory=False):
         logger.info(f"[CELERY-SNAPSHOT] VM: {vm.name}, Include memory: {include_memory}")
 
         # Générer le nom du snapshot
-        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
-        snapshot_name = f"auto-{vm.name}-{timestamp}"
+        if not snapshot_name:
+            timestamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+            snapshot_name = f"auto-{vm.name}-{timestamp}"
 
         # Créer l'enregistrement Snapshot
         snapshot = Snapshot.objects.create(
@@ -389,42 +417,53 @@ def cleanup_old_backups():
     from backups.models import RemoteStorageConfig, VirtualMachine
     from backups.backup_chain.chain_manager import BackupChainManager
     from backups.backup_chain.retention_policy import RetentionPolicyManager
+    from backups.progress_stream import tenant_for_user
+    from backups.remote_storage import mount_manager
+    from tenants.services.usage_service import usage_service
 
     try:
         # Récupérer le remote storage par défaut
         remote_storage = RemoteStorageConfig.objects.get(is_default=True, is_active=True)
 
         # Récupérer toutes les VMs
-        vms = VirtualMachine.objects.all()
+        vms = VirtualMachine.objects.select_related('server')
 
         total_deleted = 0
         total_kept = 0
         errors = []
 
-        for vm in vms:
-            try:
-                logger.info(f"[CELERY-CLEANUP] Traitement de {vm.name}")
+        # Montage partagé du stockage (vérifié par mount_manager)
+        with mount_manager.mounted(remote_storage):
+            for vm in vms:
+                try:
+                    logger.info(f"[CELERY-CLEANUP] Traitement de {vm.name}")
+
+                    # Initialiser les managers
+                    chain_manager = BackupChainManager(remote_storage, vm.name)
+                    retention_manager = RetentionPolicyManager(chain_manager)
 
-                # Initialiser les managers
-                chain_manager = BackupChainManager(remote_storage, vm.name)
-                retention_manager = RetentionPolicyManager(chain_manager)
+                    # Appliquer la politique de rétention
+                    results = retention_manager.apply_policy(dry_run=False)
 
-                # Appliquer la politique de rétention
-                results = retention_manager.apply_policy(dry_run=False)
+                    total_deleted += results['deleted_count']
+                    total_kept += results['kept_count']
 
-                total_deleted += results['deleted_count']
-                total_kept += results['kept_count']
+                    # Stockage de l'organisation décompté de l'espace libéré (UsageMetrics)
+                    if results['freed_space_bytes']:
+                        usage_service.record_storage_freed(
+                            tenant_for_user(vm.server.created_by_id), results['freed_space_bytes']
+                        )
 
-                if results['deleted_count'] > 0:
-                    logger.info(
-                        f"[CELERY-CLEANUP] ✓ {vm.name}: {results['deleted_count']} backup(s) supprimé(s), "
-                        f"{results['kept_count']} conservé(s)"
-                    )
+                    if results['deleted_count'] > 0:
+                        logger.info(
+                            f"[CELERY-CLEANUP] ✓ {vm.name}: {results['deleted_count']} backup(s) supprimé(s), "
+                            f"{results['kept_count']} conservé(s)"
+                        )
 
-            except Exception as e:
-                error_msg = f"Erreur pour {vm.name}: {e}"
-                errors.append(error_msg)
-                logger.error(f"[CELERY-CLEANUP] {error_msg}", exc_info=True)
+                except Exception as e:
+                    error_msg = f"Erreur pour {vm.name}: {e}"
+                    errors.append(error_msg)
+                    logger.error(f"[CELERY-CLEANUP] {error_msg}", exc_info=True)
 
         logger.info("[CELERY-CLEANUP] === RÉSUMÉ ===")
         logger.info(f"[CELERY-CLEANUP] Total supprimés: {total_deleted}")
@@ -447,6 +486,96 @@ def cleanup_old_backups():
         return {'error': str(e)}
 
 
+@shared_task
+def prune_backup_rollups():
+    """
+    Tâche périodique: supprime les agrégats horaires au-delà de ROLLUP_HOURLY_RETENTION_DAYS
+    (les agrégats journaliers sont conservés)
+    """
+    from backups.rollup_service import rollup_service
+
+    try:
+        return {'deleted': rollup_service.prune()}
+    except Exception as e:
+        logger.error(f"[CELERY-ROLLUP] Erreur purge des agrégats: {e}", exc_info=True)
+        return {'error': str(e)}
+
+
+@shared_task
+def check_storage_mounts():
+    """
+    Tâche périodique: contrôle des montages des stockages distants (latence,
+    remontage et vérification si besoin, démontage des cibles désactivées)
+    """
+    from backups.remote_storage import mount_manager
+
+    try:
+        return mount_manager.check_all()
+    except Exception as e:
+        logger.error(f"[CELERY-STORAGE-MOUNT] Erreur contrôle des montages: {e}", exc_info=True)
+        return {'error': str(e)}
+
+
+@shared_task
+def probe_storage_targets():
+    """
+    Tâche périodique: mesure l'espace libre et le débit d'écriture des chemins
+    de sauvegarde (utilisés pour le placement des nouveaux backups)
+    """
+    from backups.storage_placement import storage_placement
+
+    try:
+        return storage_placement.probe_all()
+    except Exception as e:
+        logger.error(f"[CELERY-STORAGE-PLACEMENT] Erreur sonde des chemins: {e}", exc_info=True)
+        return {'error': str(e)}
+
+
+@shared_task
+def tier_aged_backups():
+    """
+    Tâche périodique: déplace les backups plus anciens que STORAGE_TIERING_AGE_DAYS
+    du tier performance vers le tier capacité (débit limité)
+    """
+    from backups.storage_placement import storage_placement
+
+    try:
+        return storage_placement.tier_aged_backups()
+    except Exception as e:
+        logger.error(f"[CELERY-STORAGE-PLACEMENT] Erreur tiering des backups: {e}", exc_info=True)
+        return {'error': str(e)}
+
+
+@shared_task
+def drain_backup_staging():
+    """
+    Tâche périodique: copie vers leur cible les backups terminés dans le staging
+    local (reprise après redémarrage d'un worker ou indisponibilité de la cible)
+    """
+    from backups.backup_staging import backup_staging
+
+    try:
+        return backup_staging.drain_all()
+    except Exception as e:
+        logger.error(f"[CELERY-BACKUP-STAGING] Erreur copie du staging: {e}", exc_info=True)
+        return {'error': str(e)}
+
+
+@shared_task
+def archive_old_logs():
+    """
+    Tâche périodique: archive (JSONL gzip mensuel) puis supprime les journaux
+    plus anciens que LOG_RETENTION_DAYS
+    """
+    from backups.log_archive_service import log_archive_service
+
+    try:
+        return log_archive_service.archive()
+    except Exception as e:
+        logger.error(f"[CELERY-LOG-ARCHIVE] Erreur archivage des journaux: {e}", exc_info=True)
+        return {'error': str(e)}
+
+
 @shared_task
 def check_backup_health():
     """
@@ -462,8 +591,8 @@ def check_backup_health():
     from backups.notification_service import notification_service
 
     try:
-        # Récupérer l'état de santé global
-        health_data = health_monitor.get_overall_health()
+        # Récupérer l'état de santé global (toujours recalculé)
+        health_data = health_monitor.get_overall_health(use_cache=False)
 
         logger.info(f"[CELERY-HEALTH] Statut: {health_data['status']}")
         logger.info(f"[CELERY-HEALTH] Score: {health_data['score']}/100")
@@ -539,7 +668,8 @@ def check_backup_health():
         return {'error': str(e)}
 
 
-@shared_task
+@shared_task(acks_late=True)
+@tenant_fair_share(OVFExportJob)
 def execute_ovf_export(export_job_id):
     """
     Tâche pour exécuter un export OVF en arrière-plan
@@ -606,13 +736,15 @@ def execute_ovf_export(export_job_id):
             export_job = OVFExportJob.objects.get(id=export_job_id)
             export_job.status = 'failed'
             export_job.error_message = str(e)
+            export_job.completed_at = timezone.now()
             export_job.save()
         except:
             pass
         return {'error': str(e)}
 
 
-@shared_task
+@shared_task(acks_late=True)
+@tenant_fair_share(VMBackupJob)
 def execute_vm_backup(backup_job_id):
     """
     Tâche pour exécuter un backup de VM (snapshot + VMDK copy) en arrière-plan
@@ -672,6 +804,7 @@ def execute_vm_backup(backup_job_id):
             backup_job = VMBackupJob.objects.get(id=backup_job_id)
             backup_job.status = 'failed'
             backup_job.error_message = str(e)
+            backup_job.completed_at = timezone.now()
             backup_job.save()
         except:
             pass
@@ -688,77 +821,100 @@ def check_and_execute_replications():
     """
     Tâche périodique pour vérifier et exécuter les réplications automatiques
 
-    Cette tâche doit être exécutée régulièrement (ex: toutes les 5 minutes)
-    pour vérifier si des réplications doivent être lancées selon leur intervalle configuré.
+    Cette tâche doit être exécutée régulièrement (ex: toutes les 5 minutes).
+    Les réplications dues sont regroupées par couple (hôte source, hôte destination)
+    et triées par marge RPO; une tâche execute_replication_batch est lancée par couple.
+    Chaque réplication est réclamée atomiquement ('syncing') avant sa mise en file.
     """
     logger.info("[CELERY-REPLICATION] === VÉRIFICATION DES RÉPLICATIONS ===")
 
-    from backups.models import VMReplication
+    from backups.replication_orchestrator import replication_orchestrator
 
-    # Récupérer toutes les réplications actives
-    active_replications = VMReplication.objects.filter(is_active=True)
+    claimed_at = timezone.now()
+    due_replications = replication_orchestrator.claim(replication_orchestrator.get_due_replications(), claimed_at)
+    groups = replication_orchestrator.group_by_host_pair(due_replications)
 
-    logger.info(f"[CELERY-REPLICATION] {active_replications.count()} réplication(s) active(s)")
+    logger.info(
+        f"[CELERY-REPLICATION] {len(due_replications)} réplication(s) due(s) "
+        f"sur {len(groups)} couple(s) d'hôtes"
+    )
 
-    executed_count = 0
-    skipped_count = 0
+    dispatched_batches = 0
     failed_count = 0
 
-    for replication in active_replications:
+    for (source_id, destination_id), replications in groups.items():
+        replication_ids = [r.id for r in replications]
         try:
-            logger.info(f"[CELERY-REPLICATION] Vérification réplication {replication.id} ({replication.name})")
-
-            # Vérifier si la réplication doit être exécutée
-            now = timezone.now()
-            should_run = False
-
-            if not replication.last_replication_at:
-                # Jamais répliquée, on lance
-                should_run = True
-                reason = "Première réplication"
-            else:
-                # Calculer le temps écoulé depuis la dernière réplication
-                minutes_since_last = (now - replication.last_replication_at).total_seconds() / 60
-
-                if minutes_since_last >= replication.replication_interval_minutes:
-                    should_run = True
-                    reason = f"Intervalle écoulé ({minutes_since_last:.0f} min >= {replication.replication_interval_minutes} min)"
-                else:
-                    time_remaining = replication.replication_interval_minutes - minutes_since_last
-                    reason = f"Intervalle non écoulé (reste {time_remaining:.0f} min)"
-
-            if should_run:
-                logger.info(f"[CELERY-REPLICATION] ✓ Exécution réplication {replication.id}: {reason}")
-
-                # Lancer la tâche de réplication en arrière-plan
-                execute_replication.delay(replication.id)
-
-                executed_count += 1
-                logger.info(f"[CELERY-REPLICATION] ✓ Tâche de réplication {replication.id} lancée")
-            else:
-                skipped_count += 1
-                logger.info(f"[CELERY-REPLICATION] ⊘ Réplication {replication.id} non éligible: {reason}")
-
+            # Limites de temps sur le volume total du couple d'hôtes
+            execute_replication_batch.apply_async(
+                args=[replication_ids, claimed_at.isoformat()],
+                **transfer_time_limits(vm_transfer_size_gb(*(r.virtual_machine for r in replications)))
+            )
+            dispatched_batches += 1
+            logger.info(
+                f"[CELERY-REPLICATION] ✓ Lot {source_id} -> {destination_id} lancé: {replication_ids}"
+            )
         except Exception as e:
-            failed_count += 1
+            failed_count += len(replication_ids)
+            replication_orchestrator.release_claims(replication_ids, claimed_at)
             logger.error(
-                f"[CELERY-REPLICATION] ✗ Erreur traitement réplication {replication.id}: {e}",
+                f"[CELERY-REPLICATION] ✗ Erreur lancement lot {source_id} -> {destination_id}: {e}",
                 exc_info=True
             )
 
     logger.info("[CELERY-REPLICATION] === RÉSUMÉ ===")
-    logger.info(f"[CELERY-REPLICATION] Exécutées: {executed_count}")
-    logger.info(f"[CELERY-REPLICATION] Ignorées: {skipped_count}")
+    logger.info(f"[CELERY-REPLICATION] Exécutées: {len(due_replications) - failed_count}")
+    logger.info(f"[CELERY-REPLICATION] Lots: {dispatched_batches}")
     logger.info(f"[CELERY-REPLICATION] Échecs: {failed_count}")
 
     return {
-        'executed': executed_count,
-        'skipped': skipped_count,
+        'executed': len(due_replications) - failed_count,
+        'batches': dispatched_batches,
         'failed': failed_count
     }
 
 
-@shared_task
+@shared_task(acks_late=True)
+def execute_replication_batch(replication_ids, claimed_at=None):
+    """
+    Tâche pour exécuter en parallèle les réplications d'un même couple d'hôtes
+
+    Args:
+        replication_ids: IDs des VMReplication (même source et même destination)
+        claimed_at: Horodatage ISO de la réclamation par check_and_execute_replications
+    """
+    from django.utils.dateparse import parse_datetime
+    from backups.models import VMReplication
+    from backups.replication_orchestrator import replication_orchestrator
+
+    queryset = VMReplication.objects.select_related(
+        'source_server', 'destination_server', 'virtual_machine', 'virtual_machine__server'
+    )
+    if claimed_at:
+        # Réplications réclamées par ce lot et pas encore prises en charge
+        taken = replication_orchestrator.take_claims(replication_ids, parse_datetime(claimed_at))
+        replications = list(queryset.filter(id__in=taken))
+    else:
+        # Lot mis en file avant la réclamation atomique
+        replications = replication_orchestrator.exclude_running(
+            queryset.filter(id__in=replication_ids, is_active=True)
+        )
+
+    # Conserver l'ordre de marge RPO calculé par le dispatcher
+    order = {replication_id: position for position, replication_id in enumerate(replication_ids)}
+    replications.sort(key=lambda r: order[r.id])
+
+    logger.info(f"[CELERY-REPLICATION-BATCH] Lot de {len(replications)} réplication(s)")
+    summary = replication_orchestrator.run_pair(replications)
+
+    return {
+        'success': summary['success'],
+        'failed': summary['failed'],
+        'skipped': summary['skipped']
+    }
+
+
+@shared_task(acks_late=True)
 def execute_replication(replication_id):
     """
     Tâche pour exécuter une réplication de VM en arrière-plan
@@ -767,134 +923,23 @@ def execute_replication(replication_id):
         replication_id: ID de la VMReplication à exécuter
     """
     from backups.models import VMReplication
+    from backups.replication_orchestrator import replication_orchestrator
     from backups.replication_service import ReplicationService
-
-    logger.info(f"[CELERY-REPLICATION-EXEC] === DÉBUT RÉPLICATION {replication_id} ===")
+    from esxi.session_pool import session_pool
 
     try:
-        # Récupérer la réplication avec les relations
         replication = VMReplication.objects.select_related(
             'source_server',
             'destination_server',
             'virtual_machine',
             'virtual_machine__server'
         ).get(id=replication_id)
-
-        vm_name = replication.virtual_machine.name
-        logger.info(f"[CELERY-REPLICATION-EXEC] VM: {vm_name}, Intervalle: {replication.replication_interval_minutes} min")
-
-        # Vérifier que la réplication est toujours active
-        if not replication.is_active:
-            logger.warning(f"[CELERY-REPLICATION-EXEC] Réplication {replication_id} désactivée, annulation")
-            return {'status': 'cancelled', 'reason': 'Replication is inactive'}
-
-        # TOUJOURS vérifier si une replica existe déjà (même VM)
-        service = ReplicationService()
-        replica_vm_name = f"{vm_name}_replica"
-
-        try:
-            dest_si = service._connect_to_server(replication.destination_server)
-            existing_replica = service._get_vm_by_name(dest_si, replica_vm_name)
-            from pyVim.connect import Disconnect
-            Disconnect(dest_si)
-
-            if existing_replica:
-                logger.warning(f"[CELERY-REPLICATION-EXEC] ⚠️ REPLICA EXISTANTE DÉTECTÉE: {replica_vm_name}")
-                logger.warning(f"[CELERY-REPLICATION-EXEC] La réplication automatique est ANNULÉE pour éviter l'écrasement")
-                logger.warning(f"[CELERY-REPLICATION-EXEC] Action requise: Supprimez manuellement la replica ou lancez une réplication manuelle")
-
-                # Envoyer une notification à l'utilisateur
-                try:
-                    EmailNotificationService.send_replication_failure_notification(
-                        vm_name=vm_name,
-                        source_server=replication.source_server.hostname,
-                        destination_server=replication.destination_server.hostname,
-                        error_message=f"Une replica '{replica_vm_name}' existe déjà sur {replication.destination_server.hostname}. "
-                                     f"Supprimez-la manuellement avant de lancer une nouvelle réplication."
-                    )
-                except Exception as email_error:
-                    logger.warning(f"[CELERY-REPLICATION-EXEC] Email notification failed: {email_error}")
-
-                return {
-                    'status': 'skipped',
-                    'reason': f'Replica {replica_vm_name} already exists on destination server. Manual deletion required.',
-                    'replication_id': replication_id
-                }
-        except Exception as check_error:
-            logger.warning(f"[CELERY-REPLICATION-EXEC] Erreur vérification replica: {check_error}")
-            # En cas d'erreur de vérification, continuer quand même (pour ne pas bloquer)
-
-        logger.info(f"[CELERY-REPLICATION-EXEC] ✓ Aucune replica existante, démarrage de la réplication...")
-
-        # Mettre à jour le statut
-        replication.status = 'syncing'
-        replication.save()
-
-        # Fonction de callback pour logger la progression
-        def progress_callback(progress_percent, status_val, message):
-            logger.info(f"[CELERY-REPLICATION-EXEC] {replication_id}: {progress_percent}% - {status_val} - {message}")
-
-        result = service.replicate_vm(
-            replication,
-            progress_callback=progress_callback,
-            replication_id=None  # Pas d'ID pour annulation dans le contexte Celery
-        )
-
-        logger.info(f"[CELERY-REPLICATION-EXEC] ✓ Réplication terminée avec succès: {vm_name}")
-
-        # IMPORTANT: S'assurer que le statut est bien 'active' après le succès
-        # (le service devrait le faire, mais on force pour être sûr)
-        replication.refresh_from_db()
-        if replication.status == 'syncing':
-            replication.status = 'active'
-            replication.save()
-            logger.info(f"[CELERY-REPLICATION-EXEC] Statut remis à 'active'")
-
-        # Envoyer notification de succès
-        try:
-            # Calculer la durée de la réplication si disponible
-            duration_seconds = None
-            if replication.last_replication_duration_seconds:
-                duration_seconds = replication.last_replication_duration_seconds
-
-            EmailNotificationService.send_replication_success_notification(
-                vm_name=vm_name,
-                source_server=replication.source_server.hostname,
-                destination_server=replication.destination_server.hostname,
-                duration_seconds=duration_seconds
-            )
-        except Exception as email_error:
-            logger.warning(f"[CELERY-REPLICATION-EXEC] Email notification failed: {email_error}")
-
-        return {'status': 'success', 'replication_id': replication_id}
-
     except VMReplication.DoesNotExist:
         logger.error(f"[CELERY-REPLICATION-EXEC] Réplication {replication_id} introuvable")
         return {'status': 'failed', 'error': f'Replication {replication_id} not found'}
-    except Exception as e:
-        logger.error(f"[CELERY-REPLICATION-EXEC] ✗ Erreur réplication: {e}", exc_info=True)
 
-        # Mettre à jour le statut en cas d'erreur
-        try:
-            replication = VMReplication.objects.get(id=replication_id)
-            replication.status = 'error'
-            replication.save()
-
-            # Envoyer notification d'échec
-            try:
-                EmailNotificationService.send_replication_failure_notification(
-                    vm_name=replication.virtual_machine.name,
-                    source_server=replication.source_server.hostname,
-                    destination_server=replication.destination_server.hostname,
-                    error_message=str(e)
-                )
-            except Exception as email_error:
-                logger.warning(f"[CELERY-REPLICATION-EXEC] Email notification failed: {email_error}")
-
-        except:
-            pass
-
-        return {'status': 'failed', 'error': str(e)}
+    service = ReplicationService(session_pool=session_pool)
+    return replication_orchestrator.run_replication(replication, service)
 
 
 @shared_task
@@ -909,14 +954,19 @@ def check_and_trigger_auto_failovers():
 
     from backups.models import VMReplication, FailoverEvent
     from backups.replication_service import ReplicationService
+    from backups.host_health_probe import host_health_probe
 
     # Récupérer toutes les réplications avec failover automatique activé
-    auto_failover_replications = VMReplication.objects.filter(
+    auto_failover_replications = list(VMReplication.objects.filter(
         is_active=True,
         failover_mode='automatic'
-    )
+    ).select_related('source_server', 'destination_server', 'virtual_machine', 'virtual_machine__server'))
+
+    logger.info(f"[CELERY-FAILOVER] {len(auto_failover_replications)} réplication(s) en mode automatique")
 
-    logger.info(f"[CELERY-FAILOVER] {auto_failover_replications.count()} réplication(s) en mode automatique")
+    # Un seul sondage par hôte source distinct, partagé par toutes ses réplications
+    snapshots = host_health_probe.get_snapshots(r.get_source_server for r in auto_failover_replications)
+    logger.info(f"[CELERY-FAILOVER] {len(snapshots)} hôte(s) source sondé(s)")
 
     triggered_count = 0
     skipped_count = 0
@@ -929,7 +979,10 @@ def check_and_trigger_auto_failovers():
             logger.info(f"[CELERY-FAILOVER] Vérification réplication {replication.id} ({replication.name})")
 
             # Vérifier si un failover automatique doit être déclenché
-            result = service.check_and_trigger_auto_failover(replication)
+            result = service.check_and_trigger_auto_failover(
+                replication,
+                snapshot=snapshots[replication.get_source_server.id]
+            )
 
             if result.get('should_failover'):
                 reason = result.get('reason', 'Panne détectée')
@@ -1009,15 +1062,19 @@ def check_and_trigger_auto_failbacks():
 
     from backups.models import VMReplication
     from backups.replication_service import ReplicationService
+    from backups.host_health_probe import host_health_probe
 
     # Récupérer toutes les réplications avec failover actif et failback automatique activé
-    active_failover_replications = VMReplication.objects.filter(
+    active_failover_replications = list(VMReplication.objects.filter(
         is_active=True,
         failover_active=True,  # Failover actuellement actif
         failback_enabled=True  # Failback automatique activé
-    )
+    ).select_related('source_server', 'destination_server', 'virtual_machine', 'virtual_machine__server'))
 
-    logger.info(f"[CELERY-FAILBACK] {active_failover_replications.count()} réplication(s) en failover actif avec failback auto")
+    logger.info(f"[CELERY-FAILBACK] {len(active_failover_replications)} réplication(s) en failover actif avec failback auto")
+
+    # Un seul sondage par hôte source distinct
+    snapshots = host_health_probe.get_snapshots(r.get_source_server for r in active_failover_replications)
 
     triggered_count = 0
     skipped_count = 0
@@ -1030,7 +1087,10 @@ def check_and_trigger_auto_failbacks():
             logger.info(f"[CELERY-FAILBACK] Vérification réplication {replication.id} ({replication.name})")
 
             # Vérifier si un failback automatique doit être déclenché
-            result = service.check_and_trigger_auto_failback(replication)
+            result = service.check_and_trigger_auto_failback(
+                replication,
+                snapshot=snapshots[replication.get_source_server.id]
+            )
 
             if result.get('should_failback'):
                 reason = result.get('reason', 'VM master revenue en ligne')
@@ -1084,3 +1144,29 @@ def check_and_trigger_auto_failbacks():
         'skipped': skipped_count,
         'failed': failed_count
     }
+
+
+@shared_task
+def execute_recovery_plan(execution_id):
+    """
+    Tâche pour exécuter un plan de reprise (failover de site)
+
+    Args:
+        execution_id: ID du RecoveryPlanExecution créé par start_recovery_plan
+    """
+    from backups.models import RecoveryPlanExecution
+    from backups.recovery_plan_service import RecoveryPlanExecutor
+
+    try:
+        execution = RecoveryPlanExecution.objects.select_related('plan', 'triggered_by').get(id=execution_id)
+    except RecoveryPlanExecution.DoesNotExist:
+        logger.error(f"[CELERY-RECOVERY-PLAN] Exécution {execution_id} introuvable")
+        return {'success': False, 'error': f'Recovery plan execution {execution_id} not found'}
+
+    result = RecoveryPlanExecutor().execute(execution)
+    return {
+        'success': result['success'],
+        'message': result['message'],
+        'rto_seconds': result['rto_seconds'],
+        'rto_met': result['rto_met']
+    }
@@ -0,0 +1,332 @@
+"""
+Partage équitable des transferts entre organisations (tenants)
+
+Les backups, exports et réplications de toutes les organisations partagent les
+mêmes workers et le même stockage. Sans arbitrage, une organisation qui lance
+50 exports occupe toutes les places et repousse les fenêtres de sauvegarde des
+autres. Ce module applique, par plan (Plan.name):
+
+- un poids (TENANT_PLAN_WEIGHTS): part des places libérées attribuée à
+  l'organisation quand plusieurs attendent (file équitable pondérée de
+  backups.job_dispatcher en exécution locale);
+- un nombre maximal de jobs simultanés (TENANT_MAX_CONCURRENT_JOBS): en
+  exécution locale, les jobs suivants attendent dans la file du dispatcher;
+  avec Celery, un worker qui reçoit un job au-delà de la limite le remet en
+  queue (TENANT_DEFER_SECONDS) et passe au suivant;
+- un débit maximal de téléchargement (TENANT_MAX_BANDWIDTH_MB_PER_SECOND),
+  appliqué par processus;
+- le quota de stockage (Plan.max_storage_gb), vérifié avant le démarrage
+  d'un job à partir de sa taille prévue.
+
+Les utilisateurs sans organisation (superutilisateurs, installation mono-tenant)
+ne sont soumis à aucune limite.
+"""
+import functools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PLAN_WEIGHTS = {'bronze': 1, 'silver': 2, 'gold': 4}
+DEFAULT_MAX_CONCURRENT_JOBS = {'bronze': 2, 'silver': 4, 'gold': 8}
+DEFAULT_MAX_BANDWIDTH_MB_PER_SECOND = {'bronze': 50, 'silver': 150, 'gold': 0}
+
+# Jobs pris en compte pour le stockage et les places occupées
+TRANSFER_JOBS = {
+    'backup_job': ('BackupJob', 'backup_size_mb'),
+    'vm_backup': ('VMBackupJob', 'backup_size_mb'),
+    'ovf_export': ('OVFExportJob', 'export_size_mb'),
+}
+
+IN_FLIGHT_STATUSES = ('pending', 'running')
+
+
+class TenantQuotaExceeded(Exception):
+    """Le job dépasserait le quota de stockage de l'organisation"""
+
+
+class TenantBandwidthLimiter:
+    """
+    Seau à jetons partagé par les transferts d'une organisation (dans le processus)
+    """
+
+    def __init__(self, mb_per_second):
+        self.rate = mb_per_second * 1024 * 1024
+        self._lock = threading.Lock()
+        self._allowance = self.rate
+        self._last = time.monotonic()
+
+    def consume(self, nbytes):
+        """Attend le temps nécessaire pour que le débit reste sous la limite"""
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= nbytes
+            wait = -self._allowance / self.rate if self._allowance < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class TenantScheduler:
+    """
+    Profils de partage par organisation, quotas et places des workers Celery
+    """
+
+    SLOT_PREFIX = 'tenant_slot'
+
+    def __init__(self):
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Profil
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _plan_setting(name, defaults, plan_name, fallback):
+        configured = getattr(settings, name, defaults)
+        return configured.get(plan_name, defaults.get(plan_name, fallback))
+
+    def profile(self, user_id):
+        """
+        Profil de partage de l'organisation d'un utilisateur
+
+        Args:
+            user_id: Utilisateur à l'origine du job (created_by)
+
+        Returns:
+            dict: {'tenant_id', 'plan', 'weight', 'max_concurrent_jobs',
+                   'bandwidth_mb_per_second', 'max_storage_gb'}
+                  (limites à 0 = illimité)
+        """
+        from tenants.context_cache import get_tenant_context
+
+        context = None
+        if user_id:
+            try:
+                context = get_tenant_context(user_id)
+            except Exception as e:
+                logger.warning(f"[TENANT-SCHEDULER] Tenant de l'utilisateur {user_id} indéterminé: {e}")
+
+        if not context or not context['organization_id'] or not context['plan']:
+            return {
+                'tenant_id': None,
+                'plan': None,
+                'weight': 1,
+                'max_concurrent_jobs': 0,
+                'bandwidth_mb_per_second': 0,
+                'max_storage_gb': 0,
+            }
+
+        plan = context['plan']
+        return {
+            'tenant_id': context['organization_id'],
+            'plan': plan['name'],
+            'weight': max(1, self._plan_setting('TENANT_PLAN_WEIGHTS', DEFAULT_PLAN_WEIGHTS, plan['name'], 1)),
+            'max_concurrent_jobs': self._plan_setting(
+                'TENANT_MAX_CONCURRENT_JOBS', DEFAULT_MAX_CONCURRENT_JOBS, plan['name'], 0
+            ),
+            'bandwidth_mb_per_second': self._plan_setting(
+                'TENANT_MAX_BANDWIDTH_MB_PER_SECOND', DEFAULT_MAX_BANDWIDTH_MB_PER_SECOND, plan['name'], 0
+            ),
+            'max_storage_gb': plan['max_storage_gb'] or 0,
+        }
+
+    @staticmethod
+    def tenant_user_ids(tenant_id):
+        """Propriétaire et membres actifs d'une organisation"""
+        from tenants.models import Organization, OrganizationMember
+
+        user_ids = set(OrganizationMember.objects.filter(
+            organization_id=tenant_id, is_active=True
+        ).values_list('user_id', flat=True))
+        user_ids.update(Organization.objects.filter(id=tenant_id).values_list('owner_id', flat=True))
+        return user_ids
+
+    # ------------------------------------------------------------------
+    # Quota de stockage
+    # ------------------------------------------------------------------
+    @staticmethod
+    def predicted_size_gb(vm, kind='vm_backup'):
+        """
+        Taille prévue d'un job sur une VM
+
+        Taille du dernier job terminé du même type sur cette VM, sinon taille
+        des disques (premier backup, export).
+        """
+        from django.apps import apps
+
+        model_name, size_field = TRANSFER_JOBS[kind]
+        model = apps.get_model('backups', model_name)
+        last_size_mb = model.objects.filter(
+            virtual_machine=vm, status='completed'
+        ).order_by('-completed_at').values_list(size_field, flat=True).first()
+        if last_size_mb:
+            return last_size_mb / 1024
+        return vm.disk_gb or 0
+
+    @staticmethod
+    def storage_used_gb(user_ids, include_in_flight=True, exclude_job=None):
+        """
+        Stockage occupé par les jobs des utilisateurs d'une organisation
+
+        Les jobs en attente ou en cours sont comptés pour la taille de leurs
+        disques (place réservée), pour que des jobs lancés simultanément ne
+        dépassent pas ensemble le quota.
+
+        Args:
+            exclude_job: Job à ne pas compter (celui dont on vérifie le démarrage)
+        """
+        from django.apps import apps
+
+        used_mb = 0
+        in_flight_gb = 0
+        for model_name, size_field in TRANSFER_JOBS.values():
+            jobs = apps.get_model('backups', model_name).objects.filter(created_by_id__in=user_ids)
+            used_mb += jobs.filter(status='completed').aggregate(total=Sum(size_field))['total'] or 0
+            if include_in_flight:
+                in_flight = jobs.filter(status__in=IN_FLIGHT_STATUSES)
+                if exclude_job is not None and type(exclude_job).__name__ == model_name:
+                    in_flight = in_flight.exclude(id=exclude_job.id)
+                in_flight_gb += in_flight.aggregate(total=Sum('virtual_machine__disk_gb'))['total'] or 0
+        return used_mb / 1024 + in_flight_gb
+
+    def check_storage_quota(self, user_id, vm, kind='vm_backup', job=None):
+        """
+        Vérifie qu'un job tient dans le quota de stockage avant son démarrage
+
+        Args:
+            user_id: Créateur du job
+            vm: VM sauvegardée ou exportée
+            kind: 'backup_job' | 'vm_backup' | 'ovf_export' (base de la taille prévue)
+            job: Job déjà créé (exclu des réservations en cours)
+
+        Raises:
+            TenantQuotaExceeded: Si stockage occupé + taille prévue > Plan.max_storage_gb
+        """
+        if not getattr(settings, 'TENANT_STORAGE_QUOTA_ENFORCED', True):
+            return
+
+        profile = self.profile(user_id)
+        if not profile['tenant_id'] or not profile['max_storage_gb']:
+            return
+
+        predicted = self.predicted_size_gb(vm, kind)
+        used = self.storage_used_gb(self.tenant_user_ids(profile['tenant_id']), exclude_job=job)
+        if used + predicted > profile['max_storage_gb']:
+            message = (
+                f"Quota de stockage dépassé: {used:.1f} GB utilisés + {predicted:.1f} GB prévus "
+                f"pour {vm.name} > {profile['max_storage_gb']} GB (plan {profile['plan']})"
+            )
+            logger.warning(f"[TENANT-SCHEDULER] {message}")
+            raise TenantQuotaExceeded(message)
+
+    # ------------------------------------------------------------------
+    # Places des workers Celery
+    # ------------------------------------------------------------------
+    def acquire_slot(self, profile, job_key, timeout):
+        """
+        Réserve une place parmi les max_concurrent_jobs de l'organisation
+
+        cache.add() est atomique: avec un cache partagé (Redis, Memcached), les
+        places sont communes à tous les workers. Une place expire après
+        timeout (limite de temps du job) si le worker meurt sans la libérer.
+
+        Returns:
+            str: Clé de la place, '' si l'organisation n'est pas limitée, None si toutes sont occupées
+        """
+        limit = profile['max_concurrent_jobs']
+        if not profile['tenant_id'] or not limit:
+            return ''
+        for index in range(limit):
+            key = f"{self.SLOT_PREFIX}:{profile['tenant_id']}:{index}"
+            if cache.add(key, job_key, timeout=timeout):
+                return key
+        return None
+
+    @staticmethod
+    def release_slot(key):
+        if key:
+            cache.delete(key)
+
+    # ------------------------------------------------------------------
+    # Débit
+    # ------------------------------------------------------------------
+    def bandwidth_limiter(self, user_id):
+        """
+        Limiteur de débit de l'organisation d'un utilisateur
+
+        Returns:
+            TenantBandwidthLimiter ou None (débit non limité)
+        """
+        profile = self.profile(user_id)
+        rate = profile['bandwidth_mb_per_second']
+        if not profile['tenant_id'] or not rate:
+            return None
+        with self._limiters_lock:
+            limiter = self._limiters.get(profile['tenant_id'])
+            if limiter is None or limiter.rate != rate * 1024 * 1024:
+                limiter = TenantBandwidthLimiter(rate)
+                self._limiters[profile['tenant_id']] = limiter
+            return limiter
+
+
+# Instance globale
+tenant_scheduler = TenantScheduler()
+
+
+def tenant_fair_share(model):
+    """
+    Décorateur des tâches de transfert exécutées par Celery
+
+    Le job n'est exécuté que si l'organisation de son créateur a une place libre;
+    sinon la tâche est remise en queue (TENANT_DEFER_SECONDS), ce qui laisse le
+    worker aux autres organisations. Appelée directement (file locale du
+    dispatcher, déjà équitable), la tâche s'exécute sans contrôle.
+
+    Args:
+        model: Modèle du job (argument 0 de la tâche = ID du job)
+    """
+    def decorator(func):
+        task_name = f'{func.__module__}.{func.__name__}'
+
+        @functools.wraps(func)
+        def wrapper(job_id, *args, **kwargs):
+            from celery import current_task
+
+            task = current_task
+            if task is None or task.name != task_name or task.request.called_directly:
+                return func(job_id, *args, **kwargs)
+
+            created_by_id = model.objects.filter(id=job_id).values_list('created_by_id', flat=True).first()
+            profile = tenant_scheduler.profile(created_by_id)
+            time_limit, soft_time_limit = task.request.timelimit or (None, None)
+            slot = tenant_scheduler.acquire_slot(
+                profile, f'{task_name}:{job_id}', timeout=time_limit or getattr(
+                    settings, 'TRANSFER_TIME_LIMIT_MAX_SECONDS', 48 * 3600
+                )
+            )
+            if slot is None:
+                countdown = getattr(settings, 'TENANT_DEFER_SECONDS', 60)
+                logger.info(
+                    f"[TENANT-SCHEDULER] {task_name}({job_id}): {profile['max_concurrent_jobs']} job(s) "
+                    f"déjà en cours pour le tenant {profile['tenant_id']}, remis en queue dans {countdown}s"
+                )
+                task.apply_async(
+                    args=task.request.args, kwargs=task.request.kwargs, countdown=countdown,
+                    time_limit=time_limit, soft_time_limit=soft_time_limit
+                )
+                return None
+
+            try:
+                return func(job_id, *args, **kwargs)
+            finally:
+                tenant_scheduler.release_slot(slot)
+
+        return wrapper
+    return decorator
@@ -4,25 +4,41 @@ Utilise snapshot + copie directe des VMDKs
 Permet restauration VM/VMDK/Fichiers
 """
 import os
-import shutil
+import hashlib
 import logging
 import json
+import time
 import requests
 import urllib3
 from datetime import datetime
+from django.conf import settings
 from django.utils import timezone
 from pyVim.task import WaitForTask
 from pyVmomi import vim
 
+from backups.backup_staging import backup_staging
+from backups.storage_backends import backend_for_path, join as storage_join, local_backend
+from backups.storage_capacity import GB
+from backups.tenant_scheduler import tenant_scheduler
+
 # Désactiver les avertissements SSL pour ESXi
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger(__name__)
 
+# Lecture maximale d'un descriptor VMDK (fichier texte de quelques Ko)
+DESCRIPTOR_MAX_BYTES = 1024 * 1024
+
 
 class VMBackupService:
     """
     Service de backup de VMs avec snapshot + copie VMDK
+
+    Les fichiers sont écrits par le backend de backup_full_path: sur un
+    stockage S3, chaque VMDK est envoyé en upload multipart parallèle au fil
+    du téléchargement HTTP depuis ESXi, sans copie locale. Vers une cible
+    lente (SMB, NFS), ils sont écrits dans le staging local s'il est
+    configuré, puis copiés en arrière-plan (voir backups.backup_staging).
     """
 
     def __init__(self, vm_obj, backup_job):
@@ -36,6 +52,15 @@ class VMBackupService:
         self.snapshot = None
         self.snapshot_name = f"backup_snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
 
+        # Backend de la destination (système de fichiers ou S3)
+        self.storage = backend_for_path(backup_job.backup_full_path)
+        # Dossier où les fichiers sont écrits (destination, ou zone de staging)
+        self.backup_path = backup_job.backup_full_path
+        self.staging = None
+
+        # Débit maximal de l'organisation (None = non limité)
+        self.bandwidth_limiter = tenant_scheduler.bandwidth_limiter(backup_job.created_by_id)
+
         # Récupérer les credentials ESXi pour le téléchargement HTTP
         esxi_server = self.backup_job.virtual_machine.server
         self.esxi_host = esxi_server.hostname
@@ -45,6 +70,11 @@ class VMBackupService:
         # Temps de démarrage de la phase de téléchargement (pour progression time-based)
         self.download_phase_start_time = None
 
+        # Suivi du snapshot pendant la lecture des disques (âge, delta)
+        self.snapshot_created_at = None
+        self.last_snapshot_check = 0
+        self.snapshot_age_warned = False
+
     def check_cancelled(self):
         """Vérifie si le backup a été annulé par l'utilisateur"""
         self.backup_job.refresh_from_db(fields=['status'])
@@ -55,10 +85,14 @@ class VMBackupService:
     def execute_backup(self):
         """
         Exécute le backup complet
-        1. Créer snapshot
-        2. Copier VMDKs
-        3. Sauvegarder configuration
-        4. Supprimer snapshot
+
+        Le snapshot n'est ouvert que pendant la lecture des disques: chaque
+        écriture de la VM pendant ce temps va dans le delta, que la suppression
+        doit consolider (stun de la VM proportionnel au delta).
+        1. Télécharger les fichiers de configuration et les métadonnées (sans snapshot)
+        2. Créer snapshot
+        3. Copier VMDKs (âge et delta du snapshot mesurés pendant la copie)
+        4. Supprimer snapshot dès la fin des lectures
         """
         try:
             logger.info(f"[VM-BACKUP] Début backup de {self.vm.name}")
@@ -69,14 +103,33 @@ class VMBackupService:
             self.backup_job.download_speed_mbps = 0
             self.backup_job.save()
 
-            # 1. Créer snapshot (1% -> 5%)
+            # Cible lente: écriture dans le staging local, copie après suppression du snapshot
+            self.open_staging()
+            self.storage.makedirs(self.backup_path)
+
+            # 1. Télécharger fichiers config (.vmx, .nvram, .vmsd, .vmsn, .log) (1% -> 2%)
+            # Lus avant le snapshot: ils ne référencent pas le snapshot temporaire du backup
+            self.check_cancelled()
+            logger.info(f"[VM-BACKUP] Téléchargement fichiers configuration VM...")
+            config_files = self.download_vm_files()
+            self.backup_job.progress_percentage = 2
+            self.backup_job.save()
+
+            # 2. Sauvegarder métadonnées JSON (2% -> 3%)
+            self.check_cancelled()
+            logger.info(f"[VM-BACKUP] Sauvegarde métadonnées...")
+            self.save_vm_configuration()
+            self.backup_job.progress_percentage = 3
+            self.backup_job.save()
+
+            # 3. Créer snapshot (3% -> 5%)
             self.check_cancelled()
             logger.info(f"[VM-BACKUP] Création snapshot...")
             self.create_snapshot()
             self.backup_job.progress_percentage = 5
             self.backup_job.save()
 
-            # 2. Copier les VMDKs (5% -> 90%)
+            # 4. Copier les VMDKs (5% -> 90%)
             self.check_cancelled()
             logger.info(f"[VM-BACKUP] Copie des VMDKs...")
             vmdk_files = self.copy_vmdks()
@@ -84,27 +137,21 @@ class VMBackupService:
             self.backup_job.progress_percentage = 90
             self.backup_job.save()
 
-            # 3. Télécharger fichiers config (.vmx, .nvram, .vmsd, .vmsn, .log) (90% -> 95%)
-            self.check_cancelled()
-            logger.info(f"[VM-BACKUP] Téléchargement fichiers configuration VM...")
-            config_files = self.download_vm_files()
-            self.backup_job.progress_percentage = 95
-            self.backup_job.save()
-
-            # 4. Sauvegarder métadonnées JSON (95% -> 98%)
-            self.check_cancelled()
-            logger.info(f"[VM-BACKUP] Sauvegarde métadonnées...")
-            self.save_vm_configuration()
-            self.backup_job.progress_percentage = 98
-            self.backup_job.save()
-
-            # 5. Supprimer le snapshot (98% -> 99%)
-            self.check_cancelled()
+            # 5. Supprimer le snapshot dès la fin des lectures (90% -> 99%)
             logger.info(f"[VM-BACKUP] Suppression snapshot...")
             self.remove_snapshot()
             self.backup_job.progress_percentage = 99
             self.backup_job.save()
 
+            # Copie du staging vers la cible: le job passe 'completed' à la fin de la copie
+            if self.staging:
+                staged_bytes = self.staging.seal()
+                self.backup_job.backup_size_mb = staged_bytes / (1024 * 1024)
+                self.backup_job.save()
+                logger.info(f"[VM-BACKUP] Lectures terminées, copie vers {self.backup_job.backup_full_path} en arrière-plan")
+                backup_staging.start_drain(self.staging, self.backup_job.created_by_id, staged_bytes)
+                return True
+
             # Finaliser (99% -> 100%)
             self.backup_job.progress_percentage = 100
             self.backup_job.status = 'completed'
@@ -134,11 +181,10 @@ class VMBackupService:
                 self.backup_job.save()
 
                 # Supprimer le dossier de backup incomplet
-                if self.backup_job.backup_full_path and os.path.exists(self.backup_job.backup_full_path):
+                if self.backup_path and self.storage.exists(self.backup_path):
                     try:
-                        import shutil
-                        shutil.rmtree(self.backup_job.backup_full_path)
-                        logger.info(f"[VM-BACKUP] Dossier de backup incomplet supprimé: {self.backup_job.backup_full_path}")
+                        self.storage.delete(self.backup_path)
+                        logger.info(f"[VM-BACKUP] Dossier de backup incomplet supprimé: {self.backup_path}")
                     except Exception as del_err:
                         logger.warning(f"[VM-BACKUP] Erreur suppression dossier backup: {del_err}")
             else:
@@ -151,7 +197,15 @@ class VMBackupService:
 
                 # Note: On GARDE le dossier de backup en cas d'échec pour investigation/debug
                 # L'utilisateur peut manuellement le supprimer s'il le souhaite
-                logger.warning(f"[VM-BACKUP] Dossier de backup incomplet conservé pour investigation: {self.backup_job.backup_full_path}")
+                # (sauf le staging local, qui doit rester disponible pour les autres backups)
+                if not self.staging:
+                    logger.warning(f"[VM-BACKUP] Dossier de backup incomplet conservé pour investigation: {self.backup_job.backup_full_path}")
+
+            if self.staging:
+                try:
+                    self.staging.discard()
+                except Exception as staging_err:
+                    logger.warning(f"[VM-BACKUP] Erreur suppression staging: {staging_err}")
 
             # Nettoyer le snapshot en cas d'erreur ou d'annulation
             if self.snapshot:
@@ -164,6 +218,28 @@ class VMBackupService:
             if not is_cancelled:
                 raise
 
+    def open_staging(self):
+        """
+        Écrit le backup dans le staging local si la cible est lente (SMB, NFS)
+
+        Le débit de l'organisation s'applique alors à la copie vers la cible,
+        pas au téléchargement depuis ESXi.
+        """
+        try:
+            self.staging = backup_staging.open(self.backup_job)
+        except Exception as e:
+            logger.warning(f"[VM-BACKUP] Staging indisponible, écriture directe sur la cible: {e}")
+            self.staging = None
+
+        if self.staging:
+            self.storage = local_backend
+            self.backup_path = self.staging.path
+            self.bandwidth_limiter = None
+
+    def destination_path(self, filename):
+        """Chemin final d'un fichier du backup (enregistré dans le job)"""
+        return storage_join(self.backup_job.backup_full_path, filename)
+
     def create_snapshot(self):
         """Crée un snapshot de la VM"""
         try:
@@ -176,9 +252,8 @@ class VMBackupService:
                 quiesce=True   # Quiesce pour cohérence du filesystem
             )
 
-            # Attendre la tâche avec progression (1% -> 5%)
-            import time
-            progress = 1
+            # Attendre la tâche avec progression (-> 5%)
+            progress = self.backup_job.progress_percentage
             while task.info.state not in [vim.TaskInfo.State.success, vim.TaskInfo.State.error]:
                 time.sleep(0.5)
                 progress = min(progress + 1, 4)
@@ -193,6 +268,7 @@ class VMBackupService:
 
             # Récupérer le snapshot créé
             self.snapshot = self.vm.snapshot.currentSnapshot
+            self.snapshot_created_at = self.last_snapshot_check = time.monotonic()
 
             # Sauvegarder les infos du snapshot
             self.backup_job.snapshot_name = self.snapshot_name
@@ -205,6 +281,67 @@ class VMBackupService:
             logger.error(f"[VM-BACKUP] Erreur création snapshot: {e}")
             raise Exception(f"Échec création snapshot: {str(e)}")
 
+    def measure_snapshot_delta(self):
+        """
+        Taille actuelle des deltas du snapshot (fichiers en tête de la chaîne
+        de chaque disque, où vont les écritures de la VM)
+
+        Returns:
+            int: Octets, ou None si la mesure est impossible
+        """
+        try:
+            self.vm.RefreshStorageInfo()
+            layout = self.vm.layoutEx
+            file_sizes = {f.key: f.size for f in layout.file}
+            return sum(
+                sum(file_sizes.get(key, 0) for key in disk.chain[-1].fileKey)
+                for disk in layout.disk if disk.chain
+            )
+        except Exception as e:
+            logger.warning(f"[VM-BACKUP] Mesure du delta du snapshot impossible: {e}")
+            return None
+
+    def check_snapshot(self, force=False, enforce=True):
+        """
+        Mesure l'âge et le delta du snapshot ouvert (au plus une fois par
+        BACKUP_SNAPSHOT_CHECK_SECONDS) et les enregistre dans le job
+
+        Au-delà de BACKUP_SNAPSHOT_MAX_DELTA_GB le backup est interrompu: la
+        consolidation d'un delta plus gros gèlerait la VM trop longtemps.
+
+        Args:
+            force: Mesurer même si la dernière mesure est récente
+            enforce: Interrompre le backup si le delta dépasse la limite
+        """
+        if not self.snapshot or self.snapshot_created_at is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_snapshot_check < getattr(settings, 'BACKUP_SNAPSHOT_CHECK_SECONDS', 60):
+            return
+        self.last_snapshot_check = now
+
+        age = now - self.snapshot_created_at
+        delta = self.measure_snapshot_delta()
+        self.backup_job.snapshot_open_seconds = round(age, 1)
+        if delta is not None:
+            self.backup_job.snapshot_delta_bytes = max(self.backup_job.snapshot_delta_bytes, delta)
+        self.backup_job.save(update_fields=['snapshot_open_seconds', 'snapshot_delta_bytes'])
+
+        delta_gb = self.backup_job.snapshot_delta_bytes / GB
+        logger.info(f"[VM-BACKUP] Snapshot ouvert depuis {age:.0f}s, delta {delta_gb:.2f} GB")
+
+        warn_age = getattr(settings, 'BACKUP_SNAPSHOT_WARN_AGE_SECONDS', 3600)
+        if warn_age and age > warn_age and not self.snapshot_age_warned:
+            self.snapshot_age_warned = True
+            logger.warning(f"[VM-BACKUP] Snapshot '{self.snapshot_name}' ouvert depuis plus de {warn_age}s (delta {delta_gb:.2f} GB)")
+
+        max_delta_gb = getattr(settings, 'BACKUP_SNAPSHOT_MAX_DELTA_GB', 0)
+        if enforce and max_delta_gb and delta is not None and delta > max_delta_gb * GB:
+            raise Exception(
+                f"Delta du snapshot trop important ({delta_gb:.1f} GB > {max_delta_gb} GB), "
+                f"backup interrompu pour limiter le gel de la VM à la consolidation"
+            )
+
     def get_vmdk_chain_size(self, vmdk_filename, datastore, dc_name):
         """
         Calcule la taille réelle de toute la chaîne VMDK (tenant compte du thin provisioning)
@@ -264,6 +401,8 @@ class VMBackupService:
         """
         Parse un fichier descriptor VMDK pour extraire les informations importantes
 
+        Seul le début du fichier est lu (GET partiel sur un stockage S3).
+
         Args:
             descriptor_path: Chemin vers le fichier descriptor VMDK
 
@@ -276,34 +415,33 @@ class VMBackupService:
         }
 
         try:
-            with open(descriptor_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-
-                # Chercher le parent (snapshot chain)
-                for line in content.split('\n'):
-                    line = line.strip()
-
-                    # Parent file hint (snapshots)
-                    if line.startswith('parentFileNameHint'):
-                        # Format: parentFileNameHint="SQL SERVER-000006.vmdk"
-                        # Extraire le contenu entre guillemets
-                        import re
-                        match = re.search(r'"([^"]+)"', line)
-                        if match:
-                            parent = match.group(1)
-                            info['parent'] = parent
-                            logger.info(f"[VM-BACKUP] Parent VMDK trouvé: {parent}")
-
-                    # Extent file (fichier de données)
-                    elif line.startswith('RW') or line.startswith('RDONLY'):
-                        # Format: RW 16777216 VMFSSPARSE "SQL SERVER-000007-delta.vmdk"
-                        # Trouver le texte entre guillemets
-                        import re
-                        match = re.search(r'"([^"]+)"', line)
-                        if match:
-                            extent = match.group(1)
-                            info['extent_file'] = extent
-                            logger.info(f"[VM-BACKUP] Extent file trouvé: {extent}")
+            content = self.storage.read_range(descriptor_path, 0, DESCRIPTOR_MAX_BYTES).decode('utf-8', errors='ignore')
+
+            # Chercher le parent (snapshot chain)
+            for line in content.split('\n'):
+                line = line.strip()
+
+                # Parent file hint (snapshots)
+                if line.startswith('parentFileNameHint'):
+                    # Format: parentFileNameHint="SQL SERVER-000006.vmdk"
+                    # Extraire le contenu entre guillemets
+                    import re
+                    match = re.search(r'"([^"]+)"', line)
+                    if match:
+                        parent = match.group(1)
+                        info['parent'] = parent
+                        logger.info(f"[VM-BACKUP] Parent VMDK trouvé: {parent}")
+
+                # Extent file (fichier de données)
+                elif line.startswith('RW') or line.startswith('RDONLY'):
+                    # Format: RW 16777216 VMFSSPARSE "SQL SERVER-000007-delta.vmdk"
+                    # Trouver le texte entre guillemets
+                    import re
+                    match = re.search(r'"([^"]+)"', line)
+                    if match:
+                        extent = match.group(1)
+                        info['extent_file'] = extent
+                        logger.info(f"[VM-BACKUP] Extent file trouvé: {extent}")
 
         except Exception as e:
             logger.warning(f"[VM-BACKUP] Erreur parsing descriptor: {e}")
@@ -339,12 +477,11 @@ class VMBackupService:
 
         # URL du descriptor
         vmdk_url = f"https://{self.esxi_host}/folder/{vmdk_filename}?dcPath={dc_name}&dsName={datastore_name}"
-        dest_file = os.path.join(backup_path, os.path.basename(vmdk_filename))
+        dest_file = self.storage.join(backup_path, os.path.basename(vmdk_filename))
 
         # Télécharger le descriptor
         logger.info(f"[VM-BACKUP] Téléchargement descriptor: {vmdk_filename}")
-        self.download_vmdk_file(vmdk_url, dest_file)
-        file_size = os.path.getsize(dest_file) if os.path.exists(dest_file) else 0
+        file_size = self.download_vmdk_file(vmdk_url, dest_file)
         total_size += file_size
         # Note: downloaded_bytes est déjà incrémenté dans download_vmdk_file() chunk par chunk
 
@@ -375,12 +512,11 @@ class VMBackupService:
         if data_filename not in downloaded_files_set:
             downloaded_files_set.add(data_filename)
             data_url = f"https://{self.esxi_host}/folder/{data_filename}?dcPath={dc_name}&dsName={datastore_name}"
-            data_dest_file = os.path.join(backup_path, os.path.basename(data_filename))
+            data_dest_file = self.storage.join(backup_path, os.path.basename(data_filename))
 
             logger.info(f"[VM-BACKUP] Téléchargement données: {data_filename}")
             try:
-                self.download_vmdk_file(data_url, data_dest_file)
-                data_size = os.path.getsize(data_dest_file) if os.path.exists(data_dest_file) else 0
+                data_size = self.download_vmdk_file(data_url, data_dest_file)
                 total_size += data_size
                 # Note: downloaded_bytes est déjà incrémenté dans download_vmdk_file() chunk par chunk
                 logger.info(f"[VM-BACKUP] Fichier données téléchargé: {data_dest_file} ({data_size / (1024*1024):.1f} MB)")
@@ -413,13 +549,16 @@ class VMBackupService:
         """
         Télécharge un fichier VMDK depuis ESXi via HTTP avec progression en temps réel
 
+        Le flux HTTP est écrit directement dans le backend de destination
+        (fichier, ou upload multipart parallèle sur S3).
+
         Args:
             vmdk_url: URL du fichier VMDK sur ESXi
-            dest_path: Chemin de destination local
+            dest_path: Chemin de destination (fichier ou s3://)
             chunk_size: Taille des chunks pour le téléchargement (8MB par défaut)
 
         Returns:
-            bool: True si succès
+            int: Octets écrits
         """
         import time
 
@@ -441,13 +580,19 @@ class VMBackupService:
             last_logged_mb = 0
             start_time = time.time()
             last_speed_update = start_time
+            # SHA-256 calculé au fil de l'eau, vérifié après la copie du staging vers la cible
+            digest = hashlib.sha256() if self.staging else None
 
-            # Télécharger par chunks
-            with open(dest_path, 'wb') as f:
+            # Télécharger par chunks (fichier partiel supprimé / upload abandonné en cas d'erreur)
+            with self.storage.open_write(dest_path, size_hint=file_size or None) as f:
                 for chunk in response.iter_content(chunk_size=chunk_size):
                     if chunk:
                         f.write(chunk)
                         downloaded += len(chunk)
+                        if digest:
+                            digest.update(chunk)
+                        if self.bandwidth_limiter:
+                            self.bandwidth_limiter.consume(len(chunk))
 
                         # INCRÉMENTER downloaded_bytes EN TEMPS RÉEL (chunk par chunk)
                         self.backup_job.downloaded_bytes += len(chunk)
@@ -461,6 +606,9 @@ class VMBackupService:
                                 logger.info(f"[VM-BACKUP] Backup annulé pendant le téléchargement")
                                 raise Exception("Backup annulé par l'utilisateur")
 
+                            # Âge et delta du snapshot (périodique)
+                            self.check_snapshot()
+
                             # Calculer la vitesse de téléchargement (tous les 2 secondes)
                             current_time = time.time()
                             if current_time - last_speed_update >= 2.0:
@@ -527,14 +675,14 @@ class VMBackupService:
 
                             last_logged_mb = int(downloaded_mb)
 
+            if digest:
+                self.staging.record_checksum(dest_path, digest.hexdigest())
+
             logger.info(f"[VM-BACKUP] VMDK téléchargé: {dest_path} ({downloaded / (1024*1024):.1f} MB)")
-            return True
+            return downloaded
 
         except Exception as e:
             logger.error(f"[VM-BACKUP] Erreur téléchargement VMDK: {e}")
-            # Nettoyer le fichier partiel en cas d'erreur
-            if os.path.exists(dest_path):
-                os.remove(dest_path)
             raise Exception(f"Échec téléchargement VMDK: {str(e)}")
 
     def copy_vmdks(self):
@@ -548,8 +696,8 @@ class VMBackupService:
 
         try:
             # Créer le dossier de backup
-            backup_path = self.backup_job.backup_full_path
-            os.makedirs(backup_path, exist_ok=True)
+            backup_path = self.backup_path
+            self.storage.makedirs(backup_path)
 
             logger.info(f"[VM-BACKUP] Destination: {backup_path}")
 
@@ -612,7 +760,7 @@ class VMBackupService:
                             vmdk_info = {
                                 'filename': vmdk_filename,
                                 'size_gb': device.capacityInKB / (1024 * 1024),
-                                'dest_path': os.path.join(backup_path, os.path.basename(vmdk_filename)),
+                                'dest_path': self.destination_path(os.path.basename(vmdk_filename)),
                                 'datastore': datastore_name,
                                 'size_mb': total_size_mb,
                                 'chain_files': list(downloaded_files_set)  # Liste tous les fichiers de la chaîne
@@ -635,7 +783,7 @@ class VMBackupService:
         Nécessaire pour une restauration complète et identique de la VM
         """
         try:
-            backup_path = self.backup_job.backup_full_path
+            backup_path = self.backup_path
 
             # Obtenir le chemin du dossier de la VM
             # Format: [datastore] VM_Folder/VM.vmx
@@ -691,7 +839,7 @@ class VMBackupService:
                             remote_path = filename
 
                         file_url = f"https://{self.esxi_host}/folder/{remote_path}?dcPath={dc.name}&dsName={datastore_name}"
-                        dest_file = os.path.join(backup_path, filename)
+                        dest_file = self.storage.join(backup_path, filename)
 
                         logger.info(f"[VM-BACKUP] Téléchargement config: {filename} ({file_size_mb:.2f} MB)")
 
@@ -704,8 +852,7 @@ class VMBackupService:
                             response = session.get(file_url, timeout=60)
                             response.raise_for_status()
 
-                            with open(dest_file, 'wb') as f:
-                                f.write(response.content)
+                            self.storage.write_bytes(dest_file, response.content)
 
                             downloaded_files.append(filename)
                             logger.info(f"[VM-BACKUP]   -> OK: {filename}")
@@ -726,8 +873,7 @@ class VMBackupService:
     def save_vm_configuration(self):
         """Sauvegarde la configuration de la VM (fichier .vmx simulé)"""
         try:
-            backup_path = self.backup_job.backup_full_path
-            config_file = os.path.join(backup_path, "vm_config.json")
+            config_file = self.storage.join(self.backup_path, "vm_config.json")
 
             # Collecter la configuration
             config = {
@@ -756,10 +902,9 @@ class VMBackupService:
                     })
 
             # Sauvegarder en JSON
-            with open(config_file, 'w') as f:
-                json.dump(config, f, indent=2)
+            self.storage.write_bytes(config_file, json.dumps(config, indent=2).encode('utf-8'))
 
-            self.backup_job.vm_config_file = config_file
+            self.backup_job.vm_config_file = self.destination_path("vm_config.json")
             self.backup_job.save()
 
             logger.info(f"[VM-BACKUP] Configuration sauvegardée: {config_file}")
@@ -769,19 +914,41 @@ class VMBackupService:
             raise Exception(f"Échec sauvegarde configuration: {str(e)}")
 
     def remove_snapshot(self):
-        """Supprime le snapshot créé"""
+        """
+        Supprime le snapshot créé (consolidation du delta dans les disques)
+
+        Enregistre dans le job la durée d'ouverture du snapshot, son delta
+        et la durée de consolidation.
+        """
         if not self.snapshot:
             return
 
         try:
+            self.check_snapshot(force=True, enforce=False)
             logger.info(f"[VM-BACKUP] Suppression snapshot '{self.snapshot_name}'...")
 
+            start = time.monotonic()
             task = self.snapshot.RemoveSnapshot_Task(removeChildren=False)
             WaitForTask(task)
-
-            logger.info(f"[VM-BACKUP] Snapshot supprimé")
             self.snapshot = None
 
+            # Consolidation restée en attente (fichier verrouillé...): la relancer tout de suite
+            if getattr(self.vm.runtime, 'consolidationNeeded', False):
+                logger.warning(f"[VM-BACKUP] Consolidation des disques nécessaire, relance...")
+                WaitForTask(self.vm.ConsolidateVMDisks_Task())
+
+            finished = time.monotonic()
+            self.backup_job.consolidation_seconds = round(finished - start, 1)
+            if self.snapshot_created_at is not None:
+                self.backup_job.snapshot_open_seconds = round(finished - self.snapshot_created_at, 1)
+            self.backup_job.save(update_fields=['snapshot_open_seconds', 'consolidation_seconds'])
+
+            logger.info(
+                f"[VM-BACKUP] Snapshot supprimé (ouvert {self.backup_job.snapshot_open_seconds:.0f}s, "
+                f"delta {self.backup_job.snapshot_delta_bytes / GB:.2f} GB, "
+                f"consolidation {self.backup_job.consolidation_seconds:.1f}s)"
+            )
+
         except Exception as e:
             logger.error(f"[VM-BACKUP] Erreur suppression snapshot: {e}")
             # On ne lève pas d'exception car le backup peut être réussi
@@ -790,14 +957,7 @@ class VMBackupService:
     def calculate_backup_size(self):
         """Calcule la taille totale du backup"""
         try:
-            backup_path = self.backup_job.backup_full_path
-            total_size = 0
-
-            for root, dirs, files in os.walk(backup_path):
-                for file in files:
-                    filepath = os.path.join(root, file)
-                    if os.path.exists(filepath):
-                        total_size += os.path.getsize(filepath)
+            total_size = sum(info['size'] for info in self.storage.list_files(self.backup_path).values())
 
             # Convertir en MB
             size_mb = total_size / (1024 * 1024)
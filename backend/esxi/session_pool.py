@@ -0,0 +1,180 @@
+"""
+session_pool.py
+
+Pool de sessions vSphere partagées par serveur ESXi.
+Évite un SmartConnect complet (login + RetrieveContent) à chaque opération.
+"""
+
+import logging
+import threading
+import time
+
+from .vmware_service import VMwareService
+
+logger = logging.getLogger(__name__)
+
+
+class ESXiSessionPool:
+    """
+    Pool de connexions VMwareService réutilisables, une par (hôte, port, utilisateur)
+
+    Une session est validée avant réutilisation (lecture de currentSession) et
+    recréée si elle a expiré côté ESXi ou si elle est restée inactive trop longtemps.
+
+    Chaque acquire() prend un bail sur la session, rendu par release(). Une
+    session remplacée (expirée, invalidée) est retirée du pool mais n'est fermée
+    qu'une fois tous ses baux rendus: les threads qui l'utilisent encore ne
+    perdent pas leur connexion en cours de route.
+    """
+
+    def __init__(self, idle_timeout=900):
+        """
+        Args:
+            idle_timeout: Durée en secondes après laquelle une session inutilisée est fermée
+        """
+        self.idle_timeout = idle_timeout
+        self._sessions = {}  # clé -> {'service': VMwareService, 'last_used': float, 'leases': int}
+        self._retired = []  # entrées retirées du pool, fermées au rendu de leur dernier bail
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    @staticmethod
+    def _make_key(server):
+        return (server.hostname, server.port or 443, server.username)
+
+    def _get_key_lock(self, key):
+        with self._lock:
+            if key not in self._key_locks:
+                self._key_locks[key] = threading.Lock()
+            return self._key_locks[key]
+
+    @staticmethod
+    def _is_alive(service):
+        """Vérifie qu'une session vSphere est toujours valide (un seul aller-retour)"""
+        try:
+            return bool(service.content and service.content.sessionManager.currentSession)
+        except Exception:
+            return False
+
+    def acquire(self, server, timeout=60):
+        """
+        Retourne un VMwareService connecté pour ce serveur (réutilisé si possible)
+
+        Chaque appel prend un bail à rendre par release() une fois la session inutilisée.
+
+        Args:
+            server: Instance ESXiServer
+            timeout: Timeout de connexion si une nouvelle session est nécessaire
+
+        Returns:
+            VMwareService connecté
+
+        Raises:
+            Exception: Si la connexion échoue
+        """
+        key = self._make_key(server)
+
+        with self._get_key_lock(key):
+            entry = self._sessions.get(key)
+            now = time.monotonic()
+
+            if entry:
+                # Une session avec des baux en cours n'est jamais inactive
+                expired = not entry['leases'] and now - entry['last_used'] > self.idle_timeout
+                if not expired and self._is_alive(entry['service']):
+                    with self._lock:
+                        entry['leases'] += 1
+                        entry['last_used'] = now
+                    return entry['service']
+
+                logger.info(f"[SESSION_POOL] Session expirée pour {server.hostname}, reconnexion")
+                self._retire(key)
+
+            service = VMwareService(
+                host=server.hostname,
+                user=server.username,
+                password=server.password,
+                port=server.port or 443
+            )
+            if not service.connect(timeout=timeout):
+                raise Exception(f"Impossible de se connecter à {server.hostname}")
+
+            with self._lock:
+                self._sessions[key] = {'service': service, 'last_used': now, 'leases': 1}
+            logger.info(f"[SESSION_POOL] Nouvelle session ouverte pour {server.hostname}")
+            return service
+
+    def release(self, service):
+        """
+        Rend un bail pris par acquire()
+
+        Args:
+            service: VMwareService retourné par acquire(), ou son service_instance
+        """
+        if service is None:
+            return
+        closing = None
+        with self._lock:
+            for entry in list(self._sessions.values()) + self._retired:
+                if entry['service'] is service or entry['service'].service_instance is service:
+                    entry['leases'] = max(0, entry['leases'] - 1)
+                    entry['last_used'] = time.monotonic()
+                    if not entry['leases'] and entry in self._retired:
+                        self._retired.remove(entry)
+                        closing = entry
+                    break
+        if closing:
+            self._close_service(closing['service'])
+
+    def _retire(self, key):
+        """Retire la session d'une clé du pool; fermée tout de suite si aucun bail n'est en cours"""
+        with self._lock:
+            entry = self._sessions.pop(key, None)
+            if entry and entry['leases']:
+                self._retired.append(entry)
+                logger.info(
+                    f"[SESSION_POOL] Session {entry['service'].host} retirée, fermeture après "
+                    f"{entry['leases']} bail(s) en cours"
+                )
+                return
+        if entry:
+            self._close_service(entry['service'])
+
+    def invalidate(self, server):
+        """Retire la session d'un serveur du pool (ex: après une erreur réseau)"""
+        key = self._make_key(server)
+        with self._get_key_lock(key):
+            self._retire(key)
+
+    def close_idle(self):
+        """Ferme les sessions sans bail et inactives depuis plus de idle_timeout secondes"""
+        now = time.monotonic()
+        with self._lock:
+            stale = [
+                k for k, e in self._sessions.items()
+                if not e['leases'] and now - e['last_used'] > self.idle_timeout
+            ]
+            entries = [self._sessions.pop(k) for k in stale]
+        for entry in entries:
+            self._close_service(entry['service'])
+        return len(entries)
+
+    def close_all(self):
+        """Ferme toutes les sessions du pool, y compris celles retirées (arrêt du processus)"""
+        with self._lock:
+            entries = list(self._sessions.values()) + self._retired
+            self._sessions.clear()
+            self._retired = []
+        for entry in entries:
+            self._close_service(entry['service'])
+
+    @staticmethod
+    def _close_service(service):
+        try:
+            service.disconnect()
+        except Exception as e:
+            logger.debug(f"[SESSION_POOL] Erreur fermeture session {service.host}: {e}")
+
+
+# Instance globale du pool (une par processus)
+session_pool = ESXiSessionPool()
@@ -0,0 +1,241 @@
+"""
+vm_index.py
+
+Index des VMs d'une session vSphere (nom / instanceUuid -> MoRef).
+
+Construit par une seule récupération PropertyCollector puis tenu à jour de manière
+incrémentale (WaitForUpdatesEx ne renvoie que les VMs créées, supprimées ou renommées),
+ce qui remplace les parcours ContainerView complets à chaque recherche.
+"""
+
+import logging
+import threading
+import time
+
+from django.conf import settings
+from pyVmomi import vim, vmodl
+
+logger = logging.getLogger(__name__)
+
+
+class VMIndex:
+    """
+    Index nom/instanceUuid -> vim.VirtualMachine pour une session vSphere
+
+    Les recherches sont des accès dictionnaire; un rafraîchissement incrémental
+    (un seul aller-retour, vide s'il n'y a pas de changement) est effectué au plus
+    une fois par refresh_interval secondes, et systématiquement en cas d'échec.
+    """
+
+    PROPERTIES = ['name', 'config.instanceUuid']
+
+    def __init__(self, content, refresh_interval=None):
+        """
+        Args:
+            content: ServiceContent de la session (si.RetrieveContent())
+            refresh_interval: Délai minimal en secondes entre deux rafraîchissements
+        """
+        self.content = content
+        self.refresh_interval = (
+            refresh_interval if refresh_interval is not None
+            else getattr(settings, 'VM_INDEX_REFRESH_SECONDS', 1)
+        )
+
+        self._lock = threading.RLock()
+        self._view = None
+        self._collector = None
+        self._version = ''
+        self._last_refresh = None
+
+        self._entries = {}  # moId -> {'vm': vim.VirtualMachine, 'name': str, 'uuid': str}
+        self._by_name = {}  # nom -> moId
+        self._by_uuid = {}  # instanceUuid -> moId
+
+    def _ensure_filter(self):
+        """Crée (une fois) un PropertyCollector privé avec un filtre sur toutes les VMs"""
+        if self._collector:
+            return
+
+        self._view = self.content.viewManager.CreateContainerView(
+            self.content.rootFolder, [vim.VirtualMachine], True
+        )
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+            name='traverseEntities',
+            path='view',
+            skip=False,
+            type=vim.view.ContainerView
+        )
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+            objectSet=[vmodl.query.PropertyCollector.ObjectSpec(
+                obj=self._view,
+                skip=True,
+                selectSet=[traversal_spec]
+            )],
+            propSet=[vmodl.query.PropertyCollector.PropertySpec(
+                type=vim.VirtualMachine,
+                pathSet=self.PROPERTIES,
+                all=False
+            )]
+        )
+
+        # Collecteur privé: ses versions ne sont pas partagées avec d'autres filtres de la session
+        self._collector = self.content.propertyCollector.CreatePropertyCollector()
+        self._collector.CreateFilter(filter_spec, partialUpdates=False)
+
+    def refresh(self):
+        """
+        Applique les changements depuis le dernier rafraîchissement
+
+        Le premier appel (version vide) renvoie toutes les VMs: c'est la construction initiale.
+        """
+        with self._lock:
+            self._ensure_filter()
+            options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=0)
+
+            update = self._collector.WaitForUpdatesEx(self._version, options)
+            changes = 0
+            while update:
+                for filter_update in update.filterSet:
+                    for object_update in filter_update.objectSet:
+                        self._apply(object_update)
+                        changes += 1
+                self._version = update.version
+                if not update.truncated:
+                    break
+                update = self._collector.WaitForUpdatesEx(self._version, options)
+
+            if self._last_refresh is None:
+                logger.info(f"[VM_INDEX] Index construit: {len(self._entries)} VM(s)")
+            elif changes:
+                logger.debug(f"[VM_INDEX] {changes} changement(s) appliqué(s)")
+
+            self._last_refresh = time.monotonic()
+
+    def _apply(self, object_update):
+        moid = object_update.obj._moId
+
+        if object_update.kind == 'leave':
+            self._unindex(moid)
+            return
+
+        entry = self._entries.get(moid) or {'vm': object_update.obj, 'name': None, 'uuid': None}
+        self._unindex(moid)
+
+        for change in object_update.changeSet or []:
+            value = change.val if change.op == 'assign' else None
+            if change.name == 'name':
+                entry['name'] = value
+            elif change.name == 'config.instanceUuid':
+                entry['uuid'] = value
+
+        self._entries[moid] = entry
+        if entry['name']:
+            self._by_name[entry['name']] = moid
+        if entry['uuid']:
+            self._by_uuid[entry['uuid']] = moid
+
+    def _unindex(self, moid):
+        entry = self._entries.pop(moid, None)
+        if not entry:
+            return
+        if entry['name'] and self._by_name.get(entry['name']) == moid:
+            del self._by_name[entry['name']]
+        if entry['uuid'] and self._by_uuid.get(entry['uuid']) == moid:
+            del self._by_uuid[entry['uuid']]
+
+    def _refresh_if_due(self):
+        """Rafraîchit si nécessaire; retourne True si un rafraîchissement a eu lieu"""
+        if self._last_refresh is None or time.monotonic() - self._last_refresh >= self.refresh_interval:
+            self.refresh()
+            return True
+        return False
+
+    def _lookup(self, mapping, key):
+        with self._lock:
+            refreshed = self._refresh_if_due()
+            moid = mapping.get(key)
+            if moid is None and not refreshed:
+                # Échec: la VM vient peut-être d'être créée ou renommée
+                self.refresh()
+                moid = mapping.get(key)
+            return self._entries[moid]['vm'] if moid else None
+
+    def find_by_name(self, vm_name):
+        """
+        Trouve une VM par son nom
+
+        Returns:
+            vim.VirtualMachine ou None
+        """
+        return self._lookup(self._by_name, vm_name)
+
+    def find_by_uuid(self, vm_uuid):
+        """
+        Trouve une VM par son instanceUuid (repli sur SearchIndex.FindByUuid)
+
+        Returns:
+            vim.VirtualMachine ou None
+        """
+        vm = self._lookup(self._by_uuid, vm_uuid)
+        if vm:
+            return vm
+
+        # Repli: recherche directe côté serveur (VM pas encore visible dans l'index)
+        return self.content.searchIndex.FindByUuid(None, vm_uuid, True, True)
+
+    def destroy(self):
+        """Libère le collecteur et la vue côté serveur"""
+        with self._lock:
+            for obj, method in ((self._collector, 'DestroyPropertyCollector'), (self._view, 'Destroy')):
+                if obj is not None:
+                    try:
+                        getattr(obj, method)()
+                    except Exception:
+                        pass
+            self._collector = None
+            self._view = None
+            self._version = ''
+            self._last_refresh = None
+            self._entries.clear()
+            self._by_name.clear()
+            self._by_uuid.clear()
+
+
+# Un index par session, porté par le stub SOAP: l'index référence lui-même le stub
+# (content et MoRefs des VMs), un registre global ne pourrait donc jamais le libérer.
+# Attaché au stub, il est collecté avec la session si drop_vm_index n'a pas été appelé.
+_INDEX_ATTR = '_vm_index'
+_indexes_lock = threading.Lock()
+
+
+def get_vm_index(service_instance, content=None):
+    """
+    Retourne l'index VM associé à une session vSphere (créé au premier appel)
+
+    Args:
+        service_instance: vim.ServiceInstance connecté
+        content: ServiceContent déjà récupéré (optionnel, évite un aller-retour)
+
+    Returns:
+        VMIndex
+    """
+    stub = service_instance._stub
+    with _indexes_lock:
+        index = getattr(stub, _INDEX_ATTR, None)
+        if index is None:
+            index = VMIndex(content or service_instance.RetrieveContent())
+            setattr(stub, _INDEX_ATTR, index)
+        return index
+
+
+def drop_vm_index(service_instance):
+    """Détruit l'index d'une session avant sa déconnexion (collecteur et vue côté serveur)"""
+    if service_instance is None:
+        return
+    stub = service_instance._stub
+    with _indexes_lock:
+        index = getattr(stub, _INDEX_ATTR, None)
+        if index is not None:
+            setattr(stub, _INDEX_ATTR, None)
+    if index:
+        index.destroy()
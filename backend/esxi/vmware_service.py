@@ -14,6 +14,8 @@ import time
 import requests
 import urllib3
 
+from .vm_index import get_vm_index, drop_vm_index
+
 logger = logging.getLogger(__name__)
 
 class VMwareService:
@@ -154,6 +156,7 @@ class VMwareService:
     def disconnect(self):
         """Déconnecte proprement"""
         if self.service_instance:
+            drop_vm_index(self.service_instance)
             Disconnect(self.service_instance)
             self.service_instance = None
             self.content = None
@@ -217,6 +220,75 @@ class VMwareService:
         container.Destroy()
         return vms_list
 
+    def _retrieve_vm_properties(self, properties):
+        """
+        Récupère des propriétés de toutes les VMs en un seul appel PropertyCollector
+        (au lieu d'un aller-retour par VM et par propriété)
+
+        Args:
+            properties: Liste de chemins de propriétés (ex: ['name', 'runtime.powerState'])
+
+        Returns:
+            list: [(vim.VirtualMachine, {propriété: valeur}), ...]
+        """
+        if not self.content:
+            return []
+
+        container = self.content.viewManager.CreateContainerView(
+            self.content.rootFolder, [vim.VirtualMachine], True
+        )
+
+        try:
+            traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+                name='traverseEntities',
+                path='view',
+                skip=False,
+                type=vim.view.ContainerView
+            )
+            obj_spec = vmodl.query.PropertyCollector.ObjectSpec(
+                obj=container,
+                skip=True,
+                selectSet=[traversal_spec]
+            )
+            prop_spec = vmodl.query.PropertyCollector.PropertySpec(
+                type=vim.VirtualMachine,
+                pathSet=list(properties),
+                all=False
+            )
+            filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+                objectSet=[obj_spec],
+                propSet=[prop_spec]
+            )
+
+            collector = self.content.propertyCollector
+            result = collector.RetrievePropertiesEx([filter_spec], vmodl.query.PropertyCollector.RetrieveOptions())
+
+            vms = []
+            while result:
+                for obj in result.objects:
+                    props = {prop.name: prop.val for prop in (obj.propSet or [])}
+                    vms.append((obj.obj, props))
+                if not result.token:
+                    break
+                result = collector.ContinueRetrievePropertiesEx(result.token)
+
+            return vms
+        finally:
+            container.Destroy()
+
+    def get_vm_power_states(self):
+        """
+        Retourne l'état d'alimentation de toutes les VMs de l'hôte en une seule requête
+
+        Returns:
+            dict: {nom_vm: 'poweredOn'|'poweredOff'|'suspended'}
+        """
+        return {
+            props['name']: str(props.get('runtime.powerState'))
+            for _, props in self._retrieve_vm_properties(['name', 'runtime.powerState'])
+            if 'name' in props
+        }
+
 
     def get_datastores(self):
         """Récupère les datastores disponibles"""
@@ -1447,13 +1519,15 @@ class VMwareService:
             }
 
     def _find_vm_by_uuid(self, vm_uuid):
-        """Trouve une VM par son UUID"""
+        """Trouve une VM par son UUID (index de session, repli SearchIndex.FindByUuid)"""
         if not self.content:
             return None
 
-        search_index = self.content.searchIndex
-        vm = search_index.FindByUuid(None, vm_uuid, True, True)
-        return vm
+        try:
+            return get_vm_index(self.service_instance, self.content).find_by_uuid(vm_uuid)
+        except Exception as e:
+            logger.warning(f"[VM_INDEX] Index indisponible, recherche directe: {e}")
+            return self.content.searchIndex.FindByUuid(None, vm_uuid, True, True)
 
     def deploy_ovf(self, ovf_path, vm_name, datastore_name, network_name="VM Network", power_on=False, progress_callback=None, restore_id=None, disk_provisioning=None):
         """
@@ -2235,23 +2309,14 @@ class VMwareService:
         return None
 
     def _find_vm_by_name(self, vm_name):
-        """Trouve une VM par son nom"""
+        """Trouve une VM par son nom (index de session)"""
         if not self.content:
             return None
 
         try:
-            container = self.content.viewManager.CreateContainerView(
-                self.content.rootFolder, [vim.VirtualMachine], True
-            )
-
-            for vm in container.view:
-                if vm.name == vm_name:
-                    container.Destroy()
-                    return vm
-
-            container.Destroy()
-        except:
-            pass
+            return get_vm_index(self.service_instance, self.content).find_by_name(vm_name)
+        except Exception as e:
+            logger.warning(f"[VM_INDEX] Erreur recherche VM {vm_name}: {e}")
 
         return None
 
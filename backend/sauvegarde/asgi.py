@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sauvegarde.settings')
 
 application = get_asgi_application()
+
+# Reprise des copies du staging interrompues par l'arrêt précédent (backups.backup_staging)
+from backups.backup_staging import backup_staging  # noqa: E402
+
+backup_staging.resume_pending()
@@ -4,10 +4,13 @@ Configuration Celery pour le projet ESXi Backup Manager
 import os
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import worker_ready
 
 # Définir le module de settings Django par défaut
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sauvegarde.settings')
 
+from django.conf import settings  # noqa: E402
+
 app = Celery('sauvegarde')
 
 # Charger la configuration depuis les settings Django
@@ -16,6 +19,14 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Auto-découverte des tâches dans les applications Django
 app.autodiscover_tasks()
 
+# Routage: plan de contrôle, maintenance et une queue par classe de transfert
+# (voir backups/task_routing.py et CELERY_README.md pour les profils de workers).
+# Toutes les queues sont déclarées: un worker lancé sans -Q les consomme toutes.
+from backups.task_routing import task_queues, task_routes  # noqa: E402
+
+app.conf.task_queues = task_queues()
+app.conf.task_routes = task_routes()
+
 # Configuration des tâches périodiques (Celery Beat)
 app.conf.beat_schedule = {
     # Vérifier et exécuter les schedules de backup toutes les heures
@@ -27,38 +38,87 @@ app.conf.beat_schedule = {
     'check-and-execute-snapshot-schedules': {
         'task': 'backups.tasks.check_and_execute_snapshot_schedules',
         'schedule': crontab(minute='*'),  # Toutes les minutes
+        'options': {'expires': 60},
     },
     # Vérifier et exécuter les réplications automatiques toutes les 5 minutes
     'check-and-execute-replications': {
         'task': 'backups.tasks.check_and_execute_replications',
         'schedule': crontab(minute='*/5'),  # Toutes les 5 minutes
     },
-    # Vérifier et déclencher les auto-failovers toutes les minutes
+    # Vérifier et déclencher les auto-failovers (sonde de santé, intervalle en secondes)
     'check-and-trigger-auto-failovers': {
         'task': 'backups.tasks.check_and_trigger_auto_failovers',
-        'schedule': crontab(minute='*'),  # Toutes les minutes pour réaction rapide
+        'schedule': float(getattr(settings, 'FAILOVER_PROBE_INTERVAL_SECONDS', 60)),
+        # Une sonde non exécutée avant la suivante est obsolète: ne pas l'empiler
+        'options': {'expires': float(getattr(settings, 'FAILOVER_PROBE_INTERVAL_SECONDS', 60))},
     },
-    # Vérifier et déclencher les auto-failbacks toutes les minutes
+    # Vérifier et déclencher les auto-failbacks (même intervalle que la sonde)
     'check-and-trigger-auto-failbacks': {
         'task': 'backups.tasks.check_and_trigger_auto_failbacks',
-        'schedule': crontab(minute='*'),  # Toutes les minutes pour réaction rapide
+        'schedule': float(getattr(settings, 'FAILOVER_PROBE_INTERVAL_SECONDS', 60)),
+        'options': {'expires': float(getattr(settings, 'FAILOVER_PROBE_INTERVAL_SECONDS', 60))},
     },
     # Nettoyer les anciens backups tous les jours à 3h du matin
     'cleanup-old-backups': {
         'task': 'backups.tasks.cleanup_old_backups',
         'schedule': crontab(hour=3, minute=0),  # Tous les jours à 3h00
     },
+    # Purger les agrégats horaires anciens tous les jours à 3h30
+    'prune-backup-rollups': {
+        'task': 'backups.tasks.prune_backup_rollups',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    # Déplacer les backups anciens vers le tier capacité tous les jours à 2h
+    'tier-aged-backups': {
+        'task': 'backups.tasks.tier_aged_backups',
+        'schedule': crontab(hour=2, minute=0),
+    },
+    # Sonder l'espace libre et le débit des chemins de sauvegarde
+    'probe-storage-targets': {
+        'task': 'backups.tasks.probe_storage_targets',
+        'schedule': float(getattr(settings, 'STORAGE_PROBE_INTERVAL_SECONDS', 300)),
+        'options': {'expires': float(getattr(settings, 'STORAGE_PROBE_INTERVAL_SECONDS', 300))},
+    },
+    # Reprendre la copie des backups restés dans le staging local
+    'drain-backup-staging': {
+        'task': 'backups.tasks.drain_backup_staging',
+        'schedule': float(getattr(settings, 'BACKUP_STAGING_DRAIN_INTERVAL_SECONDS', 300)),
+        'options': {'expires': float(getattr(settings, 'BACKUP_STAGING_DRAIN_INTERVAL_SECONDS', 300))},
+    },
+    # Contrôler les montages des stockages distants
+    'check-storage-mounts': {
+        'task': 'backups.tasks.check_storage_mounts',
+        'schedule': float(getattr(settings, 'STORAGE_MOUNT_CHECK_INTERVAL_SECONDS', 60)),
+        'options': {'expires': float(getattr(settings, 'STORAGE_MOUNT_CHECK_INTERVAL_SECONDS', 60))},
+    },
+    # Archiver les journaux anciens tous les jours à 4h
+    'archive-old-logs': {
+        'task': 'backups.tasks.archive_old_logs',
+        'schedule': crontab(hour=4, minute=0),
+    },
     # Vérifier la santé des backups toutes les 6 heures
     'check-backup-health': {
         'task': 'backups.tasks.check_backup_health',
         'schedule': crontab(minute=0, hour='*/6'),  # Toutes les 6 heures
     },
+    # Reporter les compteurs d'appels API (Redis) dans UsageMetrics toutes les minutes
+    'flush-usage-counters': {
+        'task': 'tenants.tasks.flush_usage_counters',
+        'schedule': crontab(minute='*'),
+        'options': {'expires': 60},
+    },
 }
 
 # Configuration du timezone
 app.conf.timezone = 'Europe/Paris'
 
 
+@worker_ready.connect
+def resume_backup_staging(sender=None, **kwargs):
+    """Reprise des copies du staging interrompues par l'arrêt précédent du worker"""
+    sender.app.send_task('backups.tasks.drain_backup_staging')
+
+
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
     print(f'Request: {self.request!r}')
@@ -0,0 +1,106 @@
+"""
+Backend PostgreSQL avec pool de connexions dans le processus
+
+Identique à django.db.backends.postgresql, mais les connexions sont prises
+dans un pool (psycopg2) partagé par tous les threads du processus et y sont
+rendues à la fermeture (fin de requête, close_old_connections). Les threads
+courts (exécution des jobs, flux SSE) ne paient plus l'ouverture d'une
+connexion TCP + authentification.
+
+Configuration (settings.DATABASES['default']['POOL_OPTIONS']):
+    min_size: Connexions ouvertes à la création du pool
+    max_size: Connexions simultanées maximales
+    timeout: Attente maximale (secondes) d'une connexion libre
+"""
+import logging
+import threading
+
+from django.db.backends.postgresql import base
+from django.db.utils import OperationalError
+from psycopg2 import pool as pg_pool
+
+logger = logging.getLogger(__name__)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class BlockingConnectionPool(pg_pool.ThreadedConnectionPool):
+    """
+    Pool thread-safe qui attend une connexion libre au lieu de lever PoolError
+    """
+
+    def __init__(self, minconn, maxconn, timeout, *args, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._timeout = timeout
+        super().__init__(minconn, maxconn, *args, **kwargs)
+
+    def getconn(self, key=None):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise OperationalError(
+                f"Pool de connexions PostgreSQL saturé ({self.maxconn} connexions, attente {self._timeout}s)"
+            )
+        try:
+            return super().getconn(key)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super().putconn(conn, key, close)
+        finally:
+            self._slots.release()
+
+
+class _PooledDatabase:
+    """
+    Module psycopg2 dont connect() puise dans le pool de l'alias
+
+    DatabaseWrapper.get_new_connection() appelle self.Database.connect():
+    remplacer ce seul point conserve toute l'initialisation de Django
+    (niveau d'isolation, autocommit, fuseau horaire, JSONB).
+    """
+
+    def __init__(self, database, get_pool):
+        self._database = database
+        self._get_pool = get_pool
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+    def connect(self, **conn_params):
+        return self._get_pool(conn_params).getconn()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.Database = _PooledDatabase(base.Database, self._get_pool)
+
+    def _get_pool(self, conn_params):
+        with _pools_lock:
+            connection_pool = _pools.get(self.alias)
+            if connection_pool is None:
+                options = self.settings_dict.get('POOL_OPTIONS', {})
+                max_size = max(1, options.get('max_size', 10))
+                min_size = min(options.get('min_size', 1), max_size)
+                connection_pool = BlockingConnectionPool(
+                    min_size, max_size, options.get('timeout', 30), **conn_params
+                )
+                _pools[self.alias] = connection_pool
+                logger.info(f"[DB-POOL] Pool '{self.alias}' créé ({min_size}-{max_size} connexions)")
+        return connection_pool
+
+    def _close(self):
+        if self.connection is None:
+            return
+        connection_pool = _pools.get(self.alias)
+        if connection_pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            # Une connexion en erreur est fermée plutôt que rendue au pool
+            # (psycopg2 annule la transaction en cours des connexions rendues)
+            broken = self.connection.closed or self.errors_occurred
+            connection_pool.putconn(self.connection, close=bool(broken))
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -62,6 +63,7 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'tenants.middleware.TenantMiddleware',        # 👈 Tenant detection
     'tenants.middleware.TenantAccessMiddleware',  # 👈 Subscription verification
+    'tenants.middleware.ApiUsageMiddleware',      # 👈 API calls per organization (UsageMetrics)
 ]
 
 ROOT_URLCONF = 'sauvegarde.urls'
@@ -87,12 +89,78 @@ WSGI_APPLICATION = 'sauvegarde.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite par défaut (développement). Profil PostgreSQL pour la production:
+# DB_ENGINE=postgresql avec DB_NAME / DB_USER / DB_PASSWORD / DB_HOST / DB_PORT.
+# Les workers Celery, les threads de l'API et les threads de progression
+# écrivent en parallèle: SQLite sérialise toutes ces écritures.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+# Pool de connexions dans le processus (PostgreSQL, 0 = désactivé).
+# Utile sans PgBouncer pour les threads courts (exécution des jobs, SSE).
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 0))
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': (
+                'sauvegarde.db_backends.postgresql_pool' if DB_POOL_MAX_SIZE
+                else 'django.db.backends.postgresql'
+            ),
+            'NAME': os.environ.get('DB_NAME', 'esxi_backup'),
+            'USER': os.environ.get('DB_USER', 'esxi_backup'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            # Connexions persistantes: une connexion par thread réutilisée entre
+            # requêtes (avec le pool, la connexion est rendue au pool à chaque fin de requête)
+            'CONN_MAX_AGE': 0 if DB_POOL_MAX_SIZE else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': 10,
+                'application_name': 'esxi-backup',
+            },
+            'POOL_OPTIONS': {
+                'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+                'max_size': DB_POOL_MAX_SIZE,
+                # Attente maximale d'une connexion libre (secondes)
+                'timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Attente du verrou d'écriture au lieu d'un "database is locked" immédiat
+                'timeout': 20,
+            },
+        }
+    }
+
+# Cache
+# Les verrous (cache.add), réservations de capacité, états et références des
+# montages de stockage sont partagés entre le processus web et les workers
+# Celery: le cache doit être commun à tous les processus (Redis, déjà utilisé
+# comme broker). CACHE_BACKEND=locmem uniquement pour un développement en un
+# seul processus (refusé par le check backups.E001 hors DEBUG).
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'redis')
+
+if CACHE_BACKEND == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('CACHE_REDIS_URL', 'redis://localhost:6379/1'),
+            'KEY_PREFIX': 'esxi-backup',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
-}
 
 
 # Password validation
@@ -216,10 +284,228 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'Europe/Paris'
 CELERY_ENABLE_UTC = True
 
+# Routage des tâches: voir backups/task_routing.py (queues control, maintenance
+# et une queue par classe de transfert). Un worker ne réserve qu'une tâche à la
+# fois: les transferts durent des heures et ne doivent pas être accaparés.
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+
+# Limites de temps des transferts, calculées à partir de la taille des disques:
+# soft = base + taille / débit minimal (plafonnée au maximum), hard = soft + marge
+TRANSFER_TIME_LIMIT_BASE_SECONDS = 1800
+TRANSFER_MIN_THROUGHPUT_MB_PER_SECOND = 10
+TRANSFER_TIME_LIMIT_MAX_SECONDS = 48 * 3600
+TRANSFER_TIME_LIMIT_GRACE_SECONDS = 600
+
+# Avec acks_late, Redis redistribue un message non acquitté après visibility_timeout:
+# il doit dépasser la durée maximale d'un transfert (sinon le job serait lancé deux fois)
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'visibility_timeout': TRANSFER_TIME_LIMIT_MAX_SECONDS + TRANSFER_TIME_LIMIT_GRACE_SECONDS + 3600,
+}
+
+# ==========================================================
+# Job Dispatcher (backups.job_dispatcher)
+# ==========================================================
+# Les jobs lancés depuis l'API vont dans la queue Celery de leur classe
+# (backup, export, restore, replication, snapshot) si un worker la consomme,
+# sinon dans un pool de threads borné par classe dans le processus web.
+JOB_DISPATCHER_USE_CELERY = True
+# Jobs simultanés par classe en exécution locale (les suivants attendent en file)
+JOB_DISPATCHER_CONCURRENCY = {
+    'backup': 2,
+    'export': 2,
+    'restore': 2,
+    'replication': 4,
+    'snapshot': 4,
+}
+# Durée de mise en cache de la liste des queues consommées par les workers
+JOB_DISPATCHER_CELERY_CHECK_SECONDS = 30
+# Attente maximale des jobs locaux en cours à l'arrêt du processus
+JOB_DISPATCHER_DRAIN_TIMEOUT_SECONDS = 300
+
+# ==========================================================
+# Tenant Fair Share (backups.tenant_scheduler)
+# ==========================================================
+# Part des places libérées attribuée à chaque plan quand plusieurs organisations attendent
+TENANT_PLAN_WEIGHTS = {'bronze': 1, 'silver': 2, 'gold': 4}
+# Jobs de transfert simultanés par organisation (0 = illimité)
+TENANT_MAX_CONCURRENT_JOBS = {'bronze': 2, 'silver': 4, 'gold': 8}
+# Débit de téléchargement par organisation et par processus, en MB/s (0 = illimité)
+TENANT_MAX_BANDWIDTH_MB_PER_SECOND = {'bronze': 50, 'silver': 150, 'gold': 0}
+# Délai avant nouvelle tentative d'un job Celery dont l'organisation n'a plus de place
+TENANT_DEFER_SECONDS = 60
+# Refus des jobs dont la taille prévue dépasse Plan.max_storage_gb
+TENANT_STORAGE_QUOTA_ENFORCED = True
+
+# ==========================================================
+# Storage Capacity (backups.storage_capacity)
+# ==========================================================
+# Admission des jobs: la taille prévue est réservée sur la cible avant tout transfert
+STORAGE_CAPACITY_ENFORCED = True
+# Espace laissé libre sur chaque cible
+STORAGE_CAPACITY_MIN_FREE_GB = 1
+# Majoration de la taille prévue (historique de la chaîne, taux de changement CBT)
+STORAGE_CAPACITY_SAFETY_FACTOR = 1.2
+# Derniers jobs du même type pris en compte pour la taille prévue
+STORAGE_CAPACITY_HISTORY_JOBS = 5
+# Redirection d'un backup full vers un autre chemin de sauvegarde actif si sa cible est pleine
+STORAGE_CAPACITY_REROUTE = True
+# Fenêtre des agrégats utilisée pour le taux de changement et la croissance (jours avant saturation)
+STORAGE_FORECAST_WINDOW_DAYS = 14
+
+# ==========================================================
+# Storage Placement & Tiering (backups.storage_placement)
+# ==========================================================
+# Placement des backups full sur le chemin du même tier au meilleur débit attendu
+STORAGE_PLACEMENT_ENABLED = True
+# Intervalle de la sonde (espace libre, débit d'écriture) des chemins de sauvegarde
+STORAGE_PROBE_INTERVAL_SECONDS = 300
+# Volume écrit par la sonde
+STORAGE_PROBE_WRITE_MB = 64
+# Débit crédité à un chemin pas encore sondé
+STORAGE_PLACEMENT_DEFAULT_WRITE_MBPS = 100
+# Âge à partir duquel un backup est déplacé vers le tier capacité
+STORAGE_TIERING_AGE_DAYS = 30
+# Volume maximal déplacé par exécution du tiering
+STORAGE_TIERING_MAX_GB_PER_RUN = 500
+# Débit maximal des copies de tiering (0 = illimité)
+STORAGE_TIERING_MAX_MB_PER_SECOND = 50
+
+# ==========================================================
+# Storage Mounts (backups.remote_storage.mount_manager)
+# ==========================================================
+# Montages des stockages distants partagés entre les jobs: vérification complète
+# (connectivité, authentification, écriture, débit) au plus une fois par intervalle
+STORAGE_MOUNT_VERIFY_SECONDS = 600
+# Intervalle du contrôle des montages (sonde de latence, remontage si besoin)
+STORAGE_MOUNT_CHECK_INTERVAL_SECONDS = 60
+# Options de montage NFS
+STORAGE_NFS_MOUNT_OPTIONS = 'rw,hard,timeo=600'
+
+# ==========================================================
+# Storage I/O (backups.storage_backends)
+# ==========================================================
+# Fichiers copiés en parallèle (tiering, restauration depuis un stockage objet)
+STORAGE_COPY_WORKERS = 2
+# Durée de cache des configurations de stockage actives (choix du driver par chemin)
+STORAGE_BACKEND_CACHE_SECONDS = 60
+
+# ==========================================================
+# VM Backup Snapshots (backups.vm_backup_service)
+# ==========================================================
+# Intervalle de mesure de l'âge et du delta du snapshot pendant la lecture des disques
+BACKUP_SNAPSHOT_CHECK_SECONDS = 60
+# Avertissement quand le snapshot d'un backup reste ouvert plus longtemps
+BACKUP_SNAPSHOT_WARN_AGE_SECONDS = 3600
+# Delta au-delà duquel le backup est interrompu et le snapshot supprimé (0 = pas de limite)
+BACKUP_SNAPSHOT_MAX_DELTA_GB = 0
+
+# ==========================================================
+# Backup Staging (backups.backup_staging)
+# ==========================================================
+# Disque local rapide où les backups de VM vers une cible lente sont écrits avant
+# d'être copiés en arrière-plan ('' = désactivé)
+BACKUP_STAGING_DIR = os.environ.get('BACKUP_STAGING_DIR', '')
+# Protocoles des cibles qui passent par le staging
+BACKUP_STAGING_PROTOCOLS = ('smb', 'nfs')
+# Espace laissé libre dans le staging (sinon écriture directe sur la cible)
+BACKUP_STAGING_MIN_FREE_GB = 20
+# Relecture de chaque fichier copié et comparaison du SHA-256
+BACKUP_STAGING_VERIFY = True
+# Tentatives de copie avant de passer le job en échec
+BACKUP_STAGING_MAX_ATTEMPTS = 5
+# Intervalle de reprise des copies en attente
+BACKUP_STAGING_DRAIN_INTERVAL_SECONDS = 300
+
+# ==========================================================
+# Object Storage (S3) (backups.storage_backends)
+# ==========================================================
+# Taille d'une part d'upload multipart (min 5 Mo); mémoire d'un upload VMDK
+# bornée à (S3_UPLOAD_WORKERS + 1) parts
+S3_MULTIPART_PART_MB = 32
+# Parts envoyées en parallèle par fichier
+S3_UPLOAD_WORKERS = 4
+# GET partiels parallèles (lecture anticipée des restaurations, checksums, copies)
+S3_DOWNLOAD_WORKERS = 8
+# 'path' (MinIO, Ceph) ou 'virtual' (AWS)
+S3_ADDRESSING_STYLE = 'path'
+
+# ==========================================================
+# Failover Detection (Health Probe)
+# ==========================================================
+# Latence de détection: chaque hôte ESXi source est sondé une fois par intervalle
+FAILOVER_PROBE_INTERVAL_SECONDS = 30
+# Timeout des tests TCP/HTTPS de la sonde
+FAILOVER_PROBE_TIMEOUT_SECONDS = 5
+
+# Index VM par session vSphere: délai minimal entre deux rafraîchissements incrémentaux
+VM_INDEX_REFRESH_SECONDS = 1
+
+# ==========================================================
+# Replication Orchestrator
+# ==========================================================
+# Nombre de VMs répliquées simultanément par couple (hôte source, hôte destination)
+REPLICATION_MAX_PARALLEL_PER_PAIR = 4
+
+# ==========================================================
+# Progress Stream (Server-Sent Events)
+# ==========================================================
+# Redis pub/sub pour diffuser la progression des workers Celery vers les processus ASGI
+# (sans Redis: diffusion limitée au processus courant)
+PROGRESS_STREAM_REDIS_URL = CELERY_BROKER_URL
+# Délai minimal entre deux événements d'une même opération (les statuts finaux sont toujours envoyés)
+PROGRESS_STREAM_MIN_INTERVAL_SECONDS = 0.25
+# Commentaire keep-alive envoyé aux clients en l'absence d'événement
+PROGRESS_STREAM_HEARTBEAT_SECONDS = 15
+# Durée de validité d'un ticket d'ouverture du flux (usage unique, remplace le token en paramètre)
+PROGRESS_STREAM_TICKET_SECONDS = 30
+
+# ==========================================================
+# Prometheus Metrics
+# ==========================================================
+# Durée de validité de l'instantané servi par /api/metrics (un recalcul au plus par période)
+METRICS_CACHE_TTL_SECONDS = 30
+
+# ==========================================================
+# Backup Health Monitoring & Dashboard
+# ==========================================================
+# Résultat de /api/health/{overall,issues,metrics} en cache par tenant
+# (invalidé à la fin de chaque job de backup)
+HEALTH_CACHE_TTL_SECONDS = 60
+# Résumé /api/dashboard/{stats,recent_backups} en cache par tenant
+# (invalidé à chaque changement de statut d'un job de backup)
+DASHBOARD_CACHE_TTL_SECONDS = 60
+
+# ==========================================================
+# Backup Rollups
+# ==========================================================
+# Agrégats horaires conservés N jours (les agrégats journaliers sont permanents)
+ROLLUP_HOURLY_RETENTION_DAYS = 31
+
+# ==========================================================
+# Log Archival (BackupLog, ReplicationLog, NotificationLog)
+# ==========================================================
+# Journaux conservés en base N jours, puis archivés en JSONL gzip mensuel
+LOG_RETENTION_DAYS = 90
+# Dossier des archives (peut être un partage monté sur le stockage de sauvegarde)
+LOG_ARCHIVE_DIR = BASE_DIR / 'log_archives'
+# Lignes archivées puis supprimées par transaction
+LOG_ARCHIVE_BATCH_SIZE = 1000
+# Nombre maximal de lignes renvoyées par un endpoint lorsqu'il relit les archives
+LOG_ARCHIVE_QUERY_LIMIT = 1000
+
 # ==========================================================
 # Multi-Tenant SaaS Configuration
 # ==========================================================
 
+# Tenant context of each user (organization, subscription, plan limits) cached
+# by TenantMiddleware; invalidated by signals on membership/organization/plan changes
+TENANT_CONTEXT_CACHE_SECONDS = 60
+
+# UsageMetrics: API calls counted in Redis, written to the database by
+# tenants.tasks.flush_usage_counters (in-process counters flushed every N seconds without Redis)
+USAGE_COUNTERS_REDIS_URL = CELERY_BROKER_URL
+USAGE_API_CALLS_FLUSH_SECONDS = 60
+
 # PayPal Configuration
 PAYPAL_MODE = 'sandbox'  # 'sandbox' or 'live'
 PAYPAL_CLIENT_ID = 'your-paypal-client-id'  # TODO: Add your PayPal Client ID
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'sauvegarde.settings')
 
 application = get_wsgi_application()
+
+# Reprise des copies du staging interrompues par l'arrêt précédent (backups.backup_staging)
+from backups.backup_staging import backup_staging  # noqa: E402
+
+backup_staging.resume_pending()
@@ -13,6 +13,5 @@ class TenantsConfig(AppConfig):
         """
         Import signals and perform app initialization
         """
-        # Import signals if any
-        # from . import signals
-        pass
+        # Invalidation of the cached tenant contexts
+        from . import signals  # noqa: F401
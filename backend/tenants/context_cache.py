@@ -0,0 +1,146 @@
+"""
+Per-user tenant context cache
+
+Resolving the tenant of a user costs one or two queries (owned organization,
+then first active membership) and the subscription check needs the
+organization row. Both run on every authenticated request, including the
+1-second progress polling, so the result is cached per user:
+
+    {
+        'organization_id': UUID or None,
+        'name': str,
+        'status': str,
+        'subscription_end': datetime or None,
+        'plan': {'name', 'max_esxi_servers', 'max_vms', ...} or None,
+        'error': str or None,   # explicitly requested organization not allowed
+    }
+
+Entries expire after TENANT_CONTEXT_CACHE_SECONDS and are invalidated by
+signals (see tenants.signals): membership and user changes drop the entries
+of that user, organization and plan changes bump a version key that
+invalidates every entry at once (these changes are rare).
+"""
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+TENANT_CONTEXT_VERSION_KEY = 'tenant_context_version'
+
+PLAN_LIMIT_FIELDS = (
+    'max_esxi_servers', 'max_vms', 'max_backups_per_month', 'max_storage_gb', 'max_users',
+    'has_replication', 'has_surebackup', 'has_api_access',
+)
+
+
+def invalidate_all_tenant_contexts():
+    """Invalidate every cached tenant context (organization or plan change)"""
+    cache.set(TENANT_CONTEXT_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_user_tenant_context(user_id, org_id=None):
+    """
+    Invalidate the cached contexts of one user
+
+    Args:
+        user_id: User ID
+        org_id: Organization the entry was explicitly requested for (X-Organization-ID)
+    """
+    keys = [_cache_key(user_id, None)]
+    if org_id:
+        keys.append(_cache_key(user_id, org_id))
+    cache.delete_many(keys)
+
+
+def _cache_key(user_id, org_id, version=None):
+    if version is None:
+        version = cache.get(TENANT_CONTEXT_VERSION_KEY, 0)
+    return f'tenant_context:{version}:{user_id}:{org_id or "-"}'
+
+
+def _normalize_org_id(org_id):
+    """UUID string of a requested organization, '' if none, None if malformed"""
+    if not org_id:
+        return ''
+    try:
+        return str(uuid.UUID(str(org_id)))
+    except ValueError:
+        return None
+
+
+def build_tenant_context(organization, error=None):
+    """Cacheable snapshot of an organization (no model instance)"""
+    if organization is None:
+        return {
+            'organization_id': None,
+            'name': None,
+            'status': None,
+            'subscription_end': None,
+            'plan': None,
+            'error': error,
+        }
+
+    plan = organization.plan
+    return {
+        'organization_id': organization.id,
+        'name': organization.name,
+        'status': organization.status,
+        'subscription_end': organization.subscription_end,
+        'plan': {
+            'name': plan.name,
+            **{field: getattr(plan, field) for field in PLAN_LIMIT_FIELDS},
+        },
+        'error': error,
+    }
+
+
+def get_tenant_context(user, org_id=None):
+    """
+    Tenant context of an authenticated user (cached)
+
+    Args:
+        user: User instance or user ID (the user is only loaded on a cache miss)
+        org_id: Organization explicitly requested (X-Organization-ID)
+
+    Returns:
+        dict: See module docstring
+    """
+    from django.contrib.auth.models import User
+    from .middleware import resolve_organization
+
+    user_id = user if isinstance(user, int) else user.id
+    normalized = _normalize_org_id(org_id)
+    key = _cache_key(user_id, normalized) if normalized is not None else None
+
+    if key:
+        context = cache.get(key)
+        if context is not None:
+            return context
+
+    if isinstance(user, int):
+        try:
+            user = User.objects.get(id=user_id)
+        except User.DoesNotExist:
+            return build_tenant_context(None)
+
+    organization, error = resolve_organization(user, org_id)
+    context = build_tenant_context(organization, error)
+
+    if key:
+        cache.set(key, context, timeout=getattr(settings, 'TENANT_CONTEXT_CACHE_SECONDS', 60))
+    return context
+
+
+def is_context_active(context):
+    """Same rule as Organization.is_active(), on a cached context"""
+    from django.utils import timezone
+
+    if context['status'] != 'active':
+        return False
+    if context['subscription_end'] and context['subscription_end'] < timezone.now():
+        return False
+    return True
@@ -0,0 +1,34 @@
+"""
+Management command to recompute the UsageMetrics counters from scratch
+"""
+from django.core.management.base import BaseCommand
+
+from tenants.models import Organization
+from tenants.services.usage_service import usage_service
+
+
+class Command(BaseCommand):
+    help = 'Recompute the current-period usage counters of each organization (backfill or repair)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--organization', action='append', help='Organization ID or slug (repeatable)')
+
+    def handle(self, *args, **options):
+        organizations = Organization.objects.all()
+        if options['organization']:
+            wanted = options['organization']
+            organizations = [
+                org for org in organizations if str(org.id) in wanted or org.slug in wanted
+            ]
+
+        flushed = usage_service.flush_api_calls()
+        if flushed:
+            self.stdout.write(f'{flushed} pending API call(s) flushed')
+
+        for org in organizations:
+            counters = usage_service.reconcile(org.id)
+            self.stdout.write(
+                f"{org.slug}: {counters.get('backups_count', 0)} backup(s) this period, "
+                f"{counters.get('storage_used_gb', 0)} GB stored"
+            )
+        self.stdout.write(self.style.SUCCESS('Usage counters up to date'))
@@ -3,12 +3,81 @@ Tenant isolation middleware
 Automatically filters queries based on current user's organization
 """
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
 from django.http import JsonResponse
 import logging
 
+from .context_cache import get_tenant_context, is_context_active
+
 logger = logging.getLogger(__name__)
 
 
+def resolve_organization(user, org_id=None):
+    """
+    Resolve the organization (tenant) of an authenticated user
+
+    Tenant can be determined from:
+    1. Organization ID explicitly requested (X-Organization-ID), if the user is a member
+    2. User's primary organization (owned, then first active membership)
+
+    Superusers only get a tenant when one is explicitly requested.
+
+    Returns:
+        tuple: (Organization or None, error message or None)
+    """
+    from .models import Organization, OrganizationMember
+
+    # Superusers can access all tenants
+    if user.is_superuser:
+        if org_id:
+            try:
+                return Organization.objects.select_related('plan').get(id=org_id), None
+            except (Organization.DoesNotExist, ValueError):
+                pass
+        return None, None
+
+    # Method 1: Organization explicitly requested
+    if org_id:
+        try:
+            # Verify user has access to this organization
+            membership = OrganizationMember.objects.select_related('organization__plan').get(
+                organization_id=org_id,
+                user=user,
+                is_active=True
+            )
+            logger.debug(f"Tenant set from header: {membership.organization.name}")
+            return membership.organization, None
+        except (OrganizationMember.DoesNotExist, ValueError):
+            logger.warning(f"User {user.username} attempted to access organization {org_id} without permission")
+            return None, 'Accès non autorisé à cette organisation'
+
+    # Method 2: Get user's primary organization (owner or first membership)
+    try:
+        # Try to get owned organization first
+        owned_org = Organization.objects.select_related('plan').filter(owner=user).first()
+        if owned_org:
+            logger.debug(f"Tenant set from ownership: {owned_org.name}")
+            return owned_org, None
+
+        # Otherwise, get first active membership
+        membership = OrganizationMember.objects.filter(
+            user=user,
+            is_active=True
+        ).select_related('organization__plan').first()
+
+        if membership:
+            logger.debug(f"Tenant set from membership: {membership.organization.name}")
+            return membership.organization, None
+
+    except Exception as e:
+        logger.error(f"Error determining tenant for user {user.username}: {str(e)}")
+
+    # No organization found - user might be in setup phase
+    # Don't block the request, but tenant will be None
+    logger.debug(f"No tenant found for user {user.username}")
+    return None, None
+
+
 class TenantMiddleware(MiddlewareMixin):
     """
     Middleware to set current tenant (organization) in thread-local storage
@@ -23,75 +92,37 @@ class TenantMiddleware(MiddlewareMixin):
         1. User's primary organization (from OrganizationMember)
         2. Organization ID in request headers (X-Organization-ID)
         3. Organization slug in subdomain (org.example.com)
-        """
-        from .models import Organization, OrganizationMember
 
+        The resolution is cached per user (see tenants.context_cache): in the
+        steady state, no query is made. request.organization is loaded lazily,
+        only if a view actually uses it.
+        """
         # Set default tenant to None
         request.tenant = None
         request.organization = None
+        request.tenant_context = None
 
         # Skip for anonymous users
         if not request.user or not request.user.is_authenticated:
             return None
 
-        # Skip for superusers (they can access all tenants)
-        if request.user.is_superuser:
-            # Check if specific organization is requested
-            org_id = request.META.get('HTTP_X_ORGANIZATION_ID')
-            if org_id:
-                try:
-                    request.organization = Organization.objects.get(id=org_id)
-                    request.tenant = request.organization.id
-                except Organization.DoesNotExist:
-                    pass
-            return None
+        context = get_tenant_context(
+            request.user,
+            request.META.get('HTTP_X_ORGANIZATION_ID')
+        )
+        if context['error']:
+            return JsonResponse({'error': context['error']}, status=403)
 
-        # Method 1: Check for organization in request headers
-        org_id = request.META.get('HTTP_X_ORGANIZATION_ID')
+        org_id = context['organization_id']
         if org_id:
-            try:
-                # Verify user has access to this organization
-                membership = OrganizationMember.objects.get(
-                    organization_id=org_id,
-                    user=request.user,
-                    is_active=True
-                )
-                request.organization = membership.organization
-                request.tenant = request.organization.id
-                logger.debug(f"Tenant set from header: {request.organization.name}")
-                return None
-            except OrganizationMember.DoesNotExist:
-                logger.warning(f"User {request.user.username} attempted to access organization {org_id} without permission")
-                return JsonResponse({'error': 'Accès non autorisé à cette organisation'}, status=403)
-
-        # Method 2: Get user's primary organization (owner or first membership)
-        try:
-            # Try to get owned organization first
-            owned_org = Organization.objects.filter(owner=request.user).first()
-            if owned_org:
-                request.organization = owned_org
-                request.tenant = owned_org.id
-                logger.debug(f"Tenant set from ownership: {owned_org.name}")
-                return None
-
-            # Otherwise, get first active membership
-            membership = OrganizationMember.objects.filter(
-                user=request.user,
-                is_active=True
-            ).select_related('organization').first()
-
-            if membership:
-                request.organization = membership.organization
-                request.tenant = membership.organization.id
-                logger.debug(f"Tenant set from membership: {membership.organization.name}")
-                return None
+            from .models import Organization
 
-        except Exception as e:
-            logger.error(f"Error determining tenant for user {request.user.username}: {str(e)}")
+            request.tenant_context = context
+            request.tenant = org_id
+            request.organization = SimpleLazyObject(
+                lambda: Organization.objects.select_related('plan').get(id=org_id)
+            )
 
-        # No organization found - user might be in setup phase
-        # Don't block the request, but tenant will be None
-        logger.debug(f"No tenant found for user {request.user.username}")
         return None
 
     def process_response(self, request, response):
@@ -101,7 +132,38 @@ class TenantMiddleware(MiddlewareMixin):
             delattr(request, 'tenant')
         if hasattr(request, 'organization'):
             delattr(request, 'organization')
+        if hasattr(request, 'tenant_context'):
+            delattr(request, 'tenant_context')
+
+        return response
+
 
+class ApiUsageMiddleware(MiddlewareMixin):
+    """
+    Count API calls per organization (UsageMetrics.api_calls_count)
+
+    Runs after the view, so token-authenticated users (resolved by DRF) are
+    counted too. The tenant resolved by TenantMiddleware is reused; when it
+    is unknown (DRF authentication), the call is counted against the user and
+    attributed to its organization at flush time: no query per request.
+    Counters live in Redis and are flushed periodically
+    (see tenants.services.usage_service).
+    """
+
+    def process_response(self, request, response):
+        if not request.path.startswith('/api/'):
+            return response
+
+        user = getattr(request, 'user', None)
+        if not user or not user.is_authenticated:
+            return response
+
+        try:
+            from .services.usage_service import usage_service
+
+            usage_service.count_api_call(org_id=getattr(request, 'tenant', None), user_id=user.id)
+        except Exception as e:
+            logger.warning(f"API call not counted: {e}")
         return response
 
 
@@ -130,23 +192,23 @@ class TenantAccessMiddleware(MiddlewareMixin):
         if not request.user or not request.user.is_authenticated or request.user.is_superuser:
             return None
 
-        # Check if organization is active
-        if hasattr(request, 'organization') and request.organization:
-            org = request.organization
-
+        # Check if organization is active (cached context, no query)
+        context = getattr(request, 'tenant_context', None)
+        if context:
             # Check subscription status
-            if org.status != 'active':
+            if context['status'] != 'active':
                 return JsonResponse({
                     'error': 'Votre abonnement n\'est pas actif',
-                    'status': org.status,
-                    'message': self._get_status_message(org.status)
+                    'status': context['status'],
+                    'message': self._get_status_message(context['status'])
                 }, status=403)
 
             # Check if subscription has expired
-            if not org.is_active():
+            if not is_context_active(context):
+                subscription_end = context['subscription_end']
                 return JsonResponse({
                     'error': 'Votre abonnement a expiré',
-                    'expired_at': org.subscription_end.isoformat() if org.subscription_end else None,
+                    'expired_at': subscription_end.isoformat() if subscription_end else None,
                     'message': 'Veuillez renouveler votre abonnement pour continuer'
                 }, status=403)
 
@@ -0,0 +1,324 @@
+"""
+Incremental usage accounting (UsageMetrics)
+
+Counters of the current billing period are updated from events instead of
+being recomputed from the job history and the storage directories:
+
+- job completion (once per job, from backups.rollup_service.record_job):
+  backups_count + 1, storage_used_gb + job size
+- retention cleanup and deletion of a backup/export: storage_used_gb - freed size
+- ESXi server added/removed, VM synchronization: esxi_servers_count / vms_count
+  (indexed COUNT on the tenant's servers)
+- membership changes: users_count
+- API calls: counted in Redis (USAGE_COUNTERS_REDIS_URL) and flushed to the
+  database by the flush_usage_counters task; without Redis, counted in the
+  process and flushed every USAGE_API_CALLS_FLUSH_SECONDS
+
+Reading the usage of an organization is then a single row lookup. The
+reconcile_usage command recomputes the counters from scratch (initial
+backfill, drift after a crash).
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+API_CALLS_KEY_PREFIX = 'usage:api_calls:'
+# Calls of users whose tenant is not known during the request (token
+# authentication, resolved by DRF after TenantMiddleware): attributed to the
+# user's organization at flush time, so counting never queries the database
+USER_API_CALLS_KEY_PREFIX = 'usage:user_api_calls:'
+
+# Level counters carried over to the next billing period (the others restart at 0)
+CARRIED_OVER_FIELDS = ('esxi_servers_count', 'vms_count', 'storage_used_gb', 'users_count')
+
+
+class UsageAccountingService:
+    """
+    Incremental maintenance of the current UsageMetrics row of each organization
+    """
+
+    def __init__(self, redis_url=None):
+        self.redis_url = redis_url or getattr(
+            settings, 'USAGE_COUNTERS_REDIS_URL', getattr(settings, 'CELERY_BROKER_URL', None)
+        )
+        self._redis = None
+        self._redis_retry_at = 0
+        self._lock = threading.Lock()
+        self._local_api_calls = {}
+        self._local_flushed_at = time.monotonic()
+
+    # ------------------------------------------------------------------
+    # Current period
+    # ------------------------------------------------------------------
+    @staticmethod
+    def current_metrics(org_id):
+        """
+        UsageMetrics row of the current billing period (created on first use)
+
+        A new period starts when the previous one has ended; level counters
+        (servers, VMs, storage, users) are carried over.
+
+        Returns:
+            UsageMetrics or None if the organization does not exist
+        """
+        from ..models import Organization, UsageMetrics
+
+        today = timezone.now().date()
+        metrics = UsageMetrics.objects.select_related('organization__plan').filter(
+            organization_id=org_id, period_start__lte=today
+        ).order_by('-period_start').first()
+        if metrics and metrics.period_end >= today:
+            return metrics
+
+        organization = Organization.objects.filter(id=org_id).only('billing_cycle').first()
+        if organization is None:
+            return None
+
+        length = 365 if organization.billing_cycle == 'yearly' else 30
+        defaults = {'period_end': today + timedelta(days=length)}
+        if metrics:
+            defaults.update({field: getattr(metrics, field) for field in CARRIED_OVER_FIELDS})
+        try:
+            with transaction.atomic():
+                metrics, _ = UsageMetrics.objects.get_or_create(
+                    organization_id=org_id, period_start=today, defaults=defaults
+                )
+        except IntegrityError:
+            metrics = UsageMetrics.objects.get(organization_id=org_id, period_start=today)
+        return metrics
+
+    def _increment(self, org_id, metrics=None, **deltas):
+        """Atomic F() update of the current period (no read-modify-write)"""
+        metrics = metrics or self.current_metrics(org_id)
+        if metrics is None:
+            return
+        from ..models import UsageMetrics
+
+        updates = {}
+        for field, delta in deltas.items():
+            if field == 'storage_used_gb' and delta < 0:
+                updates[field] = Greatest(F(field) + delta, Value(0.0))
+            else:
+                updates[field] = F(field) + delta
+        UsageMetrics.objects.filter(id=metrics.id).update(**updates, updated_at=timezone.now())
+
+    # ------------------------------------------------------------------
+    # Events
+    # ------------------------------------------------------------------
+    @staticmethod
+    def tenant_of_user(user_id):
+        from backups.progress_stream import tenant_for_user
+
+        return tenant_for_user(user_id)
+
+    def record_job(self, job, size_mb):
+        """
+        Finished backup/export job (called once per job)
+
+        Args:
+            job: BackupJob, VMBackupJob or OVFExportJob in a final status
+            size_mb: Size written to the storage (0 if the job did not complete)
+        """
+        if job.status != 'completed':
+            return
+        org_id = self.tenant_of_user(job.created_by_id)
+        if not org_id:
+            return
+
+        deltas = {'storage_used_gb': (size_mb or 0) / 1024}
+        metrics = self.current_metrics(org_id)
+        completed_at = job.completed_at or timezone.now()
+        if metrics and metrics.period_start <= completed_at.date() <= metrics.period_end:
+            deltas['backups_count'] = 1
+        self._increment(org_id, metrics=metrics, **deltas)
+
+    def record_storage_freed(self, org_id, freed_bytes):
+        """Backups deleted (retention, manual deletion)"""
+        if org_id and freed_bytes:
+            self._increment(org_id, storage_used_gb=-freed_bytes / (1024 ** 3))
+
+    def refresh_inventory(self, org_id):
+        """Recount ESXi servers and VMs of an organization (server added/removed, VM sync)"""
+        if not org_id:
+            return
+        from backups.tenant_scheduler import tenant_scheduler
+        from esxi.models import ESXiServer, VirtualMachine
+
+        user_ids = tenant_scheduler.tenant_user_ids(org_id)
+        metrics = self.current_metrics(org_id)
+        if metrics is None:
+            return
+        type(metrics).objects.filter(id=metrics.id).update(
+            esxi_servers_count=ESXiServer.objects.filter(created_by_id__in=user_ids).count(),
+            vms_count=VirtualMachine.objects.filter(server__created_by_id__in=user_ids).count(),
+            updated_at=timezone.now(),
+        )
+
+    def refresh_members(self, org_id):
+        """Recount active members (membership added/removed)"""
+        from ..models import OrganizationMember
+
+        metrics = self.current_metrics(org_id)
+        if metrics is None:
+            return
+        type(metrics).objects.filter(id=metrics.id).update(
+            users_count=OrganizationMember.objects.filter(organization_id=org_id, is_active=True).count(),
+            updated_at=timezone.now(),
+        )
+
+    # ------------------------------------------------------------------
+    # API calls
+    # ------------------------------------------------------------------
+    def _get_redis(self):
+        """Redis client, or None (retried every 30 s)"""
+        if not self.redis_url or not self.redis_url.startswith('redis'):
+            return None
+        if self._redis is not None:
+            return self._redis
+        if time.monotonic() < self._redis_retry_at:
+            return None
+        try:
+            import redis
+            client = redis.Redis.from_url(self.redis_url, socket_connect_timeout=1, socket_timeout=1)
+            client.ping()
+            self._redis = client
+        except Exception as e:
+            logger.warning(f"[USAGE] Redis unavailable ({e}), API calls counted in process")
+            self._redis_retry_at = time.monotonic() + 30
+        return self._redis
+
+    def count_api_call(self, org_id=None, user_id=None):
+        """
+        Count one API call (no database access)
+
+        Args:
+            org_id: Organization of the request, when already resolved
+            user_id: Authenticated user, attributed to its organization at flush time
+        """
+        if org_id:
+            key = f'{API_CALLS_KEY_PREFIX}{org_id}'
+        elif user_id:
+            key = f'{USER_API_CALLS_KEY_PREFIX}{user_id}'
+        else:
+            return
+
+        client = self._get_redis()
+        if client is not None:
+            try:
+                client.incr(key)
+                return
+            except Exception as e:
+                logger.warning(f"[USAGE] Redis error ({e}), API calls counted in process")
+                self._redis = None
+                self._redis_retry_at = time.monotonic() + 30
+
+        with self._lock:
+            self._local_api_calls[key] = self._local_api_calls.get(key, 0) + 1
+            due = time.monotonic() - self._local_flushed_at >= getattr(
+                settings, 'USAGE_API_CALLS_FLUSH_SECONDS', 60
+            )
+        if due:
+            self.flush_local_api_calls()
+
+    def _organization_of_key(self, key):
+        """Organization a counter key is attributed to (None if the user has none)"""
+        if key.startswith(USER_API_CALLS_KEY_PREFIX):
+            return self.tenant_of_user(int(key[len(USER_API_CALLS_KEY_PREFIX):]))
+        return key[len(API_CALLS_KEY_PREFIX):]
+
+    def flush_local_api_calls(self):
+        """Write the in-process API call counters (fallback without Redis)"""
+        with self._lock:
+            counts, self._local_api_calls = self._local_api_calls, {}
+            self._local_flushed_at = time.monotonic()
+        flushed = 0
+        for key, count in counts.items():
+            org_id = self._organization_of_key(key)
+            if org_id:
+                self._increment(org_id, api_calls_count=count)
+                flushed += count
+        return flushed
+
+    def flush_api_calls(self):
+        """
+        Move the Redis API call counters to the current UsageMetrics rows
+
+        GETSET 0 reads and resets each counter atomically: calls counted
+        during the flush are kept for the next one.
+
+        Returns:
+            int: Number of API calls written
+        """
+        flushed = self.flush_local_api_calls()
+        client = self._get_redis()
+        if client is None:
+            return flushed
+
+        for prefix in (API_CALLS_KEY_PREFIX, USER_API_CALLS_KEY_PREFIX):
+            for key in client.scan_iter(match=f'{prefix}*', count=500):
+                count = int(client.getset(key, 0) or 0)
+                if not count:
+                    continue
+                key = key.decode() if isinstance(key, bytes) else key
+                try:
+                    org_id = self._organization_of_key(key)
+                    if org_id:
+                        self._increment(org_id, api_calls_count=count)
+                        flushed += count
+                except Exception as e:
+                    client.incrby(key, count)
+                    logger.error(f"[USAGE] API calls flush failed for {key}: {e}")
+        return flushed
+
+    # ------------------------------------------------------------------
+    # Reconciliation
+    # ------------------------------------------------------------------
+    def reconcile(self, org_id):
+        """
+        Recompute the current period from the job history and the inventory
+
+        Full scan of the organization's jobs: initial backfill or repair only.
+
+        Returns:
+            dict: Recomputed counters
+        """
+        from django.db.models import Sum
+        from backups.models import BackupJob, OVFExportJob, VMBackupJob
+        from backups.tenant_scheduler import tenant_scheduler
+
+        metrics = self.current_metrics(org_id)
+        if metrics is None:
+            return {}
+        user_ids = tenant_scheduler.tenant_user_ids(org_id)
+
+        storage_mb = 0
+        backups_count = 0
+        for model, size_field in ((BackupJob, 'backup_size_mb'), (VMBackupJob, 'backup_size_mb'),
+                                  (OVFExportJob, 'export_size_mb')):
+            completed = model.objects.filter(created_by_id__in=user_ids, status='completed')
+            storage_mb += completed.aggregate(total=Sum(size_field))['total'] or 0
+            backups_count += completed.filter(
+                completed_at__date__gte=metrics.period_start, completed_at__date__lte=metrics.period_end
+            ).count()
+
+        counters = {
+            'storage_used_gb': round(storage_mb / 1024, 3),
+            'backups_count': backups_count,
+        }
+        type(metrics).objects.filter(id=metrics.id).update(**counters, updated_at=timezone.now())
+        self.refresh_inventory(org_id)
+        self.refresh_members(org_id)
+        return counters
+
+
+# Global instance
+usage_service = UsageAccountingService()
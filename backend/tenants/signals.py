@@ -0,0 +1,62 @@
+"""
+Tenant signals
+
+Invalidate the cached tenant contexts (tenants.context_cache) when a
+membership, a user, an organization (status, subscription, owner) or a plan
+changes, and keep the level counters of UsageMetrics (users, ESXi servers,
+VMs) up to date.
+"""
+import logging
+
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from esxi.models import ESXiServer
+from .context_cache import invalidate_all_tenant_contexts, invalidate_user_tenant_context
+from .models import Organization, OrganizationMember, Plan
+from .services.usage_service import usage_service
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=OrganizationMember)
+@receiver(post_delete, sender=OrganizationMember)
+def invalidate_member_context(sender, instance, **kwargs):
+    """Membership added, changed or removed: only this user is affected"""
+    invalidate_user_tenant_context(instance.user_id, instance.organization_id)
+    try:
+        usage_service.refresh_members(instance.organization_id)
+    except Exception as e:
+        logger.error(f"Usage members refresh failed for {instance.organization_id}: {e}")
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_context(sender, instance, created, update_fields=None, **kwargs):
+    """is_superuser may have changed (login only updates last_login)"""
+    if created or (update_fields and set(update_fields) == {'last_login'}):
+        return
+    invalidate_user_tenant_context(instance.id)
+
+
+@receiver(post_save, sender=Organization)
+@receiver(post_delete, sender=Organization)
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+def invalidate_organization_contexts(sender, **kwargs):
+    """Status, subscription, owner or plan limits changed"""
+    invalidate_all_tenant_contexts()
+
+
+@receiver(post_save, sender=ESXiServer)
+@receiver(post_delete, sender=ESXiServer)
+def refresh_server_inventory(sender, instance, created=False, **kwargs):
+    """ESXi server added or removed (its VMs go with it)"""
+    if kwargs.get('signal') is post_save and not created:
+        return
+    from backups.progress_stream import tenant_for_user
+
+    try:
+        usage_service.refresh_inventory(tenant_for_user(instance.created_by_id))
+    except Exception as e:
+        logger.error(f"Usage inventory refresh failed for server {instance.pk}: {e}")
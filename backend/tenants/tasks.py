@@ -0,0 +1,21 @@
+"""
+Celery tasks of the tenants app
+"""
+import logging
+
+from celery import shared_task
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def flush_usage_counters():
+    """
+    Periodic task: write the API call counters (Redis) to UsageMetrics
+    """
+    from .services.usage_service import usage_service
+
+    flushed = usage_service.flush_api_calls()
+    if flushed:
+        logger.info(f"[USAGE] {flushed} API call(s) flushed to UsageMetrics")
+    return {'flushed': flushed}
@@ -136,11 +136,13 @@ class OrganizationViewSet(viewsets.ModelViewSet):
 
     @action(detail=True, methods=['get'])
     def usage(self, request, pk=None):
-        """Get current usage metrics"""
+        """Get current usage metrics (maintained incrementally, see usage_service)"""
+        from .services.usage_service import usage_service
+
         org = self.get_object()
 
-        # Get current period metrics
-        current_metrics = org.usage_metrics.order_by('-period_start').first()
+        # Get current period metrics (single indexed row lookup)
+        current_metrics = usage_service.current_metrics(org.id)
 
         if not current_metrics:
             return Response({
@@ -1,5 +1,14 @@
 import { ref, onMounted, onUnmounted } from 'vue'
 import { useOperationsStore } from '@/stores/operations'
+import { useProgressStream } from '@/composables/useProgressStream'
+
+// Type d'opération -> type d'événement du flux SSE
+const STREAM_KINDS = {
+  replication: 'replication',
+  restore: 'restore',
+  export: 'ovf_export',
+  backup: 'vm_backup'
+}
 
 /**
  * Composable pour tracker une opération avec persistence
@@ -19,6 +28,13 @@ export function useOperationTracking(operationType, getProgressFn, options = {})
     onProgress = null
   } = options
 
+  // Progression poussée par le serveur pour l'opération suivie
+  const { connected: streamConnected } = useProgressStream((event) => {
+    if (currentOperationId.value !== null && String(currentOperationId.value) === event.id) {
+      handleProgress(currentOperationId.value, event.data)
+    }
+  }, { kinds: [STREAM_KINDS[operationType] || operationType] })
+
   /**
    * Démarrer le tracking d'une opération
    */
@@ -45,44 +61,12 @@ export function useOperationTracking(operationType, getProgressFn, options = {})
     stopPolling()
 
     pollInterval.value = setInterval(async () => {
+      // Le flux SSE pousse déjà la progression: le polling n'est qu'un repli
+      if (streamConnected.value) return
+
       try {
         const progressData = await getProgressFn(operationId)
-
-        // Mettre à jour le store
-        operationsStore.updateProgress(
-          operationType,
-          operationId,
-          progressData.progress || 0,
-          progressData.status,
-          progressData.message || ''
-        )
-
-        // Callback de progression
-        if (onProgress) {
-          onProgress(progressData)
-        }
-
-        // Arrêter le polling si terminé
-        if (progressData.status === 'completed' || progressData.status === 'error' || progressData.status === 'cancelled') {
-          stopPolling()
-          currentOperationId.value = null
-
-          // Callbacks
-          if (progressData.status === 'completed' && onComplete) {
-            onComplete(progressData)
-          } else if (progressData.status === 'error' && onError) {
-            onError(progressData)
-          }
-
-          // Retirer l'opération après un délai (pour voir le statut final)
-          setTimeout(() => {
-            // Ne retirer que si toujours dans le même état (pas relancée)
-            const op = operationsStore.getOperation(operationType, operationId)
-            if (op && (op.status === 'completed' || op.status === 'error' || op.status === 'cancelled')) {
-              operationsStore.removeOperation(operationType, operationId)
-            }
-          }, 10000) // 10 secondes
-        }
+        handleProgress(operationId, progressData)
       } catch (error) {
         console.error(`Erreur polling ${operationType}:`, error)
         // Ne pas arrêter le polling en cas d'erreur réseau temporaire
@@ -90,6 +74,47 @@ export function useOperationTracking(operationType, getProgressFn, options = {})
     }, pollMs)
   }
 
+  /**
+   * Traiter une mise à jour de progression (polling ou flux SSE)
+   */
+  const handleProgress = (operationId, progressData) => {
+    // Mettre à jour le store
+    operationsStore.updateProgress(
+      operationType,
+      operationId,
+      progressData.progress || 0,
+      progressData.status,
+      progressData.message || ''
+    )
+
+    // Callback de progression
+    if (onProgress) {
+      onProgress(progressData)
+    }
+
+    // Arrêter le suivi si terminé
+    if (progressData.status === 'completed' || progressData.status === 'error' || progressData.status === 'cancelled') {
+      stopPolling()
+      currentOperationId.value = null
+
+      // Callbacks
+      if (progressData.status === 'completed' && onComplete) {
+        onComplete(progressData)
+      } else if (progressData.status === 'error' && onError) {
+        onError(progressData)
+      }
+
+      // Retirer l'opération après un délai (pour voir le statut final)
+      setTimeout(() => {
+        // Ne retirer que si toujours dans le même état (pas relancée)
+        const op = operationsStore.getOperation(operationType, operationId)
+        if (op && (op.status === 'completed' || op.status === 'error' || op.status === 'cancelled')) {
+          operationsStore.removeOperation(operationType, operationId)
+        }
+      }, 10000) // 10 secondes
+    }
+  }
+
   /**
    * Arrêter le polling
    */
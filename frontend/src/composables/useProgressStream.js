@@ -0,0 +1,124 @@
+import { ref, onUnmounted } from 'vue'
+import { progressStreamAPI } from '@/services/api'
+
+const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000/api'
+
+// Connexion SSE partagée par tous les composants (une seule par onglet)
+const connected = ref(false)
+let eventSource = null
+let connecting = false
+let reconnectTimer = null
+const handlers = new Set()
+
+/**
+ * Ouvrir (ou réutiliser) la connexion au flux de progression
+ */
+async function connect() {
+  if (eventSource || connecting || typeof EventSource === 'undefined') return
+  if (!localStorage.getItem('authToken')) return
+
+  // Ticket à usage unique: le token d'authentification ne passe jamais dans l'URL
+  connecting = true
+  let ticket
+  try {
+    const response = await progressStreamAPI.getTicket()
+    ticket = response.data.ticket
+  } catch (error) {
+    scheduleReconnect()
+    return
+  } finally {
+    connecting = false
+  }
+  if (eventSource || handlers.size === 0) return
+
+  const params = new URLSearchParams({ ticket })
+  eventSource = new EventSource(`${API_BASE_URL}/progress/stream/?${params.toString()}`)
+
+  eventSource.onopen = () => {
+    connected.value = true
+  }
+
+  eventSource.addEventListener('progress', (message) => {
+    let event
+    try {
+      event = JSON.parse(message.data)
+    } catch (error) {
+      return
+    }
+    handlers.forEach(handler => {
+      try {
+        handler(event)
+      } catch (error) {
+        console.error('Erreur handler progression:', error)
+      }
+    })
+  })
+
+  eventSource.onerror = () => {
+    // Le polling reprend tant que le flux est coupé
+    connected.value = false
+    if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+      eventSource = null
+      scheduleReconnect()
+    }
+  }
+}
+
+/**
+ * Nouvelle tentative dans 5 s (nouveau ticket à chaque connexion)
+ */
+function scheduleReconnect() {
+  if (handlers.size > 0 && !reconnectTimer) {
+    reconnectTimer = setTimeout(() => {
+      reconnectTimer = null
+      connect()
+    }, 5000)
+  }
+}
+
+function disconnect() {
+  if (reconnectTimer) {
+    clearTimeout(reconnectTimer)
+    reconnectTimer = null
+  }
+  if (eventSource) {
+    eventSource.close()
+    eventSource = null
+  }
+  connected.value = false
+}
+
+/**
+ * Composable pour recevoir la progression des opérations en temps réel (Server-Sent Events)
+ *
+ * Les endpoints de polling restent le repli: tant que `connected` est faux,
+ * les composants continuent à interroger l'API.
+ *
+ * @param {Function} handler - Reçoit chaque événement { kind, id, data, timestamp }
+ * @param {Object} options - Options (kinds: liste des types d'événements à recevoir)
+ */
+export function useProgressStream(handler, options = {}) {
+  const { kinds = null } = options
+
+  const filteredHandler = (event) => {
+    if (kinds && !kinds.includes(event.kind)) return
+    handler(event)
+  }
+
+  handlers.add(filteredHandler)
+  connect()
+
+  const unsubscribe = () => {
+    handlers.delete(filteredHandler)
+    if (handlers.size === 0) {
+      disconnect()
+    }
+  }
+
+  onUnmounted(unsubscribe)
+
+  return {
+    connected,
+    unsubscribe
+  }
+}
@@ -318,6 +318,13 @@ export const verificationSchedulesAPI = {
   toggleActive: (id) => apiClient.post(`/verification-schedules/${id}/toggle_active/`),
 }
 
+// ===========================
+// PROGRESS STREAM API
+// ===========================
+export const progressStreamAPI = {
+  getTicket: () => apiClient.post('/progress/ticket/'),  // Ticket à usage unique pour ouvrir le flux SSE
+}
+
 // ===========================
 // EMAIL SETTINGS API
 // ===========================
@@ -164,6 +164,26 @@ export const useVMOperationsStore = defineStore('vmOperations', () => {
     }
   }
 
+  // ===========================
+  // PROGRESSION TEMPS RÉEL (SSE)
+  // ===========================
+
+  /**
+   * Appliquer un événement de progression du flux SSE à la liste concernée
+   * @returns {boolean} true si un job de la liste a été mis à jour
+   */
+  function applyProgressEvent(event) {
+    const list = event.kind === 'ovf_export' ? ovfExports : event.kind === 'vm_backup' ? vmBackups : null
+    if (!list) return false
+
+    const job = list.value.find(j => String(j.id) === event.id)
+    if (!job) return false
+
+    const { progress, ...fields } = event.data
+    Object.assign(job, fields, { progress_percentage: progress })
+    return true
+  }
+
   return {
     // État
     ovfExports,
@@ -183,5 +203,8 @@ export const useVMOperationsStore = defineStore('vmOperations', () => {
     cancelVMBackup,
     deleteVMBackup,
     getAvailableBaseBackups,
+
+    // Progression temps réel
+    applyProgressEvent,
   }
 })